@@ -1,22 +1,31 @@
-from dataclasses import dataclass
-from typing import Annotated, Sequence, Optional
+from dataclasses import asdict, dataclass, field
+from typing import Annotated, Any, Dict, List, Sequence, Optional, Tuple
+import hashlib
+import json
 import os
+import threading
 import warnings
 
 from langchain_core.callbacks.base import BaseCallbackHandler
 from langchain_core.messages import SystemMessage
+from langchain_core.runnables import Runnable, RunnableConfig
 from langchain_openai import ChatOpenAI
-from langgraph.checkpoint.memory import MemorySaver
 from langgraph.graph import START, END, StateGraph
-from langgraph.prebuilt import ToolNode, tools_condition
+from langgraph.prebuilt import tools_condition
 from langgraph.graph.message import add_messages
+from langgraph.graph.state import CompiledStateGraph
+from langgraph.utils.runnable import RunnableCallable
 from langchain_core.messages import BaseMessage
 
 from tools.tools_rag import retriever_tool, search
 from tools.tools_text2sqlite import text2sqlite_tool#, get_time_by_timezone
-from tools.tools_execute_sqlite import execute_sqlite_query
+from tools.tools_execute_sqlite import execute_sqlite_batch, execute_sqlite_query, fetch_sqlite_page
 from tools.tools_charts import highcharts_tool
 from tools.tools_export import export_artifacts_tool
+from tools.cancellation import check_cancelled
+from tools.tool_executor import ConcurrentToolNode, keep_recent_timings
+from tools.history_compaction import history_compactor, keep_recent_reports
+from tools.sqlite_checkpointer import create_checkpointer
 
 
 from langchain_mcp_adapters.client import MultiServerMCPClient
@@ -39,8 +48,15 @@ os.environ["STREAMLIT_SERVER_RUNNING"] = "false"
 @dataclass
 class MessagesState:
     messages: Annotated[Sequence[BaseMessage], add_messages]
+    # 每次工具调用的分组、排队与执行耗时（由 ConcurrentToolNode 写入，只保留最近若干条）
+    tool_timings: Annotated[List[Dict[str, Any]], keep_recent_timings] = field(default_factory=list)
+    # 历史压缩：较早轮次的增量摘要、摘要覆盖到的最后一条消息 id、每次模型调用压缩前后的 token 数
+    history_summary: str = ""
+    history_summary_upto: Optional[str] = None
+    compaction_reports: Annotated[List[Dict[str, Any]], keep_recent_reports] = field(default_factory=list)
 
-memory = MemorySaver()
+# 会话状态持久化到 SQLite（CHATBI_CHECKPOINTER=memory 时使用进程内的 MemorySaver），所有模型的 Agent 共用
+memory = create_checkpointer()
 
 # Set up MCP client
 import os
@@ -81,7 +97,7 @@ try:
 except Exception as e:
     print(f"Warning: Failed to initialize MCP tools: {e}")
     mcp_tools = []
-tools = [retriever_tool, search, text2sqlite_tool, highcharts_tool, execute_sqlite_query, export_artifacts_tool]
+tools = [retriever_tool, search, text2sqlite_tool, highcharts_tool, execute_sqlite_query, execute_sqlite_batch, fetch_sqlite_page, export_artifacts_tool]
 tools = tools + mcp_tools
 
 @dataclass
@@ -130,11 +146,14 @@ sys_msg = SystemMessage(
     You have access to the following tools:
     - database_schema_rag: This tool allows you to search for database schema details when needed to generate the SQL code.
     - text2sqlite_query: This tool allows you to convert natural language text to a SQLite query.
-    - execute_sqlite_query: This tool allows you to execute a SQLite query on a fixed database and return the results as JSON. Use this tool to interact with the SQLite database.
+    - execute_sqlite_query: This tool allows you to execute a SQLite query on a fixed database and return the results as JSON. Use this tool to interact with the SQLite database. Large results return only the first page; 'truncated', 'total_rows' and a 'cursor' tell you more rows exist. Results with many rows are stored on the server: you get a preview of the rows, the column 'schema' and a 'result_handle'.
+    - execute_sqlite_batch: This tool runs several independent read-only queries concurrently and returns all results in one response, keyed by the names you give them. When a question needs several queries that do not depend on each other (e.g. a comparison or dashboard with multiple metrics), call this tool once instead of calling execute_sqlite_query repeatedly.
+    - fetch_sqlite_page: This tool fetches further pages of a truncated execute_sqlite_query result by its 'cursor'. Only use it when the remaining rows are really needed; prefer aggregate queries.
+    - export_artifacts: This tool exports charts (PNG), data (CSV/Excel) and PDF reports. To export a stored query result, pass its 'result_handle' in the payload instead of the rows.
     - high_charts_json: This tool allows you to generate Highcharts JSON config from a list of numbers and chart type. IMPORTANT: When the user asks to draw a chart, graph, or visualization (like "画图", "画出", "图表", "可视化"), you MUST:
       1. First execute a SQL query to get the data
       2. Extract the numeric data from the query results
-      3. Call high_charts_json tool with the numbers and appropriate chart type (like "area", "line", "column", "bar", "spline")
+      3. Call high_charts_json tool with the numbers and appropriate chart type (like "area", "line", "column", "bar", "spline"); if the query result has a 'result_handle', pass it (with 'value_column' / 'label_column') instead of copying the numbers
       4. Include the chart configuration in your final answer
 
     Your final answer should contain the analysis results or visualizations based on the user's question and the data retrieved from the database.
@@ -144,8 +163,8 @@ sys_msg = SystemMessage(
 )
 
 
-def create_agent(callback_handler: BaseCallbackHandler, model_name: str) -> StateGraph:
-    # 动态获取模型配置，确保读取最新的环境变量
+def get_model_config(model_name: str) -> ModelConfig:
+    """获取并校验模型配置（每次调用都读取最新的环境变量）"""
     model_configurations = get_model_configurations()
     config = model_configurations.get(model_name)
     if not config:
@@ -162,24 +181,56 @@ def create_agent(callback_handler: BaseCallbackHandler, model_name: str) -> Stat
                 f"Please set the OPENAI_API_KEY environment variable. "
                 f"You can set it in your system environment or create a .env file in the project root."
             )
+    return config
 
+
+def _build_agent(config: ModelConfig) -> CompiledStateGraph:
+    """构建并编译 Agent 图；回调不绑定在 LLM 上，而是通过每次运行的 config 传入"""
     llm = ChatOpenAI(
         model=config.model_name,
         api_key=config.api_key,
-        callbacks=[callback_handler],
         streaming=True,
+        stream_usage=True,  # 流式输出时也返回 token 用量
         base_url=config.base_url,
         temperature=0.1
     )
 
     llm_with_tools = llm.bind_tools(tools)
+    # 历史摘要：非流式，且不带请求的回调，摘要内容不会作为回答 token 推送给客户端
+    summarizer = ChatOpenAI(
+        model=config.model_name,
+        api_key=config.api_key,
+        base_url=config.base_url,
+        temperature=0
+    )
+    summarizer_config = {"callbacks": [], "run_name": "history_summary"}
+
+    def llm_agent(state: MessagesState, config: RunnableConfig):
+        check_cancelled()
+        # 发送给模型的是压缩后的历史：最近几轮原样保留，更早的轮次并入摘要
+        compaction = history_compactor.compact(
+            sys_msg, state.messages, state.history_summary, state.history_summary_upto,
+            lambda prompt: summarizer.invoke(prompt, summarizer_config).content,
+        )
+        check_cancelled()
+        return {"messages": [llm_with_tools.invoke(compaction.messages, config)], **compaction.state_update()}
 
-    def llm_agent(state: MessagesState):
-        return {"messages": [llm_with_tools.invoke([sys_msg] + state.messages)]}
+    async def allm_agent(state: MessagesState, config: RunnableConfig):
+        # 异步执行路径（ainvoke / astream_events），LLM 请求不占用线程
+        check_cancelled()
+
+        async def summarize(prompt: str) -> str:
+            return (await summarizer.ainvoke(prompt, summarizer_config)).content
+
+        compaction = await history_compactor.acompact(
+            sys_msg, state.messages, state.history_summary, state.history_summary_upto, summarize,
+        )
+        check_cancelled()
+        return {"messages": [await llm_with_tools.ainvoke(compaction.messages, config)], **compaction.state_update()}
 
     builder = StateGraph(MessagesState)
-    builder.add_node("llm_agent", llm_agent)
-    builder.add_node("tools", ToolNode(tools))
+    builder.add_node("llm_agent", RunnableCallable(llm_agent, allm_agent, name="llm_agent"))
+    builder.add_node("tools", ConcurrentToolNode(tools))
 
     builder.add_edge(START, "llm_agent")
     builder.add_conditional_edges("llm_agent", tools_condition)
@@ -195,3 +246,48 @@ def create_agent(callback_handler: BaseCallbackHandler, model_name: str) -> Stat
     # st.image(image, caption="React Graph")
 
     return react_graph
+
+
+# 已编译的 Agent 图缓存：(模型名, 配置指纹) -> CompiledStateGraph
+_agent_cache: Dict[Tuple[str, str], CompiledStateGraph] = {}
+_agent_cache_lock = threading.Lock()
+
+
+def _config_fingerprint(config: ModelConfig) -> str:
+    """配置指纹，环境变量（API Key、Base URL）变化时指纹随之变化；不保存明文 Key"""
+    return hashlib.sha256(json.dumps(asdict(config), sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_agent(model_name: str) -> CompiledStateGraph:
+    """
+    获取指定模型的已编译 Agent 图（按模型名和配置指纹缓存）
+
+    图本身不持有任何请求级状态，流式回调应通过运行配置传入：
+        react_graph.invoke(state, config={"configurable": {...}, "callbacks": [handler]})
+    """
+    config = get_model_config(model_name)
+    key = (model_name, _config_fingerprint(config))
+    with _agent_cache_lock:
+        react_graph = _agent_cache.get(key)
+        if react_graph is None:
+            # 同一模型的旧配置已失效，移除旧的图
+            for stale_key in [k for k in _agent_cache if k[0] == model_name]:
+                del _agent_cache[stale_key]
+            react_graph = _build_agent(config)
+            _agent_cache[key] = react_graph
+    return react_graph
+
+
+def clear_agent_cache() -> None:
+    """清空已编译的 Agent 图缓存"""
+    with _agent_cache_lock:
+        _agent_cache.clear()
+
+
+def create_agent(callback_handler: BaseCallbackHandler, model_name: str) -> Runnable:
+    """
+    兼容旧接口：返回绑定了回调处理器的缓存 Agent 图
+
+    新代码请使用 get_agent，并在运行配置中传入 callbacks。
+    """
+    return get_agent(model_name).with_config(callbacks=[callback_handler])
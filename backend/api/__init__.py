@@ -1,6 +1,11 @@
 from fastapi import APIRouter
 from backend.api.chat import router as chat_router
+from backend.api.batch import router as batch_router
+from backend.api.answer import router as answer_router
+from backend.api.sessions import router as sessions_router
 
 router = APIRouter()
 router.include_router(chat_router, prefix="/chat", tags=["chat"])
-
+router.include_router(batch_router, prefix="/chat", tags=["chat"])
+router.include_router(answer_router, prefix="/chat", tags=["chat"])
+router.include_router(sessions_router, prefix="/admin", tags=["admin"])
@@ -0,0 +1,229 @@
+"""
+聊天请求准入控制
+
+- 全局并发上限：同时执行的 Agent 数量
+- 会话级上限：单个 session 排队 + 执行中的请求数量
+- 同一 session 的请求串行执行，避免多轮对话在 MemorySaver 线程中交错
+- 有界等待队列，按 session_id 轮询（round-robin）公平调度
+- 批量任务（lane="batch"）最多同时占用 CHATBI_MAX_BATCH_RUNS 个执行槽（小于全局上限），
+  其余执行槽始终留给交互式请求
+- 队列已满时立即拒绝，由路由返回 429 + Retry-After
+
+所有方法都在事件循环线程中调用，不需要加锁。
+"""
+import asyncio
+import os
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Set
+
+DEFAULT_MAX_CONCURRENT_RUNS = int(os.getenv("CHATBI_MAX_CONCURRENT_RUNS", "8"))
+DEFAULT_MAX_QUEUE_SIZE = int(os.getenv("CHATBI_MAX_QUEUE_SIZE", "64"))
+DEFAULT_MAX_PER_SESSION = int(os.getenv("CHATBI_MAX_PENDING_PER_SESSION", "4"))
+DEFAULT_RETRY_AFTER_SECONDS = int(os.getenv("CHATBI_RETRY_AFTER_SECONDS", "5"))
+# 批量任务可同时占用的执行槽数；未设置时为全局上限的一半
+DEFAULT_MAX_BATCH_RUNS = int(os.getenv("CHATBI_MAX_BATCH_RUNS", "0"))
+
+LANE_INTERACTIVE = "interactive"
+LANE_BATCH = "batch"
+
+
+class AdmissionRejected(Exception):
+    """请求被准入控制拒绝"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionTicket:
+    """一次请求的准入凭证"""
+
+    def __init__(self, session_id: str, lane: str = LANE_INTERACTIVE):
+        self.session_id = session_id
+        self.lane = lane
+        self.granted = False
+        self.released = False
+        self.position = 0  # 排队位置，从 1 开始；获得执行权后为 0
+        self._changed = asyncio.Event()
+
+    def _notify(self) -> None:
+        self._changed.set()
+
+    async def wait_for_change(self) -> None:
+        """等待排队位置变化或获得执行权"""
+        await self._changed.wait()
+        self._changed.clear()
+
+
+class AdmissionController:
+    """全局 + 会话级并发控制，带公平排队"""
+
+    def __init__(
+        self,
+        max_concurrent: int = DEFAULT_MAX_CONCURRENT_RUNS,
+        max_queue_size: int = DEFAULT_MAX_QUEUE_SIZE,
+        max_per_session: int = DEFAULT_MAX_PER_SESSION,
+        retry_after: int = DEFAULT_RETRY_AFTER_SECONDS,
+        max_batch_runs: int = DEFAULT_MAX_BATCH_RUNS,
+    ):
+        self.max_concurrent = max(max_concurrent, 1)
+        # 至少 1 个；全局上限大于 1 时始终小于全局上限
+        self.max_batch_runs = max(min(max_batch_runs or self.max_concurrent // 2, self.max_concurrent - 1), 1)
+        self.max_queue_size = max(max_queue_size, 0)
+        self.max_per_session = max(max_per_session, 1)
+        self.retry_after = retry_after
+
+        self._running_sessions: Dict[str, AdmissionTicket] = {}
+        # 按轮询顺序排列的等待队列：session_id -> 该 session 的等待请求
+        self._waiting: "OrderedDict[str, deque[AdmissionTicket]]" = OrderedDict()
+        self._waiting_count = 0
+        self.rejected_count = 0
+
+    @property
+    def running(self) -> int:
+        return len(self._running_sessions)
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting_count
+
+    @property
+    def running_batch(self) -> int:
+        return sum(1 for ticket in self._running_sessions.values() if ticket.lane == LANE_BATCH)
+
+    def busy_sessions(self) -> Set[str]:
+        """有请求正在执行或排队的 session（会话管理不会回收它们）"""
+        return set(self._running_sessions) | set(self._waiting)
+
+    def _pending_for(self, session_id: str) -> int:
+        running = 1 if session_id in self._running_sessions else 0
+        return running + len(self._waiting.get(session_id, ()))
+
+    def enqueue(self, session_id: str, lane: str = LANE_INTERACTIVE) -> AdmissionTicket:
+        """
+        申请执行权；能立即执行时 ticket.granted 为 True，否则进入等待队列
+
+        lane 为 "batch" 的请求只能使用 max_batch_runs 个执行槽
+
+        Raises:
+            AdmissionRejected: 等待队列已满或该 session 的请求过多
+        """
+        if self._pending_for(session_id) >= self.max_per_session:
+            self.rejected_count += 1
+            raise AdmissionRejected(
+                f"会话 {session_id} 的进行中请求已达上限（{self.max_per_session}）",
+                self.retry_after,
+            )
+        ticket = AdmissionTicket(session_id, lane)
+        self._waiting.setdefault(session_id, deque()).append(ticket)
+        self._waiting_count += 1
+        self._dispatch()
+        if not ticket.granted and self._waiting_count > self.max_queue_size:
+            self._remove_waiting(ticket)
+            self.rejected_count += 1
+            raise AdmissionRejected(
+                f"服务繁忙，等待队列已满（{self.max_queue_size}）",
+                self.retry_after,
+            )
+        return ticket
+
+    async def acquire(self, session_id: str, lane: str = LANE_INTERACTIVE) -> AdmissionTicket:
+        """申请并等待执行权（不关心排队位置时使用）"""
+        ticket = self.enqueue(session_id, lane)
+        try:
+            while not ticket.granted:
+                await ticket.wait_for_change()
+        except BaseException:
+            self.release(ticket)
+            raise
+        return ticket
+
+    def release(self, ticket: AdmissionTicket) -> None:
+        """执行结束或客户端放弃排队时释放；可重复调用"""
+        if ticket.released:
+            return
+        ticket.released = True
+        if ticket.granted:
+            if self._running_sessions.get(ticket.session_id) is ticket:
+                del self._running_sessions[ticket.session_id]
+        else:
+            self._remove_waiting(ticket)
+        self._dispatch()
+
+    def _remove_waiting(self, ticket: AdmissionTicket) -> None:
+        queue = self._waiting.get(ticket.session_id)
+        if queue and ticket in queue:
+            queue.remove(ticket)
+            self._waiting_count -= 1
+            if not queue:
+                del self._waiting[ticket.session_id]
+        self._update_positions()
+
+    def _dispatch(self) -> None:
+        """按轮询顺序把空闲的执行槽分配给等待中的 session（批量任务达到上限时跳过）"""
+        while self.running < self.max_concurrent:
+            batch_full = self.running_batch >= self.max_batch_runs
+            next_session = None
+            for session_id, queue in self._waiting.items():
+                if session_id in self._running_sessions:
+                    continue
+                if batch_full and queue[0].lane == LANE_BATCH:
+                    continue
+                next_session = session_id
+                break
+            if next_session is None:
+                break
+            queue = self._waiting[next_session]
+            ticket = queue.popleft()
+            self._waiting_count -= 1
+            # 被调度的 session 移到轮询队尾
+            del self._waiting[next_session]
+            if queue:
+                self._waiting[next_session] = queue
+            ticket.granted = True
+            ticket.position = 0
+            self._running_sessions[next_session] = ticket
+            ticket._notify()
+        self._update_positions()
+
+    def _dispatch_order(self) -> List[AdmissionTicket]:
+        """按当前轮询顺序模拟后续的调度次序，用于计算排队位置"""
+        queues = [list(queue) for queue in self._waiting.values()]
+        order: List[AdmissionTicket] = []
+        depth = 0
+        while len(order) < self._waiting_count:
+            for queue in queues:
+                if depth < len(queue):
+                    order.append(queue[depth])
+            depth += 1
+        return order
+
+    def _update_positions(self) -> None:
+        for index, ticket in enumerate(self._dispatch_order(), start=1):
+            if ticket.position != index:
+                ticket.position = index
+                ticket._notify()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected_count,
+            "max_concurrent": self.max_concurrent,
+            "max_queue_size": self.max_queue_size,
+            "max_per_session": self.max_per_session,
+            "running_batch": self.running_batch,
+            "max_batch_runs": self.max_batch_runs,
+        }
+
+
+_controller: Optional[AdmissionController] = None
+
+
+def get_admission_controller() -> AdmissionController:
+    """进程级单例（延迟创建，确保 asyncio 对象在事件循环内创建）"""
+    global _controller
+    if _controller is None:
+        _controller = AdmissionController()
+    return _controller
@@ -0,0 +1,246 @@
+"""
+非流式问答 API 路由
+
+POST /api/chat/answer 直接返回 JSON：最终回答、执行过的 SQL、查询结果表和图表配置。
+面向仪表盘和脚本，不需要 token 级流式输出。
+
+未指定 session_id 的请求与对话历史无关，结果按（规范化问题, 模型, 数据库版本）缓存：
+- 响应带 ETag，客户端携带 If-None-Match 重复请求时返回 304
+- 数据库文件变化后数据库版本随之变化，旧缓存不再命中
+- 相同问题的并发请求只执行一次 Agent
+- 精确缓存未命中时再查语义缓存（见 semantic_cache），换一种问法的相同问题也能命中
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+import unicodedata
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from fastapi import APIRouter, Header, HTTPException
+from fastapi.responses import JSONResponse, Response
+from pydantic import BaseModel
+
+from agent import get_agent
+from tools.tools_execute_sqlite import get_database_version
+from backend.api.admission import AdmissionRejected, get_admission_controller
+from backend.api.artifacts import build_answer_payload
+from backend.api.callback import StreamingCallbackHandler
+from backend.api.chat import _resolve_final_message, invoke_agent
+from backend.api.metrics import metrics
+from backend.api.semantic_cache import semantic_cache
+from backend.api.sessions import session_manager
+
+router = APIRouter()
+
+DEFAULT_ANSWER_CACHE_SIZE = int(os.getenv("CHATBI_ANSWER_CACHE_SIZE", "256"))
+DEFAULT_ANSWER_CACHE_TTL_SECONDS = float(os.getenv("CHATBI_ANSWER_CACHE_TTL_SECONDS", "3600"))
+
+
+class AnswerRequest(BaseModel):
+    """非流式问答请求模型"""
+    query: str
+    model: str = "qwen-plus"
+    session_id: Optional[str] = None  # 指定时在该会话中作答（依赖对话历史，不使用缓存）
+    request_id: Optional[str] = None
+    use_cache: bool = True
+
+
+def normalize_question(question: str) -> str:
+    """规范化问题文本：全角转半角、小写、合并空白、去掉结尾标点"""
+    text = unicodedata.normalize("NFKC", question).strip().lower()
+    text = re.sub(r"\s+", " ", text)
+    return text.rstrip("?。.!！ ")
+
+
+def answer_cache_key(question: str, model: str, database_version: str) -> str:
+    raw = json.dumps([normalize_question(question), model, database_version], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def compute_etag(payload: Dict[str, Any]) -> str:
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True, default=str)
+    return '"' + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:32] + '"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """If-None-Match 可能包含多个（弱）ETag 或 *"""
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in [tag[2:] if tag.startswith("W/") else tag for tag in candidates]
+
+
+class AnswerCache:
+    """有界 LRU + TTL 的回答缓存：key -> (过期时间, payload, etag)"""
+
+    def __init__(self, max_entries: int = DEFAULT_ANSWER_CACHE_SIZE,
+                 ttl: float = DEFAULT_ANSWER_CACHE_TTL_SECONDS):
+        self.max_entries = max(max_entries, 0)
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any], str]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, payload, etag = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return payload, etag
+
+    def put(self, key: str, payload: Dict[str, Any], etag: str) -> None:
+        if self.max_entries == 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, payload, etag)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+answer_cache = AnswerCache()
+# 正在计算中的缓存键 -> Task，相同问题的并发请求共享同一次执行
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+async def run_answer(query: str, session_id: str, model: str, request_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    经过准入控制执行一次 Agent，返回结构化回答（不含请求级字段）
+
+    Raises:
+        AdmissionRejected: 准入控制拒绝
+        Exception: Agent 执行失败
+    """
+    admission = get_admission_controller()
+    ticket = await admission.acquire(session_id)
+    callback_handler = StreamingCallbackHandler()
+    try:
+        database_version = get_database_version()
+        result = await invoke_agent(query, session_id, model, callback_handler, request_id)
+    finally:
+        try:
+            await session_manager.arelease(session_id, model)
+        finally:
+            admission.release(ticket)
+
+    return {
+        # 只取最后一条 AI 消息，不包含工具调用前的中间输出
+        **build_answer_payload(query, model, _resolve_final_message("", result), result, database_version),
+        "usage": {**callback_handler.usage, "llm_calls": callback_handler.llm_calls},
+    }
+
+
+def _answer_response(payload: Dict[str, Any], etag: str, if_none_match: Optional[str],
+                     request_id: str, session_id: str, cached: bool, started_at: float) -> Response:
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "no-cache",  # 客户端每次都需用 If-None-Match 重新校验
+        "X-Cache": "HIT" if cached else "MISS",
+    }
+    if etag_matches(if_none_match, etag):
+        metrics.incr("answer_not_modified")
+        return Response(status_code=304, headers=headers)
+    latency_ms = round((time.perf_counter() - started_at) * 1000, 2)
+    metrics.observe("answer_latency_ms", latency_ms)
+    return JSONResponse(
+        content={
+            "request_id": request_id,
+            "session_id": session_id,
+            **payload,
+            "cached": cached,
+            "latency_ms": latency_ms,
+        },
+        headers=headers,
+    )
+
+
+@router.post("/answer")
+async def chat_answer(request: AnswerRequest, if_none_match: Optional[str] = Header(None)):
+    """
+    非流式问答接口
+
+    Args:
+        request: 问答请求
+        if_none_match: 上次响应的 ETag，回答未变化时返回 304
+
+    Returns:
+        结构化 JSON 回答
+    """
+    started_at = time.perf_counter()
+    request_id = request.request_id or str(uuid.uuid4())
+    cacheable = request.use_cache and request.session_id is None
+    # 无会话的问答使用一次性的会话线程，回答不受其他请求的对话历史影响；
+    # 线程 ID 用随机值生成，客户端传入的 request_id 可能重复，只用于关联日志
+    session_id = request.session_id or f"answer-{uuid.uuid4().hex}"
+
+    try:
+        get_agent(request.model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    database_version = get_database_version()
+    key = answer_cache_key(request.query, request.model, database_version)
+    vector = None
+    if cacheable:
+        cached = answer_cache.get(key)
+        if cached is not None:
+            metrics.incr("answer_cache_hits")
+            payload, etag = cached
+            return _answer_response(payload, etag, if_none_match, request_id, session_id, True, started_at)
+        metrics.incr("answer_cache_misses")
+
+        if semantic_cache.enabled:
+            # 换一种问法的相同问题：命中语义缓存时同样不执行 Agent
+            loop = asyncio.get_running_loop()
+            vector = await loop.run_in_executor(None, semantic_cache.embed, request.query)
+            match = semantic_cache.lookup(request.query, vector, request.model, database_version)
+            if match is not None:
+                entry, similarity = match
+                payload = {
+                    **entry.payload,
+                    "semantic_match": {"question": entry.question, "similarity": round(similarity, 4)},
+                }
+                etag = compute_etag(payload)
+                answer_cache.put(key, payload, etag)
+                return _answer_response(payload, etag, if_none_match, request_id, session_id, True, started_at)
+
+    try:
+        if cacheable:
+            task = _inflight.get(key)
+            if task is None:
+                task = asyncio.create_task(run_answer(request.query, session_id, request.model, request_id))
+                _inflight[key] = task
+                task.add_done_callback(lambda _: _inflight.pop(key, None))
+            else:
+                metrics.incr("answer_inflight_joins")
+            # 客户端断开不取消共享的执行，结果仍会写入缓存
+            payload = await asyncio.shield(task)
+        else:
+            payload = await run_answer(request.query, session_id, request.model, request_id)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"处理请求时出错: {str(e)}")
+
+    etag = compute_etag(payload)
+    if cacheable:
+        # 以执行开始时的数据库版本作为键，执行期间数据库发生变化时该条目不会再被命中
+        answer_cache.put(answer_cache_key(request.query, request.model, payload["database_version"]), payload, etag)
+        semantic_cache.store(request.query, vector, request.model, payload["database_version"], payload)
+    return _answer_response(payload, etag, if_none_match, request_id, session_id, False, started_at)
@@ -0,0 +1,145 @@
+"""
+Agent 运行结果中的结构化产物
+
+从消息列表中提取执行过的 SQL、查询结果表和图表配置，
+供非流式问答接口和回答缓存使用。
+"""
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+
+
+def _parse_tool_content(content: Any) -> Any:
+    """ToolNode 会把工具返回的 dict 序列化为 JSON 字符串"""
+    if isinstance(content, str):
+        try:
+            return json.loads(content)
+        except ValueError:
+            return content
+    return content
+
+
+def _turn_start(messages: List[Any]) -> int:
+    """本轮消息的起始位置（最后一条用户消息之后）"""
+    start = 0
+    for index, message in enumerate(messages):
+        if isinstance(message, HumanMessage):
+            start = index + 1
+    return start
+
+
+def _sql_responses(name: Optional[str], args: Dict[str, Any], content: Any) -> List[Tuple[Optional[str], Optional[str], Any]]:
+    """
+    SQL 工具消息中的各条查询：[(查询名称, SQL, 单条查询的返回值)]
+
+    execute_sqlite_query 只有一条（名称为 None）；execute_sqlite_batch 按名称展开。
+    """
+    if name == "execute_sqlite_query":
+        return [(None, args.get("query"), content)]
+    if name == "execute_sqlite_batch":
+        queries = args.get("queries") or {}
+        if isinstance(content, dict) and isinstance(content.get("results"), dict):
+            return [(key, queries.get(key), response) for key, response in content["results"].items()]
+        return [(key, query, content) for key, query in queries.items()]
+    return []
+
+
+def count_iterations(messages: List[Any]) -> Dict[str, int]:
+    """本轮的 Agent 迭代情况：LLM 调用次数、工具调用次数、SQL 查询条数、失败的 SQL 条数、自动修正的 SQL 条数"""
+    counts = {"llm_calls": 0, "tool_calls": 0, "sql_calls": 0, "sql_errors": 0, "sql_fixed": 0}
+    tool_calls: Dict[str, Dict[str, Any]] = {}
+    for message in messages[_turn_start(messages):]:
+        if isinstance(message, AIMessage):
+            counts["llm_calls"] += 1
+            counts["tool_calls"] += len(message.tool_calls)
+            tool_calls.update((call["id"], call) for call in message.tool_calls)
+        elif isinstance(message, ToolMessage):
+            call = tool_calls.get(message.tool_call_id, {})
+            content = _parse_tool_content(message.content)
+            for _, _, response in _sql_responses(message.name or call.get("name"), call.get("args", {}), content):
+                counts["sql_calls"] += 1
+                if not isinstance(response, dict) or response.get("status") != "success":
+                    counts["sql_errors"] += 1
+                elif response.get("sql_fixes"):
+                    counts["sql_fixed"] += 1
+    return counts
+
+
+def extract_artifacts(messages: List[Any]) -> Dict[str, List[Any]]:
+    """从本轮（最后一条用户消息之后）的消息中提取执行过的 SQL、查询结果表和图表配置"""
+    start = _turn_start(messages)
+
+    tool_calls: Dict[str, Dict[str, Any]] = {}
+    sql: List[str] = []
+    tables: List[Dict[str, Any]] = []
+    charts: List[Dict[str, Any]] = []
+    for message in messages[start:]:
+        if isinstance(message, AIMessage):
+            for call in message.tool_calls:
+                tool_calls[call["id"]] = call
+                for _, query, _ in _sql_responses(call["name"], call["args"], None):
+                    if query:
+                        sql.append(query)
+        elif isinstance(message, ToolMessage):
+            call = tool_calls.get(message.tool_call_id, {})
+            name = message.name or call.get("name")
+            content = _parse_tool_content(message.content)
+            if not isinstance(content, dict):
+                continue
+            for query_name, query, response in _sql_responses(name, call.get("args", {}), content):
+                if not isinstance(response, dict) or response.get("status") != "success":
+                    continue
+                result = response.get("result") or {}
+                if "columns" in result:
+                    tables.append({
+                        "sql": query,
+                        "name": query_name,
+                        "columns": result["columns"],
+                        "rows": result["rows"],
+                        # 大结果只包含第一页，其余行通过 GET /api/chat/sql/pages/{cursor} 获取
+                        "truncated": result.get("truncated", False),
+                        "total_rows": result.get("total_rows", len(result["rows"])),
+                        "cursor": result.get("cursor"),
+                        # 落盘的大结果：rows 只是预览，完整数据通过结果句柄读取
+                        "result_handle": result.get("result_handle"),
+                    })
+            if name == "high_charts_json" and "chart_config" in content:
+                charts.append({
+                    "chart_type": content.get("chart_type"),
+                    "chart_config": content["chart_config"],
+                })
+    return {"sql": sql, "tables": tables, "charts": charts}
+
+
+def turn_compaction(result: Any) -> Optional[Dict[str, int]]:
+    """本轮各次模型调用的历史压缩情况合计（压缩前 / 后的提示词 token 数、节省的 token 数）；未经过 Agent 时为 None"""
+    if not isinstance(result, dict) or not result.get("compaction_reports"):
+        return None
+    humans = [message for message in result.get("messages", []) if isinstance(message, HumanMessage)]
+    if not humans:
+        return None
+    reports = [report for report in result["compaction_reports"] if report.get("turn_id") == humans[-1].id]
+    if not reports:
+        return None
+    return {
+        "llm_calls": len(reports),
+        "original_tokens": sum(report["original_tokens"] for report in reports),
+        "prompt_tokens": sum(report["prompt_tokens"] for report in reports),
+        "saved_tokens": sum(report["saved_tokens"] for report in reports),
+        "folded_turns": sum(report["folded_turns"] for report in reports),
+    }
+
+
+def build_answer_payload(query: str, model: str, message: str, result: Any,
+                         database_version: str) -> Dict[str, Any]:
+    """结构化回答：最终回答 + 本轮产物 + 本轮历史压缩情况 + 数据库版本"""
+    messages = result.get("messages", []) if isinstance(result, dict) else []
+    return {
+        "query": query,
+        "model": model,
+        "message": message,
+        **extract_artifacts(messages),
+        "history_compaction": turn_compaction(result),
+        "database_version": database_version,
+    }
@@ -0,0 +1,215 @@
+"""
+批量问题 API 路由
+
+一次请求提交多个问题（日报、回归检查等固定问题集），在共享的已编译 Agent 图上
+以有界并发执行；每个问题使用独立的会话线程，互不影响。
+- stream=True（默认）：SSE 输出，每完成一个问题发送一个 item 事件，最后发送汇总结果
+- stream=False：执行完成后直接返回汇总 JSON
+每个问题仍经过准入控制，并走批量通道（lane="batch"）：所有批量任务合计最多占用
+CHATBI_MAX_BATCH_RUNS 个执行槽，其余执行槽留给交互式请求。
+会话线程为 batch-{batch_id}-{run_id}-{index}，run_id 每次请求随机生成：
+以相同 batch_id 重新运行（如每天的日报）不会接着上一次运行的对话。
+"""
+import asyncio
+import json
+import os
+import statistics
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel
+
+from agent import get_agent
+from backend.api.admission import LANE_BATCH, AdmissionRejected, get_admission_controller
+from backend.api.callback import StreamingCallbackHandler
+from backend.api.chat import _resolve_final_message, _sse_response, invoke_agent
+from backend.api.metrics import metrics
+from backend.api.sessions import session_manager
+
+router = APIRouter()
+
+DEFAULT_BATCH_CONCURRENCY = int(os.getenv("CHATBI_BATCH_CONCURRENCY", "4"))
+MAX_BATCH_CONCURRENCY = int(os.getenv("CHATBI_BATCH_MAX_CONCURRENCY", "16"))
+MAX_BATCH_QUESTIONS = int(os.getenv("CHATBI_BATCH_MAX_QUESTIONS", "200"))
+
+
+class BatchRequest(BaseModel):
+    """批量问题请求模型"""
+    questions: List[str]
+    model: str = "qwen-plus"
+    max_concurrency: int = DEFAULT_BATCH_CONCURRENCY  # 上限为 CHATBI_BATCH_MAX_CONCURRENCY
+    stream: bool = True
+    batch_id: Optional[str] = None
+
+
+def _sse(payload: Dict[str, Any], event: str = "message") -> Dict[str, str]:
+    return {"event": event, "data": json.dumps(payload, ensure_ascii=False)}
+
+
+def new_run_id() -> str:
+    """每次运行的随机后缀，保证会话线程不与以前的运行重复"""
+    return uuid.uuid4().hex[:8]
+
+
+async def run_batch_item(batch_id: str, run_id: str, index: int, question: str, model: str,
+                         semaphore: asyncio.Semaphore) -> Dict[str, Any]:
+    """
+    执行批量中的一个问题，返回该问题的结果（不抛出异常）
+
+    latency_ms 只统计获得执行权之后的耗时，排队时间单独记录在 queued_ms 中。
+    """
+    session_id = f"batch-{batch_id}-{run_id}-{index}"
+    item: Dict[str, Any] = {
+        "index": index,
+        "query": question,
+        "session_id": session_id,
+        "status": "error",
+        "message": "",
+        "latency_ms": 0.0,
+        "queued_ms": 0.0,
+        "usage": None,
+    }
+    enqueued_at = time.perf_counter()
+    async with semaphore:
+        admission = get_admission_controller()
+        try:
+            ticket = await admission.acquire(session_id, LANE_BATCH)
+        except AdmissionRejected as e:
+            item["message"] = e.reason
+            metrics.incr("batch_items_rejected")
+            return item
+
+        started_at = time.perf_counter()
+        item["queued_ms"] = round((started_at - enqueued_at) * 1000, 2)
+        callback_handler = StreamingCallbackHandler()
+        try:
+            result = await invoke_agent(question, session_id, model, callback_handler)
+            item["message"] = _resolve_final_message(callback_handler.final_message, result)
+            item["status"] = "ok"
+        except Exception as e:
+            item["message"] = str(e)
+        finally:
+            try:
+                await session_manager.arelease(session_id, model)
+            finally:
+                admission.release(ticket)
+            item["latency_ms"] = round((time.perf_counter() - started_at) * 1000, 2)
+            item["usage"] = {**callback_handler.usage, "llm_calls": callback_handler.llm_calls}
+            metrics.observe("batch_item_latency_ms", item["latency_ms"])
+    return item
+
+
+def summarize_batch(batch_id: str, run_id: str, model: str, results: List[Dict[str, Any]],
+                    wall_time_ms: float) -> Dict[str, Any]:
+    """汇总批量结果：成功/失败数量、延迟分布和 token 用量合计"""
+    latencies = [item["latency_ms"] for item in results if item["status"] == "ok"]
+    usage = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0, "llm_calls": 0}
+    for item in results:
+        for key, value in (item.get("usage") or {}).items():
+            usage[key] = usage.get(key, 0) + value
+    succeeded = sum(1 for item in results if item["status"] == "ok")
+    return {
+        "batch_id": batch_id,
+        "run_id": run_id,
+        "model": model,
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "wall_time_ms": round(wall_time_ms, 2),
+        "latency_ms": {
+            "avg": round(statistics.mean(latencies), 2) if latencies else 0.0,
+            "p50": round(statistics.median(latencies), 2) if latencies else 0.0,
+            "max": max(latencies) if latencies else 0.0,
+        },
+        "usage": usage,
+        "results": sorted(results, key=lambda item: item["index"]),
+    }
+
+
+async def stream_batch(batch_id: str, run_id: str, model: str, questions: List[str], max_concurrency: int):
+    """
+    以有界并发执行批量问题，按完成顺序输出 SSE 事件
+
+    生成器被提前关闭（客户端断开）时取消所有未完成的问题。
+    """
+    semaphore = asyncio.Semaphore(max_concurrency)
+    started_at = time.perf_counter()
+    tasks = [
+        asyncio.create_task(run_batch_item(batch_id, run_id, index, question, model, semaphore))
+        for index, question in enumerate(questions)
+    ]
+    metrics.incr("batches_started")
+    try:
+        yield _sse({
+            "type": "batch_start",
+            "batch_id": batch_id,
+            "run_id": run_id,
+            "total": len(questions),
+            "max_concurrency": max_concurrency,
+            "finished": False,
+        })
+        results = []
+        for completed in asyncio.as_completed(tasks):
+            item = await completed
+            results.append(item)
+            yield _sse({
+                "type": "item",
+                "batch_id": batch_id,
+                "completed": len(results),
+                "total": len(questions),
+                **item,
+                "finished": False,
+            })
+        summary = summarize_batch(batch_id, run_id, model, results, (time.perf_counter() - started_at) * 1000)
+        metrics.incr("batches_completed")
+        yield _sse({"type": "batch_result", **summary, "finished": True})
+    finally:
+        pending = [task for task in tasks if not task.done()]
+        for task in pending:
+            task.cancel()
+        if pending:
+            await asyncio.gather(*pending, return_exceptions=True)
+
+
+@router.post("/batch")
+async def chat_batch(request: BatchRequest):
+    """
+    批量问题接口
+
+    Args:
+        request: 批量请求
+
+    Returns:
+        stream=True 时为 SSE 流式响应，否则为汇总 JSON
+    """
+    if not request.questions:
+        raise HTTPException(status_code=400, detail="questions 不能为空")
+    if len(request.questions) > MAX_BATCH_QUESTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"问题数量超过上限（{MAX_BATCH_QUESTIONS}）"
+        )
+    try:
+        # 提前校验模型配置，避免每个问题各自失败
+        get_agent(request.model)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    batch_id = request.batch_id or uuid.uuid4().hex[:12]
+    run_id = new_run_id()
+    max_concurrency = min(max(request.max_concurrency, 1), MAX_BATCH_CONCURRENCY)
+
+    if not request.stream:
+        semaphore = asyncio.Semaphore(max_concurrency)
+        started_at = time.perf_counter()
+        metrics.incr("batches_started")
+        results = await asyncio.gather(*[
+            run_batch_item(batch_id, run_id, index, question, request.model, semaphore)
+            for index, question in enumerate(request.questions)
+        ])
+        metrics.incr("batches_completed")
+        return summarize_batch(batch_id, run_id, request.model, list(results), (time.perf_counter() - started_at) * 1000)
+
+    return _sse_response(stream_batch(batch_id, run_id, request.model, request.questions, max_concurrency))
@@ -2,13 +2,16 @@
 流式输出回调处理器
 用于 SSE 流式输出
 """
-from typing import Any, Callable, List, Optional
+from typing import Any, Callable, Dict, List, Optional
+import asyncio
 import queue
 import threading
 
 from langchain_core.callbacks.base import BaseCallbackHandler
 from langchain_core.messages import BaseMessage
 
+from tools.cancellation import CancelScope, RunCancelled
+
 
 def _extract_text(token: Any) -> str:
     """
@@ -43,19 +46,71 @@ def _extract_text(token: Any) -> str:
     return str(token)
 
 
+class AsyncTokenBridge:
+    """
+    工作线程到事件循环的 token 通道
+
+    生产者在任意线程调用 put_threadsafe，由 call_soon_threadsafe 投递到 asyncio.Queue，
+    消费者 await get() 时挂起，token 到达即被唤醒，无需轮询。
+    """
+
+    DONE = object()  # 结束标记
+
+    def __init__(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        self.loop = loop or asyncio.get_running_loop()
+        self.queue: asyncio.Queue = asyncio.Queue()
+
+    def put_threadsafe(self, item: Any) -> None:
+        """从任意线程投递一个元素"""
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            # 事件循环已关闭（例如客户端已断开），丢弃即可
+            pass
+
+    def close(self) -> None:
+        """投递结束标记，排在此前已投递的元素之后"""
+        self.put_threadsafe(self.DONE)
+
+    async def get(self) -> Any:
+        return await self.queue.get()
+
+
 class StreamingCallbackHandler(BaseCallbackHandler):
     """流式输出回调处理器"""
+
+    # 让 RunCancelled 从回调中抛出，中止正在进行的 LLM 流式请求
+    raise_error = True
     
-    def __init__(self, token_callback: Optional[Callable[[str], None]] = None):
+    def __init__(self, token_callback: Optional[Callable[[str], None]] = None,
+                 cancel_scope: Optional[CancelScope] = None):
         self.token_buffer: List[str] = []
-        self.final_message: str = ""
+        # 错误信息等直接设置的最终消息；未设置时由 token_buffer 拼接
+        self._final_message: Optional[str] = None
         self.has_streaming_started: bool = False
         self.has_streaming_ended: bool = False
         self.token_callback = token_callback  # 用于实时发送 token 的回调函数
         self.token_queue = queue.Queue()  # 用于存储待发送的 token
+        self.cancel_scope = cancel_scope  # 运行被取消时在下一个 token 处中止 LLM 请求
+        self.usage: Dict[str, int] = {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}
+        self.llm_calls: int = 0
     
+    @property
+    def final_message(self) -> str:
+        """累计输出的完整消息，读取时才拼接（逐 token 拼接是 O(n^2)）"""
+        if self._final_message is None:
+            return "".join(self.token_buffer)
+        return self._final_message
+
+    @final_message.setter
+    def final_message(self, message: str) -> None:
+        self._final_message = message
+
     def on_llm_new_token(self, token: str, **kwargs) -> None:
         """处理新的 token"""
+        if self.cancel_scope is not None and self.cancel_scope.cancelled:
+            raise RunCancelled("Agent run was cancelled while streaming")
+
         extracted = _extract_text(token)
         if not extracted:
             return
@@ -64,7 +119,7 @@ class StreamingCallbackHandler(BaseCallbackHandler):
             self.has_streaming_started = True
         
         self.token_buffer.append(extracted)
-        self.final_message = "".join(self.token_buffer)
+        self._final_message = None
         
         # 如果有回调函数，实时发送 token
         if self.token_callback:
@@ -77,6 +132,26 @@ class StreamingCallbackHandler(BaseCallbackHandler):
         """LLM 输出结束"""
         self.has_streaming_ended = True
         self.has_streaming_started = False
+        self.llm_calls += 1
+        self._accumulate_usage(response)
+
+    def _accumulate_usage(self, response) -> None:
+        """累计本次运行所有 LLM 调用的 token 用量"""
+        usage = None
+        for generations in getattr(response, "generations", None) or []:
+            for generation in generations:
+                message = getattr(generation, "message", None)
+                usage = getattr(message, "usage_metadata", None) or usage
+        if usage is None:
+            # 非流式调用时 OpenAI 兼容接口把用量放在 llm_output 中
+            token_usage = (getattr(response, "llm_output", None) or {}).get("token_usage") or {}
+            usage = {
+                "input_tokens": token_usage.get("prompt_tokens", 0),
+                "output_tokens": token_usage.get("completion_tokens", 0),
+                "total_tokens": token_usage.get("total_tokens", 0),
+            }
+        for key in self.usage:
+            self.usage[key] += int(usage.get(key) or 0)
     
     def on_llm_error(self, error: Exception, **kwargs) -> None:
         """LLM 错误处理"""
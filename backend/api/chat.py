@@ -3,9 +3,10 @@
 支持 SSE 流式输出
 """
 import json
+import os
 import uuid
-from typing import Optional
-from fastapi import APIRouter, HTTPException
+from typing import Any, Callable, Optional
+from fastapi import APIRouter, Header, HTTPException, Query
 from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 try:
@@ -15,12 +16,42 @@ except ImportError:
     from fastapi.responses import StreamingResponse
     import asyncio
 
-from agent import MessagesState, create_agent
-from langchain_core.messages import HumanMessage
-from backend.api.callback import StreamingCallbackHandler
+from agent import MessagesState, get_agent, memory
+from langchain_core.messages import AIMessage, HumanMessage
+from tools.cancellation import CancelScope, cancel_scope
+from tools.duckdb_engine import get_duckdb_engine
+from tools.history_compaction import history_compactor
+from tools.result_store import result_store
+from tools.rollups import get_rollup_manager
+from tools.sql_result_cache import sql_result_cache
+from tools.sqlite_pool import get_read_pool
+from tools.sql_guard import query_guard
+from tools.sql_validator import sql_validator
+from tools.sqlite_checkpointer import checkpointer_stats
+from tools.sql_pagination import DEFAULT_MAX_ROWS
+from tools.tool_executor import tool_execution_stats
+from tools.tools_execute_sqlite import DATABASE_PATH, fetch_result_page, get_database_version
+from backend.api.admission import AdmissionRejected, AdmissionTicket, get_admission_controller
+from backend.api.artifacts import build_answer_payload, count_iterations, turn_compaction
+from backend.api.callback import AsyncTokenBridge, StreamingCallbackHandler, _extract_text
+from backend.api.fast_path import fast_path_router
+from backend.api.metrics import metrics
+from backend.api.replay import get_replay_registry, parse_last_event_id
+from backend.api.semantic_cache import semantic_cache
+from backend.api.sessions import session_manager
+from backend.api.stream_protocol import (
+    STREAM_PROTOCOL_LEGACY,
+    SUPPORTED_STREAM_PROTOCOLS,
+    StreamEncoder,
+    create_stream_encoder,
+)
 
 router = APIRouter()
 
+EXECUTION_MODES = ("thread", "async")
+# 默认执行模式：thread 在线程池中同步执行 Agent，async 基于 astream_events 原生异步执行
+DEFAULT_EXECUTION_MODE = os.getenv("CHATBI_EXECUTION_MODE", "thread")
+
 
 class ChatRequest(BaseModel):
     """聊天请求模型"""
@@ -28,6 +59,14 @@ class ChatRequest(BaseModel):
     session_id: Optional[str] = None
     request_id: Optional[str] = None
     model: str = "qwen-plus"
+    stream_protocol: int = STREAM_PROTOCOL_LEGACY  # 1: 累计消息（兼容旧客户端）；2: delta 增量协议
+    execution_mode: Optional[str] = None  # "thread" 或 "async"，默认读取 CHATBI_EXECUTION_MODE
+
+
+class FeedbackRequest(BaseModel):
+    """回答反馈请求模型"""
+    request_id: str
+    correct: bool
 
 
 class ChatResponse(BaseModel):
@@ -38,252 +77,491 @@ class ChatResponse(BaseModel):
     finished: bool
 
 
-async def stream_agent_response(query: str, session_id: str, request_id: str, model: str):
+def _friendly_error_message(error: Exception, config: dict) -> str:
+    """把 Agent 执行异常转换为面向用户的错误信息"""
+    error_msg = str(error)
+    # 如果是递归限制错误，提供更友好的错误信息
+    if "recursion_limit" in error_msg.lower():
+        error_msg = f"任务执行步骤过多（超过{config.get('recursion_limit', 100)}步）。这可能是因为任务过于复杂或陷入了循环。请尝试简化您的问题或重新表述。"
+    return error_msg
+
+
+def _resolve_final_message(streamed_message: str, result) -> str:
+    """
+    确定最终要发送的完整消息
+
+    优先使用 LLM 流式输出累计的文本，为空时从 Agent 结果中提取
+    """
+    final_message = streamed_message
+
+    print(f"[DEBUG] Sending final message. Length: {len(final_message)}")
+    print(f"[DEBUG] Streamed message length: {len(streamed_message) if streamed_message else 0}")
+    print(f"[DEBUG] Result type: {type(result)}")
+    if result:
+        print(f"[DEBUG] Result keys: {result.keys() if isinstance(result, dict) else 'Not a dict'}")
+
+    # 如果最终消息为空，尝试从 result 中获取
+    if not final_message and result:
+        if isinstance(result, dict) and "messages" in result:
+            messages = result["messages"]
+            print(f"[DEBUG] Found {len(messages)} messages in result")
+
+            # 检查是否有工具调用（特别是图表工具）
+            from langchain_core.messages import AIMessage, ToolMessage
+            chart_config = None
+            for msg in messages:
+                if isinstance(msg, ToolMessage):
+                    print(f"[DEBUG] Found ToolMessage: tool_call_id={msg.tool_call_id}")
+                    print(f"[DEBUG] ToolMessage content type: {type(msg.content)}")
+                    print(f"[DEBUG] ToolMessage content preview: {str(msg.content)[:200]}")
+                    # 检查是否是图表工具的返回
+                    if isinstance(msg.content, dict) and "chart_config" in msg.content:
+                        chart_config = msg.content["chart_config"]
+                        print(f"[DEBUG] Found chart_config in ToolMessage!")
+
+            # 查找最后一个 AI 消息
+            for msg in reversed(messages):
+                if isinstance(msg, AIMessage):
+                    if hasattr(msg, "content"):
+                        final_message = msg.content
+                        print(f"[DEBUG] Got AI message from result: {len(final_message)} chars")
+                        # 如果有图表配置，添加到消息中
+                        if chart_config:
+                            print(f"[DEBUG] Adding chart_config to final message")
+                            # 将图表配置以 JSON 代码块形式添加到消息中
+                            chart_json = json.dumps(chart_config, ensure_ascii=False, indent=2)
+                            final_message = f"{final_message}\n\n```json\n{chart_json}\n```"
+                        break
+            # 如果没有 AI 消息，尝试获取最后一个消息的内容
+            if not final_message and messages:
+                last_msg = messages[-1]
+                if hasattr(last_msg, "content"):
+                    final_message = str(last_msg.content)
+                    print(f"[DEBUG] Got last message content: {len(final_message)} chars")
+
+    # 如果还是没有消息，至少发送一个提示
+    if not final_message:
+        final_message = "处理完成，但未收到响应内容。"
+        print(f"[WARNING] No message content found!")
+
+    return final_message
+
+
+def _record_iterations(result) -> None:
+    """按问题统计 Agent 迭代次数（LLM 调用、工具调用、失败 / 自动修正的 SQL）和历史压缩节省的 token 数"""
+    if not isinstance(result, dict) or not result.get("messages"):
+        return
+    for name, value in count_iterations(result["messages"]).items():
+        metrics.observe(f"agent_{name}_per_question", value)
+    compaction = turn_compaction(result)
+    if compaction is not None:
+        metrics.observe("history_prompt_tokens_per_question", compaction["prompt_tokens"])
+        metrics.observe("history_tokens_saved_per_question", compaction["saved_tokens"])
+
+
+async def _cancel_run(scope: CancelScope, run_future) -> None:
+    """运行被放弃（客户端断开且宽限期内未重连）：取消运行并等待其退出，确保同一会话的下一轮不会与之交错"""
+    import asyncio
+
+    scope.cancel()
+    if isinstance(run_future, asyncio.Task):
+        run_future.cancel()
+    metrics.incr("runs_cancelled")
+    print(f"[INFO] Run abandoned by client, agent run cancelled")
+    try:
+        await asyncio.shield(run_future)
+    except BaseException:
+        pass
+
+
+async def stream_agent_response(query: str, session_id: str, request_id: str, model: str,
+                                encoder: Optional[StreamEncoder] = None,
+                               on_complete: Optional[Callable[[Any], None]] = None,
+                                announce: bool = True):
     """
     流式输出 Agent 响应
+
+    Agent 在线程池中执行，token 通过 AsyncTokenBridge 推送回事件循环，
+    生成器在 token 到达时立即被唤醒，空闲时不占用 CPU。
+    运行被放弃（客户端断开且宽限期内未重连）时取消运行：中止 LLM 流式请求、中断 SQLite 语句，并在下一个节点前退出。
     
     Args:
         query: 用户查询
         session_id: 会话 ID
         request_id: 请求 ID
         model: 模型名称
+        encoder: 流式协议编码器，默认使用 v1 协议
+        on_complete: 运行成功结束后以 Agent 结果调用（例如写入语义缓存）
+        announce: 是否发送开始帧（快速路径回退到 Agent 时已经发送过）
     """
     import asyncio
-    import queue
-    from queue import Queue
     
+    if encoder is None:
+        encoder = create_stream_encoder(STREAM_PROTOCOL_LEGACY, request_id, session_id)
+
+    scope = CancelScope()
+    agent_future = None
     try:
-        # 用于存储流式输出的队列
-        token_queue = Queue()
-        accumulated_message = ""
+        # 工作线程 -> 事件循环的 token 通道
+        loop = asyncio.get_running_loop()
+        bridge = AsyncTokenBridge(loop)
         
         # 创建回调处理器，实时发送 token
         def on_token(token: str):
             """实时发送 token"""
             print(f"[DEBUG] Received token: {repr(token[:50])}")
-            token_queue.put(token)
+            bridge.put_threadsafe(token)
         
-        callback_handler = StreamingCallbackHandler(token_callback=on_token)
+        callback_handler = StreamingCallbackHandler(token_callback=on_token, cancel_scope=scope)
         
-        # 创建 Agent
-        react_graph = create_agent(callback_handler, model)
+        # 获取已编译的 Agent（按模型缓存）
+        react_graph = get_agent(model)
         
         # 创建消息状态
         messages = [HumanMessage(content=query)]
         state = MessagesState(messages=messages)
         
-        # 配置
+        # 配置：请求级的流式回调通过运行配置传入
         config = {
             "configurable": {"thread_id": session_id},
-            "recursion_limit": 100  # 增加递归限制，避免复杂任务时过早停止
+            "recursion_limit": 100,  # 增加递归限制，避免复杂任务时过早停止
+            "callbacks": [callback_handler],
         }
         
         # 发送初始消息
-        yield {
-            "event": "message",
-            "data": json.dumps({
-                "type": "start",
-                "request_id": request_id,
-                "session_id": session_id,
-                "message": "已接收到你的任务，将立即开始处理...",
-                "finished": False
-            }, ensure_ascii=False)
-        }
+        if announce:
+            yield encoder.start("已接收到你的任务，将立即开始处理...")
         
         # 在后台线程执行 Agent
         def run_agent():
-            try:
-                print(f"[DEBUG] Starting agent execution for query: {query[:50]}...")
-                print(f"[DEBUG] Config: {config}")
-                # 使用 invoke 方法，递归限制已在 config 中设置
-                result = react_graph.invoke(state, config=config)
-                print(f"[DEBUG] Agent execution completed. Final message length: {len(callback_handler.final_message)}")
-                print(f"[DEBUG] Final message preview: {callback_handler.final_message[:100]}...")
-                return result
-            except Exception as e:
-                error_msg = str(e)
-                print(f"[ERROR] Agent execution failed: {error_msg}")
-                import traceback
-                traceback.print_exc()
-                # 如果是递归限制错误，提供更友好的错误信息
-                if "recursion_limit" in error_msg.lower():
-                    error_msg = f"任务执行步骤过多（超过{config.get('recursion_limit', 100)}步）。这可能是因为任务过于复杂或陷入了循环。请尝试简化您的问题或重新表述。"
-                token_queue.put(("error", error_msg))
-                return None
+            with cancel_scope(scope):
+                try:
+                    print(f"[DEBUG] Starting agent execution for query: {query[:50]}...")
+                    print(f"[DEBUG] Config: {config}")
+                    # 使用 invoke 方法，递归限制已在 config 中设置
+                    result = react_graph.invoke(state, config=config)
+                    print(f"[DEBUG] Agent execution completed. Final message length: {len(callback_handler.final_message)}")
+                    print(f"[DEBUG] Final message preview: {callback_handler.final_message[:100]}...")
+                    return result
+                except Exception as e:
+                    if scope.cancelled:
+                        print(f"[INFO] Agent execution cancelled: {e}")
+                        return None
+                    print(f"[ERROR] Agent execution failed: {e}")
+                    import traceback
+                    traceback.print_exc()
+                    bridge.put_threadsafe(("error", _friendly_error_message(e, config)))
+                    return None
         
-        # 启动 Agent 执行
-        loop = asyncio.get_event_loop()
+        # 启动 Agent 执行，结束时向通道写入结束标记
+        metrics.incr("runs_started")
         agent_future = loop.run_in_executor(None, run_agent)
+        agent_future.add_done_callback(lambda _: bridge.close())
         
-        # 实时发送 token
-        agent_done = False
-        last_message_sent = ""
-        
-        while not agent_done:
-            try:
-                # 尝试获取 token（非阻塞）
-                try:
-                    token = token_queue.get_nowait()
-                    if isinstance(token, tuple) and token[0] == "error":
-                        raise Exception(token[1])
-                    accumulated_message += token
-                    
-                    # 只有当消息有变化时才发送
-                    if accumulated_message != last_message_sent:
-                        last_message_sent = accumulated_message
-                        yield {
-                            "event": "message",
-                            "data": json.dumps({
-                                "type": "response",
-                                "request_id": request_id,
-                                "session_id": session_id,
-                                "message": accumulated_message,
-                                "finished": False
-                            }, ensure_ascii=False)
-                        }
-                except queue.Empty:
-                    # 队列为空，检查 Agent 是否完成
-                    if agent_future.done():
-                        agent_done = True
-                        try:
-                            result = await agent_future
-                        except Exception as e:
-                            raise e
-                        
-                        # 发送剩余的 token
-                        while not token_queue.empty():
-                            try:
-                                token = token_queue.get_nowait()
-                                if isinstance(token, tuple) and token[0] == "error":
-                                    raise Exception(token[1])
-                                accumulated_message += token
-                            except queue.Empty:
-                                break
-                        
-                        # 获取最终消息
-                        final_message = callback_handler.final_message if callback_handler.final_message else accumulated_message
-                        
-                        print(f"[DEBUG] Sending final message. Length: {len(final_message)}")
-                        print(f"[DEBUG] Accumulated message length: {len(accumulated_message)}")
-                        print(f"[DEBUG] Callback handler final message length: {len(callback_handler.final_message) if callback_handler.final_message else 0}")
-                        print(f"[DEBUG] Result type: {type(result)}")
-                        if result:
-                            print(f"[DEBUG] Result keys: {result.keys() if isinstance(result, dict) else 'Not a dict'}")
-                        
-                        # 如果最终消息为空，尝试从 result 中获取
-                        if not final_message and result:
-                            if isinstance(result, dict) and "messages" in result:
-                                messages = result["messages"]
-                                print(f"[DEBUG] Found {len(messages)} messages in result")
-                                
-                                # 检查是否有工具调用（特别是图表工具）
-                                from langchain_core.messages import AIMessage, ToolMessage
-                                chart_config = None
-                                for msg in messages:
-                                    if isinstance(msg, ToolMessage):
-                                        print(f"[DEBUG] Found ToolMessage: tool_call_id={msg.tool_call_id}")
-                                        print(f"[DEBUG] ToolMessage content type: {type(msg.content)}")
-                                        print(f"[DEBUG] ToolMessage content preview: {str(msg.content)[:200]}")
-                                        # 检查是否是图表工具的返回
-                                        if isinstance(msg.content, dict) and "chart_config" in msg.content:
-                                            chart_config = msg.content["chart_config"]
-                                            print(f"[DEBUG] Found chart_config in ToolMessage!")
-                                
-                                # 查找最后一个 AI 消息
-                                for msg in reversed(messages):
-                                    if isinstance(msg, AIMessage):
-                                        if hasattr(msg, "content"):
-                                            final_message = msg.content
-                                            print(f"[DEBUG] Got AI message from result: {len(final_message)} chars")
-                                            # 如果有图表配置，添加到消息中
-                                            if chart_config:
-                                                print(f"[DEBUG] Adding chart_config to final message")
-                                                # 将图表配置以 JSON 代码块形式添加到消息中
-                                                chart_json = json.dumps(chart_config, ensure_ascii=False, indent=2)
-                                                final_message = f"{final_message}\n\n```json\n{chart_json}\n```"
-                                            break
-                                # 如果没有 AI 消息，尝试获取最后一个消息的内容
-                                if not final_message and messages:
-                                    last_msg = messages[-1]
-                                    if hasattr(last_msg, "content"):
-                                        final_message = str(last_msg.content)
-                                        print(f"[DEBUG] Got last message content: {len(final_message)} chars")
-                        
-                        # 如果还是没有消息，至少发送一个提示
-                        if not final_message:
-                            final_message = "处理完成，但未收到响应内容。"
-                            print(f"[WARNING] No message content found!")
-                        
-                        # 发送最终消息
-                        yield {
-                            "event": "message",
-                            "data": json.dumps({
-                                "type": "response",
-                                "request_id": request_id,
-                                "session_id": session_id,
-                                "message": final_message,
-                                "finished": True
-                            }, ensure_ascii=False)
-                        }
-                        print(f"[DEBUG] Final message sent successfully")
-                    else:
-                        # 任务未完成，等待一小段时间
-                        await asyncio.sleep(0.1)
-            except Exception as e:
-                agent_done = True
-                raise e
+        # 实时发送 token：没有 token 时挂起等待，不轮询
+        while True:
+            token = await bridge.get()
+            if token is AsyncTokenBridge.DONE:
+                break
+            if isinstance(token, tuple) and token[0] == "error":
+                metrics.incr("runs_failed")
+                await agent_future
+                raise Exception(token[1])
+            for event in encoder.token(token):
+                yield event
+
+        result = await agent_future
+        metrics.incr("runs_completed")
+        _record_iterations(result)
+
+        # 发送最终消息
+        final_message = _resolve_final_message(callback_handler.final_message or encoder.message, result)
+        if on_complete is not None:
+            on_complete(result)
+        yield encoder.final(final_message)
+        print(f"[DEBUG] Final message sent successfully")
         
     except Exception as e:
         # 发送错误消息
-        yield {
-            "event": "error",
-            "data": json.dumps({
-                "type": "error",
-                "request_id": request_id,
-                "session_id": session_id,
-                "message": f"处理请求时出错: {str(e)}",
-                "finished": True
-            }, ensure_ascii=False)
-        }
+        yield encoder.error(f"处理请求时出错: {str(e)}")
 
+    finally:
+        # 生成器被提前关闭（运行被放弃）而 Agent 仍在运行
+        if agent_future is not None and not agent_future.done():
+            await _cancel_run(scope, agent_future)
 
-@router.post("/query")
-async def chat_query(request: ChatRequest):
+
+async def stream_agent_events(query: str, session_id: str, request_id: str, model: str,
+                              encoder: Optional[StreamEncoder] = None,
+                             on_complete: Optional[Callable[[Any], None]] = None,
+                              announce: bool = True):
     """
-    聊天查询接口（SSE 流式输出）
-    
+    异步执行模式：基于 LangGraph astream_events 原生异步执行 Agent
+
+    LLM 调用走 ainvoke，不占用线程池线程；执行过程中输出 LLM token、
+    工具开始/结束和最终回答等结构化事件，大量会话可共享同一个事件循环。
+    Agent 在独立的 Task 中运行，运行被放弃时取消该 Task（同时取消进行中的 LLM 请求）并中断 SQLite 语句。
+
     Args:
-        request: 聊天请求
-        
-    Returns:
-        SSE 流式响应
+        query: 用户查询
+        session_id: 会话 ID
+        request_id: 请求 ID
+        model: 模型名称
+        encoder: 流式协议编码器，默认使用 v1 协议
+        on_complete: 运行成功结束后以 Agent 结果调用（例如写入语义缓存）
+        announce: 是否发送开始帧（快速路径回退到 Agent 时已经发送过）
     """
-    session_id = request.session_id or "default"
-    request_id = request.request_id or str(uuid.uuid4())
-    
+    import asyncio
+    import time
+    from contextlib import aclosing
+
+    if encoder is None:
+        encoder = create_stream_encoder(STREAM_PROTOCOL_LEGACY, request_id, session_id)
+
+    config = {
+        "configurable": {"thread_id": session_id},
+        "recursion_limit": 100  # 增加递归限制，避免复杂任务时过早停止
+    }
+
+    scope = CancelScope()
+    run_task = None
+    try:
+        # token 直接来自 astream_events，不需要回调处理器
+        react_graph = get_agent(model)
+        state = MessagesState(messages=[HumanMessage(content=query)])
+
+        if announce:
+            yield encoder.start("已接收到你的任务，将立即开始处理...")
+
+        event_queue: asyncio.Queue = asyncio.Queue()
+
+        async def run_graph():
+            # Task 拥有独立的 context，CancelScope 会传递到图节点和工具线程
+            with cancel_scope(scope):
+                try:
+                    async with aclosing(react_graph.astream_events(state, config=config, version="v2")) as stream:
+                        async for event in stream:
+                            event_queue.put_nowait(event)
+                finally:
+                    event_queue.put_nowait(AsyncTokenBridge.DONE)
+
+        metrics.incr("runs_started")
+        run_task = asyncio.create_task(run_graph())
+
+        streamed_parts = []
+        tool_started_at = {}
+        result = None
+        while True:
+            event = await event_queue.get()
+            if event is AsyncTokenBridge.DONE:
+                break
+            kind = event["event"]
+            node = event.get("metadata", {}).get("langgraph_node")
+            if kind == "on_chat_model_stream" and node == "llm_agent":
+                # 只转发 Agent 主 LLM 的 token，工具内部的 LLM 调用（如 text2sqlite）不转发
+                token = _extract_text(event["data"].get("chunk"))
+                if token:
+                    streamed_parts.append(token)
+                    for sse_event in encoder.token(token):
+                        yield sse_event
+            elif kind == "on_tool_start":
+                tool_started_at[event["run_id"]] = time.perf_counter()
+                for sse_event in encoder.tool_start(event["name"], event["run_id"], event["data"].get("input")):
+                    yield sse_event
+            elif kind == "on_tool_end":
+                started = tool_started_at.pop(event["run_id"], time.perf_counter())
+                duration_ms = (time.perf_counter() - started) * 1000
+                for sse_event in encoder.tool_end(event["name"], event["run_id"], event["data"].get("output"), duration_ms):
+                    yield sse_event
+            elif kind == "on_chain_end" and not event.get("parent_ids"):
+                # 根图结束，输出即最终状态
+                result = event["data"].get("output")
+
+        try:
+            await run_task
+        except Exception as e:
+            metrics.incr("runs_failed")
+            print(f"[ERROR] Async agent execution failed: {e}")
+            import traceback
+            traceback.print_exc()
+            raise Exception(_friendly_error_message(e, config)) from e
+        metrics.incr("runs_completed")
+        _record_iterations(result)
+
+        final_message = _resolve_final_message("".join(streamed_parts) or encoder.message, result)
+        if on_complete is not None:
+            on_complete(result)
+        yield encoder.final(final_message)
+
+    except Exception as e:
+        yield encoder.error(f"处理请求时出错: {str(e)}")
+
+    finally:
+        # 生成器被提前关闭（运行被放弃）而 Agent 仍在运行
+        if run_task is not None and not run_task.done():
+            await _cancel_run(scope, run_task)
+
+
+async def stream_cached_answer(query: str, session_id: str, model: str, encoder: StreamEncoder,
+                               payload: dict):
+    """
+    命中语义缓存时直接输出缓存的回答，不执行 Agent
+
+    问答仍写入会话线程（作为 llm_agent 节点的输出），后续追问可以引用这一轮的上下文。
+    """
+    message = payload["message"]
+    yield encoder.start("已接收到你的任务，将立即开始处理...")
+    get_agent(model).update_state(
+        {"configurable": {"thread_id": session_id}},
+        {"messages": [HumanMessage(content=query), AIMessage(content=message)]},
+        as_node="llm_agent",
+    )
+    for event in encoder.token(message):
+        yield event
+    yield encoder.final(message)
+
+
+async def stream_routed_response(stream_func, query: str, session_id: str, request_id: str, model: str,
+                                 encoder: StreamEncoder, on_complete: Optional[Callable[[Any], None]] = None):
+    """
+    先尝试简单问题的快速路径（见 fast_path），问题不适用或快速路径失败时交给 Agent（stream_func）
+
+    快速路径的回答一次性作为 token 输出；问答同样写入会话线程。
+    """
+    import asyncio
+    import time
+    from contextlib import aclosing
+
+    started_at = time.perf_counter()
+    yield encoder.start("已接收到你的任务，将立即开始处理...")
+    scope = CancelScope()
+    try:
+        with cancel_scope(scope):
+            result, route = await fast_path_router.aanswer(query, session_id, model)
+    except asyncio.CancelledError:
+        scope.cancel()
+        raise
+    except Exception as e:
+        yield encoder.error(f"处理请求时出错: {str(e)}")
+        return
+
+    if result is not None:
+        message = _resolve_final_message("", result)
+        for event in encoder.token(message):
+            yield event
+        fast_path_router.record(route, (time.perf_counter() - started_at) * 1000, request_id)
+        if on_complete is not None:
+            on_complete(result)
+        yield encoder.final(message)
+        return
+
+    async with aclosing(stream_func(query=query, session_id=session_id, request_id=request_id, model=model,
+                                    encoder=encoder, on_complete=on_complete, announce=False)) as events:
+        async for event in events:
+            yield event
+    fast_path_router.record(route, (time.perf_counter() - started_at) * 1000, request_id)
+
+
+def _is_fresh_session(session_id: str, model: str) -> bool:
+    """会话线程中还没有任何消息（回答不依赖对话历史，可以使用语义缓存）"""
+    snapshot = get_agent(model).get_state({"configurable": {"thread_id": session_id}})
+    values = snapshot.values
+    messages = values.get("messages") if isinstance(values, dict) else getattr(values, "messages", None)
+    return not messages
+
+
+async def invoke_agent(query: str, session_id: str, model: str,
+                       callback_handler: StreamingCallbackHandler, request_id: Optional[str] = None):
+    """
+    非流式执行一次 Agent（ainvoke，原生异步），返回 Agent 结果
+
+    简单的单表聚合问题先走快速路径（见 fast_path），返回同样格式的结果；不适用或失败时再执行 Agent。
+    调用方负责准入控制；callback_handler 用于累计最终文本和 token 用量。
+    Task 被取消时同时取消运行（中止 LLM 请求、中断 SQLite 语句）。
+    request_id 用于把回答反馈（POST /feedback）归到对应路径。
+
+    Raises:
+        Exception: Agent 执行失败，异常信息为面向用户的错误信息
+    """
+    import asyncio
+    import time
+
+    scope = CancelScope()
+    callback_handler.cancel_scope = scope
+    config = {
+        "configurable": {"thread_id": session_id},
+        "recursion_limit": 100,
+        "callbacks": [callback_handler],
+    }
+    started_at = time.perf_counter()
+    agent_run = False
+    try:
+        with cancel_scope(scope):
+            result, route = await fast_path_router.aanswer(query, session_id, model, [callback_handler])
+            if result is None:
+                agent_run = True
+                metrics.incr("runs_started")
+                state = MessagesState(messages=[HumanMessage(content=query)])
+                result = await get_agent(model).ainvoke(state, config=config)
+    except asyncio.CancelledError:
+        scope.cancel()
+        if agent_run:
+            metrics.incr("runs_cancelled")
+        raise
+    except Exception as e:
+        if agent_run:
+            metrics.incr("runs_failed")
+        raise Exception(_friendly_error_message(e, config)) from e
+    if agent_run:
+        metrics.incr("runs_completed")
+        _record_iterations(result)
+    fast_path_router.record(route, (time.perf_counter() - started_at) * 1000, request_id)
+    return result
+
+
+async def admitted_stream(ticket: AdmissionTicket, encoder: StreamEncoder, events, model: str):
+    """
+    准入控制包装：排队期间发送位置更新，获得执行权后转发 Agent 事件，结束时整理会话（见 sessions）并释放执行槽
+
+    Args:
+        ticket: 准入凭证
+        encoder: 流式协议编码器
+        events: Agent 事件生成器（获得执行权后才开始迭代）
+        model: 模型名称（裁剪会话历史时使用）
+    """
+    admission = get_admission_controller()
+    try:
+        last_position = None
+        while not ticket.granted:
+            if ticket.position != last_position:
+                last_position = ticket.position
+                yield encoder.queued(ticket.position)
+            await ticket.wait_for_change()
+        async for event in events:
+            yield event
+    finally:
+        try:
+            if ticket.granted:
+                await session_manager.arelease(ticket.session_id, model)
+        finally:
+            admission.release(ticket)
+            await events.aclose()
+
+
+def _sse_response(event_stream):
+    """把事件生成器包装为 SSE 响应"""
     try:
         from sse_starlette.sse import EventSourceResponse
-        return EventSourceResponse(
-            stream_agent_response(
-                query=request.query,
-                session_id=session_id,
-                request_id=request_id,
-                model=request.model
-            )
-        )
+        return EventSourceResponse(event_stream)
     except ImportError:
         # 如果 sse-starlette 不可用，使用 StreamingResponse
         from fastapi.responses import StreamingResponse
         import asyncio
         
         async def generate():
-            async for event in stream_agent_response(
-                query=request.query,
-                session_id=session_id,
-                request_id=request_id,
-                model=request.model
-            ):
-                yield f"event: {event['event']}\ndata: {event['data']}\n\n"
+            async for event in event_stream:
+                event_id = f"id: {event['id']}\n" if "id" in event else ""
+                yield f"{event_id}event: {event['event']}\ndata: {event['data']}\n\n"
         
         return StreamingResponse(
             generate(),
@@ -295,6 +573,177 @@ async def chat_query(request: ChatRequest):
         )
 
 
+@router.post("/query")
+async def chat_query(request: ChatRequest, last_event_id: Optional[str] = Header(None)):
+    """
+    聊天查询接口（SSE 流式输出）
+
+    每个事件带有递增的 SSE id。连接断开后运行在服务端继续，
+    使用同一 request_id 并携带 Last-Event-ID 重新请求即可从缺失的事件继续，不会重新执行。
+    
+    Args:
+        request: 聊天请求
+        last_event_id: 断线重连时客户端收到的最后一个事件 id
+        
+    Returns:
+        SSE 流式响应
+    """
+    session_id = request.session_id or "default"
+    request_id = request.request_id or str(uuid.uuid4())
+
+    replay_registry = get_replay_registry()
+    if request.request_id:
+        existing = replay_registry.get(request_id)
+        if existing is not None:
+            metrics.incr("streams_resumed")
+            return _sse_response(existing.subscribe(parse_last_event_id(last_event_id)))
+
+    if request.stream_protocol not in SUPPORTED_STREAM_PROTOCOLS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的 stream_protocol: {request.stream_protocol}，可选值: {list(SUPPORTED_STREAM_PROTOCOLS)}"
+        )
+    encoder = create_stream_encoder(request.stream_protocol, request_id, session_id)
+
+    execution_mode = request.execution_mode or DEFAULT_EXECUTION_MODE
+    if execution_mode not in EXECUTION_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"不支持的 execution_mode: {execution_mode}，可选值: {list(EXECUTION_MODES)}"
+        )
+    stream_func = stream_agent_events if execution_mode == "async" else stream_agent_response
+
+    # 新会话的问题与对话历史无关，先查语义缓存
+    cached_payload = None
+    on_complete = None
+    if semantic_cache.enabled and _is_fresh_session(session_id, request.model):
+        import asyncio
+
+        database_version = get_database_version()
+        loop = asyncio.get_running_loop()
+        vector = await loop.run_in_executor(None, semantic_cache.embed, request.query)
+        match = semantic_cache.lookup(request.query, vector, request.model, database_version)
+        if match is not None:
+            cached_payload = match[0].payload
+        else:
+            def on_complete(result):
+                message = _resolve_final_message("", result)
+                semantic_cache.store(
+                    request.query, vector, request.model, database_version,
+                    build_answer_payload(request.query, request.model, message, result, database_version),
+                )
+
+    # 准入控制：队列已满时快速返回 429，同一 session 的请求串行执行
+    try:
+        ticket = get_admission_controller().enqueue(session_id)
+    except AdmissionRejected as e:
+        raise HTTPException(
+            status_code=429,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    replay = replay_registry.create(request_id, session_id, encoder)
+    if cached_payload is not None:
+        events = stream_cached_answer(request.query, session_id, request.model, encoder, cached_payload)
+    else:
+        events = stream_routed_response(
+            stream_func,
+            query=request.query,
+            session_id=session_id,
+            request_id=request_id,
+            model=request.model,
+            encoder=encoder,
+            on_complete=on_complete
+        )
+    replay.start(admitted_stream(ticket, encoder, events, request.model))
+    return _sse_response(replay.subscribe())
+
+
+@router.get("/stream/{request_id}")
+async def resume_stream(request_id: str, last_event_id: Optional[str] = Header(None),
+                        from_id: Optional[str] = Query(None, alias="last_event_id")):
+    """
+    重新订阅一个请求的事件流（断线重连）
+
+    Args:
+        request_id: 请求 ID
+        last_event_id: Last-Event-ID 请求头
+        from_id: 不便设置请求头时（如浏览器 EventSource 首次连接）可用查询参数 last_event_id 代替
+
+    Returns:
+        SSE 流式响应，从 last_event_id 之后的事件开始
+    """
+    replay = get_replay_registry().get(request_id)
+    if replay is None:
+        raise HTTPException(status_code=404, detail=f"请求 {request_id} 不存在或事件已过期")
+    metrics.incr("streams_resumed")
+    return _sse_response(replay.subscribe(parse_last_event_id(last_event_id or from_id)))
+
+
+@router.get("/sql/pages/{cursor}")
+async def get_sql_page(cursor: str, offset: Optional[int] = Query(None, ge=0),
+                       limit: int = Query(DEFAULT_MAX_ROWS, ge=1, le=DEFAULT_MAX_ROWS),
+                       session_id: Optional[str] = None):
+    """
+    获取被截断的查询结果的后续页
+
+    Args:
+        cursor: execute_sqlite_query 返回的游标句柄或结果句柄（result_handle）
+        offset: 起始行号，默认接着上一页
+        limit: 本页最多返回的行数
+        session_id: 结果句柄不带 offset 时按会话记录读取位置，未指定时使用 "default"
+
+    Returns:
+        一页结果（columns、rows、next_offset 等）
+    """
+    import asyncio
+
+    page = await asyncio.get_running_loop().run_in_executor(None, fetch_result_page, cursor, offset, limit, session_id)
+    if page["status"] != "success":
+        raise HTTPException(status_code=404, detail=page["error"])
+    return page["result"]
+
+
+@router.post("/feedback")
+async def submit_feedback(request: FeedbackRequest):
+    """
+    客户端对一次回答是否正确的反馈，按回答路径（快速路径 / Agent）汇总为准确率
+
+    Args:
+        request: request_id 与 correct
+
+    Returns:
+        该请求的回答路径（fast / fallback / agent）
+    """
+    path = fast_path_router.record_feedback(request.request_id, request.correct)
+    if path is None:
+        raise HTTPException(status_code=404, detail=f"请求 {request.request_id} 不存在或反馈已记录")
+    return {"request_id": request.request_id, "path": path}
+
+
+@router.get("/metrics")
+async def get_metrics():
+    """运行指标：Agent 运行计数（含被取消的运行）、快速路径、历史压缩、准入控制、重放缓冲区、语义缓存、SQL 结果缓存、SQL 代价保护、SQL 校验、汇总表改写、DuckDB 引擎、结果文件、工具并发执行、会话 checkpoint 存储、会话管理与连接池状态"""
+    return {
+        **metrics.snapshot(),
+        "fast_path": fast_path_router.stats(),
+        "history_compaction": history_compactor.stats(),
+        "admission": get_admission_controller().stats(),
+        "replay": get_replay_registry().stats(),
+        "semantic_cache": semantic_cache.stats(),
+        "sql_cache": sql_result_cache.stats(),
+        "sql_guard": query_guard.stats(),
+        "sql_validator": sql_validator.stats(),
+        "rollups": get_rollup_manager(DATABASE_PATH).stats(),
+        "duckdb": get_duckdb_engine(DATABASE_PATH).stats(),
+        "result_store": result_store.stats(),
+        "tool_executor": tool_execution_stats(),
+        "checkpointer": checkpointer_stats(memory),
+        "sessions": session_manager.stats(),
+        "sqlite_pool": get_read_pool(DATABASE_PATH).stats(),
+    }
+
+
 @router.get("/health")
 async def health_check():
     """健康检查"""
@@ -0,0 +1,315 @@
+"""
+简单问题的快速路径
+
+"有多少个产品" 这类单表聚合问题在 ReAct 循环中要经过 LLM -> database_schema_rag -> LLM -> text2sqlite_query（又一次 LLM）
+-> LLM -> execute_sqlite_query -> LLM，四五次串行的模型调用。快速路径先用规则对问题分类：
+
+- 只命中一张表、包含聚合意图（多少 / 几个 / 总额 / 平均 / 最高 ...）、不涉及图表 / 导出 / 分析 / 对比、
+  也不是指代上文的追问 —— 走确定性流程：读取该表的实时 DDL 和表说明 -> 一次 SQL 生成调用
+  -> execute_readonly_query（与 execute_sqlite_query 相同的校验、缓存和代价保护）-> 模板化回答
+- 其余问题，或快速路径任何一步失败（模型认为无法回答、SQL 不合法、执行出错、结果为空或行数过多）—— 交给 Agent
+
+快速路径的问答（含一条 execute_sqlite_query 工具调用和结果）写入会话线程，后续追问可以引用；
+/answer 返回的 sql、tables 与 Agent 路径格式相同。
+
+按路径统计（GET /api/chat/metrics 的 fast_path 字段）：
+- fast（快速路径作答）、fallback（尝试后回退到 Agent，耗时含尝试时间）、agent（未路由）的请求数与耗时分位数
+- 分类原因与回退原因的计数
+- 准确率：客户端对回答的反馈（POST /api/chat/feedback）按路径汇总；离线准确率见 benchmarks/bench_fast_path.py
+"""
+import asyncio
+import contextvars
+import os
+import re
+import threading
+import uuid
+from collections import OrderedDict, deque
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langchain_openai import ChatOpenAI
+from langgraph.prebuilt.tool_node import msg_content_output
+
+from agent import get_agent, get_model_config
+from tools.cancellation import check_cancelled
+from tools.sqlite_pool import get_read_pool
+from tools.tools_execute_sqlite import DATABASE_PATH, execute_readonly_query, get_database_version
+
+DEFAULT_FAST_PATH_ENABLED = os.getenv("CHATBI_FAST_PATH_ENABLED", "true").lower() == "true"
+DEFAULT_FAST_PATH_MAX_ROWS = int(os.getenv("CHATBI_FAST_PATH_MAX_ROWS", "20"))
+DEFAULT_FAST_PATH_MAX_QUESTION_CHARS = int(os.getenv("CHATBI_FAST_PATH_MAX_QUESTION_CHARS", "80"))
+DEFAULT_FAST_PATH_LATENCY_WINDOW = int(os.getenv("CHATBI_FAST_PATH_LATENCY_WINDOW", "1000"))
+
+DOCS_DIR = Path(__file__).resolve().parent.parent.parent / "docs"
+PATHS = ("fast", "fallback", "agent")
+
+# 表 -> 问题中指向该表的关键词（表名本身也算）
+TABLE_KEYWORDS = {
+    "ORDER_DETAILS": ("订单", "下单", "order"),
+    "CUSTOMER_DETAILS": ("客户", "顾客", "会员", "customer"),
+    "PAYMENTS": ("支付", "付款", "payment"),
+    "PRODUCTS": ("产品", "商品", "product"),
+    "TRANSACTIONS": ("交易", "transaction"),
+    "USER_INTERACTIONS": ("互动", "交互", "浏览", "点击", "interaction"),
+}
+_AGGREGATE_RE = re.compile(
+    r"多少|几[个种笔位单次类家条名]|数量|总数|总额|总金额|总和|合计|总共|一共|平均|均值|"
+    r"最大|最小|最高|最低|最多|最少|最早|最晚|"
+    r"\b(?:how many|how much|count|total|sum|average|avg|maximum|minimum|max|min|number of)\b",
+    re.IGNORECASE,
+)
+_COMPLEX_RE = re.compile(
+    r"图|可视化|趋势|导出|下载|报告|报表|pdf|excel|csv|分析|为什么|原因|建议|预测|对比|比较|相比|环比|同比|关联|"
+    r"\b(?:chart|plot|graph|export|report|why|compare|trend|predict)\b",
+    re.IGNORECASE,
+)
+# 指代上文的追问需要对话历史，交给 Agent
+_FOLLOW_UP_RE = re.compile(r"它|他们|她们|这些|那些|上面|上述|刚才|之前|以上|前面|继续|呢[？?]?$")
+_SQL_FENCE_RE = re.compile(r"^```(?:sql|sqlite)?\s*|\s*```$", re.IGNORECASE)
+
+
+@dataclass
+class RouteDecision:
+    """一次请求的路由：path 为 fast / fallback / agent，reason 为分类或回退原因"""
+    path: str
+    reason: str
+    table: Optional[str] = None
+    sql: Optional[str] = None
+
+
+def _format_value(value: Any) -> str:
+    if value is None:
+        return "空"
+    if isinstance(value, bool):
+        return str(value)
+    if isinstance(value, int):
+        return f"{value:,}"
+    if isinstance(value, float):
+        return f"{value:,.2f}"
+    return str(value)
+
+
+def render_answer(table: str, sql: str, columns: List[str], rows: List[List[Any]]) -> str:
+    """模板化回答：单个值直接给出，单行列出各列，多行输出 Markdown 表格，最后附上执行的 SQL"""
+    if len(rows) == 1 and len(columns) == 1:
+        body = f"{columns[0]}：**{_format_value(rows[0][0])}**"
+    elif len(rows) == 1:
+        body = "\n".join(f"- {column}：**{_format_value(value)}**" for column, value in zip(columns, rows[0]))
+    else:
+        lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+        lines += ["| " + " | ".join(_format_value(value) for value in row) + " |" for row in rows]
+        body = "\n".join(lines)
+    return f"根据 {table} 表的查询结果：\n\n{body}\n\n执行的 SQL：\n```sql\n{sql}\n```"
+
+
+class FastPathRouter:
+    """简单问题的分类与确定性问答流程，以及按路径的耗时和准确率统计（线程安全）"""
+
+    def __init__(self, enabled: bool = DEFAULT_FAST_PATH_ENABLED, max_rows: int = DEFAULT_FAST_PATH_MAX_ROWS,
+                 max_question_chars: int = DEFAULT_FAST_PATH_MAX_QUESTION_CHARS,
+                 latency_window: int = DEFAULT_FAST_PATH_LATENCY_WINDOW, docs_dir: Path = DOCS_DIR):
+        self.enabled = enabled
+        self.max_rows = max_rows
+        self.max_question_chars = max_question_chars
+        self.docs_dir = docs_dir
+        self._lock = threading.Lock()
+        self._llms: Dict[Tuple[str, str, Optional[str]], ChatOpenAI] = {}
+        # (表名, 数据库版本) -> 表结构说明
+        self._schemas: Dict[Tuple[str, str], str] = {}
+        self._latencies: Dict[str, Deque[float]] = {path: deque(maxlen=max(latency_window, 1)) for path in PATHS}
+        self._counts: Dict[str, int] = {path: 0 for path in PATHS}
+        self._reasons: Dict[str, int] = {}
+        self._fallbacks: Dict[str, int] = {}
+        # request_id -> 路径，用于把客户端反馈归到路径上
+        self._request_paths: "OrderedDict[str, str]" = OrderedDict()
+        self._feedback: Dict[str, Dict[str, int]] = {path: {"rated": 0, "correct": 0} for path in PATHS}
+
+    def classify(self, question: str) -> RouteDecision:
+        """规则分类，不调用模型"""
+        text = question.strip()
+        if not self.enabled:
+            return RouteDecision("agent", "disabled")
+        if len(text) > self.max_question_chars:
+            return RouteDecision("agent", "too_long")
+        if _COMPLEX_RE.search(text):
+            return RouteDecision("agent", "complex")
+        if _FOLLOW_UP_RE.search(text):
+            return RouteDecision("agent", "follow_up")
+        if not _AGGREGATE_RE.search(text):
+            return RouteDecision("agent", "not_aggregate")
+        lowered = text.lower()
+        tables = [
+            table for table, keywords in TABLE_KEYWORDS.items()
+            if table.lower() in lowered or any(keyword in lowered for keyword in keywords)
+        ]
+        if not tables:
+            return RouteDecision("agent", "no_table")
+        if len(tables) > 1:
+            return RouteDecision("agent", "multi_table")
+        return RouteDecision("fast", "single_table_aggregate", table=tables[0])
+
+    def table_schema(self, table: str) -> str:
+        """表结构：实时 DDL（列名和类型以数据库为准）+ docs/ 下的表说明（与 schema 检索的语料相同）"""
+        version = get_database_version()
+        key = (table, version)
+        with self._lock:
+            schema = self._schemas.get(key)
+        if schema is not None:
+            return schema
+        with get_read_pool(DATABASE_PATH).connection() as conn:
+            row = conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        if row is None:
+            raise LookupError(f"table {table} not found")
+        doc_path = self.docs_dir / f"{table.lower()}.md"
+        doc = doc_path.read_text(encoding="utf-8").strip() if doc_path.exists() else ""
+        schema = row[0] + (f"\n\n{doc}" if doc else "")
+        with self._lock:
+            # 数据库变化后旧版本的条目不再使用
+            self._schemas = {k: v for k, v in self._schemas.items() if k[1] == version}
+            self._schemas[key] = schema
+        return schema
+
+    def _llm(self, model: str) -> ChatOpenAI:
+        config = get_model_config(model)
+        key = (config.model_name, config.api_key, config.base_url)
+        with self._lock:
+            llm = self._llms.get(key)
+            if llm is None:
+                # 不启用流式输出：SQL 生成不应作为回答 token 推送给客户端
+                llm = ChatOpenAI(model=config.model_name, api_key=config.api_key, base_url=config.base_url,
+                                 temperature=0)
+                self._llms = {k: v for k, v in self._llms.items() if k[0] != config.model_name}
+                self._llms[key] = llm
+        return llm
+
+    def generate_sql(self, question: str, table: str, model: str, callbacks: Optional[List[Any]] = None) -> Optional[str]:
+        """一次模型调用生成 SQL；模型认为单表无法回答或输出不是单条 SELECT 时返回 None"""
+        prompt = (
+            f"你是一个 SQLite 专家。请只使用下面这张表，为问题写一条 SQLite 查询语句，只返回 SQL，不要有任何解释。\n"
+            f"如果只用这张表无法回答该问题，只返回 NONE。\n"
+            f"注意：表名直接写 {table}，不需要前缀 STREAM_HACKATHON.STREAMLIT；结果列使用有意义的别名。\n"
+            f"表结构:\n{self.table_schema(table)}\n"
+            f"问题: {question.strip()}\n"
+        )
+        response = self._llm(model).invoke(prompt, config={"callbacks": callbacks or []})
+        sql = _SQL_FENCE_RE.sub("", str(response.content).strip()).strip().rstrip(";").strip()
+        if not re.match(r"(?:SELECT|WITH)\b", sql, re.IGNORECASE) or ";" in sql:
+            return None
+        return sql
+
+    def answer(self, question: str, session_id: str, model: str, route: RouteDecision,
+               callbacks: Optional[List[Any]] = None) -> Optional[Dict[str, Any]]:
+        """
+        执行快速路径，成功时返回 Agent 结果格式的 {"messages": [...]} 并写入会话线程
+
+        失败时返回 None，route.path 置为 fallback，route.reason 记录回退原因；取消时抛出 RunCancelled
+        """
+        def fallback(reason: str) -> None:
+            route.path, route.reason = "fallback", reason
+            print(f"[INFO] Fast path fell back to agent ({reason}): {question[:50]}")
+
+        check_cancelled()
+        try:
+            sql = self.generate_sql(question, route.table, model, callbacks)
+        except Exception as e:
+            fallback("generation_error")
+            print(f"[WARNING] Fast path SQL generation failed: {e}")
+            return None
+        if sql is None:
+            fallback("unanswerable")
+            return None
+
+        check_cancelled()
+        response = execute_readonly_query(sql, session_id)
+        route.sql = response.get("executed_query", sql)
+        if response.get("status") != "success":
+            fallback("execution_error")
+            return None
+        result = response["result"]
+        if not result.get("rows"):
+            fallback("empty_result")
+            return None
+        if result.get("truncated") or len(result["rows"]) > self.max_rows:
+            fallback("large_result")
+            return None
+
+        check_cancelled()
+        call_id = f"call_fast_{uuid.uuid4().hex[:12]}"
+        messages = [
+            HumanMessage(content=question),
+            AIMessage(content="", tool_calls=[{"name": "execute_sqlite_query", "args": {"query": sql}, "id": call_id}]),
+            ToolMessage(content=msg_content_output(response), tool_call_id=call_id, name="execute_sqlite_query"),
+            AIMessage(content=render_answer(route.table, route.sql, result["columns"], result["rows"])),
+        ]
+        get_agent(model).update_state({"configurable": {"thread_id": session_id}}, {"messages": messages},
+                                      as_node="llm_agent")
+        return {"messages": messages}
+
+    async def aanswer(self, question: str, session_id: str, model: str,
+                      callbacks: Optional[List[Any]] = None) -> Tuple[Optional[Dict[str, Any]], RouteDecision]:
+        """分类并在线程池中执行快速路径（复制当前上下文，取消范围随之生效）；返回 (结果或 None, 路由)"""
+        route = self.classify(question)
+        if route.path != "fast":
+            return None, route
+        loop = asyncio.get_running_loop()
+        result = await loop.run_in_executor(
+            None, contextvars.copy_context().run, self.answer, question, session_id, model, route, callbacks,
+        )
+        return result, route
+
+    def record(self, route: RouteDecision, elapsed_ms: float, request_id: Optional[str] = None) -> None:
+        """记录一次请求的路由与端到端耗时（fallback 的耗时包含快速路径的尝试）"""
+        with self._lock:
+            self._counts[route.path] += 1
+            self._latencies[route.path].append(elapsed_ms)
+            reasons = self._fallbacks if route.path == "fallback" else self._reasons
+            reasons[route.reason] = reasons.get(route.reason, 0) + 1
+            if route.path == "fallback":
+                self._reasons["single_table_aggregate"] = self._reasons.get("single_table_aggregate", 0) + 1
+            if request_id:
+                self._request_paths[request_id] = route.path
+                self._request_paths.move_to_end(request_id)
+                while len(self._request_paths) > 4096:
+                    self._request_paths.popitem(last=False)
+
+    def record_feedback(self, request_id: str, correct: bool) -> Optional[str]:
+        """记录客户端对回答是否正确的反馈，返回该请求的路径；请求未知（或已被淘汰）时返回 None"""
+        with self._lock:
+            path = self._request_paths.pop(request_id, None)
+            if path is None:
+                return None
+            self._feedback[path]["rated"] += 1
+            self._feedback[path]["correct"] += bool(correct)
+            return path
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            routed = self._counts["fast"] + self._counts["fallback"]
+            latency = {}
+            for path, samples in self._latencies.items():
+                ordered = sorted(samples)
+                latency[path] = {
+                    "count": self._counts[path],
+                    "avg_ms": round(sum(ordered) / len(ordered), 2) if ordered else 0.0,
+                    "p50_ms": round(ordered[len(ordered) // 2], 2) if ordered else 0.0,
+                    "p95_ms": round(ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)], 2) if ordered else 0.0,
+                    "max_ms": round(ordered[-1], 2) if ordered else 0.0,
+                }
+            return {
+                "enabled": self.enabled,
+                "routed": routed,
+                "answered": self._counts["fast"],
+                "success_rate": round(self._counts["fast"] / routed, 4) if routed else 0.0,
+                "latency": latency,
+                "routes": dict(self._reasons),
+                "fallback_reasons": dict(self._fallbacks),
+                "accuracy": {
+                    path: {**feedback, "rate": round(feedback["correct"] / feedback["rated"], 4) if feedback["rated"] else None}
+                    for path, feedback in self._feedback.items()
+                },
+            }
+
+
+fast_path_router = FastPathRouter()
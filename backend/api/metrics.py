@@ -0,0 +1,38 @@
+"""
+进程内运行指标
+
+简单的线程安全计数器与耗时统计，通过 GET /api/chat/metrics 暴露
+"""
+import threading
+from typing import Any, Dict
+
+
+class Metrics:
+    """计数器 + 数值观测（count / sum / max）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, int] = {}
+        self._observations: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            stats = self._observations.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+            stats["count"] += 1
+            stats["sum"] += value
+            stats["max"] = max(stats["max"], value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            observations = {
+                name: {**stats, "avg": stats["sum"] / stats["count"] if stats["count"] else 0.0}
+                for name, stats in self._observations.items()
+            }
+            return {"counters": dict(self._counters), "observations": observations}
+
+
+metrics = Metrics()
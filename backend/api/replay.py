@@ -0,0 +1,203 @@
+"""
+可恢复的 SSE 流
+
+每个请求的事件由独立的 Task 生产，与发起它的 HTTP 连接解耦：
+- 事件按顺序编号（SSE id），写入该请求的有界重放缓冲区（按事件数和字节数限制）
+- 连接断开后运行继续；客户端携带 Last-Event-ID 重连（POST /api/chat/query 使用同一 request_id，
+  或 GET /api/chat/stream/{request_id}）即可从缺失的事件继续接收
+- 缺失的事件已被淘汰时，先发送一个 resync 帧（当前累计的完整消息），再继续实时事件
+- 没有任何订阅者超过宽限期（CHATBI_STREAM_DETACH_GRACE_SECONDS）后才取消运行
+- 运行结束后缓冲区保留 TTL 秒，过期后清理
+
+所有方法都在事件循环线程中调用，不需要加锁。
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import aclosing
+from itertools import islice
+from typing import AsyncIterator, Deque, Dict, List, Optional
+
+from backend.api.metrics import metrics
+from backend.api.stream_protocol import StreamEncoder
+
+DEFAULT_REPLAY_MAX_EVENTS = int(os.getenv("CHATBI_STREAM_REPLAY_MAX_EVENTS", "2000"))
+DEFAULT_REPLAY_MAX_BYTES = int(os.getenv("CHATBI_STREAM_REPLAY_MAX_BYTES", str(2 * 1024 * 1024)))
+DEFAULT_REPLAY_TTL_SECONDS = float(os.getenv("CHATBI_STREAM_REPLAY_TTL_SECONDS", "300"))
+DEFAULT_DETACH_GRACE_SECONDS = float(os.getenv("CHATBI_STREAM_DETACH_GRACE_SECONDS", "30"))
+
+
+def parse_last_event_id(value: Optional[str]) -> int:
+    """解析 Last-Event-ID，缺失或无法解析时从头开始"""
+    try:
+        return max(int(value), 0) if value else 0
+    except ValueError:
+        return 0
+
+
+class ReplayStream:
+    """一个请求的事件缓冲区及其生产 Task"""
+
+    def __init__(
+        self,
+        request_id: str,
+        session_id: str,
+        encoder: StreamEncoder,
+        max_events: int = DEFAULT_REPLAY_MAX_EVENTS,
+        max_bytes: int = DEFAULT_REPLAY_MAX_BYTES,
+        detach_grace: float = DEFAULT_DETACH_GRACE_SECONDS,
+    ):
+        self.request_id = request_id
+        self.session_id = session_id
+        self.encoder = encoder
+        self.max_events = max(max_events, 1)
+        self.max_bytes = max_bytes
+        self.detach_grace = detach_grace
+
+        self._events: Deque[Dict[str, str]] = deque()
+        self._bytes = 0
+        self.last_id = 0
+        self.finished = False
+        self.finished_at: Optional[float] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+        self._abandon_handle: Optional[asyncio.TimerHandle] = None
+
+    @property
+    def first_id(self) -> int:
+        """缓冲区中最早事件的 id"""
+        return self.last_id - len(self._events) + 1
+
+    def publish(self, event: Dict[str, str]) -> None:
+        """编号并写入缓冲区，超出限制时淘汰最早的事件（至少保留最新一个）"""
+        self.last_id += 1
+        event = {**event, "id": str(self.last_id)}
+        self._events.append(event)
+        self._bytes += len(event["data"])
+        while len(self._events) > 1 and (
+            len(self._events) > self.max_events or self._bytes > self.max_bytes
+        ):
+            self._bytes -= len(self._events.popleft()["data"])
+        self._notify()
+
+    def _notify(self) -> None:
+        # 唤醒所有等待中的订阅者，后续等待使用新的 Event
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def start(self, events: AsyncIterator[Dict[str, str]]) -> None:
+        """在独立的 Task 中消费事件生成器，运行不再依赖任何一个连接"""
+        self.task = asyncio.create_task(self._produce(events))
+        self._schedule_abandon()
+
+    async def _produce(self, events) -> None:
+        try:
+            async with aclosing(events) as stream:
+                async for event in stream:
+                    self.publish(event)
+        finally:
+            self.finished = True
+            self.finished_at = time.monotonic()
+            if self._abandon_handle is not None:
+                self._abandon_handle.cancel()
+                self._abandon_handle = None
+            self._notify()
+
+    def _pending_after(self, cursor: int) -> List[Dict[str, str]]:
+        """返回 id 大于 cursor 的事件"""
+        if cursor >= self.last_id:
+            return []
+        if cursor + 1 < self.first_id:
+            metrics.incr("stream_replay_gaps")
+            if self.finished:
+                # 最终帧携带完整消息，直接发送即可
+                return [self._events[-1]]
+            return [{**self.encoder.resync(), "id": str(self.last_id)}]
+        return list(islice(self._events, cursor + 1 - self.first_id, None))
+
+    async def subscribe(self, last_event_id: int = 0) -> AsyncIterator[Dict[str, str]]:
+        """从 last_event_id 之后开始接收事件，直到运行结束"""
+        self.subscribers += 1
+        if self._abandon_handle is not None:
+            self._abandon_handle.cancel()
+            self._abandon_handle = None
+        cursor = last_event_id
+        try:
+            while True:
+                changed = self._changed
+                pending = self._pending_after(cursor)
+                if not pending:
+                    if self.finished:
+                        return
+                    await changed.wait()
+                    continue
+                for event in pending:
+                    yield event
+                    cursor = int(event["id"])
+        finally:
+            self.subscribers -= 1
+            if self.subscribers == 0 and not self.finished:
+                metrics.incr("streams_detached")
+                self._schedule_abandon()
+
+    def _schedule_abandon(self) -> None:
+        if self._abandon_handle is not None:
+            self._abandon_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._abandon_handle = loop.call_later(max(self.detach_grace, 0), self._abandon)
+
+    def _abandon(self) -> None:
+        """宽限期内没有客户端重连：取消运行"""
+        self._abandon_handle = None
+        if self.subscribers == 0 and self.task is not None and not self.task.done():
+            print(f"[INFO] No subscriber for request {self.request_id} within {self.detach_grace}s, cancelling run")
+            self.task.cancel()
+
+
+class ReplayRegistry:
+    """request_id -> ReplayStream，结束的流在 TTL 后清理"""
+
+    def __init__(self, ttl: float = DEFAULT_REPLAY_TTL_SECONDS):
+        self.ttl = ttl
+        self._streams: Dict[str, ReplayStream] = {}
+
+    def create(self, request_id: str, session_id: str, encoder: StreamEncoder) -> ReplayStream:
+        self.purge_expired()
+        stream = ReplayStream(request_id, session_id, encoder)
+        self._streams[request_id] = stream
+        return stream
+
+    def get(self, request_id: str) -> Optional[ReplayStream]:
+        self.purge_expired()
+        return self._streams.get(request_id)
+
+    def purge_expired(self) -> None:
+        now = time.monotonic()
+        expired = [
+            request_id for request_id, stream in self._streams.items()
+            if stream.finished and now - stream.finished_at > self.ttl
+        ]
+        for request_id in expired:
+            del self._streams[request_id]
+
+    def stats(self) -> Dict[str, int]:
+        streams = list(self._streams.values())
+        return {
+            "streams": len(streams),
+            "running": sum(1 for stream in streams if not stream.finished),
+            "detached": sum(1 for stream in streams if not stream.finished and stream.subscribers == 0),
+            "buffered_bytes": sum(stream._bytes for stream in streams),
+        }
+
+
+_registry: Optional[ReplayRegistry] = None
+
+
+def get_replay_registry() -> ReplayRegistry:
+    """进程级单例（延迟创建，确保 asyncio 对象在事件循环内创建）"""
+    global _registry
+    if _registry is None:
+        _registry = ReplayRegistry()
+    return _registry
@@ -0,0 +1,229 @@
+"""
+语义回答缓存
+
+同一个问题常有不同的问法（"每个类别有多少产品" / "各类别产品数量"），每种问法都会
+走一遍 ReAct 循环。语义缓存使用与 schema 检索相同的 DefChromaEF 向量化问题，
+与已缓存问题的余弦相似度不低于阈值时直接返回缓存的回答（及其 SQL）。
+
+- 相似度达标还不够：问题中的数字/日期字面量、时间词、涉及的表和实体（数据库中低基数文本列的取值）
+  必须与缓存问题完全一致，否则不命中。"2023年订单总额" 和 "2024年订单总额" 向量几乎相同，答案却不同
+- 条目记录写入时的数据库版本，example.db 变化后旧条目在下次查找时被清除
+- 按模型区分，超出容量时淘汰最久未命中的条目
+- 命中/未命中次数、被字面量校验拦下的次数与查找耗时通过 GET /api/chat/metrics 暴露
+- 默认关闭：阈值尚未在中文问题集上校准，开启前应先用实际问法评估
+
+embed() 是 CPU 密集的同步调用，异步代码中应放到线程池执行。
+"""
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from backend.api.fast_path import TABLE_KEYWORDS
+from backend.api.metrics import metrics
+from tools.sqlite_pool import get_read_pool
+from tools.tools_execute_sqlite import DATABASE_PATH
+
+DEFAULT_SEMANTIC_CACHE_ENABLED = os.getenv("CHATBI_SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+DEFAULT_SEMANTIC_CACHE_THRESHOLD = float(os.getenv("CHATBI_SEMANTIC_CACHE_THRESHOLD", "0.92"))
+DEFAULT_SEMANTIC_CACHE_SIZE = int(os.getenv("CHATBI_SEMANTIC_CACHE_SIZE", "512"))
+# 文本列不同取值不超过该数量时，其取值视为实体（类别、会员等级、互动类型等）
+DEFAULT_SEMANTIC_CACHE_ENTITY_MAX_VALUES = int(os.getenv("CHATBI_SEMANTIC_CACHE_ENTITY_MAX_VALUES", "50"))
+
+_NUMBER_RE = re.compile(r"\d+(?:\.\d+)?")
+_CN_NUMBER_RE = re.compile(r"[零〇一二两三四五六七八九十百千万亿]+")
+# 含数字字但不表示数量的常用词，提取中文数字前先去掉
+_CN_NUMBER_IDIOMS_RE = re.compile(r"一共|一下|一些|一起|一直|一样|一般|一致|一律|统一|唯一|万一|每一|十分|千万")
+_TIME_WORD_RE = re.compile(
+    r"今年|去年|前年|明年|本月|上月|上个月|下个月|本周|上周|下周|今天|昨天|前天|明天|"
+    r"本季度|上季度|下季度|上半年|下半年|年初|年底|年末|月初|月底|月末"
+)
+
+
+def question_signature(question: str, entities: Tuple[str, ...] = ()) -> FrozenSet[str]:
+    """问题中决定答案的字面量：数字、时间词、涉及的表和实体取值，语义缓存命中要求两边完全一致"""
+    text = question.strip().lower()
+    signature = {f"num:{float(number):g}" for number in _NUMBER_RE.findall(text)}
+    signature.update(f"cn:{number}" for number in _CN_NUMBER_RE.findall(_CN_NUMBER_IDIOMS_RE.sub(" ", text)))
+    signature.update(f"time:{word}" for word in _TIME_WORD_RE.findall(text))
+    signature.update(
+        f"table:{table}" for table, keywords in TABLE_KEYWORDS.items()
+        if table.lower() in text or any(keyword in text for keyword in keywords)
+    )
+    signature.update(
+        f"entity:{value}" for value in entities
+        if re.search(rf"(?<![a-z0-9]){re.escape(value)}(?![a-z0-9])", text)
+    )
+    return frozenset(signature)
+
+
+@dataclass
+class SemanticCacheEntry:
+    question: str
+    model: str
+    database_version: str
+    vector: np.ndarray
+    payload: Dict[str, Any]
+    signature: FrozenSet[str] = frozenset()
+    created_at: float = field(default_factory=time.time)
+    hits: int = 0
+
+
+class SemanticAnswerCache:
+    """基于问题向量相似度的回答缓存（线程安全）"""
+
+    def __init__(self, embeddings=None, threshold: float = DEFAULT_SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = DEFAULT_SEMANTIC_CACHE_SIZE,
+                 enabled: bool = DEFAULT_SEMANTIC_CACHE_ENABLED,
+                 entity_max_values: int = DEFAULT_SEMANTIC_CACHE_ENTITY_MAX_VALUES):
+        self._embeddings = embeddings
+        self.entity_max_values = entity_max_values
+        # 数据库版本 -> 实体取值，数据库变化后重新读取
+        self._entities: Optional[Tuple[str, Tuple[str, ...]]] = None
+        self.threshold = threshold
+        self.max_entries = max(max_entries, 0)
+        self.enabled = enabled and self.max_entries > 0
+        self._lock = threading.Lock()
+        # 按最近命中/写入时间排序，末尾最新
+        self._entries: List[SemanticCacheEntry] = []
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.rejected = 0
+        self.errors = 0
+
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            from tools.tools_rag import embeddings
+            self._embeddings = embeddings
+        return self._embeddings
+
+    def embed(self, question: str) -> Optional[np.ndarray]:
+        """向量化问题（单位向量）；嵌入模型不可用时返回 None，缓存视为未命中"""
+        started_at = time.perf_counter()
+        try:
+            vector = np.asarray(self.embeddings.embed_query(question.strip()), dtype=np.float32)
+        except Exception as e:
+            with self._lock:
+                self.errors += 1
+            print(f"[WARNING] Semantic cache embedding failed: {e}")
+            return None
+        metrics.observe("semantic_cache_embed_ms", (time.perf_counter() - started_at) * 1000)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+    def entities(self, database_version: str) -> Tuple[str, ...]:
+        """数据库中低基数文本列的取值（小写），作为问题中的实体关键词"""
+        cached = self._entities
+        if cached is not None and cached[0] == database_version:
+            return cached[1]
+        values = set()
+        try:
+            with get_read_pool(DATABASE_PATH).connection() as conn:
+                tables = [row[0] for row in conn.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+                )]
+                for table in tables:
+                    for column in conn.execute(f'PRAGMA table_info("{table}")').fetchall():
+                        if "CHAR" not in column[2].upper() and "TEXT" not in column[2].upper():
+                            continue
+                        rows = conn.execute(
+                            f'SELECT DISTINCT "{column[1]}" FROM "{table}" WHERE "{column[1]}" IS NOT NULL LIMIT ?',
+                            (self.entity_max_values + 1,),
+                        ).fetchall()
+                        if len(rows) <= self.entity_max_values:
+                            values.update(str(row[0]).strip().lower() for row in rows)
+        except Exception as e:
+            # 读不到实体时仍校验数字、时间词和表
+            print(f"[WARNING] Semantic cache failed to load entity values: {e}")
+        entities = tuple(sorted(value for value in values if len(value) >= 2))
+        self._entities = (database_version, entities)
+        return entities
+
+    def signature(self, question: str, database_version: str) -> FrozenSet[str]:
+        return question_signature(question, self.entities(database_version))
+
+    def _purge(self, database_version: str) -> None:
+        """移除数据库版本已过期的条目（调用方持有锁）"""
+        stale = [entry for entry in self._entries if entry.database_version != database_version]
+        if stale:
+            self._entries = [entry for entry in self._entries if entry.database_version == database_version]
+            self.invalidated += len(stale)
+
+    def lookup(self, question: str, vector: Optional[np.ndarray], model: str,
+               database_version: str) -> Optional[Tuple[SemanticCacheEntry, float]]:
+        """返回字面量一致、相似度最高且不低于阈值的条目及其相似度"""
+        if vector is None:
+            return None
+        started_at = time.perf_counter()
+        signature = self.signature(question, database_version)
+        with self._lock:
+            self._purge(database_version)
+            candidates = [entry for entry in self._entries if entry.model == model]
+            best, similarity = None, 0.0
+            if candidates:
+                scores = np.stack([entry.vector for entry in candidates]) @ vector
+                matching = [index for index, entry in enumerate(candidates) if entry.signature == signature]
+                if matching:
+                    index = max(matching, key=lambda i: scores[i])
+                    best, similarity = candidates[index], float(scores[index])
+                if similarity < self.threshold:
+                    best = None
+                    if float(scores.max()) >= self.threshold:
+                        # 问法相近但数字/日期/表/实体不同，答案不能复用
+                        self.rejected += 1
+            if best is not None:
+                self.hits += 1
+                best.hits += 1
+                self._entries.remove(best)
+                self._entries.append(best)
+            else:
+                self.misses += 1
+                best = None
+        metrics.observe("semantic_cache_lookup_ms", (time.perf_counter() - started_at) * 1000)
+        return (best, similarity) if best is not None else None
+
+    def store(self, question: str, vector: Optional[np.ndarray], model: str,
+              database_version: str, payload: Dict[str, Any]) -> None:
+        if vector is None or not self.enabled:
+            return
+        entry = SemanticCacheEntry(
+            question, model, database_version, vector, payload, self.signature(question, database_version)
+        )
+        with self._lock:
+            self._purge(database_version)
+            # 相同问法的旧条目直接替换
+            self._entries = [
+                existing for existing in self._entries
+                if not (existing.model == model and existing.question == question)
+            ]
+            self._entries.append(entry)
+            if len(self._entries) > self.max_entries:
+                del self._entries[:len(self._entries) - self.max_entries]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "invalidated": self.invalidated,
+                "rejected": self.rejected,
+                "errors": self.errors,
+            }
+
+
+semantic_cache = SemanticAnswerCache()
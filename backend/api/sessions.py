@@ -0,0 +1,249 @@
+"""
+会话管理
+
+每个 session_id（未指定时为 "default"，/answer 与批量接口为每次请求生成一个）都会在 checkpointer 中留下一个线程，
+以前从不回收：MemorySaver 下进程内存只增不减，SQLite checkpointer 下数据库文件持续增长。现在：
+- 单个会话的最新状态超过 CHATBI_SESSION_MAX_BYTES 时，删除已并入历史摘要的早期消息
+  （模型看到的提示词不变，见 tools/history_compaction.py）；仍然超出时只记录告警，不删除正在进行的对话
+- 空闲超过 CHATBI_SESSION_IDLE_TTL_SECONDS 的会话被回收
+- 会话数超过 CHATBI_SESSION_MAX_SESSIONS 时按最近使用时间回收最久未使用的会话（LRU）
+- 回收会话时删除它的全部 checkpoint，并释放它引用的结果文件（result_store.release_session）
+- MemorySaver 不清理旧 checkpoint，每次运行结束后只保留最近 CHATBI_CHECKPOINT_KEEP_PER_THREAD 个
+
+会话列表、占用和最近使用时间都取自 checkpointer（SQLite checkpointer 的 threads 表），
+所有进程和重启之后看到同一份数据；有请求正在执行或排队的会话（见 admission，本进程内）不会被回收。管理接口（需要 CHATBI_ADMIN_TOKEN，未设置时不可用）：
+- GET /api/admin/sessions：会话列表与各会话的占用
+- DELETE /api/admin/sessions/{session_id}：回收指定会话
+- POST /api/admin/sessions/sweep：立即执行一次空闲回收与 LRU 回收
+"""
+import asyncio
+import hmac
+import os
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from langchain_core.messages import RemoveMessage, ToolMessage
+
+from agent import get_agent, memory
+from backend.api.admission import get_admission_controller
+from backend.api.metrics import metrics
+from tools.result_store import result_store
+from tools.sqlite_checkpointer import count_threads, prune_thread, thread_sizes, touch_thread
+
+DEFAULT_SESSION_MAX_SESSIONS = int(os.getenv("CHATBI_SESSION_MAX_SESSIONS", "1000"))
+DEFAULT_SESSION_MAX_BYTES = int(os.getenv("CHATBI_SESSION_MAX_BYTES", str(8 * 1024 * 1024)))
+DEFAULT_SESSION_IDLE_TTL_SECONDS = float(os.getenv("CHATBI_SESSION_IDLE_TTL_SECONDS", str(24 * 3600)))
+DEFAULT_SESSION_SWEEP_INTERVAL_SECONDS = float(os.getenv("CHATBI_SESSION_SWEEP_INTERVAL_SECONDS", "60"))
+# 管理接口的访问令牌；未设置时管理接口一律返回 404
+DEFAULT_ADMIN_TOKEN = os.getenv("CHATBI_ADMIN_TOKEN", "")
+
+
+def require_admin_token(authorization: Optional[str] = Header(None),
+                        x_admin_token: Optional[str] = Header(None)) -> None:
+    """校验 Authorization: Bearer <token> 或 X-Admin-Token 请求头"""
+    if not DEFAULT_ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = x_admin_token
+    if token is None and authorization and authorization.lower().startswith("bearer "):
+        token = authorization[7:].strip()
+    if not token or not hmac.compare_digest(token.encode("utf-8"), DEFAULT_ADMIN_TOKEN.encode("utf-8")):
+        raise HTTPException(status_code=401, detail="需要有效的管理令牌", headers={"WWW-Authenticate": "Bearer"})
+
+
+router = APIRouter(dependencies=[Depends(require_admin_token)])
+
+
+class SessionManager:
+    """有界会话存储：单会话大小上限、空闲超时与 LRU 回收（线程安全）"""
+
+    def __init__(self, checkpointer, max_sessions: int = DEFAULT_SESSION_MAX_SESSIONS,
+                 max_bytes: int = DEFAULT_SESSION_MAX_BYTES, idle_ttl: float = DEFAULT_SESSION_IDLE_TTL_SECONDS,
+                 sweep_interval: float = DEFAULT_SESSION_SWEEP_INTERVAL_SECONDS):
+        self.checkpointer = checkpointer
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._stats = {
+            "trims": 0, "trimmed_messages": 0, "over_budget": 0,
+            "evicted_idle": 0, "evicted_lru": 0, "evicted_admin": 0, "released_results": 0,
+        }
+
+    def sessions(self, busy: Iterable[str] = ()) -> List[Dict[str, Any]]:
+        """全部会话及其占用，按最近使用时间倒序"""
+        busy = set(busy)
+        now = time.time()
+        sessions = []
+        for session_id, size in thread_sizes(self.checkpointer).items():
+            last_active = size["last_active"]
+            sessions.append({
+                "session_id": session_id,
+                "last_active": last_active,
+                "idle_seconds": round(now - last_active, 1) if last_active else None,
+                "checkpoints": size["checkpoints"],
+                "bytes": size["bytes"],
+                "state_bytes": size["state_bytes"],
+                "busy": session_id in busy,
+            })
+        sessions.sort(key=lambda item: item["last_active"] or 0, reverse=True)
+        return sessions
+
+    def finish(self, session_id: str, model: str, busy: Iterable[str] = ()) -> None:
+        """一次运行结束后调用（仍持有该会话的执行权）：清理旧 checkpoint、检查大小上限，必要时执行回收"""
+        # 记录在 checkpointer 中（而不是本进程内），空闲回收在所有进程和重启之后看到同一个时间
+        touch_thread(self.checkpointer, session_id)
+        prune_thread(self.checkpointer, session_id)
+        size = thread_sizes(self.checkpointer, session_id).get(session_id)
+        if size and self.max_bytes > 0 and size["state_bytes"] > self.max_bytes:
+            trimmed = self._trim(session_id, model)
+            if trimmed:
+                prune_thread(self.checkpointer, session_id)
+                size = thread_sizes(self.checkpointer, session_id).get(session_id) or size
+            if size["state_bytes"] > self.max_bytes:
+                with self._lock:
+                    self._stats["over_budget"] += 1
+                print(f"[WARNING] Session {session_id} holds {size['state_bytes']} bytes after trimming "
+                      f"(limit {self.max_bytes})")
+        if size:
+            metrics.observe("session_state_bytes", size["state_bytes"])
+        over_limit = self.max_sessions > 0 and count_threads(self.checkpointer) > self.max_sessions
+        self.sweep(busy, force=over_limit)
+
+    def _trim(self, session_id: str, model: str) -> int:
+        """删除已并入历史摘要的消息（保留摘要锚点消息本身），返回删除的消息数"""
+        agent = get_agent(model)
+        config = {"configurable": {"thread_id": session_id}}
+        snapshot = agent.get_state(config)
+        if snapshot.next:
+            # 上一次运行没有正常结束，状态中可能有未完成的工具调用
+            return 0
+        values = snapshot.values
+        messages = list(values.get("messages") or [])
+        anchor = values.get("history_summary_upto")
+        ids = [message.id for message in messages]
+        if anchor not in ids:
+            return 0
+        index = ids.index(anchor)
+        # 锚点是工具结果时，删除它之前的消息会留下没有对应调用的 ToolMessage
+        if index == 0 or isinstance(messages[index], ToolMessage):
+            return 0
+        agent.update_state(config, {"messages": [RemoveMessage(id=message.id) for message in messages[:index]]},
+                           as_node="llm_agent")
+        with self._lock:
+            self._stats["trims"] += 1
+            self._stats["trimmed_messages"] += index
+        print(f"[INFO] Trimmed {index} summarized messages from session {session_id}")
+        return index
+
+    def evict(self, session_id: str, reason: str = "admin") -> int:
+        """删除会话的全部 checkpoint 并释放它引用的结果文件，返回删除的结果文件数"""
+        self.checkpointer.delete_thread(session_id)
+        released = result_store.release_session(session_id)
+        with self._lock:
+            self._stats[f"evicted_{reason}"] += 1
+            self._stats["released_results"] += released
+        print(f"[INFO] Evicted session {session_id} ({reason})")
+        return released
+
+    def sweep(self, busy: Iterable[str] = (), force: bool = True) -> List[str]:
+        """回收空闲超时的会话，再按最久未使用的顺序回收超出数量上限的会话；返回被回收的会话"""
+        now = time.time()
+        with self._lock:
+            if not force and now - self._last_sweep < self.sweep_interval:
+                return []
+            self._last_sweep = now
+        sessions = self.sessions(busy)
+        evicted = []
+        if self.idle_ttl > 0:
+            for session in sessions:
+                if not session["busy"] and session["idle_seconds"] is not None and session["idle_seconds"] > self.idle_ttl:
+                    self.evict(session["session_id"], "idle")
+                    evicted.append(session["session_id"])
+        remaining = [session for session in sessions if session["session_id"] not in evicted]
+        if self.max_sessions > 0 and len(remaining) > self.max_sessions:
+            # sessions 按最近使用时间倒序，从尾部开始回收
+            excess = len(remaining) - self.max_sessions
+            for session in reversed(remaining):
+                if excess <= 0:
+                    break
+                if session["busy"]:
+                    continue
+                self.evict(session["session_id"], "lru")
+                evicted.append(session["session_id"])
+                excess -= 1
+        return evicted
+
+    async def arelease(self, session_id: str, model: str) -> None:
+        """在线程池中执行 finish()；失败只记录告警，不影响请求"""
+        busy = get_admission_controller().busy_sessions()
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.finish, session_id, model, busy)
+        except Exception as e:
+            print(f"[WARNING] Session bookkeeping failed for {session_id}: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        return {
+            "sessions": count_threads(self.checkpointer),
+            "max_sessions": self.max_sessions,
+            "max_bytes": self.max_bytes,
+            "idle_ttl_seconds": self.idle_ttl,
+            **stats,
+        }
+
+
+session_manager = SessionManager(memory)
+
+
+@router.get("/sessions")
+async def list_sessions(limit: int = Query(100, ge=1, le=10000),
+                        order: str = Query("recent", pattern="^(recent|size)$")):
+    """
+    会话列表与占用
+
+    Args:
+        limit: 最多返回的会话数
+        order: recent（最近使用在前）或 size（最新状态最大的在前）
+
+    Returns:
+        会话总数、总字节数与每个会话的 checkpoint 数、字节数、最近使用时间、是否正在执行
+    """
+    busy = get_admission_controller().busy_sessions()
+    sessions = await asyncio.get_running_loop().run_in_executor(None, session_manager.sessions, busy)
+    if order == "size":
+        sessions.sort(key=lambda item: item["state_bytes"], reverse=True)
+    return {
+        "total": len(sessions),
+        "total_bytes": sum(item["bytes"] for item in sessions),
+        "sessions": sessions[:limit],
+    }
+
+
+@router.delete("/sessions/{session_id}")
+async def evict_session(session_id: str):
+    """
+    回收指定会话（删除对话历史与结果文件）
+
+    Returns:
+        被删除的结果文件数；会话不存在时 404，正在执行或排队时 409
+    """
+    if session_id in get_admission_controller().busy_sessions():
+        raise HTTPException(status_code=409, detail=f"会话 {session_id} 有正在执行的请求")
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, thread_sizes, memory, session_id):
+        raise HTTPException(status_code=404, detail=f"会话 {session_id} 不存在")
+    released = await loop.run_in_executor(None, session_manager.evict, session_id, "admin")
+    return {"session_id": session_id, "evicted": True, "released_results": released}
+
+
+@router.post("/sessions/sweep")
+async def sweep_sessions():
+    """立即执行一次空闲回收与 LRU 回收"""
+    busy = get_admission_controller().busy_sessions()
+    evicted = await asyncio.get_running_loop().run_in_executor(None, session_manager.sweep, busy)
+    return {"evicted": evicted}
@@ -0,0 +1,213 @@
+"""
+SSE 流式协议编码器
+
+协议版本按请求协商（ChatRequest.stream_protocol）：
+- v1（默认，兼容旧客户端）：每个 token 都重新发送累计的完整消息
+- v2：只追加发送 delta，定期发送 checkpoint 帧用于校验/重同步（断线重连时也用它补齐），最终帧携带完整文本；
+  异步执行模式下还会发送 tool_start / tool_end 结构化事件
+"""
+import json
+import os
+from typing import Any, Dict, List
+
+STREAM_PROTOCOL_LEGACY = 1
+STREAM_PROTOCOL_DELTA = 2
+SUPPORTED_STREAM_PROTOCOLS = (STREAM_PROTOCOL_LEGACY, STREAM_PROTOCOL_DELTA)
+
+# v2 协议中每隔多少个 delta 发送一次 checkpoint 帧
+DEFAULT_CHECKPOINT_INTERVAL = int(os.getenv("CHATBI_STREAM_CHECKPOINT_INTERVAL", "200"))
+# 工具事件中输入/输出预览的最大字符数
+TOOL_PREVIEW_CHARS = 500
+
+
+def _preview(value: Any) -> str:
+    """工具输入输出可能很大（如查询结果），事件中只携带截断后的预览"""
+    if hasattr(value, "content"):
+        value = value.content
+    text = value if isinstance(value, str) else json.dumps(value, ensure_ascii=False, default=str)
+    if len(text) > TOOL_PREVIEW_CHARS:
+        return text[:TOOL_PREVIEW_CHARS] + "..."
+    return text
+
+
+class StreamEncoder:
+    """流式协议编码器基类，负责把 Agent 输出转换为 SSE 事件"""
+
+    version: int = STREAM_PROTOCOL_LEGACY
+
+    def __init__(self, request_id: str, session_id: str):
+        self.request_id = request_id
+        self.session_id = session_id
+        # 累计消息按片段保存，读取 message 时才拼接（逐 token 拼接字符串是 O(n^2)）
+        self._parts: List[str] = []
+        self._length = 0
+
+    @property
+    def message(self) -> str:
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    @message.setter
+    def message(self, message: str) -> None:
+        self._parts = [message] if message else []
+        self._length = len(message)
+
+    def _append(self, token: str) -> None:
+        self._parts.append(token)
+        self._length += len(token)
+
+    def _event(self, payload: Dict[str, Any], event: str = "message") -> Dict[str, str]:
+        data = {
+            "request_id": self.request_id,
+            "session_id": self.session_id,
+            **payload,
+        }
+        return {"event": event, "data": json.dumps(data, ensure_ascii=False)}
+
+    def start(self, message: str) -> Dict[str, str]:
+        """开始帧，回显本次协商的协议版本"""
+        return self._event({
+            "type": "start",
+            "protocol": self.version,
+            "message": message,
+            "finished": False,
+        })
+
+    def queued(self, position: int) -> Dict[str, str]:
+        """排队帧，准入控制排队期间每次位置变化时发送"""
+        return self._event({
+            "type": "queued",
+            "position": position,
+            "message": f"当前排队中，前面还有 {position - 1} 个任务...",
+            "finished": False,
+        })
+
+    def token(self, token: str) -> List[Dict[str, str]]:
+        """处理一个新 token，返回需要发送的事件列表"""
+        raise NotImplementedError
+
+    def tool_start(self, name: str, run_id: str, tool_input: Any) -> List[Dict[str, str]]:
+        """工具开始执行，v1 协议不发送"""
+        return []
+
+    def tool_end(self, name: str, run_id: str, output: Any, duration_ms: float) -> List[Dict[str, str]]:
+        """工具执行结束，v1 协议不发送"""
+        return []
+
+    def resync(self) -> Dict[str, str]:
+        """重连时缺失的事件已被淘汰：发送当前累计的完整消息代替"""
+        return self._event({
+            "type": "response",
+            "message": self.message,
+            "finished": False,
+        })
+
+    def final(self, message: str) -> Dict[str, str]:
+        """最终帧，始终携带完整文本"""
+        self.message = message
+        return self._event({
+            "type": "response",
+            "message": message,
+            "finished": True,
+        })
+
+    def error(self, message: str) -> Dict[str, str]:
+        """错误帧"""
+        return self._event({
+            "type": "error",
+            "message": message,
+            "finished": True,
+        }, event="error")
+
+
+class LegacyStreamEncoder(StreamEncoder):
+    """v1 协议：每个 token 重新发送累计消息"""
+
+    version = STREAM_PROTOCOL_LEGACY
+
+    def token(self, token: str) -> List[Dict[str, str]]:
+        if not token:
+            return []
+        self._append(token)
+        return [self._event({
+            "type": "response",
+            "message": self.message,
+            "finished": False,
+        })]
+
+
+class DeltaStreamEncoder(StreamEncoder):
+    """v2 协议：append-only 的 delta 帧 + 定期 checkpoint 帧"""
+
+    version = STREAM_PROTOCOL_DELTA
+
+    def __init__(self, request_id: str, session_id: str, checkpoint_interval: int = DEFAULT_CHECKPOINT_INTERVAL):
+        super().__init__(request_id, session_id)
+        self.checkpoint_interval = max(int(checkpoint_interval), 0)
+        self.seq = 0
+
+    def token(self, token: str) -> List[Dict[str, str]]:
+        if not token:
+            return []
+        offset = self._length
+        self._append(token)
+        self.seq += 1
+        events = [self._event({
+            "type": "delta",
+            "seq": self.seq,
+            "offset": offset,
+            "delta": token,
+        })]
+        if self.checkpoint_interval and self.seq % self.checkpoint_interval == 0:
+            events.append(self.checkpoint())
+        return events
+
+    def tool_start(self, name: str, run_id: str, tool_input: Any) -> List[Dict[str, str]]:
+        return [self._event({
+            "type": "tool_start",
+            "tool": name,
+            "run_id": run_id,
+            "input": _preview(tool_input),
+        })]
+
+    def tool_end(self, name: str, run_id: str, output: Any, duration_ms: float) -> List[Dict[str, str]]:
+        return [self._event({
+            "type": "tool_end",
+            "tool": name,
+            "run_id": run_id,
+            "output": _preview(output),
+            "duration_ms": round(duration_ms, 1),
+        })]
+
+    def checkpoint(self) -> Dict[str, str]:
+        """checkpoint 帧：客户端可用 length 校验本地拼接结果，不一致时直接用 message 覆盖"""
+        return self._event({
+            "type": "checkpoint",
+            "seq": self.seq,
+            "length": self._length,
+            "message": self.message,
+        })
+
+    def resync(self) -> Dict[str, str]:
+        return self.checkpoint()
+
+    def final(self, message: str) -> Dict[str, str]:
+        self.message = message
+        return self._event({
+            "type": "response",
+            "seq": self.seq,
+            "message": message,
+            "finished": True,
+        })
+
+
+def create_stream_encoder(protocol: int, request_id: str, session_id: str) -> StreamEncoder:
+    """根据协商的协议版本创建编码器"""
+    if protocol == STREAM_PROTOCOL_LEGACY:
+        return LegacyStreamEncoder(request_id, session_id)
+    if protocol == STREAM_PROTOCOL_DELTA:
+        return DeltaStreamEncoder(request_id, session_id)
+    raise ValueError(
+        f"Unsupported stream protocol: {protocol}. Supported: {list(SUPPORTED_STREAM_PROTOCOLS)}"
+    )
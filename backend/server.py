@@ -81,13 +81,19 @@ if __name__ == "__main__":
     
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "8000"))
+    # reload 只支持单 worker
+    workers = int(os.getenv("WORKERS", "1"))
     
-    logger.info(f"Starting ChatBI server on {host}:{port}")
+    logger.info(f"Starting ChatBI server on {host}:{port} with {workers} worker(s)")
+    if workers > 1:
+        # 同一会话的串行执行、流式重放缓冲区和分页游标都在进程内，checkpoint 和结果文件在 worker 之间共享
+        logger.warning("Multiple workers require sticky routing by session_id in front of the server")
     
     uvicorn.run(
         app="backend.server:app",
         host=host,
         port=port,
-        reload=os.getenv("ENV", "local") == "local",
+        workers=workers,
+        reload=os.getenv("ENV", "local") == "local" and workers == 1,
     )
 
@@ -0,0 +1,59 @@
+"""
+Agent 请求准备开销基准测试
+
+对比每个请求都重新构建 Agent（ChatOpenAI + bind_tools + StateGraph.compile）
+与按模型缓存已编译图（get_agent）的耗时。不会发起任何 LLM 请求。
+
+用法:
+    python benchmarks/bench_agent_setup.py --iterations 50
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+# 构建 ChatOpenAI 需要 API Key，基准测试不会真正调用模型
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+import agent  # noqa: E402
+
+
+def time_calls(func, iterations: int):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-request agent setup overhead")
+    parser.add_argument("--model", default="qwen-plus")
+    parser.add_argument("--iterations", type=int, default=50)
+    args = parser.parse_args()
+
+    def uncached():
+        agent._build_agent(agent.get_model_config(args.model))
+
+    agent.clear_agent_cache()
+    agent.get_agent(args.model)  # 预热缓存
+
+    def cached():
+        agent.get_agent(args.model)
+
+    print(f"model: {args.model}, iterations: {args.iterations}")
+    print(f"{'setup':>10} {'mean ms':>10} {'p50 ms':>10} {'max ms':>10}")
+    for name, func in (("rebuild", uncached), ("cached", cached)):
+        samples = time_calls(func, args.iterations)
+        print(f"{name:>10} {statistics.mean(samples):>10.3f} {statistics.median(samples):>10.3f} {max(samples):>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Checkpointer 基准测试
+
+用与 Agent 相同形状的图（模型节点 -> 工具节点 -> 模型节点，messages 通道用 add_messages 合并）模拟多个会话的多轮对话，
+工具输出是 example.db 上一条真实查询的 JSON 结果。对比：
+- memory：进程内 MemorySaver
+- sqlite：SQLiteCheckpointSaver 默认配置（批量提交 + 压缩 + 清理旧 checkpoint）
+- sqlite-no-batch：每次 put_writes 单独提交
+- sqlite-raw：不压缩、不清理
+打印每轮耗时的 p50 / p95、事务数和数据库文件大小（WAL 合并后），并校验从新打开的 SQLite 文件中读出的最终状态与内存中一致。
+不会修改 tools/example.db。
+
+用法:
+    python benchmarks/bench_checkpointer.py --sessions 20 --turns 10
+"""
+import argparse
+import json
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Annotated, Sequence
+
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+os.environ.setdefault("CHATBI_RESULT_STORE_ENABLED", "false")
+os.environ.setdefault("CHATBI_SQL_QUERY_LOG_ENABLED", "false")
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, ToolMessage  # noqa: E402
+from langgraph.checkpoint.memory import MemorySaver  # noqa: E402
+from langgraph.graph import END, START, StateGraph  # noqa: E402
+from langgraph.graph.message import add_messages  # noqa: E402
+
+from tools.sqlite_checkpointer import SQLiteCheckpointSaver  # noqa: E402
+from tools.tools_execute_sqlite import execute_readonly_query  # noqa: E402
+
+QUERY = "SELECT * FROM PRODUCTS LIMIT 50"
+
+
+@dataclass
+class State:
+    messages: Annotated[Sequence[BaseMessage], add_messages]
+
+
+def build_graph(checkpointer, tool_output: str):
+    def model(state: State):
+        last = state.messages[-1]
+        if isinstance(last, HumanMessage):
+            return {"messages": [AIMessage("", tool_calls=[
+                {"name": "execute_sqlite_query", "args": {"query": QUERY}, "id": f"call_{len(state.messages)}"}])]}
+        return {"messages": [AIMessage("查询结果要点：" + "说明" * 200)]}
+
+    def tools(state: State):
+        call = state.messages[-1].tool_calls[0]
+        return {"messages": [ToolMessage(tool_output, tool_call_id=call["id"], name=call["name"])]}
+
+    builder = StateGraph(State)
+    builder.add_node("llm_agent", model)
+    builder.add_node("tools", tools)
+    builder.add_edge(START, "llm_agent")
+    builder.add_conditional_edges("llm_agent", lambda s: "tools" if s.messages[-1].tool_calls else END)
+    builder.add_edge("tools", "llm_agent")
+    return builder.compile(checkpointer=checkpointer)
+
+
+def file_size(path: Path) -> int:
+    """把 WAL 合并回主文件后的数据库大小"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return path.stat().st_size
+
+
+def run(checkpointer, tool_output: str, sessions: int, turns: int):
+    graph = build_graph(checkpointer, tool_output)
+    timings = []
+    for turn in range(turns):
+        for session in range(sessions):
+            started_at = time.perf_counter()
+            graph.invoke({"messages": [HumanMessage(f"问题 {turn}")]}, {"configurable": {"thread_id": f"s{session}"}})
+            timings.append((time.perf_counter() - started_at) * 1000)
+    timings.sort()
+    return graph, {
+        "p50_ms": statistics.median(timings),
+        "p95_ms": timings[int(len(timings) * 0.95) - 1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare MemorySaver with the SQLite checkpointer under a multi-session workload")
+    parser.add_argument("--sessions", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=10)
+    args = parser.parse_args()
+
+    tool_output = json.dumps(execute_readonly_query(QUERY), ensure_ascii=False, default=str)
+    variants = {
+        "memory": None,
+        "sqlite": {},
+        "sqlite-no-batch": {"write_batch": 0},
+        "sqlite-raw": {"compress_min_bytes": -1, "keep_per_thread": 0},
+    }
+    print(f"{args.sessions} sessions x {args.turns} turns, tool output {len(tool_output)} bytes per call\n")
+    print(f"{'variant':<16} {'p50 ms':>8} {'p95 ms':>8} {'transactions':>13} {'file KiB':>9} {'ratio':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        reference = None
+        for name, options in variants.items():
+            path = Path(tmp) / f"{name}.db"
+            checkpointer = MemorySaver() if options is None else SQLiteCheckpointSaver(str(path), **options)
+            graph, result = run(checkpointer, tool_output, args.sessions, args.turns)
+            final = graph.get_state({"configurable": {"thread_id": "s0"}}).values["messages"]
+            if options is None:
+                reference = [m.content for m in final]
+                print(f"{name:<16} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {'-':>13} {'-':>9} {'-':>6}")
+                continue
+            stats = checkpointer.stats()
+            # 重新打开文件（相当于另一个 worker 或重启后的进程），状态应与内存中一致
+            reopened = build_graph(SQLiteCheckpointSaver(str(path)), tool_output)
+            restored = [m.content for m in reopened.get_state({"configurable": {"thread_id": "s0"}}).values["messages"]]
+            marker = "" if restored == reference else "  <-- state mismatch"
+            print(f"{name:<16} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} {stats['transactions']:>13} "
+                  f"{file_size(path) / 1024:>9.0f} {stats['compression_ratio']:>6.2f}{marker}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+DuckDB 引擎基准测试
+
+在 example.db 的放大副本上，对一组常见的分析问题（按月交互数、按类别收入、客户消费排行等）
+分别用 SQLite 和 DuckDB（CHATBI_SQL_ENGINE=duckdb 的路由方式，同步的列式副本）执行，
+对比耗时并校验两边结果一致（浮点数按相对误差 1e-9 比较）。不会修改 tools/example.db。
+
+需要安装 duckdb 和 pandas。
+
+用法:
+    python benchmarks/bench_duckdb_engine.py --scale 2000 --repeat 3
+"""
+import argparse
+import math
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from bench_index_advisor import scale_database  # noqa: E402
+from tools.duckdb_engine import DuckDBEngine, duckdb, route_reason  # noqa: E402
+from tools.tools_execute_sqlite import DATABASE_PATH, _run_statement, get_database_version  # noqa: E402
+
+QUESTIONS = [
+    ("monthly interactions",
+     "SELECT substr(INTERACTION_DATE, 1, 7) AS month, COUNT(*) AS interactions FROM USER_INTERACTIONS "
+     "GROUP BY month ORDER BY month"),
+    ("interactions by type",
+     "SELECT INTERACTION_TYPE, COUNT(*) AS interactions, COUNT(DISTINCT CUSTOMER_ID) AS customers "
+     "FROM USER_INTERACTIONS GROUP BY INTERACTION_TYPE ORDER BY interactions DESC, INTERACTION_TYPE"),
+    ("revenue by category",
+     "SELECT p.CATEGORY, SUM(t.QUANTITY * t.PRICE) AS revenue, AVG(t.PRICE) AS avg_price FROM TRANSACTIONS t "
+     "JOIN PRODUCTS p ON p.PRODUCT_ID = t.PRODUCT_ID GROUP BY p.CATEGORY ORDER BY revenue DESC, p.CATEGORY"),
+    ("top customers by spend",
+     "SELECT c.CUSTOMER_ID, c.FIRST_NAME, c.LAST_NAME, SUM(o.TOTAL_AMOUNT) AS spend FROM ORDER_DETAILS o "
+     "JOIN CUSTOMER_DETAILS c ON c.CUSTOMER_ID = o.CUSTOMER_ID GROUP BY c.CUSTOMER_ID, c.FIRST_NAME, c.LAST_NAME "
+     "ORDER BY spend DESC, c.CUSTOMER_ID LIMIT 10"),
+    ("payments by month",
+     "SELECT substr(PAYMENT_DATE, 1, 7) AS month, COUNT(*) AS payments, SUM(AMOUNT) AS amount FROM PAYMENTS "
+     "GROUP BY month ORDER BY month"),
+    ("cart conversion",
+     "SELECT INTERACTION_TYPE, SUM(ADDED_TO_CART) AS carts, SUM(PURCHASE_COMPLETED) AS purchases, "
+     "AVG(DURATION_SECONDS) AS avg_duration FROM USER_INTERACTIONS GROUP BY INTERACTION_TYPE ORDER BY INTERACTION_TYPE"),
+    ("overall totals",
+     "SELECT COUNT(*) AS orders, SUM(TOTAL_AMOUNT) AS revenue, AVG(TOTAL_AMOUNT) AS avg_order FROM ORDER_DETAILS"),
+]
+
+
+def same_rows(left, right) -> bool:
+    if len(left) != len(right):
+        return False
+    for a_row, b_row in zip(left, right):
+        for a, b in zip(a_row, b_row):
+            if isinstance(a, float) or isinstance(b, float):
+                if a is None or b is None or not math.isclose(a, b, rel_tol=1e-9, abs_tol=1e-9):
+                    return False
+            elif a != b:
+                return False
+    return True
+
+
+def timed(func, repeat: int):
+    """执行 repeat 次，返回（最后一次结果, 中位数耗时 ms）"""
+    samples, result = [], None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        samples.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare SQLite and DuckDB on standard analytic questions")
+    parser.add_argument("--scale", type=int, default=2000, help="multiply every table by this factor")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    if duckdb is None:
+        sys.exit("duckdb is not installed")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "bench.db")
+        source = sqlite3.connect(DATABASE_PATH)
+        target = sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+        scale_database(path, args.scale)
+        version = get_database_version(path)
+
+        engine = DuckDBEngine(path, engine="duckdb", mode="copy", duckdb_path=str(Path(tmp) / "bench.duckdb"))
+        engine.connection(version)
+        engine.wait_for_sync()
+        print(f"scale: {args.scale}, repeat: {args.repeat}, DuckDB copy synced in {engine.last_sync_seconds:.2f}s")
+
+        conn = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+        print(f"{'sqlite ms':>10} {'duckdb ms':>10} {'speedup':>8}  {'match':<5}  question")
+        total_sqlite = total_duckdb = 0.0
+        try:
+            for name, query in QUESTIONS:
+                reason = route_reason(query)
+                if reason:
+                    print(f"{'':>10} {'':>10} {'':>8}  {'-':<5}  {name} (not routed: {reason})")
+                    continue
+                expected, sqlite_ms = timed(lambda: _run_statement(conn, query), args.repeat)
+                actual, duckdb_ms = timed(lambda: engine.execute(conn, query, version), args.repeat)
+                match = actual is not None and actual["columns"] == expected["columns"] \
+                    and same_rows(actual["rows"], expected["rows"])
+                total_sqlite += sqlite_ms
+                total_duckdb += duckdb_ms
+                print(f"{sqlite_ms:>10.1f} {duckdb_ms:>10.1f} {sqlite_ms / duckdb_ms if duckdb_ms else 0:>7.1f}x  "
+                      f"{'yes' if match else 'NO':<5}  {name}")
+        finally:
+            conn.close()
+        print(f"{total_sqlite:>10.1f} {total_duckdb:>10.1f} "
+              f"{total_sqlite / total_duckdb if total_duckdb else 0:>7.1f}x  {'':<5}  total")
+        print(f"routed: {engine.routed}, fallbacks: {engine.fallbacks}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+快速路径基准测试
+
+一组标注过的问题：是否应走快速路径，以及可以作为标准答案的参考 SQL。
+- 默认只评估规则分类（不调用模型）：路由的精确率 / 召回率，被误判的问题
+- --llm：对每个有参考 SQL 的问题分别执行快速路径和完整 Agent，按路径统计端到端耗时、LLM 调用次数，
+  以及准确率（回答中查询结果的数值与参考 SQL 的结果一致）。需要 OPENAI_API_KEY
+
+快速路径的准确率只统计实际由快速路径作答的问题，回退的问题计入 fallback。不会修改 tools/example.db。
+
+用法:
+    python benchmarks/bench_fast_path.py
+    python benchmarks/bench_fast_path.py --llm --model qwen-plus
+"""
+import argparse
+import asyncio
+import sqlite3
+import statistics
+import sys
+import time
+import uuid
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from backend.api.fast_path import fast_path_router  # noqa: E402
+from tools.tools_execute_sqlite import DATABASE_PATH  # noqa: E402
+
+# (问题, 是否应走快速路径, 参考 SQL；None 表示不做结果比对)
+CASES = [
+    ("有多少个产品？", True, "SELECT COUNT(*) FROM PRODUCTS"),
+    ("一共有多少位客户", True, "SELECT COUNT(*) FROM CUSTOMER_DETAILS"),
+    ("订单总金额是多少", True, "SELECT SUM(TOTAL_AMOUNT) FROM ORDER_DETAILS"),
+    ("平均每笔支付金额是多少", True, "SELECT AVG(AMOUNT) FROM PAYMENTS"),
+    ("各类别分别有几种产品", True, "SELECT CATEGORY, COUNT(*) FROM PRODUCTS GROUP BY CATEGORY"),
+    ("最贵的产品价格是多少", True, "SELECT MAX(PRICE) FROM PRODUCTS"),
+    ("每种互动类型有多少条记录", True, "SELECT INTERACTION_TYPE, COUNT(*) FROM USER_INTERACTIONS GROUP BY INTERACTION_TYPE"),
+    ("各会员等级的客户数量", True, "SELECT LOYALTY_LEVEL, COUNT(*) FROM CUSTOMER_DETAILS GROUP BY LOYALTY_LEVEL"),
+    ("交易一共有多少笔", True, "SELECT COUNT(*) FROM TRANSACTIONS"),
+    ("how many orders are there", True, "SELECT COUNT(*) FROM ORDER_DETAILS"),
+    ("每个客户的订单总金额", False, "SELECT CUSTOMER_ID, SUM(TOTAL_AMOUNT) FROM ORDER_DETAILS GROUP BY CUSTOMER_ID"),
+    ("哪个类别的产品交易数量最多", False, None),
+    ("画出每月订单金额的趋势图", False, None),
+    ("把订单数据导出成 Excel", False, None),
+    ("分析一下客户流失的原因", False, None),
+    ("那支付呢？", False, None),
+    ("你好，你能做什么", False, None),
+    ("列出所有电子产品", False, None),
+]
+
+
+def normalize(rows):
+    """比较用：只看数值与文本，忽略列名和行序，浮点数保留两位小数"""
+    values = []
+    for row in rows or []:
+        values.append(tuple(round(v, 2) if isinstance(v, float) else v for v in row))
+    return sorted(values, key=repr)
+
+
+def tables_match(tables, expected):
+    return any(normalize(table["rows"]) == expected for table in tables)
+
+
+def evaluate_routing():
+    tp = fp = fn = tn = 0
+    print(f"{'expected':<9} {'routed':<7} {'reason':<24} question")
+    for question, expected, _ in CASES:
+        route = fast_path_router.classify(question)
+        routed = route.path == "fast"
+        tp += routed and expected
+        fp += routed and not expected
+        fn += not routed and expected
+        tn += not routed and not expected
+        marker = "" if routed == expected else "  <-- misrouted"
+        print(f"{'fast' if expected else 'agent':<9} {'fast' if routed else 'agent':<7} {route.reason:<24} {question}{marker}")
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    print(f"\nrouting: precision {precision:.2f}, recall {recall:.2f} (tp {tp}, fp {fp}, fn {fn}, tn {tn})")
+
+
+async def evaluate_end_to_end(model: str):
+    from backend.api.artifacts import extract_artifacts
+    from backend.api.callback import StreamingCallbackHandler
+    from backend.api.chat import invoke_agent
+    from backend.api.fast_path import fast_path_router as router
+
+    conn = sqlite3.connect(Path(DATABASE_PATH).resolve().as_uri() + "?mode=ro", uri=True)
+    paths = {"fast": [], "fallback": [], "agent": []}
+    print(f"\n{'path':<9} {'ms':>8} {'llm':>4}  correct  question")
+    for question, _, reference in CASES:
+        if reference is None:
+            continue
+        expected = normalize(conn.execute(reference).fetchall())
+        for force_agent in (False, True):
+            router.enabled = not force_agent
+            handler = StreamingCallbackHandler()
+            answered = router.stats()["answered"]
+            started_at = time.perf_counter()
+            try:
+                result = await invoke_agent(question, f"bench-{uuid.uuid4().hex[:8]}", model, handler)
+                correct = tables_match(extract_artifacts(result["messages"])["tables"], expected)
+            except Exception as e:
+                print(f"[WARNING] {question}: {e}")
+                correct = False
+            elapsed_ms = (time.perf_counter() - started_at) * 1000
+            if force_agent:
+                path = "agent"
+            else:
+                path = "fast" if router.stats()["answered"] > answered else "fallback"
+            paths[path].append((elapsed_ms, handler.llm_calls, correct))
+            print(f"{path:<9} {elapsed_ms:>8.0f} {handler.llm_calls:>4}  {'yes' if correct else 'NO ':<7}  {question}")
+    router.enabled = True
+    conn.close()
+
+    print(f"\n{'path':<9} {'n':>3} {'p50 ms':>8} {'avg llm':>8} {'accuracy':>9}")
+    for path, samples in paths.items():
+        if not samples:
+            continue
+        print(f"{path:<9} {len(samples):>3} {statistics.median(s[0] for s in samples):>8.0f} "
+              f"{statistics.mean(s[1] for s in samples):>8.1f} {sum(s[2] for s in samples) / len(samples):>9.0%}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate fast-path routing, and optionally per-path latency and accuracy")
+    parser.add_argument("--llm", action="store_true", help="run the fast path and the full agent end to end (needs OPENAI_API_KEY)")
+    parser.add_argument("--model", default="qwen-plus")
+    args = parser.parse_args()
+
+    evaluate_routing()
+    if args.llm:
+        asyncio.run(evaluate_end_to_end(args.model))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+会话历史压缩基准测试
+
+模拟一个长会话：每轮是一个典型的分析问题（schema 检索 -> 执行 SQL -> 可选画图 -> 回答），
+工具输出来自在 example.db 上实际执行的查询。逐轮打印不压缩时发送的提示词 token 数、压缩后的 token 数和节省的比例。
+
+摘要默认不调用模型（用压缩后的对话文本代替，与摘要生成失败时的回退相同），只衡量结构性的节省；
+压缩本身的耗时单独统计。不会修改 tools/example.db。
+
+用法:
+    python benchmarks/bench_history_compaction.py --turns 20 --keep-turns 3 --max-tokens 32000
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+os.environ.setdefault("CHATBI_RESULT_STORE_ENABLED", "false")
+os.environ.setdefault("CHATBI_SQL_QUERY_LOG_ENABLED", "false")
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage  # noqa: E402
+
+from bench_sql_batch import DASHBOARD  # noqa: E402
+from tools.history_compaction import HistoryCompactor  # noqa: E402
+from tools.tools_execute_sqlite import execute_readonly_query  # noqa: E402
+
+SCHEMA_DOCS = project_root / "docs"
+
+
+def simulated_turn(index: int, name: str, query: str):
+    """一轮对话：检索表结构、执行 SQL、隔一轮画一次图，最后给出回答"""
+    response = execute_readonly_query(query)
+    rows = (response.get("result") or {}).get("rows") or []
+    schema = (SCHEMA_DOCS / "database_overview.md").read_text(encoding="utf-8")
+    messages = [
+        HumanMessage(content=f"问题 {index}：{name} 的情况怎么样？", id=f"h{index}"),
+        AIMessage(content="", id=f"a{index}", tool_calls=[
+            {"name": "database_schema_rag", "args": {"query": name}, "id": f"rag{index}"}]),
+        ToolMessage(content=schema, tool_call_id=f"rag{index}", name="database_schema_rag", id=f"t{index}a"),
+        AIMessage(content="", id=f"b{index}", tool_calls=[
+            {"name": "execute_sqlite_query", "args": {"query": query}, "id": f"sql{index}"}]),
+        ToolMessage(content=json.dumps(response, ensure_ascii=False, default=str), tool_call_id=f"sql{index}",
+                    name="execute_sqlite_query", id=f"t{index}b"),
+    ]
+    if index % 2 == 0:
+        numbers = [row[-1] for row in rows if isinstance(row[-1], (int, float))]
+        chart = {"chart_type": "column", "chart_config": {
+            "chart": {"type": "column"}, "series": [{"name": name, "data": numbers}],
+            "xAxis": {"categories": [str(row[0]) for row in rows]}}}
+        messages += [
+            AIMessage(content="", id=f"c{index}", tool_calls=[
+                {"name": "high_charts_json", "args": {"numbers": numbers, "chart_type": "column"}, "id": f"chart{index}"}]),
+            ToolMessage(content=json.dumps(chart, ensure_ascii=False), tool_call_id=f"chart{index}",
+                        name="high_charts_json", id=f"t{index}c"),
+        ]
+    messages.append(AIMessage(content=f"{name} 的查询结果共 {len(rows)} 行，" + "要点说明。" * 40, id=f"f{index}"))
+    return messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure prompt tokens per turn with and without history compaction")
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--keep-turns", type=int, default=3)
+    parser.add_argument("--max-tokens", type=int, default=32000)
+    parser.add_argument("--summary-max-tokens", type=int, default=800)
+    args = parser.parse_args()
+
+    from agent import sys_msg
+
+    compactor = HistoryCompactor(enabled=True, keep_turns=args.keep_turns, max_tokens=args.max_tokens,
+                                 summary_max_tokens=args.summary_max_tokens)
+    queries = list(DASHBOARD.items())
+    history, summary, summary_upto = [], "", None
+    timings = []
+    print(f"{'turn':>4} {'full tokens':>12} {'compacted':>10} {'saved':>8} {'saved %':>8} {'folded':>7}")
+    for index in range(args.turns):
+        name, query = queries[index % len(queries)]
+        turn = simulated_turn(index, name, query)
+        history.extend(turn[:1])
+        # 本轮第一次模型调用（只有用户问题）时压缩，统计方式与 llm_agent 相同
+        started_at = time.perf_counter()
+        result = compactor.compact(sys_msg, history, summary, summary_upto, lambda prompt: None)
+        timings.append((time.perf_counter() - started_at) * 1000)
+        summary, summary_upto = result.summary, result.summary_upto
+        report = result.report
+        ratio = report["saved_tokens"] / report["original_tokens"] if report["original_tokens"] else 0
+        print(f"{index + 1:>4} {report['original_tokens']:>12} {report['prompt_tokens']:>10} "
+              f"{report['saved_tokens']:>8} {ratio:>8.0%} {report['folded_turns']:>7}")
+        history.extend(turn[1:])
+
+    stats = compactor.stats()
+    print(f"\ntotal prompt tokens: {stats['tokens_before']} -> {stats['tokens_after']} "
+          f"(saved {stats['tokens_saved']}, {stats['saved_ratio']:.0%}); "
+          f"compaction time p50 {statistics.median(timings):.2f} ms, max {max(timings):.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""
+索引建议基准测试
+
+在 example.db 的副本上回放查询日志中的工作负载：先在无二级索引时计时，再创建索引建议工具
+推荐的索引后计时，对比每条查询及总体（按出现次数加权）的耗时。不会修改 tools/example.db。
+
+example.db 只有几百行，索引的效果体现不出来，--scale N 会把副本中每张表复制为 N 倍
+（整数 *_ID 列按同一偏移量平移，表之间的连接关系保持不变）。
+查询日志为空时使用内置的示例工作负载（按客户、订单、日期过滤和连接）。
+
+用法:
+    python benchmarks/bench_index_advisor.py --scale 200 --repeat 5
+    python benchmarks/bench_index_advisor.py --log logs/sql_queries.jsonl --top 5
+"""
+import argparse
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from tools.index_advisor import IndexAdvisor, apply_indexes  # noqa: E402
+from tools.query_log import DEFAULT_QUERY_LOG_PATH, WorkloadQuery, load_workload  # noqa: E402
+from tools.sql_result_cache import canonicalize_sql  # noqa: E402
+from tools.tools_execute_sqlite import DATABASE_PATH  # noqa: E402
+
+SAMPLE_WORKLOAD = [
+    ("SELECT o.ORDER_ID, o.ORDER_DATE, o.TOTAL_AMOUNT FROM ORDER_DETAILS o WHERE o.CUSTOMER_ID = 7", 5),
+    ("SELECT c.FIRST_NAME, c.LAST_NAME, COUNT(*) AS orders FROM CUSTOMER_DETAILS c "
+     "JOIN ORDER_DETAILS o ON o.CUSTOMER_ID = c.CUSTOMER_ID GROUP BY c.CUSTOMER_ID", 3),
+    ("SELECT p.CATEGORY, SUM(t.QUANTITY * t.PRICE) AS revenue FROM ORDER_DETAILS o "
+     "JOIN TRANSACTIONS t ON t.ORDER_ID = o.ORDER_ID JOIN PRODUCTS p ON p.PRODUCT_ID = t.PRODUCT_ID "
+     "WHERE o.CUSTOMER_ID = 3 GROUP BY p.CATEGORY", 4),
+    ("SELECT INTERACTION_TYPE, COUNT(*) FROM USER_INTERACTIONS "
+     "WHERE INTERACTION_DATE >= '2024-06-01' AND INTERACTION_DATE < '2024-06-08' GROUP BY INTERACTION_TYPE", 4),
+    ("SELECT SUM(pay.AMOUNT) FROM PAYMENTS pay WHERE pay.ORDER_ID = 12", 2),
+    ("SELECT COUNT(*) FROM USER_INTERACTIONS u JOIN TRANSACTIONS t ON t.PRODUCT_ID = u.PRODUCT_ID "
+     "WHERE u.CUSTOMER_ID = 5", 2),
+]
+
+
+def scale_database(path: str, factor: int) -> None:
+    """把每张表复制为 factor 倍，整数 *_ID 列按 i * 偏移量平移"""
+    conn = sqlite3.connect(path)
+    try:
+        tables = [row[0] for row in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        )]
+        offset = 10 ** (len(str(max(
+            conn.execute(f'SELECT COALESCE(MAX(rowid), 0) FROM "{table}"').fetchone()[0] for table in tables
+        ))) + 1)
+        for table in tables:
+            columns = conn.execute(f'PRAGMA table_info("{table}")').fetchall()
+            for i in range(1, factor):
+                select = ", ".join(
+                    f'"{name}" + {i * offset}' if name.upper().endswith("_ID") and col_type.upper() == "INTEGER"
+                    else f'"{name}"'
+                    for _, name, col_type, *_ in columns
+                )
+                conn.execute(f'INSERT INTO "{table}" SELECT {select} FROM "{table}" WHERE rowid < {offset}')
+        conn.commit()
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+
+
+def time_workload(path: str, workload, repeat: int):
+    """每条查询执行 repeat 次（取中位数，ms）"""
+    conn = sqlite3.connect(Path(path).resolve().as_uri() + "?mode=ro", uri=True)
+    timings = {}
+    try:
+        for item in workload:
+            samples = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                conn.execute(item.query).fetchall()
+                samples.append((time.perf_counter() - start) * 1000)
+            timings[item.canonical] = statistics.median(samples)
+    finally:
+        conn.close()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the logged workload before/after advisor indexes")
+    parser.add_argument("--log", default=DEFAULT_QUERY_LOG_PATH)
+    parser.add_argument("--scale", type=int, default=200, help="multiply every table by this factor")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--top", type=int, default=5, help="number of recommended indexes to apply")
+    args = parser.parse_args()
+
+    workload = load_workload(args.log)
+    if not workload:
+        print(f"Query log {args.log} is empty, using the sample workload")
+        workload = [WorkloadQuery(query, canonicalize_sql(query), count, 0.0) for query, count in SAMPLE_WORKLOAD]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "bench.db")
+        source = sqlite3.connect(DATABASE_PATH)
+        target = sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+        scale_database(path, args.scale)
+
+        before = time_workload(path, workload, args.repeat)
+        advisor = IndexAdvisor(path, workload)
+        try:
+            recommended = advisor.recommend(args.top)
+        finally:
+            advisor.close()
+        print(f"scale: {args.scale}, queries: {len(workload)}, repeat: {args.repeat}")
+        for candidate in recommended:
+            print(f"  {candidate.statement}  (est. rows saved {candidate.savings:,})")
+        apply_indexes(path, recommended)
+        after = time_workload(path, workload, args.repeat)
+
+    print(f"{'count':>6} {'before ms':>10} {'after ms':>10} {'speedup':>8}  query")
+    total_before = total_after = 0.0
+    for item in workload:
+        b, a = before[item.canonical], after[item.canonical]
+        total_before += item.count * b
+        total_after += item.count * a
+        print(f"{item.count:>6} {b:>10.3f} {a:>10.3f} {b / a if a else 0:>7.1f}x  {item.canonical[:70]}")
+    print(f"{'total':>6} {total_before:>10.3f} {total_after:>10.3f} "
+          f"{total_before / total_after if total_after else 0:>7.1f}x  (weighted by count)")
+
+
+if __name__ == "__main__":
+    main()
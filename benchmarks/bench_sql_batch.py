@@ -0,0 +1,105 @@
+"""
+批量查询基准测试
+
+模拟“对比看板”类问题：一组相互独立的聚合查询，分别
+- 逐条调用 execute_sqlite_query（Agent 每条查询需要一轮 LLM 调用）
+- 一次调用 execute_sqlite_batch（并发执行，一轮 LLM 调用）
+对比 SQL 执行的墙钟时间，并校验两种方式结果一致。LLM 轮次的节省不在此计时之内（每省一轮约为一次模型调用延迟）。
+SQLite 执行语句时释放 GIL，并发的收益取决于 CPU 核数（单核机器上两者耗时相近）。
+
+在 example.db 的放大副本上执行，关闭结果缓存命中、汇总表改写和 DuckDB 路由，只比较 SQLite 本身。不会修改 tools/example.db。
+
+用法:
+    python benchmarks/bench_sql_batch.py --scale 500 --repeat 3 --workers 4
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+os.environ.setdefault("CHATBI_SQL_ENGINE", "sqlite")
+os.environ.setdefault("CHATBI_ROLLUPS_ENABLED", "false")
+os.environ.setdefault("CHATBI_RESULT_STORE_ENABLED", "false")
+os.environ.setdefault("CHATBI_SQL_QUERY_LOG_ENABLED", "false")
+
+from bench_index_advisor import scale_database  # noqa: E402
+import tools.tools_execute_sqlite as sqlite_tools  # noqa: E402
+from tools.sql_result_cache import sql_result_cache  # noqa: E402
+
+DASHBOARD = {
+    "orders": "SELECT COUNT(*) AS orders, SUM(TOTAL_AMOUNT) AS revenue, AVG(TOTAL_AMOUNT) AS avg_order FROM ORDER_DETAILS",
+    "payments_by_month": "SELECT substr(PAYMENT_DATE, 1, 7) AS month, COUNT(*) AS payments, SUM(AMOUNT) AS amount "
+                         "FROM PAYMENTS GROUP BY month ORDER BY month",
+    "interactions_by_type": "SELECT INTERACTION_TYPE, COUNT(*) AS interactions, SUM(PURCHASE_COMPLETED) AS purchases "
+                            "FROM USER_INTERACTIONS GROUP BY INTERACTION_TYPE ORDER BY INTERACTION_TYPE",
+    "revenue_by_category": "SELECT p.CATEGORY, SUM(t.QUANTITY * t.PRICE) AS revenue FROM TRANSACTIONS t "
+                           "JOIN PRODUCTS p ON p.PRODUCT_ID = t.PRODUCT_ID GROUP BY p.CATEGORY ORDER BY p.CATEGORY",
+    "customers_by_level": "SELECT LOYALTY_LEVEL, COUNT(*) AS customers FROM CUSTOMER_DETAILS "
+                          "GROUP BY LOYALTY_LEVEL ORDER BY LOYALTY_LEVEL",
+    "monthly_interactions": "SELECT substr(INTERACTION_DATE, 1, 7) AS month, COUNT(*) AS interactions "
+                            "FROM USER_INTERACTIONS GROUP BY month ORDER BY month",
+}
+
+
+def rows_of(response):
+    return (response.get("result") or {}).get("rows") if response.get("status") == "success" else response.get("error")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sequential execute_sqlite_query calls with execute_sqlite_batch")
+    parser.add_argument("--scale", type=int, default=500, help="multiply every table by this factor")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=sqlite_tools.DEFAULT_BATCH_WORKERS)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "bench.db")
+        source = sqlite3.connect(sqlite_tools.DATABASE_PATH)
+        target = sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+        scale_database(path, args.scale)
+        sqlite_tools.DATABASE_PATH = path
+        sqlite_tools._batch_executor = ThreadPoolExecutor(max_workers=args.workers, thread_name_prefix="sqlite-batch")
+
+        def sequential():
+            sql_result_cache.invalidate(path)
+            return {name: sqlite_tools.execute_sqlite_query.invoke({"query": query}) for name, query in DASHBOARD.items()}
+
+        def batch():
+            sql_result_cache.invalidate(path)
+            return sqlite_tools.execute_sqlite_batch.invoke({"queries": DASHBOARD})["results"]
+
+        timings = {"sequential": [], "batch": []}
+        results = {}
+        for _ in range(args.repeat):
+            for name, func in (("sequential", sequential), ("batch", batch)):
+                start = time.perf_counter()
+                results[name] = func()
+                timings[name].append((time.perf_counter() - start) * 1000)
+
+        match = all(rows_of(results["sequential"][name]) == rows_of(results["batch"][name]) for name in DASHBOARD)
+        sequential_ms = statistics.median(timings["sequential"])
+        batch_ms = statistics.median(timings["batch"])
+        print(f"scale: {args.scale}, queries: {len(DASHBOARD)}, workers: {args.workers}, repeat: {args.repeat}, "
+              f"cpus: {os.cpu_count()}")
+        print(f"{'query':<24} {'ms':>8}  status")
+        for name, response in results["batch"].items():
+            print(f"{name:<24} {response['elapsed_ms']:>8.1f}  {response['status']}")
+        print(f"sequential execute_sqlite_query: {sequential_ms:8.1f} ms ({len(DASHBOARD)} tool calls / LLM turns)")
+        print(f"execute_sqlite_batch:            {batch_ms:8.1f} ms (1 tool call / LLM turn)")
+        print(f"speedup: {sequential_ms / batch_ms if batch_ms else 0:.2f}x, results match: {'yes' if match else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+"""
+SQL 校验与自动修正基准测试
+
+一组模型常见的错误 SQL（库名前缀、拼错的列名 / 表名、大小写不一致、歧义列、语法错误），每条附带正确写法。
+对每条语句统计：
+- 直接执行是否失败（失败即 Agent 需要多一轮“执行失败 -> 模型改写”）
+- 校验器是否自动修正，修正后的结果是否与正确写法一致
+- 无法修正时是否给出诊断和候选名称
+以及校验本身的耗时（schema 已缓存时的单次编译检查）。不会修改 tools/example.db。
+
+用法:
+    python benchmarks/bench_sql_validator.py --repeat 200
+"""
+import argparse
+import sqlite3
+import statistics
+import sys
+import time
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from tools.sql_validator import SqlValidator  # noqa: E402
+from tools.tools_execute_sqlite import DATABASE_PATH, get_database_version  # noqa: E402
+
+# (说明, 模型生成的 SQL, 正确写法；None 表示无法唯一修正，应返回诊断)
+CASES = [
+    ("schema prefix",
+     "SELECT COUNT(*) FROM STREAM_HACKATHON.STREAMLIT.ORDER_DETAILS",
+     "SELECT COUNT(*) FROM ORDER_DETAILS"),
+    ("partial schema prefix",
+     "SELECT o.ORDER_ID, o.TOTAL_AMOUNT FROM STREAMLIT.ORDER_DETAILS o ORDER BY o.ORDER_ID",
+     "SELECT o.ORDER_ID, o.TOTAL_AMOUNT FROM ORDER_DETAILS o ORDER BY o.ORDER_ID"),
+    ("prefixed join",
+     "SELECT c.FIRST_NAME, SUM(o.TOTAL_AMOUNT) AS spend FROM STREAM_HACKATHON.STREAMLIT.ORDER_DETAILS o "
+     "JOIN STREAM_HACKATHON.STREAMLIT.CUSTOMER_DETAILS c ON c.CUSTOMER_ID = o.CUSTOMER_ID "
+     "GROUP BY c.CUSTOMER_ID ORDER BY spend DESC, c.CUSTOMER_ID",
+     "SELECT c.FIRST_NAME, SUM(o.TOTAL_AMOUNT) AS spend FROM ORDER_DETAILS o "
+     "JOIN CUSTOMER_DETAILS c ON c.CUSTOMER_ID = o.CUSTOMER_ID GROUP BY c.CUSTOMER_ID ORDER BY spend DESC, c.CUSTOMER_ID"),
+    ("lower-case identifiers",
+     "select category, count(*) as n from products group by category order by category",
+     "SELECT CATEGORY, COUNT(*) AS n FROM PRODUCTS GROUP BY CATEGORY ORDER BY CATEGORY"),
+    ("missing underscore",
+     "SELECT ORDERDATE, TOTAL_AMOUNT FROM ORDER_DETAILS ORDER BY ORDER_ID",
+     "SELECT ORDER_DATE, TOTAL_AMOUNT FROM ORDER_DETAILS ORDER BY ORDER_ID"),
+    ("misspelled column",
+     "SELECT LOYALTY_LEVLE, COUNT(*) FROM CUSTOMER_DETAILS GROUP BY LOYALTY_LEVLE ORDER BY 1",
+     "SELECT LOYALTY_LEVEL, COUNT(*) FROM CUSTOMER_DETAILS GROUP BY LOYALTY_LEVEL ORDER BY 1"),
+    ("misspelled qualified column",
+     "SELECT p.CATEGORY, SUM(t.QUANTITY * t.PRCE) AS revenue FROM TRANSACTIONS t JOIN PRODUCTS p "
+     "ON p.PRODUCT_ID = t.PRODUCT_ID GROUP BY p.CATEGORY ORDER BY p.CATEGORY",
+     "SELECT p.CATEGORY, SUM(t.QUANTITY * t.PRICE) AS revenue FROM TRANSACTIONS t JOIN PRODUCTS p "
+     "ON p.PRODUCT_ID = t.PRODUCT_ID GROUP BY p.CATEGORY ORDER BY p.CATEGORY"),
+    ("singular table name",
+     "SELECT COUNT(*) FROM PAYMENT",
+     "SELECT COUNT(*) FROM PAYMENTS"),
+    ("several mistakes",
+     "SELECT substr(ORDERDATE, 1, 7) AS month, SUM(TOTAL_AMMOUNT) AS revenue "
+     "FROM STREAM_HACKATHON.STREAMLIT.ORDER_DETAIL GROUP BY month ORDER BY month",
+     "SELECT substr(ORDER_DATE, 1, 7) AS month, SUM(TOTAL_AMOUNT) AS revenue FROM ORDER_DETAILS GROUP BY month ORDER BY month"),
+    ("ambiguous column", "SELECT CUSTOMER_ID FROM ORDER_DETAILS o JOIN CUSTOMER_DETAILS c ON c.CUSTOMER_ID = o.CUSTOMER_ID", None),
+    ("unknown column", "SELECT REGION, COUNT(*) FROM CUSTOMER_DETAILS GROUP BY REGION", None),
+    ("syntax error", "SELECT COUNT(*) FORM ORDER_DETAILS", None),
+    ("valid query",
+     "SELECT INTERACTION_TYPE, COUNT(*) FROM USER_INTERACTIONS GROUP BY INTERACTION_TYPE ORDER BY 1",
+     "SELECT INTERACTION_TYPE, COUNT(*) FROM USER_INTERACTIONS GROUP BY INTERACTION_TYPE ORDER BY 1"),
+]
+
+
+def run(conn: sqlite3.Connection, query: str):
+    try:
+        return conn.execute(query).fetchall(), None
+    except sqlite3.Error as e:
+        return None, str(e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure local SQL validation and auto-repair")
+    parser.add_argument("--repeat", type=int, default=200, help="timing iterations per query")
+    args = parser.parse_args()
+
+    conn = sqlite3.connect(Path(DATABASE_PATH).resolve().as_uri() + "?mode=ro", uri=True)
+    version = get_database_version()
+    validator = SqlValidator(enabled=True, autofix=True)
+    failed_raw = fixed = diagnosed = wrong = 0
+    print(f"{'raw':<6} {'result':<10} {'check us':>9}  case")
+    for name, query, expected in CASES:
+        _, raw_error = run(conn, query)
+        failed_raw += raw_error is not None
+        result = validator.validate(conn, query, DATABASE_PATH, version)
+
+        # 计时：校验器不缓存结果的单次校验（schema 已缓存）
+        samples = []
+        for _ in range(args.repeat):
+            timing = SqlValidator(enabled=True, autofix=True)
+            timing._catalogs = validator._catalogs
+            start = time.perf_counter()
+            timing.validate(conn, query, DATABASE_PATH, version)
+            samples.append((time.perf_counter() - start) * 1e6)
+
+        if result.rejected:
+            outcome = "diagnosed" if expected is None else "MISSED"
+            diagnosed += expected is None
+            wrong += expected is not None
+            detail = f"{result.diagnostics[0].type}: {result.diagnostics[0].candidates[:3]}"
+        else:
+            actual, error = run(conn, result.query)
+            reference, _ = run(conn, expected) if expected else (None, None)
+            if expected is None or error or actual != reference:
+                outcome = "WRONG"
+                wrong += 1
+            else:
+                outcome = "fixed" if result.fixes else "ok"
+                fixed += raw_error is not None
+            detail = ", ".join(f"{fix.original}->{fix.replacement}" for fix in result.fixes if fix.type != "case")
+        print(f"{'error' if raw_error else 'ok':<6} {outcome:<10} {statistics.median(samples):>9.1f}  {name}"
+              + (f"  [{detail}]" if detail else ""))
+    conn.close()
+
+    print(f"\nqueries that fail as written: {failed_raw}/{len(CASES)}")
+    print(f"auto-fixed (agent iterations saved): {fixed}, diagnosed with candidates: {diagnosed}, wrong: {wrong}")
+    print(f"validator stats: {validator.stats()}")
+
+
+if __name__ == "__main__":
+    main()
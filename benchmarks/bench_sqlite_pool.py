@@ -0,0 +1,91 @@
+"""
+SQLite 连接池基准测试
+
+对比每次调用都 connect / close（旧的 execute_sqlite_query 实现）与只读连接池
+在 1、8、32 个并发调用方下的单次调用耗时和吞吐。只执行只读的点查询，不会修改数据库，
+也不会切换 WAL 模式。
+
+用法:
+    python benchmarks/bench_sqlite_pool.py --calls 2000
+"""
+import argparse
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from tools.sqlite_pool import SQLiteConnectionPool  # noqa: E402
+
+DATABASE_PATH = str(project_root / "tools" / "example.db")
+QUERY = "SELECT PRODUCT_NAME, CATEGORY, PRICE FROM PRODUCTS WHERE PRODUCT_ID = ?"
+
+
+def per_call_connect(product_id: int):
+    conn = sqlite3.connect(DATABASE_PATH)
+    try:
+        return conn.execute(QUERY, (product_id,)).fetchall()
+    finally:
+        conn.close()
+
+
+def make_pooled(pool: SQLiteConnectionPool):
+    def pooled(product_id: int):
+        with pool.connection() as conn:
+            return conn.execute(QUERY, (product_id,)).fetchall()
+    return pooled
+
+
+def run(func, callers: int, calls: int):
+    """callers 个线程共执行 calls 次调用，返回 (每次调用耗时列表 ms, 总耗时 s)"""
+    per_thread = max(calls // callers, 1)
+    samples = [[] for _ in range(callers)]
+    barrier = threading.Barrier(callers + 1)
+
+    def worker(index: int):
+        barrier.wait()
+        for i in range(per_thread):
+            start = time.perf_counter()
+            func(i % 20 + 1)
+            samples[index].append((time.perf_counter() - start) * 1000)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(callers)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    return [s for thread_samples in samples for s in thread_samples], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark per-call SQLite connection overhead")
+    parser.add_argument("--calls", type=int, default=2000, help="total calls per configuration")
+    parser.add_argument("--pool-size", type=int, default=8)
+    args = parser.parse_args()
+
+    pool = SQLiteConnectionPool(DATABASE_PATH, max_size=args.pool_size)
+    implementations = (("connect", per_call_connect), ("pool", make_pooled(pool)))
+
+    print(f"calls: {args.calls}, pool size: {args.pool_size}")
+    print(f"{'callers':>8} {'impl':>8} {'mean ms':>10} {'p50 ms':>10} {'p99 ms':>10} {'calls/s':>10}")
+    for callers in (1, 8, 32):
+        for name, func in implementations:
+            run(func, callers, min(args.calls, 200))  # 预热
+            samples, elapsed = run(func, callers, args.calls)
+            samples.sort()
+            p99 = samples[min(int(len(samples) * 0.99), len(samples) - 1)]
+            print(f"{callers:>8} {name:>8} {statistics.mean(samples):>10.3f} "
+                  f"{statistics.median(samples):>10.3f} {p99:>10.3f} {len(samples) / elapsed:>10.0f}")
+    pool.close()
+
+
+if __name__ == "__main__":
+    main()
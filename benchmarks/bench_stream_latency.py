@@ -0,0 +1,131 @@
+"""
+token 投递方式基准测试
+
+对比旧的轮询方式（queue.Queue + get_nowait + asyncio.sleep(0.1)）与
+AsyncTokenBridge（asyncio.Queue + call_soon_threadsafe）：
+- 首字节延迟：工作线程产生第一个 token 到 SSE 生成器拿到它的时间
+- 空闲开销：N 个并发流在没有 token 时的 CPU 占用
+
+用法:
+    python benchmarks/bench_stream_latency.py --streams 200 --idle 5
+"""
+import argparse
+import asyncio
+import importlib.util
+import queue
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+# 直接按文件加载回调模块，避免 backend.api 包初始化时加载 Agent、向量库和 LLM 客户端
+# （callback.py 依赖的 tools.cancellation 通过上面的 sys.path 导入）
+_module_path = project_root / "backend" / "api" / "callback.py"
+_spec = importlib.util.spec_from_file_location("callback", _module_path)
+callback = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(callback)
+
+AsyncTokenBridge = callback.AsyncTokenBridge
+
+_DONE = object()
+
+
+async def polling_consumer(token_queue: "queue.Queue", first_token_at: list):
+    """旧实现：非阻塞读取，队列为空时 sleep 100ms"""
+    while True:
+        try:
+            token = token_queue.get_nowait()
+        except queue.Empty:
+            await asyncio.sleep(0.1)
+            continue
+        if token is _DONE:
+            return
+        if not first_token_at:
+            first_token_at.append(time.perf_counter())
+
+
+async def bridge_consumer(bridge: AsyncTokenBridge, first_token_at: list):
+    """新实现：await 挂起，token 到达即唤醒"""
+    while True:
+        token = await bridge.get()
+        if token is AsyncTokenBridge.DONE:
+            return
+        if not first_token_at:
+            first_token_at.append(time.perf_counter())
+
+
+def start_producer(put, close, delay: float, sent_at: list):
+    def produce():
+        time.sleep(delay)
+        sent_at.append(time.perf_counter())
+        put("token")
+        close()
+    thread = threading.Thread(target=produce)
+    thread.start()
+    return thread
+
+
+async def measure_ttfb(mode: str, trials: int):
+    latencies = []
+    loop = asyncio.get_running_loop()
+    for i in range(trials):
+        sent_at, first_token_at = [], []
+        delay = 0.005 + (i % 10) * 0.007
+        if mode == "polling":
+            token_queue = queue.Queue()
+            thread = start_producer(token_queue.put, lambda: token_queue.put(_DONE), delay, sent_at)
+            await polling_consumer(token_queue, first_token_at)
+        else:
+            bridge = AsyncTokenBridge(loop)
+            thread = start_producer(bridge.put_threadsafe, bridge.close, delay, sent_at)
+            await bridge_consumer(bridge, first_token_at)
+        thread.join()
+        latencies.append((first_token_at[0] - sent_at[0]) * 1000)
+    return latencies
+
+
+async def measure_idle_cpu(mode: str, streams: int, idle_seconds: float):
+    loop = asyncio.get_running_loop()
+    closers, tasks = [], []
+    for _ in range(streams):
+        if mode == "polling":
+            token_queue = queue.Queue()
+            closers.append(lambda q=token_queue: q.put(_DONE))
+            tasks.append(asyncio.create_task(polling_consumer(token_queue, [])))
+        else:
+            bridge = AsyncTokenBridge(loop)
+            closers.append(bridge.close)
+            tasks.append(asyncio.create_task(bridge_consumer(bridge, [])))
+    await asyncio.sleep(0)
+    cpu_start = time.process_time()
+    await asyncio.sleep(idle_seconds)
+    cpu_used = time.process_time() - cpu_start
+    for close in closers:
+        close()
+    await asyncio.gather(*tasks)
+    return cpu_used
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark token delivery between agent thread and SSE generator")
+    parser.add_argument("--trials", type=int, default=30)
+    parser.add_argument("--streams", type=int, default=200)
+    parser.add_argument("--idle", type=float, default=5.0)
+    args = parser.parse_args()
+
+    print(f"{'mode':>8} {'ttfb p50 ms':>12} {'ttfb p95 ms':>12} {'idle cpu ms/s':>14}")
+    for mode in ("polling", "push"):
+        latencies = sorted(await measure_ttfb(mode, args.trials))
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        cpu = await measure_idle_cpu(mode, args.streams, args.idle)
+        print(f"{mode:>8} {statistics.median(latencies):>12.2f} {p95:>12.2f} {cpu * 1000 / args.idle:>14.2f}")
+    print(f"(idle cpu measured with {args.streams} concurrent idle streams)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+"""
+并发工具节点基准测试
+
+模拟模型在一轮中发出多个相互独立的 execute_sqlite_query 调用（对比看板的各个指标），分别用
+- 单个工作线程的 ConcurrentToolNode（等同于逐个执行）
+- 默认配置的 ConcurrentToolNode（共享线程池 + sqlite 分组限流）
+执行同一条 AIMessage，对比墙钟时间，校验两者返回的 ToolMessage 顺序与内容一致，并打印状态中的 tool_timings。
+SQLite 执行语句时释放 GIL，并发的收益取决于 CPU 核数；工具本身是网络调用（检索、LLM）时收益更明显。
+
+在 example.db 的放大副本上执行，关闭结果缓存命中、汇总表改写和 DuckDB 路由。不会修改 tools/example.db。
+
+用法:
+    python benchmarks/bench_tool_node.py --scale 500 --repeat 3
+"""
+import argparse
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+project_root = Path(__file__).resolve().parent.parent
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+os.environ.setdefault("CHATBI_SQL_ENGINE", "sqlite")
+os.environ.setdefault("CHATBI_ROLLUPS_ENABLED", "false")
+os.environ.setdefault("CHATBI_RESULT_STORE_ENABLED", "false")
+os.environ.setdefault("CHATBI_SQL_QUERY_LOG_ENABLED", "false")
+
+from langchain_core.messages import AIMessage  # noqa: E402
+
+from bench_index_advisor import scale_database  # noqa: E402
+from bench_sql_batch import DASHBOARD  # noqa: E402
+import tools.tools_execute_sqlite as sqlite_tools  # noqa: E402
+from tools.sql_result_cache import sql_result_cache  # noqa: E402
+from tools.tool_executor import ConcurrencyLimiter, ConcurrentToolNode, DEFAULT_GROUP_LIMITS  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare one-at-a-time and concurrent tool execution in the agent's tool node")
+    parser.add_argument("--scale", type=int, default=500, help="multiply every table by this factor")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = str(Path(tmp) / "bench.db")
+        source = sqlite3.connect(sqlite_tools.DATABASE_PATH)
+        target = sqlite3.connect(path)
+        source.backup(target)
+        source.close()
+        target.close()
+        scale_database(path, args.scale)
+        sqlite_tools.DATABASE_PATH = path
+
+        message = AIMessage("", tool_calls=[
+            {"name": "execute_sqlite_query", "args": {"query": query}, "id": f"call_{name}"}
+            for name, query in DASHBOARD.items()
+        ])
+        nodes = {
+            "one at a time": ConcurrentToolNode(
+                [sqlite_tools.execute_sqlite_query],
+                executor=ThreadPoolExecutor(max_workers=1), limiter=ConcurrencyLimiter({"sqlite": 1}),
+            ),
+            "concurrent": ConcurrentToolNode([sqlite_tools.execute_sqlite_query]),
+        }
+        timings = {name: [] for name in nodes}
+        outputs = {}
+        for _ in range(args.repeat):
+            for name, node in nodes.items():
+                sql_result_cache.invalidate(path)
+                start = time.perf_counter()
+                outputs[name] = node.invoke({"messages": [message]})
+                timings[name].append((time.perf_counter() - start) * 1000)
+
+        contents = {name: [(m.tool_call_id, m.content) for m in output["messages"]] for name, output in outputs.items()}
+        match = contents["one at a time"] == contents["concurrent"]
+        print(f"scale: {args.scale}, tool calls: {len(DASHBOARD)}, sqlite limit: {DEFAULT_GROUP_LIMITS['sqlite']}, "
+              f"repeat: {args.repeat}, cpus: {os.cpu_count()}")
+        print(f"{'tool call':<28} {'queued ms':>10} {'ms':>8}  status")
+        for timing in outputs["concurrent"]["tool_timings"]:
+            print(f"{timing['tool_call_id']:<28} {timing['queued_ms']:>10.1f} {timing['duration_ms']:>8.1f}  {timing['status']}")
+        for name in nodes:
+            print(f"{name:<14} {statistics.median(timings[name]):8.1f} ms")
+        one, concurrent = (statistics.median(timings[name]) for name in nodes)
+        print(f"speedup: {one / concurrent if concurrent else 0:.2f}x, results in call order and identical: {'yes' if match else 'NO'}")
+
+
+if __name__ == "__main__":
+    main()
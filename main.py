@@ -1,6 +1,6 @@
 import re, base64, json, warnings
 import streamlit as st
-from agent import MessagesState, create_agent
+from agent import MessagesState, get_agent
 from ui.sqlitechat_ui import StreamlitUICallbackHandler, message_func
 from langchain_core.messages import HumanMessage, AIMessage, ToolMessage
 
@@ -232,7 +232,8 @@ for message in messages_to_display:
 
 callback_handler = StreamlitUICallbackHandler(model)
 
-react_graph = create_agent(callback_handler, st.session_state["model"])
+# 已编译的 Agent 按模型缓存，Streamlit 每次 rerun 不再重新构建
+react_graph = get_agent(st.session_state["model"])
 
 
 
@@ -293,7 +294,7 @@ if (
         messages = [HumanMessage(content=user_input_content)]
 
         state = MessagesState(messages=messages)
-        result = react_graph.invoke(state, config=config, debug=True)
+        result = react_graph.invoke(state, config={**config, "callbacks": [callback_handler]}, debug=True)
         # st.sidebar.write(f"result: {result}")
         
 
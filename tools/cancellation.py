@@ -0,0 +1,97 @@
+"""
+Agent 运行取消机制
+
+每次 Agent 运行持有一个 CancelScope，通过 contextvars 传递到图节点和工具中：
+- LLM 节点、工具在开始前调用 check_cancelled()
+- SQLite 连接通过 track_connection() 登记，取消时调用 connection.interrupt() 中断正在执行的语句
+- 流式回调在收到 token 时检查取消状态，抛出 RunCancelled 以中止进行中的 LLM HTTP 请求
+
+LangChain / LangGraph 的线程池会复制 contextvars，因此工作线程中的工具也能拿到当前的 CancelScope。
+"""
+import contextvars
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Iterator, Optional, Set
+
+
+class RunCancelled(Exception):
+    """Agent 运行已被取消（例如客户端断开连接）"""
+
+
+class CancelScope:
+    """一次 Agent 运行的取消状态"""
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._connections: Set[sqlite3.Connection] = set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self) -> None:
+        """标记取消，并中断所有登记的 SQLite 连接上正在执行的语句"""
+        self._event.set()
+        with self._lock:
+            connections = list(self._connections)
+        for conn in connections:
+            try:
+                conn.interrupt()
+            except sqlite3.Error:
+                pass
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise RunCancelled("Agent run was cancelled")
+
+    def register_connection(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._connections.add(conn)
+        if self.cancelled:
+            conn.interrupt()
+
+    def unregister_connection(self, conn: sqlite3.Connection) -> None:
+        with self._lock:
+            self._connections.discard(conn)
+
+
+_current_scope: contextvars.ContextVar[Optional[CancelScope]] = contextvars.ContextVar(
+    "chatbi_cancel_scope", default=None
+)
+
+
+def current_scope() -> Optional[CancelScope]:
+    return _current_scope.get()
+
+
+@contextmanager
+def cancel_scope(scope: CancelScope) -> Iterator[CancelScope]:
+    """在当前上下文中激活 CancelScope"""
+    token = _current_scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _current_scope.reset(token)
+
+
+def check_cancelled() -> None:
+    """当前运行已取消时抛出 RunCancelled；不在任何运行中时不做任何事"""
+    scope = _current_scope.get()
+    if scope is not None:
+        scope.check()
+
+
+@contextmanager
+def track_connection(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """登记 SQLite 连接，运行取消时中断其上正在执行的语句"""
+    scope = _current_scope.get()
+    if scope is None:
+        yield conn
+        return
+    scope.register_connection(conn)
+    try:
+        yield conn
+    finally:
+        scope.unregister_connection(conn)
@@ -0,0 +1,320 @@
+"""
+DuckDB 分析引擎（可选）
+
+按月统计 USER_INTERACTIONS、按类别汇总 TRANSACTIONS 收入这类聚合查询，在表达到千万行级别后
+SQLite 的按行执行器很慢。安装 duckdb 后，execute_sqlite_query 会把满足条件的查询交给 DuckDB 执行：
+
+- 数据来源：默认同步一份列式副本（example.duckdb，数据库指纹变化后在后台重建，重建期间仍走 SQLite）；
+  CHATBI_DUCKDB_MODE=attach 时通过 DuckDB 的 sqlite 扩展直接挂载 example.db
+- 路由（CHATBI_SQL_ENGINE=auto）：只有聚合查询、且按查询计划估算的扫描行数不少于
+  CHATBI_DUCKDB_MIN_ROWS 时才使用 DuckDB；=duckdb 时忽略行数阈值；=sqlite 时关闭
+- 结果与 SQLite 一致：
+  * 包含 SQLite 特有函数/语义的查询（strftime、date、LIKE、标量 MAX/MIN、group_concat 等）不路由
+  * 多行的 GROUP BY 结果必须有顶层 ORDER BY（否则两个引擎的行顺序不同）
+  * DuckDB 会话设置为整数除法、NULL 在升序时排在最前（与 SQLite 相同）
+  * 列名取自 SQLite（SELECT * FROM (<query>) LIMIT 0，不执行查询）
+  * DuckDB 报错或返回了 SQLite 不会产生的值类型时，回退到 SQLite 重新执行
+
+未安装 duckdb 时本模块不做任何事。
+"""
+import decimal
+import os
+import re
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+from tools.cancellation import RunCancelled, check_cancelled, track_connection
+from tools.sql_guard import QueryBudget
+from tools.sql_pagination import fetch_bounded
+from tools.sql_result_cache import canonicalize_sql
+
+DEFAULT_SQL_ENGINE = os.getenv("CHATBI_SQL_ENGINE", "auto").lower()
+DEFAULT_DUCKDB_MODE = os.getenv("CHATBI_DUCKDB_MODE", "copy").lower()
+DEFAULT_DUCKDB_PATH = os.getenv("CHATBI_DUCKDB_PATH", "")
+DEFAULT_DUCKDB_MIN_ROWS = int(os.getenv("CHATBI_DUCKDB_MIN_ROWS", "1000000"))
+DEFAULT_DUCKDB_THREADS = int(os.getenv("CHATBI_DUCKDB_THREADS", "0"))
+
+_SYNC_BATCH_SIZE = 100000
+_SYNC_TABLE = "_chatbi_sync"
+_AGGREGATE = re.compile(r"\b(count|sum|avg|min|max|group\s+by)\b")
+_SQLITE_ONLY = re.compile(
+    r"\b(strftime|date|datetime|time|julianday|unixepoch|total|typeof|random|randomblob|printf|format|iif"
+    r"|like|glob|regexp|match|group_concat|rowid|oid|_rowid_|pragma|last_insert_rowid|changes|sqlite_\w+)\b"
+)
+_SCALAR_MIN_MAX = re.compile(r"\b(min|max)\([^()]*,")
+_STRING = re.compile(r"'(?:[^']|'')*'")
+
+
+def _sqlite_type(declared: str) -> str:
+    """按 SQLite 的类型亲和性规则映射列类型"""
+    declared = (declared or "").upper()
+    if "INT" in declared:
+        return "BIGINT"
+    if any(word in declared for word in ("CHAR", "CLOB", "TEXT")) or not declared:
+        return "VARCHAR"
+    if "BLOB" in declared:
+        return "BLOB"
+    return "DOUBLE"
+
+
+def _top_level(sql: str) -> str:
+    """去掉括号内的内容（子查询、函数参数），只保留顶层语句"""
+    previous = None
+    while previous != sql:
+        previous, sql = sql, re.sub(r"\([^()]*\)", "()", sql)
+    return sql
+
+
+def route_reason(query: str) -> Optional[str]:
+    """查询不能交给 DuckDB 时返回原因；可以时返回 None"""
+    canonical = _STRING.sub("''", canonicalize_sql(query))
+    if not canonical.startswith(("select", "with")) or ";" in canonical:
+        return "not a single SELECT"
+    if not _AGGREGATE.search(canonical):
+        return "not an aggregate query"
+    if _SQLITE_ONLY.search(canonical) or _SCALAR_MIN_MAX.search(canonical):
+        return "uses SQLite-specific functions"
+    top = _top_level(canonical)
+    if re.search(r"\bgroup\s+by\b", top) and not re.search(r"\border\s+by\b", top):
+        return "GROUP BY without ORDER BY"
+    return None
+
+
+def _normalize(value: Any) -> Any:
+    """把 DuckDB 的值转换为 SQLite 会返回的类型；无法对应时抛出 TypeError"""
+    if value is None or isinstance(value, (int, float, str, bytes)) and not isinstance(value, bool):
+        return value
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f"unexpected DuckDB value type {type(value).__name__}")
+
+
+class DuckDBEngine:
+    """DuckDB 执行后端（线程安全；每次查询使用独立的 cursor）"""
+
+    def __init__(self, database_path: str, engine: str = DEFAULT_SQL_ENGINE, mode: str = DEFAULT_DUCKDB_MODE,
+                 duckdb_path: str = DEFAULT_DUCKDB_PATH, min_rows: int = DEFAULT_DUCKDB_MIN_ROWS,
+                 threads: int = DEFAULT_DUCKDB_THREADS):
+        self.database_path = database_path
+        self.engine = engine
+        self.mode = mode
+        self.duckdb_path = duckdb_path or str(Path(database_path).with_suffix(".duckdb"))
+        self.min_rows = min_rows
+        self.threads = threads
+        self.enabled = duckdb is not None and engine in ("auto", "duckdb")
+        self._lock = threading.Lock()
+        self._conn = None
+        self._version: Optional[str] = None
+        self._sync_thread: Optional[threading.Thread] = None
+        self._failed_version: Optional[str] = None
+        self.routed = 0
+        self.fallbacks = 0
+        self.syncs = 0
+        self.last_sync_seconds = 0.0
+
+    # ---- 数据同步 ----
+
+    def _configure(self, conn) -> None:
+        conn.execute("SET integer_division = true")
+        conn.execute("SET default_null_order = 'nulls_first_on_asc_last_on_desc'")
+        if self.threads > 0:
+            conn.execute(f"SET threads = {self.threads}")
+
+    def _attach(self):
+        conn = duckdb.connect()
+        conn.execute("LOAD sqlite")
+        conn.execute(f"ATTACH '{self.database_path}' AS example (TYPE sqlite, READ_ONLY)")
+        conn.execute("USE example")
+        self._configure(conn)
+        return conn
+
+    def _sync(self, version: str) -> None:
+        """把 SQLite 表复制到新的 DuckDB 文件，完成后原子替换"""
+        started_at = time.perf_counter()
+        tmp_path = self.duckdb_path + ".tmp"
+        for path in (tmp_path, tmp_path + ".wal"):
+            if os.path.exists(path):
+                os.remove(path)
+        try:
+            import pandas as pd
+
+            source = sqlite3.connect(Path(self.database_path).resolve().as_uri() + "?mode=ro", uri=True)
+            target = duckdb.connect(tmp_path)
+            try:
+                tables = [row[0] for row in source.execute(
+                    "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+                )]
+                for table in tables:
+                    columns = source.execute(f'PRAGMA table_info("{table}")').fetchall()
+                    names = [column[1] for column in columns]
+                    definitions = ", ".join(f'"{column[1]}" {_sqlite_type(column[2])}' for column in columns)
+                    target.execute(f'CREATE TABLE "{table}" ({definitions})')
+                    cursor = source.execute(f'SELECT * FROM "{table}"')
+                    while True:
+                        batch = cursor.fetchmany(_SYNC_BATCH_SIZE)
+                        if not batch:
+                            break
+                        frame = pd.DataFrame.from_records(batch, columns=names)
+                        target.register("_chatbi_batch", frame)
+                        target.execute(f'INSERT INTO "{table}" SELECT * FROM _chatbi_batch')
+                        target.unregister("_chatbi_batch")
+                target.execute(f"CREATE TABLE {_SYNC_TABLE} AS SELECT ? AS version", [version])
+                target.execute("CHECKPOINT")
+            finally:
+                target.close()
+                source.close()
+            os.replace(tmp_path, self.duckdb_path)
+            conn = duckdb.connect(self.duckdb_path, read_only=True)
+            self._configure(conn)
+        except Exception as e:
+            print(f"[WARNING] DuckDB sync failed, queries stay on SQLite: {e}")
+            with self._lock:
+                self._failed_version = version
+                self._sync_thread = None
+            return
+        with self._lock:
+            # 旧连接上进行中的查询各自持有 cursor，不在这里关闭
+            self._conn, self._version = conn, version
+            self._sync_thread = None
+            self.syncs += 1
+            self.last_sync_seconds = time.perf_counter() - started_at
+        print(f"[INFO] DuckDB copy synced in {self.last_sync_seconds:.2f}s ({self.duckdb_path})")
+
+    def _open_existing(self, version: str) -> None:
+        """进程启动时复用已有的、版本一致的副本"""
+        try:
+            conn = duckdb.connect(self.duckdb_path, read_only=True)
+            if conn.execute(f"SELECT version FROM {_SYNC_TABLE}").fetchone()[0] == version:
+                self._configure(conn)
+                self._conn, self._version = conn, version
+            else:
+                conn.close()
+        except Exception:
+            pass
+
+    def connection(self, version: str):
+        """返回与数据库版本一致的 DuckDB 连接；副本过期时启动后台同步并返回 None"""
+        with self._lock:
+            if self.mode == "attach":
+                if self._conn is None and self._failed_version is None:
+                    try:
+                        self._conn = self._attach()
+                    except Exception as e:
+                        print(f"[WARNING] DuckDB cannot attach SQLite database: {e}")
+                        self._failed_version = "attach"
+                return self._conn
+            if self._version != version and self._conn is None and os.path.exists(self.duckdb_path):
+                self._open_existing(version)
+            if self._version == version:
+                return self._conn
+            if self._sync_thread is None and self._failed_version != version:
+                self._sync_thread = threading.Thread(target=self._sync, args=(version,), daemon=True)
+                self._sync_thread.start()
+            return None
+
+    def wait_for_sync(self, timeout: Optional[float] = None) -> None:
+        thread = self._sync_thread
+        if thread is not None:
+            thread.join(timeout)
+
+    # ---- 执行 ----
+
+    def should_route(self, query: str, estimated_rows: Optional[int]) -> bool:
+        if not self.enabled or route_reason(query) is not None:
+            return False
+        if self.engine == "duckdb":
+            return True
+        return estimated_rows is not None and estimated_rows >= self.min_rows
+
+    def execute(self, sqlite_conn: sqlite3.Connection, query: str, version: str,
+                budget: Optional[QueryBudget] = None) -> Optional[Dict[str, Any]]:
+        """
+        在 DuckDB 上执行查询，返回与 _run_statement 相同格式的结果
+
+        副本未就绪、DuckDB 执行失败或结果类型无法对应时返回 None，调用方回退到 SQLite。
+        超出执行预算或运行被取消时与 SQLite 一样抛出 OperationalError("interrupted")，不再回退。
+        """
+        conn = self.connection(version)
+        if conn is None:
+            return None
+        probe = sqlite_conn.execute(f"SELECT * FROM ({query.strip().rstrip(';')}) LIMIT 0")
+        columns = [description[0] for description in probe.description]
+        probe.close()
+        cursor = conn.cursor()
+        # DuckDB 没有 progress handler：超时和运行取消都通过 interrupt() 中断
+        timed_out = threading.Event()
+
+        def on_timeout():
+            timed_out.set()
+            cursor.interrupt()
+
+        timer = None
+        if budget is not None and budget.timeout_seconds > 0:
+            timer = threading.Timer(max(budget.timeout_seconds - budget.elapsed, 0), on_timeout)
+        try:
+            if timer:
+                timer.start()
+            with track_connection(cursor):
+                cursor.execute(query)
+                if len(cursor.description) != len(columns):
+                    raise TypeError("column count differs from SQLite")
+                rows, truncated = fetch_bounded(cursor)
+            rows = [tuple(_normalize(value) for value in row) for row in rows]
+        except Exception as e:
+            if timed_out.is_set():
+                budget.exceeded = "timeout"
+                raise sqlite3.OperationalError("interrupted") from e
+            try:
+                check_cancelled()
+            except RunCancelled:
+                raise sqlite3.OperationalError("interrupted") from e
+            with self._lock:
+                self.fallbacks += 1
+            print(f"[WARNING] DuckDB execution failed, falling back to SQLite: {str(e).splitlines()[0]}")
+            return None
+        finally:
+            if timer:
+                timer.cancel()
+            cursor.close()
+        with self._lock:
+            self.routed += 1
+        return {"columns": columns, "rows": rows, "row_count": len(rows), "truncated": truncated}
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "available": duckdb is not None,
+                "enabled": self.enabled,
+                "engine": self.engine,
+                "mode": self.mode,
+                "min_rows": self.min_rows,
+                "synced_version": self._version,
+                "syncing": self._sync_thread is not None,
+                "syncs": self.syncs,
+                "last_sync_seconds": round(self.last_sync_seconds, 3),
+                "routed": self.routed,
+                "fallbacks": self.fallbacks,
+            }
+
+
+_engines: Dict[str, DuckDBEngine] = {}
+_engines_lock = threading.Lock()
+
+
+def get_duckdb_engine(database_path: str) -> DuckDBEngine:
+    with _engines_lock:
+        engine = _engines.get(database_path)
+        if engine is None:
+            engine = DuckDBEngine(database_path)
+            _engines[database_path] = engine
+        return engine
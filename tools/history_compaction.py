@@ -0,0 +1,402 @@
+"""
+会话历史压缩
+
+llm_agent 每次调用模型都会带上完整的 state.messages：长会话里所有 SQL 结果 JSON、Highcharts 配置都会被反复发送，
+提示词 token 和延迟随轮数无限增长。HistoryCompactor 在每次调用模型前生成压缩后的提示词（只影响发送给模型的视图，
+会话线程中的消息保持原样）：
+
+- 最近 CHATBI_HISTORY_KEEP_TURNS 轮（含当前轮）原样保留
+- 更早的轮次增量并入会话摘要（保存在图状态 history_summary 中）：每次只把新移出窗口的轮次和已有摘要交给模型合并，
+  工具输出先压缩为要点（SQL、列名、行数、前几行、结果句柄 / 游标，图表只保留类型），摘要不超过 CHATBI_HISTORY_SUMMARY_MAX_TOKENS
+- 提示词总量硬上限 CHATBI_HISTORY_MAX_TOKENS：超出时依次压缩保留窗口内较早轮次的工具输出、提前把最早的轮次并入摘要、
+  压缩当前轮中较早批次的工具输出，最后截断当前批次的工具输出
+- 每次调用记录压缩前后的 token 数（图状态 compaction_reports，GET /api/chat/metrics 的 history_compaction 字段）
+
+token 数用 tiktoken（cl100k_base）计算；编码文件不可用时按字符估算（中日韩字符每字 1 个 token，其余每 4 个字符 1 个）。
+"""
+import json
+import os
+import re
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage, ToolMessage
+
+DEFAULT_HISTORY_COMPACTION_ENABLED = os.getenv("CHATBI_HISTORY_COMPACTION_ENABLED", "true").lower() == "true"
+DEFAULT_HISTORY_KEEP_TURNS = int(os.getenv("CHATBI_HISTORY_KEEP_TURNS", "3"))
+DEFAULT_HISTORY_MAX_TOKENS = int(os.getenv("CHATBI_HISTORY_MAX_TOKENS", "32000"))
+DEFAULT_HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("CHATBI_HISTORY_SUMMARY_MAX_TOKENS", "800"))
+DEFAULT_HISTORY_TOOL_PREVIEW_CHARS = int(os.getenv("CHATBI_HISTORY_TOOL_PREVIEW_CHARS", "300"))
+DEFAULT_HISTORY_REPORTS_KEPT = int(os.getenv("CHATBI_HISTORY_REPORTS_KEPT", "100"))
+
+SQL_TOOLS = ("execute_sqlite_query", "fetch_sqlite_page")
+PREVIEW_ROWS = 3
+MESSAGE_OVERHEAD_TOKENS = 4
+_CJK_RE = re.compile(r"[　-〿぀-ヿ㐀-䶿一-鿿가-힯＀-￯]")
+
+SUMMARY_PROMPT = (
+    "你在为一个数据分析助手压缩对话历史。请把“已有摘要”和“新增对话”合并成一份新的摘要，保留：用户的问题与偏好、"
+    "用到的表和字段、执行过的关键 SQL、关键数字结论、结果句柄（res_ 开头）和游标、尚未完成的事项。"
+    "用要点列出，不超过 {max_tokens} 个 token，只输出摘要。\n"
+    "已有摘要:\n{summary}\n"
+    "新增对话:\n{dialogue}\n"
+)
+
+_encoding = None
+_encoding_lock = threading.Lock()
+_encoding_failed = False
+
+
+def count_tokens(text: str) -> int:
+    """文本的 token 数（tiktoken 不可用时估算）"""
+    global _encoding, _encoding_failed
+    if not text:
+        return 0
+    if _encoding is None and not _encoding_failed:
+        with _encoding_lock:
+            if _encoding is None and not _encoding_failed:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:
+                    _encoding_failed = True
+                    print(f"[WARNING] tiktoken unavailable ({type(e).__name__}), estimating token counts")
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """截断到不超过 max_tokens 个 token（按比例估算后逐步收缩）"""
+    tokens = count_tokens(text)
+    if tokens <= max_tokens:
+        return text
+    length = max(int(len(text) * max_tokens / tokens), 0)
+    while length > 0 and count_tokens(text[:length]) > max_tokens:
+        length = int(length * 0.9)
+    return text[:length]
+
+
+def _content_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        return "".join(item.get("text") or "" if isinstance(item, dict) else str(item) for item in content)
+    return json.dumps(content, ensure_ascii=False, default=str)
+
+
+def message_tokens(message: BaseMessage) -> int:
+    tokens = MESSAGE_OVERHEAD_TOKENS + count_tokens(_content_text(message.content))
+    for call in getattr(message, "tool_calls", None) or []:
+        tokens += count_tokens(call["name"]) + count_tokens(json.dumps(call["args"], ensure_ascii=False, default=str))
+    return tokens
+
+
+def keep_recent_reports(left: Optional[List[Dict[str, Any]]],
+                        right: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """compaction_reports 的合并函数：追加本次记录，只保留最近的若干条"""
+    merged = list(left or []) + list(right or [])
+    return merged[-DEFAULT_HISTORY_REPORTS_KEPT:] if DEFAULT_HISTORY_REPORTS_KEPT > 0 else merged
+
+
+def split_turns(messages: Sequence[BaseMessage]) -> List[List[BaseMessage]]:
+    """按用户消息切分轮次（第一条用户消息之前的消息归入第一轮）"""
+    turns: List[List[BaseMessage]] = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _compact_sql_response(response: Any) -> Any:
+    if not isinstance(response, dict) or response.get("status") != "success":
+        return response
+    result = response.get("result") or {}
+    compact = {
+        "columns": result.get("columns"),
+        "row_count": result.get("total_rows", result.get("row_count")),
+        "rows_preview": (result.get("rows") or [])[:PREVIEW_ROWS],
+    }
+    for key in ("result_handle", "cursor"):
+        if result.get(key):
+            compact[key] = result[key]
+    return {"status": "success", "compacted": True, "result": compact}
+
+
+def compact_tool_content(name: Optional[str], content: Any, preview_chars: int) -> str:
+    """工具输出的紧凑形式：SQL 结果保留列名、行数、前几行和句柄，图表只保留类型，其余截断"""
+    text = _content_text(content)
+    try:
+        data = json.loads(text) if isinstance(content, str) else content
+    except ValueError:
+        data = None
+    if isinstance(data, dict):
+        if name in SQL_TOOLS:
+            return json.dumps(_compact_sql_response(data), ensure_ascii=False, default=str)
+        if name == "execute_sqlite_batch" and isinstance(data.get("results"), dict):
+            return json.dumps({
+                **{key: value for key, value in data.items() if key != "results"},
+                "compacted": True,
+                "results": {key: _compact_sql_response(value) for key, value in data["results"].items()},
+            }, ensure_ascii=False, default=str)
+        if name == "high_charts_json" and "chart_config" in data:
+            return json.dumps({"chart_type": data.get("chart_type"), "compacted": True,
+                               "note": "chart_config omitted"}, ensure_ascii=False)
+    if len(text) <= preview_chars:
+        return text
+    return f"{text[:preview_chars]}…[compacted, {len(text) - preview_chars} chars omitted]"
+
+
+def render_dialogue(turns: Sequence[Sequence[BaseMessage]], preview_chars: int) -> str:
+    """把轮次渲染为摘要输入：用户 / 助手文本，工具调用参数与压缩后的输出"""
+    calls: Dict[str, Dict[str, Any]] = {}
+    lines: List[str] = []
+    for turn in turns:
+        for message in turn:
+            if isinstance(message, HumanMessage):
+                lines.append(f"用户: {_content_text(message.content)}")
+            elif isinstance(message, AIMessage):
+                text = _content_text(message.content).strip()
+                if text:
+                    lines.append(f"助手: {text}")
+                for call in message.tool_calls:
+                    calls[call["id"]] = call
+                    lines.append(f"调用 {call['name']}: {json.dumps(call['args'], ensure_ascii=False, default=str)}")
+            elif isinstance(message, ToolMessage):
+                name = message.name or calls.get(message.tool_call_id, {}).get("name")
+                lines.append(f"{name} 返回: {compact_tool_content(name, message.content, preview_chars)}")
+    return "\n".join(lines)
+
+
+@dataclass
+class CompactionPlan:
+    """一次模型调用的压缩方案；needs_summary 时由调用方生成新摘要后交给 finish()"""
+    system: SystemMessage
+    turns: List[List[BaseMessage]]
+    summary: str
+    summary_upto: Optional[str]
+    fold: List[List[BaseMessage]] = field(default_factory=list)
+    compacted_tools: int = 0
+    original_tokens: int = 0
+    turn: int = 0
+    # 本轮用户消息的 id：已并入摘要的消息可能被会话管理删除，轮次序号会变化，按 id 归属本轮更可靠
+    turn_id: Optional[str] = None
+
+    @property
+    def needs_summary(self) -> bool:
+        return bool(self.fold)
+
+
+@dataclass
+class CompactionResult:
+    messages: List[BaseMessage]
+    summary: str
+    summary_upto: Optional[str]
+    report: Dict[str, Any]
+
+    def state_update(self) -> Dict[str, Any]:
+        return {
+            "history_summary": self.summary,
+            "history_summary_upto": self.summary_upto,
+            "compaction_reports": [self.report],
+        }
+
+
+class HistoryCompactor:
+    """会话历史压缩（线程安全，统计跨会话累计）"""
+
+    def __init__(self, enabled: bool = DEFAULT_HISTORY_COMPACTION_ENABLED, keep_turns: int = DEFAULT_HISTORY_KEEP_TURNS,
+                 max_tokens: int = DEFAULT_HISTORY_MAX_TOKENS, summary_max_tokens: int = DEFAULT_HISTORY_SUMMARY_MAX_TOKENS,
+                 tool_preview_chars: int = DEFAULT_HISTORY_TOOL_PREVIEW_CHARS):
+        self.enabled = enabled
+        self.keep_turns = max(keep_turns, 1)
+        self.max_tokens = max_tokens
+        self.summary_max_tokens = summary_max_tokens
+        self.tool_preview_chars = tool_preview_chars
+        self._lock = threading.Lock()
+        # (消息 id, 内容长度) -> token 数，避免每次调用都重新编码整段历史
+        self._token_cache: Dict[Tuple[str, int], int] = {}
+        self._stats = {
+            "calls": 0, "compacted_calls": 0, "tokens_before": 0, "tokens_after": 0,
+            "summaries": 0, "summary_failures": 0, "folded_turns": 0, "over_budget": 0,
+        }
+
+    def _tokens(self, message: BaseMessage) -> int:
+        if message.id is None:
+            return message_tokens(message)
+        key = (message.id, len(_content_text(message.content)))
+        with self._lock:
+            tokens = self._token_cache.get(key)
+        if tokens is None:
+            tokens = message_tokens(message)
+            with self._lock:
+                if len(self._token_cache) > 50000:
+                    self._token_cache.clear()
+                self._token_cache[key] = tokens
+        return tokens
+
+    def _system(self, sys_msg: SystemMessage, summary: str) -> SystemMessage:
+        # 摘要并入系统消息（部分兼容接口只接受位于开头的一条 system 消息）
+        if not summary:
+            return sys_msg
+        return SystemMessage(content=f"{_content_text(sys_msg.content)}\n\n以下是本会话较早对话的摘要：\n{summary}")
+
+    def _compact_turn(self, turn: List[BaseMessage], keep_last_batch: bool = False) -> Tuple[List[BaseMessage], int]:
+        """压缩一轮中的工具输出；keep_last_batch 时保留最后一批（模型正要读取的）工具结果"""
+        last_batch = set()
+        if keep_last_batch:
+            for message in reversed(turn):
+                if not isinstance(message, ToolMessage):
+                    break
+                last_batch.add(message.tool_call_id)
+        calls = {call["id"]: call for message in turn if isinstance(message, AIMessage) for call in message.tool_calls}
+        compacted, count = [], 0
+        for message in turn:
+            if isinstance(message, ToolMessage) and message.tool_call_id not in last_batch and not message.additional_kwargs.get("compacted"):
+                name = message.name or calls.get(message.tool_call_id, {}).get("name")
+                content = compact_tool_content(name, message.content, self.tool_preview_chars)
+                if len(content) < len(_content_text(message.content)):
+                    message = ToolMessage(content=content, tool_call_id=message.tool_call_id, name=message.name,
+                                          id=message.id, additional_kwargs={"compacted": True})
+                    count += 1
+            compacted.append(message)
+        return compacted, count
+
+    def _prompt_tokens(self, plan: CompactionPlan, summary_tokens: int) -> int:
+        return (self._tokens(plan.system) + summary_tokens
+                + sum(self._tokens(message) for turn in plan.turns for message in turn))
+
+    def plan(self, sys_msg: SystemMessage, messages: Sequence[BaseMessage], summary: str = "",
+             summary_upto: Optional[str] = None) -> CompactionPlan:
+        messages = list(messages)
+        start = 0
+        if summary_upto is not None:
+            ids = [message.id for message in messages]
+            start = ids.index(summary_upto) + 1 if summary_upto in ids else 0
+        turns = split_turns(messages[start:])
+        plan = CompactionPlan(
+            system=sys_msg, turns=turns, summary=summary or "", summary_upto=summary_upto,
+            original_tokens=self._tokens(sys_msg) + sum(self._tokens(message) for message in messages),
+            turn=sum(isinstance(message, HumanMessage) for message in messages),
+            turn_id=next((message.id for message in reversed(messages) if isinstance(message, HumanMessage)), None),
+        )
+        if not self.enabled:
+            return plan
+
+        # 移出保留窗口的轮次并入摘要
+        while len(plan.turns) > self.keep_turns:
+            plan.fold.append(plan.turns.pop(0))
+
+        def summary_tokens() -> int:
+            # 需要生成新摘要时按摘要上限预留
+            current = count_tokens(plan.summary)
+            return max(current, self.summary_max_tokens) if plan.fold else current
+
+        # 硬上限：先压缩保留窗口内较早轮次的工具输出，再提前并入摘要，最后压缩当前轮较早批次的工具输出
+        if self._prompt_tokens(plan, summary_tokens()) > self.max_tokens:
+            for index in range(len(plan.turns) - 1):
+                plan.turns[index], count = self._compact_turn(plan.turns[index])
+                plan.compacted_tools += count
+        while self._prompt_tokens(plan, summary_tokens()) > self.max_tokens and len(plan.turns) > 1:
+            plan.fold.append(plan.turns.pop(0))
+        if self._prompt_tokens(plan, summary_tokens()) > self.max_tokens:
+            plan.turns[-1], count = self._compact_turn(plan.turns[-1], keep_last_batch=True)
+            plan.compacted_tools += count
+        if self._prompt_tokens(plan, summary_tokens()) > self.max_tokens:
+            plan.turns[-1], count = self._compact_turn(plan.turns[-1])
+            plan.compacted_tools += count
+        return plan
+
+    def summary_prompt(self, plan: CompactionPlan) -> str:
+        dialogue = truncate_to_tokens(render_dialogue(plan.fold, self.tool_preview_chars), self.max_tokens)
+        return SUMMARY_PROMPT.format(max_tokens=self.summary_max_tokens, summary=plan.summary or "（无）", dialogue=dialogue)
+
+    def finish(self, plan: CompactionPlan, new_summary: Optional[str] = None) -> CompactionResult:
+        """
+        根据方案生成提示词
+
+        new_summary 为模型生成的新摘要；需要摘要但生成失败（None）时把新移出的轮次以紧凑文本追加到旧摘要后，再截断到摘要上限
+        """
+        summary, summary_upto = plan.summary, plan.summary_upto
+        summarized = False
+        if plan.fold:
+            if new_summary:
+                summary, summarized = new_summary.strip(), True
+            else:
+                summary = "\n".join(filter(None, [summary, render_dialogue(plan.fold, self.tool_preview_chars)]))
+            summary = truncate_to_tokens(summary, self.summary_max_tokens)
+            summary_upto = plan.fold[-1][-1].id
+
+        system = self._system(plan.system, summary)
+        messages = [system] + [message for turn in plan.turns for message in turn]
+        prompt_tokens = sum(self._tokens(message) for message in messages)
+        report = {
+            "turn": plan.turn,
+            "turn_id": plan.turn_id,
+            "original_tokens": plan.original_tokens,
+            "prompt_tokens": prompt_tokens,
+            "saved_tokens": max(plan.original_tokens - prompt_tokens, 0),
+            "summary_tokens": count_tokens(summary),
+            "folded_turns": len(plan.fold),
+            "compacted_tool_messages": plan.compacted_tools,
+            "summarized": summarized,
+            "over_budget": self.enabled and prompt_tokens > self.max_tokens,
+        }
+        with self._lock:
+            self._stats["calls"] += 1
+            self._stats["compacted_calls"] += report["saved_tokens"] > 0
+            self._stats["tokens_before"] += plan.original_tokens
+            self._stats["tokens_after"] += prompt_tokens
+            self._stats["summaries"] += summarized
+            self._stats["summary_failures"] += bool(plan.fold) and not summarized
+            self._stats["folded_turns"] += len(plan.fold)
+            self._stats["over_budget"] += report["over_budget"]
+        if report["saved_tokens"]:
+            print(f"[INFO] History compacted: {plan.original_tokens} -> {prompt_tokens} tokens "
+                  f"(folded {len(plan.fold)} turns, compacted {plan.compacted_tools} tool outputs)")
+        if report["over_budget"]:
+            print(f"[WARNING] Prompt still exceeds the history budget after compaction: {prompt_tokens} > {self.max_tokens}")
+        return CompactionResult(messages=messages, summary=summary, summary_upto=summary_upto, report=report)
+
+    def compact(self, sys_msg: SystemMessage, messages: Sequence[BaseMessage], summary: str,
+                summary_upto: Optional[str], summarize: Callable[[str], str]) -> CompactionResult:
+        plan = self.plan(sys_msg, messages, summary, summary_upto)
+        return self.finish(plan, self._summarize(summarize, plan) if plan.needs_summary else None)
+
+    async def acompact(self, sys_msg: SystemMessage, messages: Sequence[BaseMessage], summary: str,
+                       summary_upto: Optional[str], asummarize) -> CompactionResult:
+        plan = self.plan(sys_msg, messages, summary, summary_upto)
+        new_summary = None
+        if plan.needs_summary:
+            try:
+                new_summary = await asummarize(self.summary_prompt(plan))
+            except Exception as e:
+                print(f"[WARNING] History summarization failed: {e}")
+        return self.finish(plan, new_summary)
+
+    def _summarize(self, summarize: Callable[[str], str], plan: CompactionPlan) -> Optional[str]:
+        try:
+            return summarize(self.summary_prompt(plan))
+        except Exception as e:
+            print(f"[WARNING] History summarization failed: {e}")
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        saved = stats["tokens_before"] - stats["tokens_after"]
+        return {
+            "enabled": self.enabled,
+            "keep_turns": self.keep_turns,
+            "max_tokens": self.max_tokens,
+            **stats,
+            "tokens_saved": saved,
+            "avg_saved_per_call": round(saved / stats["calls"], 1) if stats["calls"] else 0.0,
+            "saved_ratio": round(saved / stats["tokens_before"], 4) if stats["tokens_before"] else 0.0,
+        }
+
+
+history_compactor = HistoryCompactor()
@@ -0,0 +1,310 @@
+"""
+索引建议工具
+
+generate_sqlite_data.create_tables 只建了主键，ORDER_DETAILS.CUSTOMER_ID、TRANSACTIONS.ORDER_ID、
+USER_INTERACTIONS.INTERACTION_DATE 等常用的连接/过滤列都没有索引。本工具读取查询日志
+（tools/query_log.py）中的工作负载，给出候选索引并按估算收益排序：
+
+1. 对每条查询做 EXPLAIN QUERY PLAN，从全表扫描（SCAN）和自动索引（SEARCH ... AUTOMATIC INDEX）中
+   提取候选列：自动索引使用的列组合，以及被扫描表中在查询里出现的列
+2. 在只有 schema 的内存数据库中逐个创建候选索引（what-if），重新生成查询计划，
+   用与 SQL 代价保护相同的模型估算扫描行数（SEARCH 的返回行数按列的不同值个数估算）
+3. 收益 = Σ 查询出现次数 × (无索引时的估算行数 - 有索引时的估算行数)；按贪心方式逐个选出
+   边际收益最大的索引（已选索引保留在内存副本中，再评估剩余候选）
+
+本工具创建的索引以 idx_advisor_ 为前缀，drop 命令只会删除这类索引。
+
+用法（在项目根目录执行）:
+    python -m tools.index_advisor recommend --top 10
+    python -m tools.index_advisor apply --top 3 [--dry-run]
+    python -m tools.index_advisor apply --index idx_advisor_order_details_customer_id
+    python -m tools.index_advisor list
+    python -m tools.index_advisor drop --all
+"""
+import argparse
+import re
+import sqlite3
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from tools.query_log import DEFAULT_QUERY_LOG_PATH, WorkloadQuery, load_workload
+from tools.sql_guard import analyze_plan, parse_plan_line, query_guard, table_aliases
+from tools.tools_execute_sqlite import DATABASE_PATH, get_database_version
+
+ADVISOR_PREFIX = "idx_advisor_"
+
+_CONSTRAINT = re.compile(r"\((.*)\)\s*$")
+_TERM = re.compile(r"^(\w+)\s*(=|>|<|>=|<=)\s*\?$")
+
+
+@dataclass
+class IndexCandidate:
+    table: str
+    columns: Tuple[str, ...]
+    # 估算节省的扫描行数（按查询出现次数加权）
+    savings: int = 0
+    # 受益的查询（规范化 SQL）
+    queries: List[str] = field(default_factory=list)
+
+    @property
+    def name(self) -> str:
+        return (ADVISOR_PREFIX + self.table + "_" + "_".join(self.columns)).lower()
+
+    @property
+    def statement(self) -> str:
+        columns = ", ".join(f'"{column}"' for column in self.columns)
+        return f'CREATE INDEX IF NOT EXISTS "{self.name}" ON "{self.table}" ({columns})'
+
+
+class IndexAdvisor:
+    """基于工作负载的索引建议（what-if 分析在内存中的 schema 副本上进行，不修改数据库）"""
+
+    def __init__(self, database_path: str, workload: List[WorkloadQuery]):
+        self.database_path = database_path
+        self.workload = workload
+        self._db = sqlite3.connect(Path(database_path).resolve().as_uri() + "?mode=ro", uri=True)
+        self.tables = query_guard.table_rows(self._db, database_path, get_database_version(database_path))
+        self._columns: Dict[str, List[str]] = {}
+        self._indexed: Dict[str, Set[Tuple[str, ...]]] = {}
+        for _, (table, _) in self.tables.items():
+            info = self._db.execute(f'PRAGMA table_info("{table}")').fetchall()
+            self._columns[table] = [row[1] for row in info]
+            # INTEGER PRIMARY KEY 即 rowid，本身就是索引
+            indexed = {(row[1],) for row in info if row[5] == 1 and row[2].upper() == "INTEGER"}
+            for index in self._db.execute(f'PRAGMA index_list("{table}")').fetchall():
+                columns = tuple(row[2] for row in self._db.execute(f'PRAGMA index_info("{index[1]}")'))
+                # 已有索引的每个前缀都不必再建
+                indexed.update(columns[:i] for i in range(1, len(columns) + 1))
+            self._indexed[table] = indexed
+        self._distinct: Dict[Tuple[str, str], int] = {}
+        self._scratch = sqlite3.connect(":memory:")
+        for (sql,) in self._db.execute(
+            "SELECT sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY CASE type WHEN 'table' THEN 0 WHEN 'index' THEN 1 ELSE 2 END"
+        ):
+            self._scratch.execute(sql)
+
+    def close(self) -> None:
+        self._scratch.close()
+        self._db.close()
+
+    # ---- 代价估算 ----
+
+    def _distinct_count(self, table: str, column: str) -> int:
+        key = (table, column)
+        if key not in self._distinct:
+            self._distinct[key] = self._db.execute(f'SELECT COUNT(DISTINCT "{column}") FROM "{table}"').fetchone()[0] or 1
+        return self._distinct[key]
+
+    def _search_rows(self, table: str, detail: str) -> int:
+        """每次 SEARCH 返回的估算行数：等值条件按不同值个数，范围条件按 1/4"""
+        rows = self.tables.get(table.lower(), (table, 1))[1]
+        if "PRIMARY KEY" in detail:
+            return 1
+        match = _CONSTRAINT.search(detail)
+        if not match:
+            return rows
+        estimate = float(rows)
+        for term in match.group(1).split(" AND "):
+            parsed = _TERM.match(term.strip())
+            if not parsed:
+                continue
+            column, op = parsed.groups()
+            if column == "rowid" and op == "=":
+                return 1
+            estimate /= self._distinct_count(table, column) if op == "=" and column in self._columns.get(table, []) else 4
+        return max(int(estimate), 1)
+
+    def _plan(self, query: str) -> Optional[List[Tuple[int, int, int, str]]]:
+        try:
+            return self._scratch.execute("EXPLAIN QUERY PLAN " + query).fetchall()
+        except (sqlite3.Error, sqlite3.Warning):
+            return None
+
+    def cost(self, query: str) -> Optional[int]:
+        """在当前（what-if）索引下估算查询扫描的行数；无法生成计划时返回 None"""
+        plan = self._plan(query)
+        if plan is None:
+            return None
+        return analyze_plan(plan, query, self.tables, search_rows=self._search_rows).estimated_rows
+
+    # ---- 候选索引 ----
+
+    def candidates(self) -> List[IndexCandidate]:
+        """从工作负载的查询计划中提取候选索引"""
+        found: Dict[Tuple[str, Tuple[str, ...]], IndexCandidate] = {}
+
+        def add(table: str, columns: Tuple[str, ...]) -> None:
+            if columns and columns not in self._indexed.get(table, set()):
+                found.setdefault((table, columns), IndexCandidate(table, columns))
+
+        names = {lower: name for lower, (name, _) in self.tables.items()}
+        for item in self.workload:
+            plan = self._plan(item.query)
+            if plan is None:
+                continue
+            aliases = table_aliases(item.query, names)
+            for _, _, _, detail in plan:
+                parsed = parse_plan_line(detail)
+                if not parsed or parsed[1].lower() not in aliases:
+                    continue
+                kind, name, _ = parsed
+                table = aliases[name.lower()]
+                if kind == "SEARCH" and "AUTOMATIC" in detail:
+                    constraint = _CONSTRAINT.search(detail)
+                    terms = [_TERM.match(t.strip()) for t in constraint.group(1).split(" AND ")] if constraint else []
+                    # 等值列在前，范围列在后
+                    equal = [t.group(1) for t in terms if t and t.group(2) == "="]
+                    ranged = [t.group(1) for t in terms if t and t.group(2) != "="]
+                    add(table, tuple(equal + ranged[:1]))
+                    for column in equal + ranged[:1]:
+                        add(table, (column,))
+                elif kind == "SCAN":
+                    for column in self._columns.get(table, []):
+                        if re.search(rf"\b{re.escape(column)}\b", item.query, re.IGNORECASE):
+                            add(table, (column,))
+        return list(found.values())
+
+    def _evaluate(self, candidate: IndexCandidate, baseline: Dict[str, Optional[int]]) -> None:
+        """在当前 what-if 索引集合上临时加上候选索引，计算各查询的估算收益"""
+        names = {lower: name for lower, (name, _) in self.tables.items()}
+        candidate.savings, candidate.queries = 0, []
+        self._scratch.execute(candidate.statement)
+        try:
+            for item in self.workload:
+                before = baseline[item.canonical]
+                if before is None or candidate.table not in table_aliases(item.query, names).values():
+                    continue
+                after = self.cost(item.query)
+                if after is not None and after < before:
+                    candidate.savings += item.count * (before - after)
+                    candidate.queries.append(item.canonical)
+        finally:
+            self._scratch.execute(f'DROP INDEX "{candidate.name}"')
+
+    def recommend(self, top: Optional[int] = None) -> List[IndexCandidate]:
+        """
+        贪心选择索引：每轮在已选索引的基础上评估剩余候选，选出收益最大的一个，直到没有收益或达到 top 个
+
+        索引之间会相互影响（例如 ORDER_DETAILS.CUSTOMER_ID 有索引后，连接 TRANSACTIONS.ORDER_ID
+        的索引才有用），因此收益是相对已选索引的边际收益。what-if 索引只存在于内存副本中。
+        """
+        remaining = self.candidates()
+        chosen: List[IndexCandidate] = []
+        try:
+            while remaining and (not top or len(chosen) < top):
+                baseline = {item.canonical: self.cost(item.query) for item in self.workload}
+                for candidate in remaining:
+                    self._evaluate(candidate, baseline)
+                best = min(remaining, key=lambda c: (-c.savings, len(c.columns)))
+                if best.savings <= 0:
+                    break
+                chosen.append(best)
+                remaining.remove(best)
+                self._scratch.execute(best.statement)
+        finally:
+            for candidate in chosen:
+                self._scratch.execute(f'DROP INDEX IF EXISTS "{candidate.name}"')
+        return chosen
+
+
+def advisor_indexes(conn: sqlite3.Connection) -> List[Tuple[str, str, str]]:
+    """本工具创建的索引：(索引名, 表名, 建索引语句)"""
+    return conn.execute(
+        "SELECT name, tbl_name, sql FROM sqlite_master WHERE type = 'index' AND name LIKE ? ORDER BY name",
+        (ADVISOR_PREFIX + "%",),
+    ).fetchall()
+
+
+def apply_indexes(database_path: str, candidates: List[IndexCandidate]) -> None:
+    """在数据库上创建索引（读写连接，执行后 SQL 结果缓存随数据库指纹变化自然失效）"""
+    conn = sqlite3.connect(database_path)
+    try:
+        for candidate in candidates:
+            conn.execute(candidate.statement)
+            print(f"[INFO] Created {candidate.name}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def drop_indexes(database_path: str, names: List[str]) -> None:
+    conn = sqlite3.connect(database_path)
+    try:
+        for name in names:
+            if not name.startswith(ADVISOR_PREFIX):
+                print(f"[WARNING] Skipping {name}: only {ADVISOR_PREFIX}* indexes can be dropped")
+                continue
+            conn.execute(f'DROP INDEX IF EXISTS "{name}"')
+            print(f"[INFO] Dropped {name}")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def _print_recommendations(candidates: List[IndexCandidate]) -> None:
+    if not candidates:
+        print("No index recommendations for the logged workload.")
+        return
+    print(f"{'#':>3} {'est. rows saved':>16} {'queries':>8}  index")
+    for i, candidate in enumerate(candidates, 1):
+        print(f"{i:>3} {candidate.savings:>16,} {len(candidate.queries):>8}  {candidate.statement}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recommend, apply or drop indexes based on the SQL query log")
+    parser.add_argument("--database", default=DATABASE_PATH)
+    parser.add_argument("--log", default=DEFAULT_QUERY_LOG_PATH, help="query log (JSON lines)")
+    commands = parser.add_subparsers(dest="command", required=True)
+    recommend = commands.add_parser("recommend", help="rank candidate indexes by estimated savings")
+    recommend.add_argument("--top", type=int, default=10)
+    apply = commands.add_parser("apply", help="create recommended indexes")
+    apply.add_argument("--top", type=int, default=3)
+    apply.add_argument("--index", action="append", help="name of a recommended index (repeatable)")
+    apply.add_argument("--dry-run", action="store_true")
+    commands.add_parser("list", help="list indexes created by the advisor")
+    drop = commands.add_parser("drop", help="drop indexes created by the advisor")
+    drop.add_argument("--index", action="append", help="index name (repeatable)")
+    drop.add_argument("--all", action="store_true")
+    args = parser.parse_args()
+
+    if args.command in ("recommend", "apply"):
+        workload = load_workload(args.log)
+        if not workload:
+            print(f"Query log {args.log} is empty; run some questions through the agent first.")
+            return
+        print(f"Workload: {len(workload)} distinct queries, {sum(q.count for q in workload)} executions")
+        advisor = IndexAdvisor(args.database, workload)
+        try:
+            ranked = advisor.recommend()
+        finally:
+            advisor.close()
+        if args.command == "recommend":
+            _print_recommendations(ranked[:args.top])
+            return
+        chosen = [c for c in ranked if c.name in args.index] if args.index else ranked[:args.top]
+        _print_recommendations(chosen)
+        if chosen and not args.dry_run:
+            apply_indexes(args.database, chosen)
+        return
+
+    conn = sqlite3.connect(Path(args.database).resolve().as_uri() + "?mode=ro", uri=True)
+    try:
+        existing = advisor_indexes(conn)
+    finally:
+        conn.close()
+    if args.command == "list":
+        for name, table, sql in existing:
+            print(f"{name} ({table}): {sql}")
+        if not existing:
+            print("No advisor indexes.")
+    elif args.command == "drop":
+        names = [name for name, _, _ in existing] if args.all else (args.index or [])
+        if not names:
+            print("Nothing to drop; pass --all or --index NAME.")
+        drop_indexes(args.database, names)
+
+
+if __name__ == "__main__":
+    main()
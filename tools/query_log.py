@@ -0,0 +1,120 @@
+"""
+SQL 查询日志
+
+execute_sqlite_query 执行的每条语句追加一行 JSON 到 logs/sql_queries.jsonl，
+供索引建议工具（tools/index_advisor.py）分析工作负载、基准测试回放。
+
+每行记录：时间、SQL（自动修正过的语句记录修正后的 SQL）、规范化 SQL、耗时、状态（success / error）、错误类型、
+是否命中结果缓存、执行引擎、汇总表改写（使用的汇总表和改写后的 SQL）、自动修正的类型、返回行数。
+日志超过 CHATBI_SQL_QUERY_LOG_MAX_BYTES 时轮转为 .1 文件（只保留一份）。
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterator, List
+
+from tools.sql_result_cache import canonicalize_sql
+
+DEFAULT_QUERY_LOG_ENABLED = os.getenv("CHATBI_SQL_QUERY_LOG_ENABLED", "true").lower() == "true"
+DEFAULT_QUERY_LOG_PATH = os.getenv(
+    "CHATBI_SQL_QUERY_LOG", str(Path(__file__).resolve().parent.parent / "logs" / "sql_queries.jsonl")
+)
+DEFAULT_QUERY_LOG_MAX_BYTES = int(os.getenv("CHATBI_SQL_QUERY_LOG_MAX_BYTES", str(20 * 1024 * 1024)))
+
+
+class QueryLog:
+    """追加写入的查询日志（线程安全）"""
+
+    def __init__(self, path: str = DEFAULT_QUERY_LOG_PATH, max_bytes: int = DEFAULT_QUERY_LOG_MAX_BYTES,
+                 enabled: bool = DEFAULT_QUERY_LOG_ENABLED):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+
+    def record(self, query: str, response: Dict[str, Any], elapsed_ms: float) -> None:
+        """记录一次 execute_sqlite_query 调用；写日志失败不影响查询"""
+        if not self.enabled:
+            return
+        result = response.get("result")
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "query": query,
+            "canonical": canonicalize_sql(query),
+            "elapsed_ms": round(elapsed_ms, 3),
+            "status": response.get("status"),
+            "error_type": response.get("error_type"),
+            "cached": bool((response.get("cache") or {}).get("hit")),
+            "engine": response.get("engine"),
+            "rollup": result.get("rollup") if isinstance(result, dict) else None,
+            "sql_fixes": [fix["type"] for fix in response.get("sql_fixes", [])] or None,
+            "rows": result.get("row_count") if isinstance(result, dict) else None,
+        }
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+        try:
+            with self._lock:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                if self.max_bytes > 0 and self.path.exists() and self.path.stat().st_size + len(line) > self.max_bytes:
+                    os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            print(f"[WARNING] Failed to write SQL query log: {e}")
+
+
+def read_entries(path: str = DEFAULT_QUERY_LOG_PATH) -> Iterator[Dict[str, Any]]:
+    """按时间顺序读取日志（含轮转出的 .1 文件），跳过无法解析的行"""
+    for file in (Path(path + ".1"), Path(path)):
+        if not file.exists():
+            continue
+        with open(file, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+
+@dataclass
+class WorkloadQuery:
+    """工作负载中的一条（规范化后去重的）查询"""
+    query: str
+    canonical: str
+    count: int
+    mean_elapsed_ms: float
+
+
+def load_workload(path: str = DEFAULT_QUERY_LOG_PATH, include_errors: bool = False) -> List[WorkloadQuery]:
+    """
+    把查询日志汇总为工作负载：按规范化 SQL 去重，记录出现次数和平均耗时（只统计实际执行的调用）
+
+    默认只包含成功执行的查询；按出现次数降序排列。
+    """
+    grouped: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+    for entry in read_entries(path):
+        if not entry.get("query") or (entry.get("status") != "success" and not include_errors):
+            continue
+        canonical = entry.get("canonical") or canonicalize_sql(entry["query"])
+        item = grouped.setdefault(canonical, {"query": entry["query"], "count": 0, "executed": 0, "elapsed": 0.0})
+        item["count"] += 1
+        if not entry.get("cached"):
+            item["executed"] += 1
+            item["elapsed"] += entry.get("elapsed_ms") or 0.0
+    workload = [
+        WorkloadQuery(
+            item["query"],
+            canonical,
+            item["count"],
+            item["elapsed"] / item["executed"] if item["executed"] else 0.0,
+        )
+        for canonical, item in grouped.items()
+    ]
+    workload.sort(key=lambda q: q.count, reverse=True)
+    return workload
+
+
+query_log = QueryLog()
@@ -0,0 +1,479 @@
+"""
+大结果落盘（结果句柄）
+
+工具返回值会作为 ToolMessage 保存在 LangGraph 状态中，并随会话 checkpoint 一直保留，
+大结果会让每个会话的内存随查询次数增长。execute_sqlite_query 的结果超过 CHATBI_RESULT_SPILL_ROWS 行
+（或第一页被截断）时，完整结果写入 CHATBI_RESULT_DIR 目录下的列式文件，ToolMessage 中只保留：
+结果句柄（result_handle）、列的 schema、总行数和前 CHATBI_RESULT_PREVIEW_ROWS 行预览。
+
+- 格式：安装了 pyarrow 时为 Arrow IPC（.arrow，读取时内存映射），否则安装了 duckdb 时为 Parquet（.parquet）；
+  两者都没有时不落盘，结果仍按分页返回第一页
+- 使用：fetch_sqlite_page（及 GET /api/chat/sql/pages/{handle}）按句柄分页读取，
+  high_charts_json、export_artifacts 直接从句柄读取数据，不需要 Agent 在上下文中搬运行数据
+- 共享：句柄由（数据库路径, 数据库版本, 规范化 SQL）确定，不同会话执行同一查询共用一个文件；
+  不带 offset 的分页读取位置按会话分别记录，一个会话翻页不影响另一个会话
+- 回收：文件记录引用它的会话；会话被回收（session_manager.evict 调用 release_session）后，
+  不再被任何会话引用的文件被删除。CHATBI_RESULT_SESSION_TTL_SECONDS 默认为 0，不单独按空闲时间释放，
+  避免会话仍在、其消息中的句柄已失效；目录总大小超过 CHATBI_RESULT_STORE_MAX_BYTES 时删除最久未使用的文件
+- 跨进程：每个结果文件旁有一个元数据文件（{handle}.json）和一个引用目录（{handle}.refs/，每个引用它的会话一个空文件），
+  登记表中没有的句柄从磁盘载入，重启后或其他 worker 写入的文件同样可用；释放会话时删除它在所有文件上的引用，
+  引用目录为空（rmdir 成功）时才删除文件，不会删掉其他进程仍在使用的结果。没有任何引用、超过
+  ORPHAN_GRACE_SECONDS 的文件（进程在登记引用前退出）和遗留的临时文件在 sweep 时删除
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from tools.sql_result_cache import canonicalize_sql
+
+try:
+    import pyarrow as pa
+    import pyarrow.ipc  # noqa: F401
+except Exception:  # pyarrow 未安装或与当前 NumPy 不兼容
+    pa = None
+
+try:
+    import duckdb
+    import pandas as pd
+except ImportError:
+    duckdb = None
+    pd = None
+
+DEFAULT_RESULT_STORE_ENABLED = os.getenv("CHATBI_RESULT_STORE_ENABLED", "true").lower() == "true"
+DEFAULT_RESULT_DIR = os.getenv("CHATBI_RESULT_DIR", str(Path(__file__).resolve().parent.parent / "results"))
+DEFAULT_SPILL_ROWS = int(os.getenv("CHATBI_RESULT_SPILL_ROWS", "50"))
+DEFAULT_PREVIEW_ROWS = int(os.getenv("CHATBI_RESULT_PREVIEW_ROWS", "20"))
+DEFAULT_SPILL_MAX_ROWS = int(os.getenv("CHATBI_RESULT_SPILL_MAX_ROWS", "100000"))
+DEFAULT_SESSION_TTL_SECONDS = float(os.getenv("CHATBI_RESULT_SESSION_TTL_SECONDS", "0"))
+DEFAULT_STORE_MAX_BYTES = int(os.getenv("CHATBI_RESULT_STORE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+HANDLE_PREFIX = "res_"
+DEFAULT_SESSION = "default"
+DATA_SUFFIXES = (".arrow", ".parquet")
+# 没有任何会话引用的文件和临时文件保留多久后才被 sweep 删除（写入者可能还没来得及登记引用）
+ORPHAN_GRACE_SECONDS = 3600
+
+# 列类型 -> (pyarrow 类型名, pandas dtype)
+_COLUMN_TYPES = {
+    "integer": ("int64", "Int64"),
+    "real": ("float64", "Float64"),
+    "text": ("string", "string"),
+    "blob": ("binary", object),
+    "null": ("null", object),
+}
+
+
+def result_handle(database_path: str, database_version: str, query: str) -> str:
+    raw = json.dumps([database_path, database_version, canonicalize_sql(query)], ensure_ascii=False)
+    return HANDLE_PREFIX + hashlib.sha256(raw.encode("utf-8")).hexdigest()[:20]
+
+
+def is_result_handle(handle: Optional[str]) -> bool:
+    return isinstance(handle, str) and handle.startswith(HANDLE_PREFIX)
+
+
+def _ref_name(session_id: str) -> str:
+    """会话 ID 可能含有文件名中不允许的字符，引用文件用它的哈希命名"""
+    return hashlib.sha256(session_id.encode("utf-8")).hexdigest()[:24]
+
+
+def _column_type(values: Sequence[Any]) -> str:
+    """根据 SQLite 返回的 Python 值推断列类型；同一列混合多种类型时按文本保存"""
+    kinds = {type(value) for value in values if value is not None}
+    if not kinds:
+        return "null"
+    if kinds <= {int}:
+        return "integer"
+    if kinds <= {int, float}:
+        return "real"
+    if kinds == {bytes}:
+        return "blob"
+    return "text"
+
+
+def _column_values(values: Sequence[Any], kind: str) -> List[Any]:
+    if kind == "real":
+        return [None if value is None else float(value) for value in values]
+    if kind == "text":
+        return [value if value is None or isinstance(value, str) else str(value) for value in values]
+    return list(values)
+
+
+@dataclass
+class StoredResult:
+    handle: str
+    path: Path
+    columns: List[str]
+    schema: List[Dict[str, str]]
+    row_count: int
+    size: int
+    sessions: Set[str] = field(default_factory=set)
+    # 会话 -> 不带 offset 时下一次读取的起始行
+    next_offsets: Dict[str, int] = field(default_factory=dict)
+    last_used: float = 0.0
+
+
+class ResultStore:
+    """落盘结果的登记表（按最近使用排序，线程安全）"""
+
+    def __init__(self, directory: str = DEFAULT_RESULT_DIR, spill_rows: int = DEFAULT_SPILL_ROWS,
+                 preview_rows: int = DEFAULT_PREVIEW_ROWS, max_rows: int = DEFAULT_SPILL_MAX_ROWS,
+                 session_ttl: float = DEFAULT_SESSION_TTL_SECONDS, max_bytes: int = DEFAULT_STORE_MAX_BYTES,
+                 enabled: bool = DEFAULT_RESULT_STORE_ENABLED):
+        self.directory = Path(directory)
+        self.spill_rows = max(spill_rows, 0)
+        self.preview_rows = max(preview_rows, 1)
+        self.max_rows = max(max_rows, 1)
+        self.session_ttl = session_ttl
+        self.max_bytes = max_bytes
+        self.format = "arrow" if pa is not None else "parquet" if duckdb is not None else None
+        self.enabled = enabled and self.format is not None
+        self._lock = threading.Lock()
+        self._results: "OrderedDict[str, StoredResult]" = OrderedDict()
+        self._sessions: Dict[str, float] = {}
+        self.spilled = 0
+        self.reused = 0
+        self.evicted = 0
+        self.bytes_written = 0
+
+    # ---- 写入 ----
+
+    def should_spill(self, result: Dict[str, Any]) -> bool:
+        """有结果集且第一页被截断或行数超过阈值时落盘"""
+        if not self.enabled or not result.get("columns"):
+            return False
+        return bool(result.get("truncated")) or result.get("row_count", 0) > self.spill_rows
+
+    def adopt(self, handle: str, session_id: Optional[str]) -> Optional[StoredResult]:
+        """句柄对应的文件已存在（本进程写入、重启前或其他 worker 写入）时登记当前会话并返回，否则返回 None"""
+        with self._lock:
+            stored = self._lookup(handle)
+            if stored is None:
+                return None
+            self._touch(stored, session_id)
+            if not stored.path.exists():
+                # 登记引用的同时文件被其他进程删除
+                self._forget(stored)
+                return None
+            self.reused += 1
+            return stored
+
+    def write(self, handle: str, columns: List[str], rows: Sequence[Sequence[Any]],
+              session_id: Optional[str]) -> StoredResult:
+        """把完整结果写入列式文件（最多 max_rows 行），返回登记信息；写入失败时抛出异常"""
+        rows = rows[:self.max_rows]
+        kinds = [_column_type([row[index] for row in rows]) for index in range(len(columns))]
+        values = [_column_values([row[index] for row in rows], kind) for index, kind in enumerate(kinds)]
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{handle}.{self.format}"
+        schema = [{"name": name, "type": kind} for name, kind in zip(columns, kinds)]
+        suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+        tmp_path = path.with_name(path.name + suffix)
+        meta_path = self._meta_path(handle)
+        tmp_meta_path = meta_path.with_name(meta_path.name + suffix)
+        try:
+            if self.format == "arrow":
+                self._write_arrow(tmp_path, kinds, values)
+            else:
+                self._write_parquet(tmp_path, kinds, values)
+            tmp_meta_path.write_text(
+                json.dumps({"columns": list(columns), "schema": schema, "row_count": len(rows)}, ensure_ascii=False),
+                encoding="utf-8",
+            )
+            # 先替换数据文件再替换元数据：其他进程看到元数据时数据文件一定已完整
+            os.replace(tmp_path, path)
+            os.replace(tmp_meta_path, meta_path)
+        finally:
+            for tmp in (tmp_path, tmp_meta_path):
+                if tmp.exists():
+                    tmp.unlink()
+        stored = StoredResult(handle, path, list(columns), schema, len(rows), path.stat().st_size)
+        with self._lock:
+            previous = self._results.pop(handle, None)
+            if previous is not None:
+                stored.sessions |= previous.sessions
+            self._results[handle] = stored
+            self._touch(stored, session_id)
+            self.spilled += 1
+            self.bytes_written += stored.size
+        self.sweep()
+        return stored
+
+    @staticmethod
+    def _write_arrow(path: Path, kinds: List[str], values: List[List[Any]]) -> None:
+        arrays = [pa.array(column, type=getattr(pa, _COLUMN_TYPES[kind][0])()) for kind, column in zip(kinds, values)]
+        table = pa.Table.from_arrays(arrays, names=[f"c{i}" for i in range(len(arrays))])
+        with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table, max_chunksize=65536)
+
+    @staticmethod
+    def _write_parquet(path: Path, kinds: List[str], values: List[List[Any]]) -> None:
+        # 文件中的列名用位置编号，原始列名（可能重复）保存在登记表中
+        frame = pd.DataFrame({
+            f"c{i}": pd.Series(column, dtype=_COLUMN_TYPES[kind][1]) for i, (kind, column) in enumerate(zip(kinds, values))
+        })
+        conn = duckdb.connect()
+        try:
+            conn.register("_result", frame)
+            target = str(path).replace("'", "''")
+            conn.execute(f"COPY (SELECT * FROM _result) TO '{target}' (FORMAT parquet)")
+        finally:
+            conn.close()
+
+    def describe(self, stored: StoredResult, result: Dict[str, Any],
+                 session_id: Optional[str] = None) -> Dict[str, Any]:
+        """替换后的工具结果：预览行 + 句柄 + schema + 总行数，其余字段（如 rollup）保持不变"""
+        preview = list(result.get("rows") or [])[:self.preview_rows]
+        total_rows = result.get("total_rows") if result.get("truncated") else result.get("row_count")
+        compact = {key: value for key, value in result.items() if key not in ("rows", "cursor", "next_offset")}
+        # 该会话不带 offset 的下一次读取接着预览行
+        with self._lock:
+            stored.next_offsets[session_id or DEFAULT_SESSION] = len(preview)
+        compact.update({
+            "columns": stored.columns,
+            "schema": stored.schema,
+            "rows": preview,
+            "row_count": len(preview),
+            "truncated": True,
+            "total_rows": total_rows if total_rows is not None else stored.row_count,
+            "result_handle": stored.handle,
+            "cursor": stored.handle,
+            "next_offset": len(preview),
+        })
+        if total_rows is not None and total_rows > stored.row_count:
+            # 超过 CHATBI_RESULT_SPILL_MAX_ROWS 的部分没有保存
+            compact["stored_rows"] = stored.row_count
+        return compact
+
+    # ---- 读取 ----
+
+    def get(self, handle: str, session_id: Optional[str] = None) -> Optional[StoredResult]:
+        with self._lock:
+            stored = self._lookup(handle)
+            if stored is None:
+                return None
+            if not stored.path.exists():
+                self._forget(stored)
+                return None
+            self._touch(stored, session_id)
+            return stored
+
+    def _meta_path(self, handle: str) -> Path:
+        return self.directory / f"{handle}.json"
+
+    def _refs_dir(self, handle: str) -> Path:
+        return self.directory / f"{handle}.refs"
+
+    def _lookup(self, handle: str) -> Optional[StoredResult]:
+        """登记表中的句柄，没有时从磁盘上的元数据载入（调用方持有锁）"""
+        stored = self._results.get(handle)
+        if stored is not None or not is_result_handle(handle) or os.sep in handle or "/" in handle:
+            return stored
+        try:
+            meta = json.loads(self._meta_path(handle).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        for suffix in DATA_SUFFIXES:
+            path = self.directory / f"{handle}{suffix}"
+            try:
+                size = path.stat().st_size
+            except OSError:
+                continue
+            if (suffix == ".arrow" and pa is None) or (suffix == ".parquet" and duckdb is None):
+                continue
+            stored = StoredResult(handle, path, meta["columns"], meta["schema"], meta["row_count"], size)
+            self._results[handle] = stored
+            return stored
+        return None
+
+    def read(self, handle: str, offset: int = 0, limit: Optional[int] = None,
+             session_id: Optional[str] = None) -> Tuple[List[str], List[Tuple[Any, ...]]]:
+        """读取 [offset, offset + limit) 范围的行；句柄不存在或已被回收时抛出 KeyError"""
+        stored = self.get(handle, session_id)
+        if stored is None:
+            raise KeyError(handle)
+        offset = max(offset, 0)
+        limit = stored.row_count if limit is None else max(limit, 0)
+        if stored.path.suffix == ".arrow":
+            rows = self._read_arrow(stored.path, offset, limit)
+        else:
+            rows = self._read_parquet(stored.path, offset, limit)
+        return stored.columns, rows
+
+    @staticmethod
+    def _read_arrow(path: Path, offset: int, limit: int) -> List[Tuple[Any, ...]]:
+        with pa.memory_map(str(path), "r") as source:
+            table = pa.ipc.open_file(source).read_all().slice(offset, limit)
+            return list(zip(*(column.to_pylist() for column in table.columns))) if table.num_columns else []
+
+    @staticmethod
+    def _read_parquet(path: Path, offset: int, limit: int) -> List[Tuple[Any, ...]]:
+        conn = duckdb.connect()
+        try:
+            return conn.execute(
+                "SELECT * FROM read_parquet(?) LIMIT ? OFFSET ?", [str(path), limit, offset],
+            ).fetchall()
+        finally:
+            conn.close()
+
+    def page(self, handle: str, offset: Optional[int], limit: int,
+             session_id: Optional[str] = None) -> Dict[str, Any]:
+        """与 fetch_sqlite_page 相同格式的一页结果"""
+        stored = self.get(handle, session_id)
+        if stored is None:
+            raise KeyError(handle)
+        session = session_id or DEFAULT_SESSION
+        with self._lock:
+            offset = stored.next_offsets.get(session, 0) if offset is None else max(offset, 0)
+        columns, rows = self.read(handle, offset, limit + 1, session_id)
+        truncated = len(rows) > limit
+        rows = [list(row) for row in rows[:limit]]
+        next_offset = offset + len(rows) if truncated else None
+        # 最后一页之后停在末尾，不带 offset 的下一次读取返回空页而不是重复最后一页
+        with self._lock:
+            stored.next_offsets[session] = offset + len(rows)
+        return {
+            "columns": columns,
+            "rows": rows,
+            "row_count": len(rows),
+            "offset": offset,
+            "truncated": truncated,
+            "total_rows": stored.row_count,
+            "cursor": handle,
+            "result_handle": handle,
+            "next_offset": next_offset,
+        }
+
+    # ---- 回收 ----
+
+    def _touch(self, stored: StoredResult, session_id: Optional[str]) -> None:
+        now = time.monotonic()
+        stored.last_used = now
+        self._results.move_to_end(stored.handle)
+        if session_id is not None or not stored.sessions:
+            session = session_id or DEFAULT_SESSION
+            if session not in stored.sessions:
+                # 引用记录在磁盘上，其他进程释放会话时据此判断文件是否仍被使用
+                refs_dir = self._refs_dir(stored.handle)
+                refs_dir.mkdir(parents=True, exist_ok=True)
+                (refs_dir / _ref_name(session)).touch()
+                stored.sessions.add(session)
+            self._sessions[session] = now
+
+    def _forget(self, stored: StoredResult) -> None:
+        """只从本进程的登记表移除，不动磁盘上的文件"""
+        if self._results.get(stored.handle) is stored:
+            del self._results[stored.handle]
+
+    def _delete_files(self, handle: str) -> None:
+        for path in [self.directory / f"{handle}{suffix}" for suffix in DATA_SUFFIXES] + [self._meta_path(handle)]:
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"[WARNING] Failed to delete result file {path}: {e}")
+
+    def _delete(self, stored: StoredResult) -> None:
+        """强制删除（超出目录大小上限）：连同其他会话的引用一起删除"""
+        self._forget(stored)
+        shutil.rmtree(self._refs_dir(stored.handle), ignore_errors=True)
+        self._delete_files(stored.handle)
+
+    def release_session(self, session_id: str) -> int:
+        """
+        会话结束或被回收时调用：删除该会话在所有结果文件上的引用（包括重启前和其他进程登记的），
+        引用目录变空的文件被删除，返回删除的文件数
+        """
+        removed = 0
+        marker = _ref_name(session_id)
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            for stored in self._results.values():
+                stored.next_offsets.pop(session_id, None)
+                stored.sessions.discard(session_id)
+            if not self.directory.is_dir():
+                return 0
+            for ref in self.directory.glob(f"{HANDLE_PREFIX}*.refs/{marker}"):
+                handle = ref.parent.name[:-len(".refs")]
+                try:
+                    ref.unlink()
+                    # 目录非空说明还有会话（可能在其他进程中）引用该文件
+                    ref.parent.rmdir()
+                except OSError:
+                    continue
+                stored = self._results.get(handle)
+                if stored is not None:
+                    self._forget(stored)
+                self._delete_files(handle)
+                removed += 1
+        return removed
+
+    def sweep(self) -> None:
+        """释放空闲超时的会话，再按最久未使用的顺序删除文件直到总大小不超过上限"""
+        if self.session_ttl > 0:
+            deadline = time.monotonic() - self.session_ttl
+            with self._lock:
+                idle = [session for session, last_seen in self._sessions.items() if last_seen < deadline]
+            for session in idle:
+                self.release_session(session)
+        with self._lock:
+            total = sum(stored.size for stored in self._results.values())
+            while self.max_bytes > 0 and total > self.max_bytes and len(self._results) > 1:
+                _, oldest = next(iter(self._results.items()))
+                total -= oldest.size
+                self._delete(oldest)
+                self.evicted += 1
+            self._sweep_orphans()
+
+    def _sweep_orphans(self) -> None:
+        """删除没有任何会话引用的旧文件和遗留的临时文件（调用方持有锁）"""
+        deadline = time.time() - ORPHAN_GRACE_SECONDS
+        for path in self.directory.glob(f"{HANDLE_PREFIX}*"):
+            try:
+                if path.is_dir() or path.stat().st_mtime >= deadline:
+                    continue
+                if path.suffix == ".tmp":
+                    path.unlink()
+                    continue
+            except OSError:
+                continue
+            if path.suffix not in DATA_SUFFIXES:
+                continue
+            handle = path.name[:-len(path.suffix)]
+            refs_dir = self._refs_dir(handle)
+            try:
+                refs_dir.rmdir()
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            stored = self._results.get(handle)
+            if stored is not None:
+                self._forget(stored)
+            self._delete_files(handle)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "format": self.format,
+                "directory": str(self.directory),
+                "results": len(self._results),
+                "bytes": sum(stored.size for stored in self._results.values()),
+                "sessions": len(self._sessions),
+                "spilled": self.spilled,
+                "reused": self.reused,
+                "evicted": self.evicted,
+                "bytes_written": self.bytes_written,
+            }
+
+
+result_store = ResultStore()
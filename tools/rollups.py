@@ -0,0 +1,787 @@
+"""
+预聚合汇总表（rollup）与查询改写
+
+大部分问题都是"每天/每月的订单总额""每天的支付金额""各类别的商品/交易"这类聚合的变体，
+每次都要重新扫描 example.db 的基础表。本模块在单独的 SQLite 文件（默认 tools/example_rollups.db，
+example.db 本身对应用只读）中维护汇总表，并在 execute_sqlite_query 中把能由汇总表回答的聚合查询
+改写为查询汇总表：
+
+- 汇总表按维度（取前 10/7 个字符的日期列、类别列）分组，保存每组的行数和度量列的 SUM/COUNT/MIN/MAX；
+  与驱动表多对一 LEFT JOIN 的表另存 HAS_<表名> 标记，查询中的内连接改写为 HAS_<表名> = 1
+- 刷新：数据库指纹变化后的第一次查询在一个事务中全量重建汇总表，重建完成前查询按原 SQL 执行；
+  汇总表只会以与当前指纹对应、重新聚合过的内容参与改写。不按 rowid 水位线增量合并：
+  原地 UPDATE、删除后在同一 rowid 重新插入都不改变行数和最大 rowid，确认变化只是追加需要逐行校验，
+  代价不低于重新聚合
+- 改写条件：单条 SELECT；FROM 中的表和连接条件与某个汇总表一致；WHERE / GROUP BY / HAVING / ORDER BY
+  只引用维度；聚合函数（COUNT/SUM/AVG/MIN/MAX/TOTAL）的参数是度量（或 MIN/MAX 的参数是维度）。
+  日期维度上的 strftime/date 写法、原始日期列上的比较只在数据格式保证结果相同时才改写。
+  不满足条件时按原查询执行
+- 改写后的结果与原查询相同（浮点数求和的顺序不同，可能有末位误差）；列名取自原查询
+- 每次改写都会打印日志、写入查询日志（engine=rollup，rollup 字段为汇总表和改写后的 SQL），
+  /metrics 中可以看到各汇总表的改写次数和刷新情况
+
+用法（在项目根目录执行）:
+    python -m tools.rollups status
+    python -m tools.rollups refresh [--full]
+    python -m tools.rollups rewrite "SELECT strftime('%Y-%m', ORDER_DATE) AS month, SUM(TOTAL_AMOUNT) FROM ORDER_DETAILS GROUP BY month"
+"""
+import argparse
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from tools.sql_result_cache import canonicalize_sql
+
+DEFAULT_ROLLUPS_ENABLED = os.getenv("CHATBI_ROLLUPS_ENABLED", "true").lower() == "true"
+DEFAULT_ROLLUP_DB = os.getenv("CHATBI_ROLLUP_DB", "")
+
+_STATE_TABLE = "_rollup_state"
+
+
+@dataclass(frozen=True)
+class Dimension:
+    """汇总表的维度；grain 不为空时取日期列的前 grain 个字符（10 = 日，7 = 月）"""
+    name: str
+    column: str
+    grain: Optional[int] = None
+
+    @property
+    def source(self) -> str:
+        table, column = self.column.split(".")
+        ref = f'"{table}"."{column}"'
+        return f"substr({ref}, 1, {self.grain})" if self.grain else ref
+
+
+@dataclass(frozen=True)
+class Measure:
+    """度量：expression 以 TABLE.COLUMN 引用列，aliases 是等价的其他写法"""
+    name: str
+    expression: str
+    aliases: Tuple[str, ...] = ()
+
+
+@dataclass(frozen=True)
+class Join:
+    """多对一连接：table.column 引用 parent.parent_column（column 应为 table 的主键）"""
+    table: str
+    column: str
+    parent: str
+    parent_column: str
+
+
+@dataclass(frozen=True)
+class RollupDefinition:
+    name: str
+    driver: str
+    dimensions: Tuple[Dimension, ...]
+    measures: Tuple[Measure, ...]
+    joins: Tuple[Join, ...] = ()
+
+    @property
+    def signature(self) -> str:
+        return hashlib.sha256(repr(self).encode("utf-8")).hexdigest()[:16]
+
+    @property
+    def tables(self) -> List[str]:
+        return [self.driver] + [join.table for join in self.joins]
+
+    @property
+    def group_columns(self) -> List[str]:
+        return [dimension.name for dimension in self.dimensions] + [f"HAS_{join.table}" for join in self.joins]
+
+
+ROLLUPS = (
+    RollupDefinition(
+        "rollup_orders_daily",
+        driver="ORDER_DETAILS",
+        dimensions=(
+            Dimension("ORDER_DAY", "ORDER_DETAILS.ORDER_DATE", 10),
+            Dimension("LOYALTY_LEVEL", "CUSTOMER_DETAILS.LOYALTY_LEVEL"),
+        ),
+        measures=(Measure("TOTAL_AMOUNT", "ORDER_DETAILS.TOTAL_AMOUNT"),),
+        joins=(Join("CUSTOMER_DETAILS", "CUSTOMER_ID", "ORDER_DETAILS", "CUSTOMER_ID"),),
+    ),
+    RollupDefinition(
+        "rollup_payments_daily",
+        driver="PAYMENTS",
+        dimensions=(Dimension("PAYMENT_DAY", "PAYMENTS.PAYMENT_DATE", 10),),
+        measures=(Measure("AMOUNT", "PAYMENTS.AMOUNT"),),
+    ),
+    RollupDefinition(
+        "rollup_transactions_monthly",
+        driver="TRANSACTIONS",
+        dimensions=(
+            Dimension("CATEGORY", "PRODUCTS.CATEGORY"),
+            Dimension("ORDER_MONTH", "ORDER_DETAILS.ORDER_DATE", 7),
+        ),
+        measures=(
+            Measure("QUANTITY", "TRANSACTIONS.QUANTITY"),
+            Measure("PRICE", "TRANSACTIONS.PRICE"),
+            Measure("REVENUE", "TRANSACTIONS.QUANTITY * TRANSACTIONS.PRICE",
+                    aliases=("TRANSACTIONS.PRICE * TRANSACTIONS.QUANTITY",)),
+        ),
+        joins=(
+            Join("PRODUCTS", "PRODUCT_ID", "TRANSACTIONS", "PRODUCT_ID"),
+            Join("ORDER_DETAILS", "ORDER_ID", "TRANSACTIONS", "ORDER_ID"),
+        ),
+    ),
+    RollupDefinition(
+        "rollup_products_by_category",
+        driver="PRODUCTS",
+        dimensions=(Dimension("CATEGORY", "PRODUCTS.CATEGORY"),),
+        measures=(Measure("PRICE", "PRODUCTS.PRICE"),),
+    ),
+)
+
+
+@dataclass
+class RollupRewrite:
+    """一次改写：使用的汇总表和改写后的 SQL（在汇总表数据库上执行）"""
+    table: str
+    query: str
+
+
+class NotRewritable(Exception):
+    """查询不能由汇总表回答（内部使用）"""
+
+
+# ---- 刷新 ----
+
+def _from_clause(definition: RollupDefinition) -> str:
+    parts = [f'src."{definition.driver}" AS "{definition.driver}"']
+    for join in definition.joins:
+        parts.append(
+            f'LEFT JOIN src."{join.table}" AS "{join.table}" '
+            f'ON "{join.table}"."{join.column}" = "{join.parent}"."{join.parent_column}"'
+        )
+    return " ".join(parts)
+
+
+def _aggregate_sql(definition: RollupDefinition) -> str:
+    """按维度聚合驱动表的全部行"""
+    groups = [f'{dimension.source} AS "{dimension.name}"' for dimension in definition.dimensions]
+    groups += [f'CASE WHEN "{join.table}".rowid IS NULL THEN 0 ELSE 1 END' for join in definition.joins]
+    values = ["COUNT(*)"]
+    for measure in definition.measures:
+        values += [f"{fn}({measure.expression})" for fn in ("SUM", "COUNT", "MIN", "MAX")]
+    return (
+        f"SELECT {', '.join(groups + values)} FROM {_from_clause(definition)} "
+        f"GROUP BY {', '.join(str(i + 1) for i in range(len(groups)))}"
+    )
+
+
+def _create_table(conn: sqlite3.Connection, definition: RollupDefinition, name: str) -> None:
+    # 不声明列类型，值按原样保存（不做类型亲和转换）
+    columns = [f'"{column}"' for column in definition.group_columns] + ['"ROW_COUNT"']
+    for measure in definition.measures:
+        columns += [f'"{measure.name}_{suffix}"' for suffix in ("SUM", "COUNT", "MIN", "MAX")]
+    conn.execute(f'CREATE TABLE "{name}" ({", ".join(columns)})')
+
+
+def _date_flags(conn: sqlite3.Connection, definition: RollupDefinition) -> Dict[str, Dict[str, bool]]:
+    """
+    检查日期列的格式
+
+    iso：date(X) 与 substr(X, 1, 10) 相同（strftime/date 与 substr 结果一致）；
+    exact：X 本身就是 YYYY-MM-DD（原始列与日粒度维度完全相同）。
+    """
+    flags = {}
+    for dimension in definition.dimensions:
+        if not dimension.grain:
+            continue
+        table, column = dimension.column.split(".")
+        ref = f'"{table}"."{column}"'
+        iso_bad, exact_bad = conn.execute(
+            f"SELECT COUNT(CASE WHEN {ref} IS NOT NULL AND (typeof({ref}) <> 'text' "
+            f"OR date({ref}) IS NOT substr({ref}, 1, 10)) THEN 1 END), "
+            f"COUNT(CASE WHEN {ref} IS NOT NULL AND (typeof({ref}) <> 'text' OR date({ref}) IS NOT {ref}) THEN 1 END) "
+            f"FROM {_from_clause(definition)}"
+        ).fetchone()
+        flags[dimension.name] = {"iso": iso_bad == 0, "exact": exact_bad == 0 and dimension.grain == 10}
+    return flags
+
+
+# ---- 查询解析 ----
+
+_KEYWORDS = {
+    "and", "or", "not", "in", "is", "null", "between", "like", "glob", "escape", "case", "when", "then", "else",
+    "end", "as", "asc", "desc", "collate", "nocase", "binary", "rtrim", "cast", "distinct", "true", "false",
+    "nulls", "first", "last", "exists", "integer", "int", "real", "text", "numeric", "blob",
+}
+_CLAUSE = re.compile(r"(?<!\w)(from|where|group by|having|order by|limit)(?!\w)")
+_JOIN = re.compile(r"\s*(?<!\w)(left outer join|left join|inner join|join)\s+")
+_TABLE = re.compile(r'^("[^"]+"|\w+)(?:\s+as)?(?:\s+(?!on\b)("[^"]+"|\w+))?(?:\s+on\s+(.+))?$')
+_IDENTIFIER = re.compile(r'(?<![\w."])((?:"[^"]+"|[a-z_]\w*)\.)?("[^"]+"|[a-z_]\w*)(?![\w"(.])')
+_STRING = re.compile(r"('(?:[^']|'')*')")
+_AGGREGATE = re.compile(r"(?<![\w.])(count|sum|avg|min|max|total)\(")
+_ITEM_ALIAS = re.compile(r'^(.+?)(?:\s*(?<![\w.])as\s+|\s+|(?<=\)))("[^"]+"|[a-z_]\w*)$')
+_ORDINAL = re.compile(r"^(\d+)(\s+(?:asc|desc))?$")
+_PLACEHOLDER = re.compile(r"__rollup_agg(\d+)__")
+
+
+def _mask(sql: str) -> str:
+    """把引号内和括号内的字符替换为 _，只保留顶层结构（长度不变）"""
+    out = []
+    depth = 0
+    quote = None
+    for ch in sql:
+        if quote:
+            out.append("_")
+            if ch == quote:
+                quote = None
+            continue
+        if ch in "'\"":
+            quote = ch
+            out.append("_")
+        elif ch == "(":
+            out.append("(" if depth == 0 else "_")
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+            out.append(")" if depth == 0 else "_")
+        else:
+            out.append(ch if depth == 0 else "_")
+    return "".join(out)
+
+
+def _split_commas(text: str) -> List[str]:
+    mask = _mask(text)
+    parts, start = [], 0
+    for i, ch in enumerate(mask):
+        if ch == ",":
+            parts.append(text[start:i].strip())
+            start = i + 1
+    parts.append(text[start:].strip())
+    return parts
+
+
+def _unquote(identifier: str) -> str:
+    return identifier.strip('"').lower()
+
+
+def _parse_select(canonical: str) -> Dict[str, str]:
+    """把单条 SELECT 拆成各子句（规范化后的文本）"""
+    mask = _mask(canonical)
+    if not mask.startswith("select ") or mask.startswith("select distinct") or ";" in mask:
+        raise NotRewritable("not a single SELECT")
+    if re.search(r"(?<!\w)(select|union|intersect|except|window|over)(?!\w)", mask[len("select "):]) \
+            or re.search(r"(?<![\w.])select(?!\w)", canonical[len("select "):]):
+        raise NotRewritable("compound query or subquery")
+    clauses = {}
+    matches = list(_CLAUSE.finditer(mask))
+    order = [m.group(1) for m in matches]
+    names = ["select"] + order
+    starts = [len("select ")] + [m.end() for m in matches]
+    ends = [m.start() for m in matches] + [len(canonical)]
+    expected = ["select", "from", "where", "group by", "having", "order by", "limit"]
+    if "from" not in order or [expected.index(name) for name in names] != sorted(expected.index(name) for name in names) \
+            or len(set(names)) != len(names):
+        raise NotRewritable("unsupported clause order")
+    for name, start, end in zip(names, starts, ends):
+        clauses[name] = canonical[start:end].strip()
+    return clauses
+
+
+def _parse_from(text: str) -> Tuple[Dict[str, str], List[Tuple[str, bool, str]]]:
+    """FROM 子句 → (别名 → 表名, [(连接的表, 是否 LEFT JOIN, 连接条件)])"""
+    mask = _mask(text)
+    if "," in mask:
+        raise NotRewritable("comma join")
+    joins = list(_JOIN.finditer(mask))
+    segments = []
+    start, kind = 0, None
+    for match in joins:
+        segments.append((kind, text[start:match.start()].strip()))
+        start, kind = match.end(), match.group(1)
+    segments.append((kind, text[start:].strip()))
+
+    aliases: Dict[str, str] = {}
+    joined = []
+    for kind, segment in segments:
+        match = _TABLE.match(segment)
+        if not match or (kind is None) != (match.group(3) is None):
+            raise NotRewritable("unsupported FROM clause")
+        table = _unquote(match.group(1))
+        alias = _unquote(match.group(2)) if match.group(2) else table
+        if alias in aliases or table in aliases.values():
+            raise NotRewritable("table used twice")
+        aliases[alias] = table
+        if kind is not None:
+            joined.append((table, kind.startswith("left"), match.group(3).strip()))
+    return aliases, joined
+
+
+class _Rewriter:
+    """把一条已解析的查询改写为查询某个汇总表"""
+
+    def __init__(self, definition: RollupDefinition, aliases: Dict[str, str], schema: Dict[str, Set[str]],
+                 date_flags: Dict[str, Dict[str, bool]]):
+        self.definition = definition
+        self.aliases = aliases
+        self.tables = set(aliases.values())
+        self.schema = schema
+        self.date_flags = date_flags
+        self.measures: Dict[str, Measure] = {}
+        for measure in definition.measures:
+            for expression in (measure.expression,) + measure.aliases:
+                self.measures[canonicalize_sql(expression)] = measure
+        self.select_aliases: Set[str] = set()
+
+    # 列引用解析为 table.column（小写）；select_alias 为 "first" 时别名优先（ORDER BY），
+    # 为 "fallback" 时只有不是列名的标识符才当作别名（GROUP BY / HAVING）
+    def resolve(self, text: str, select_alias: Optional[str] = None) -> str:
+        def replace(match: "re.Match") -> str:
+            qualifier, name = match.group(1), match.group(2)
+            if qualifier is None and name in _KEYWORDS:
+                return name
+            column = _unquote(name)
+            if qualifier is not None:
+                table = self.aliases.get(_unquote(qualifier[:-1]))
+                if table is None or column not in self.schema.get(table, ()):
+                    raise NotRewritable(f"unknown column {match.group(0)}")
+                return f"{table}.{column}"
+            if select_alias == "first" and column in self.select_aliases:
+                return match.group(0)
+            owners = [table for table in self.tables if column in self.schema.get(table, ())]
+            if len(owners) == 1:
+                if select_alias and column in self.select_aliases:
+                    raise NotRewritable(f"{column} is both a column and an alias")
+                return f"{owners[0]}.{column}"
+            if not owners and select_alias and column in self.select_aliases:
+                return match.group(0)
+            raise NotRewritable(f"cannot resolve {column}")
+
+        parts = _STRING.split(text)
+        for i in range(0, len(parts), 2):
+            parts[i] = _IDENTIFIER.sub(replace, parts[i])
+        return "".join(parts)
+
+    def substitute(self, text: str, where: bool = False) -> str:
+        """把维度的源表达式替换为汇总表的维度列；仍引用基础表的列时抛出 NotRewritable"""
+        for dimension in self.definition.dimensions:
+            ref = re.escape(dimension.column.lower())
+            column = f'"{dimension.name}"'
+            if not dimension.grain:
+                text = re.sub(rf"(?<![\w.]){ref}(?!\w)", column, text)
+                continue
+            flags = self.date_flags.get(dimension.name, {})
+            grain = dimension.grain
+
+            def prefix(length: int) -> str:
+                return column if length == grain else f"substr({column},1,{length})"
+
+            text = re.sub(
+                rf"(?<![\w.])substr\({ref},1,(\d+)\)",
+                lambda m: prefix(int(m.group(1))) if 0 < int(m.group(1)) <= grain else m.group(0),
+                text,
+            )
+            if flags.get("iso"):
+                formats = {"%Y": 4, "%Y-%m": 7, "%Y-%m-%d": 10}
+                text = re.sub(
+                    rf"(?<![\w.])strftime\('(%Y|%Y-%m|%Y-%m-%d)',{ref}\)",
+                    lambda m: prefix(formats[m.group(1)]) if formats[m.group(1)] <= grain else m.group(0),
+                    text,
+                )
+                if grain == 10:
+                    text = re.sub(rf"(?<![\w.])date\({ref}\)", column, text)
+            if flags.get("exact"):
+                text = re.sub(rf"(?<![\w.]){ref}(?!\w)", column, text)
+            elif where:
+                # X >= 'lit' / X < 'lit' 与 substr(X, 1, grain) 上的同一比较等价（lit 不长于 grain）
+                text = re.sub(
+                    rf"(?<![^ (]){ref}(>=|<)'([^']*)'(?![^ )])",
+                    lambda m: f"{column}{m.group(1)}'{m.group(2)}'" if len(m.group(2)) <= grain else m.group(0),
+                    text,
+                )
+        tables = "|".join(re.escape(table) for table in self.tables)
+        for i, part in enumerate(_STRING.split(text)):
+            if i % 2 == 0 and re.search(rf"(?<![\w.\"])({tables})\.\w+", part):
+                raise NotRewritable("references a column that is not a rollup dimension")
+        return text
+
+    def aggregates(self, text: str, replacements: List[str]) -> str:
+        """把聚合函数替换为占位符，replacements 中保存对应的汇总表表达式"""
+        out, pos = [], 0
+        for match in _AGGREGATE.finditer(text):
+            if match.start() < pos:
+                continue
+            # match 末尾是左括号：在掩码中找到它对应的右括号
+            end = _mask(text[match.end() - 1:]).find(")") + match.end()
+            if end < match.end():
+                raise NotRewritable("unbalanced parentheses")
+            fn, argument = match.group(1), text[match.end():end - 1]
+            out.append(text[pos:match.start()])
+            out.append(f"__rollup_agg{len(replacements)}__")
+            replacements.append(self.aggregate(fn, argument))
+            pos = end
+        out.append(text[pos:])
+        return "".join(out)
+
+    def aggregate(self, fn: str, argument: str) -> str:
+        if fn == "count" and argument == "*":
+            return 'coalesce(sum("ROW_COUNT"),0)'
+        measure = self.measures.get(argument)
+        if measure is not None:
+            name = measure.name
+            return {
+                "count": f'coalesce(sum("{name}_COUNT"),0)',
+                "sum": f'sum("{name}_SUM")',
+                "total": f'total("{name}_SUM")',
+                "avg": f'sum("{name}_SUM")*1.0/sum("{name}_COUNT")',
+                "min": f'min("{name}_MIN")',
+                "max": f'max("{name}_MAX")',
+            }[fn]
+        if fn in ("min", "max") and "," not in _mask(argument) and "__rollup_agg" not in argument:
+            # 维度上的 MIN/MAX：对分组取最值与对原始行取最值相同
+            return f"{fn}({self.substitute(argument)})"
+        raise NotRewritable(f"{fn}({argument}) is not a rollup measure")
+
+    def clause(self, text: str, replacements: List[str], select_alias: Optional[str] = None,
+               allow_aggregates: bool = True, where: bool = False) -> str:
+        text = self.resolve(text, select_alias)
+        count = len(replacements)
+        text = self.aggregates(text, replacements)
+        if not allow_aggregates and len(replacements) != count:
+            raise NotRewritable("aggregate in WHERE / GROUP BY")
+        return self.substitute(text, where)
+
+
+def _restore(text: str, replacements: List[str]) -> str:
+    return _PLACEHOLDER.sub(lambda m: replacements[int(m.group(1))], text)
+
+
+def _quote(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+# ---- 管理器 ----
+
+class RollupManager:
+    """维护汇总表（数据库变化后全量重建）并改写查询（线程安全）"""
+
+    def __init__(self, database_path: str, rollup_path: str = DEFAULT_ROLLUP_DB,
+                 definitions: Tuple[RollupDefinition, ...] = ROLLUPS, enabled: bool = DEFAULT_ROLLUPS_ENABLED):
+        self.database_path = database_path
+        path = Path(database_path)
+        self.rollup_path = rollup_path or str(path.with_name(f"{path.stem}_rollups.db"))
+        self.definitions = {definition.name: definition for definition in definitions}
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._version: Optional[str] = None
+        self._failed_version: Optional[str] = None
+        self._date_flags: Dict[str, Dict[str, Dict[str, bool]]] = {}
+        self._schema: Dict[str, Set[str]] = {}
+        self._schema_version: Optional[str] = None
+        self.rewrites: Dict[str, int] = {}
+        self.fallbacks = 0
+        self.rebuilds = 0
+        self.last_refresh_ms = 0.0
+
+    # ---- 刷新 ----
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.rollup_path, isolation_level=None, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("ATTACH DATABASE ? AS src", (Path(self.database_path).resolve().as_uri() + "?mode=ro",))
+        columns = {row[1] for row in conn.execute(f"PRAGMA main.table_info({_STATE_TABLE})")}
+        if "watermark" in columns:
+            # 旧版本按水位线增量合并的汇总表可能已经过期，丢弃状态后全部重建
+            conn.execute(f"DROP TABLE {_STATE_TABLE}")
+        conn.execute(
+            f"CREATE TABLE IF NOT EXISTS {_STATE_TABLE} (name TEXT PRIMARY KEY, signature TEXT, source_version TEXT, "
+            "driver_rows INTEGER, date_flags TEXT, refreshed_at REAL)"
+        )
+        return conn
+
+    def refresh(self, version: str, full: bool = False) -> Dict[str, str]:
+        """把所有汇总表刷新到数据库的当前内容，返回每个汇总表的刷新方式（full / fresh）"""
+        started_at = time.perf_counter()
+        modes = {}
+        conn = self._connect()
+        try:
+            for definition in self.definitions.values():
+                conn.execute("BEGIN")
+                try:
+                    modes[definition.name] = self._refresh_one(conn, definition, version, full)
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+            states = conn.execute(f"SELECT name, date_flags FROM {_STATE_TABLE}").fetchall()
+        finally:
+            conn.close()
+        elapsed_ms = (time.perf_counter() - started_at) * 1000
+        with self._lock:
+            self._date_flags = {name: json.loads(flags) for name, flags in states}
+            self._version = version
+            self.rebuilds += sum(1 for mode in modes.values() if mode == "full")
+            self.last_refresh_ms = elapsed_ms
+        rebuilt = [name for name, mode in modes.items() if mode == "full"]
+        if rebuilt:
+            print(f"[INFO] Rollups rebuilt in {elapsed_ms:.1f}ms: {rebuilt}")
+        return modes
+
+    def _refresh_one(self, conn: sqlite3.Connection, definition: RollupDefinition, version: str, full: bool) -> str:
+        state = conn.execute(
+            f"SELECT signature, source_version FROM {_STATE_TABLE} WHERE name = ?", (definition.name,),
+        ).fetchone()
+        if state and not full and state[0] == definition.signature and state[1] == version:
+            return "fresh"
+        driver_rows = conn.execute(f'SELECT COUNT(*) FROM src."{definition.driver}"').fetchone()[0]
+        conn.execute(f'DROP TABLE IF EXISTS "{definition.name}"')
+        _create_table(conn, definition, definition.name)
+        conn.execute(f'INSERT INTO "{definition.name}" {_aggregate_sql(definition)}')
+        date_flags = _date_flags(conn, definition)
+        for dimension in definition.dimensions:
+            if dimension.grain:
+                conn.execute(
+                    f'CREATE INDEX IF NOT EXISTS "{definition.name}_{dimension.name}" '
+                    f'ON "{definition.name}"("{dimension.name}")'
+                )
+        conn.execute(
+            f"INSERT OR REPLACE INTO {_STATE_TABLE} VALUES (?, ?, ?, ?, ?, ?)",
+            (definition.name, definition.signature, version, driver_rows, json.dumps(date_flags), time.time()),
+        )
+        return "full"
+
+    def ensure_fresh(self, version: str) -> bool:
+        """汇总表与数据库版本一致时返回 True；过期时就地全量重建（其他线程正在重建时返回 False）"""
+        if self._version == version:
+            return True
+        if self._failed_version == version or not self._refresh_lock.acquire(blocking=False):
+            return False
+        try:
+            if self._version != version:
+                self.refresh(version)
+            return True
+        except (sqlite3.Error, OSError) as e:
+            print(f"[WARNING] Rollup refresh failed, queries use the base tables: {e}")
+            self._failed_version = version
+            return False
+        finally:
+            self._refresh_lock.release()
+
+    # ---- 改写 ----
+
+    def _load_schema(self, conn: sqlite3.Connection, version: str) -> Dict[str, Set[str]]:
+        if self._schema_version != version:
+            schema = {}
+            for (table,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall():
+                schema[table.lower()] = {row[1].lower() for row in conn.execute(f'PRAGMA table_info("{table}")')}
+            self._schema, self._schema_version = schema, version
+        return self._schema
+
+    def _match(self, definition: RollupDefinition, aliases: Dict[str, str],
+               joined: List[Tuple[str, bool, str]], rewriter: "_Rewriter") -> List[str]:
+        """FROM 子句与汇总表一致时返回需要加 HAS_ 条件的（内连接的）表"""
+        tables = set(aliases.values())
+        if definition.driver.lower() not in tables or not tables <= {t.lower() for t in definition.tables}:
+            raise NotRewritable("tables differ")
+        flags = []
+        for table, left, condition in joined:
+            sides = condition.split("=")
+            if len(sides) != 2:
+                raise NotRewritable("unsupported join condition")
+            resolved = {rewriter.resolve(side.strip()) for side in sides}
+            join = next((
+                j for j in definition.joins
+                if resolved == {f"{j.table}.{j.column}".lower(), f"{j.parent}.{j.parent_column}".lower()}
+            ), None)
+            if join is None or (left and table != join.table.lower()):
+                raise NotRewritable("join differs")
+            if not left:
+                flags.append(join.table)
+        return flags
+
+    def rewrite(self, conn: sqlite3.Connection, query: str, version: str) -> Optional[RollupRewrite]:
+        """
+        查询能由某个汇总表回答时返回改写结果，否则返回 None
+
+        conn 是基础数据库上的（只读）连接，用于读取 schema 和原查询的列名。
+        """
+        if not self.enabled:
+            return None
+        canonical = canonicalize_sql(query)
+        if not canonical.startswith("select "):
+            return None
+        try:
+            clauses = _parse_select(canonical)
+            aliases, joined = _parse_from(clauses["from"])
+        except NotRewritable:
+            return None
+        schema = self._load_schema(conn, version)
+        for definition in self.definitions.values():
+            try:
+                rewritten = self._rewrite(conn, query, definition, clauses, aliases, joined, schema, version)
+            except NotRewritable:
+                continue
+            if rewritten is None:
+                return None
+            with self._lock:
+                self.rewrites[definition.name] = self.rewrites.get(definition.name, 0) + 1
+            print(f"[INFO] Rollup rewrite ({definition.name}): {rewritten.query}")
+            return rewritten
+        return None
+
+    def _rewrite(self, conn: sqlite3.Connection, query: str, definition: RollupDefinition,
+                 clauses: Dict[str, str], aliases: Dict[str, str], joined: List[Tuple[str, bool, str]],
+                 schema: Dict[str, Set[str]], version: str) -> Optional[RollupRewrite]:
+        rewriter = _Rewriter(definition, aliases, schema, {})
+        flags = self._match(definition, aliases, joined, rewriter)
+        # 表结构匹配后才刷新汇总表（日期格式标记取自刷新结果）
+        if not self.ensure_fresh(version):
+            return None
+        rewriter.date_flags = self._date_flags.get(definition.name, {})
+
+        items = []
+        for item in _split_commas(clauses["select"]):
+            match = _ITEM_ALIAS.match(item)
+            if match and match.group(2) not in _KEYWORDS and not match.group(1).endswith("."):
+                items.append((match.group(1).strip(), _unquote(match.group(2))))
+            else:
+                items.append((item, None))
+        rewriter.select_aliases = {alias for _, alias in items if alias}
+        rollup_columns = {column.lower() for column in definition.group_columns} | {"row_count"}
+        rollup_columns |= {f"{m.name}_{s}".lower() for m in definition.measures for s in ("sum", "count", "min", "max")}
+        if rewriter.select_aliases & rollup_columns:
+            raise NotRewritable("alias collides with a rollup column")
+
+        replacements: List[str] = []
+        select = [rewriter.clause(expression, replacements) for expression, _ in items]
+        where = [f'"HAS_{table}"=1' for table in flags]
+        if clauses.get("where"):
+            where.append(f"({rewriter.clause(clauses['where'], replacements, allow_aggregates=False, where=True)})")
+        group = []
+        for term in _split_commas(clauses["group by"]) if clauses.get("group by") else []:
+            if _ORDINAL.match(term):
+                group.append(term)
+            else:
+                group.append(rewriter.clause(term, replacements, "fallback", allow_aggregates=False))
+        having = rewriter.clause(clauses["having"], replacements, "fallback") if clauses.get("having") else None
+        order = []
+        for term in _split_commas(clauses["order by"]) if clauses.get("order by") else []:
+            order.append(term if _ORDINAL.match(term) else rewriter.clause(term, replacements, "first"))
+
+        # 只改写聚合查询；非聚合的选择列必须出现在 GROUP BY 中（否则 SQLite 取任意一行的值）
+        if not replacements and not group:
+            raise NotRewritable("not an aggregate query")
+        dimension_columns = re.compile("|".join(re.escape(f'"{d.name}"') for d in definition.dimensions))
+        group_set = set(group)
+        for position, ((_, alias), expression) in enumerate(zip(items, select), start=1):
+            if _PLACEHOLDER.search(expression) or not dimension_columns.search(expression):
+                continue
+            if expression not in group_set and str(position) not in group_set and (alias or "") not in group_set:
+                raise NotRewritable("bare column outside GROUP BY")
+
+        # 列名与原查询一致（SQLite 的列名取决于原始写法）
+        probe = conn.execute(f"SELECT * FROM ({query.strip().rstrip(';')}) LIMIT 0")
+        names = [description[0] for description in probe.description]
+        probe.close()
+        if len(names) != len(select):
+            raise NotRewritable("column count differs")
+
+        sql = "SELECT " + ", ".join(
+            f"{_restore(expression, replacements)} AS {_quote(name)}" for expression, name in zip(select, names)
+        )
+        sql += f' FROM "{definition.name}"'
+        if where:
+            sql += " WHERE " + " AND ".join(_restore(condition, replacements) for condition in where)
+        if group:
+            sql += " GROUP BY " + ", ".join(_restore(term, replacements) for term in group)
+        if having:
+            sql += " HAVING " + _restore(having, replacements)
+        if order:
+            sql += " ORDER BY " + ", ".join(_restore(term, replacements) for term in order)
+        if clauses.get("limit"):
+            sql += " LIMIT " + clauses["limit"]
+        return RollupRewrite(definition.name, sql)
+
+    def record_fallback(self) -> None:
+        with self._lock:
+            self.fallbacks += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "path": self.rollup_path,
+                "source_version": self._version,
+                "tables": list(self.definitions),
+                "rewrites": dict(self.rewrites),
+                "fallbacks": self.fallbacks,
+                "rebuilds": self.rebuilds,
+                "last_refresh_ms": round(self.last_refresh_ms, 3),
+            }
+
+
+_managers: Dict[str, RollupManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_rollup_manager(database_path: str) -> RollupManager:
+    with _managers_lock:
+        manager = _managers.get(database_path)
+        if manager is None:
+            manager = RollupManager(database_path)
+            _managers[database_path] = manager
+        return manager
+
+
+def main():
+    from tools.tools_execute_sqlite import DATABASE_PATH, get_database_version
+
+    parser = argparse.ArgumentParser(description="Maintain rollup tables and preview query rewrites")
+    parser.add_argument("--database", default=DATABASE_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="show rollup tables and their refresh state")
+    refresh = commands.add_parser("refresh", help="bring rollup tables up to date")
+    refresh.add_argument("--full", action="store_true", help="rebuild even if the rollups match the current database")
+    rewrite = commands.add_parser("rewrite", help="show how a query would be rewritten")
+    rewrite.add_argument("query")
+    args = parser.parse_args()
+
+    manager = RollupManager(args.database, enabled=True)
+    version = get_database_version(args.database)
+    if args.command == "refresh":
+        for name, mode in manager.refresh(version, full=args.full).items():
+            print(f"{name}: {mode}")
+        return
+    if args.command == "rewrite":
+        conn = sqlite3.connect(Path(args.database).resolve().as_uri() + "?mode=ro", uri=True)
+        try:
+            rewritten = manager.rewrite(conn, args.query, version)
+        finally:
+            conn.close()
+        print(rewritten.query if rewritten else "Not rewritable; the query runs on the base tables.")
+        return
+    if not os.path.exists(manager.rollup_path):
+        print(f"{manager.rollup_path} does not exist; run refresh first.")
+        return
+    conn = sqlite3.connect(Path(manager.rollup_path).resolve().as_uri() + "?mode=ro", uri=True)
+    try:
+        states = {row[0]: row[1:] for row in conn.execute(
+            f"SELECT name, source_version, driver_rows, refreshed_at FROM {_STATE_TABLE}"
+        )}
+        for name in manager.definitions:
+            if name not in states:
+                print(f"{name}: not built")
+                continue
+            source_version, driver_rows, refreshed_at = states[name]
+            rows = conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+            stale = "" if source_version == version else " (stale)"
+            print(f"{name}: {rows} groups from {driver_rows} rows, "
+                  f"refreshed {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(refreshed_at))}{stale}")
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    main()
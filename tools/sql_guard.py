@@ -0,0 +1,350 @@
+"""
+SQL 查询代价保护
+
+LLM 生成的笛卡尔积（如 TRANSACTIONS × USER_INTERACTIONS 缺少连接条件）会让
+execute_sqlite_query 占满一个 CPU 核心数分钟，取消机制只在客户端断开时才生效。这里提供两道防线：
+
+1. 执行前：EXPLAIN QUERY PLAN 预检
+   - 按查询计划估算扫描行数（嵌套循环中各层 SCAN 的表行数相乘）
+   - 大表全表扫描、未使用索引的连接（内层循环 SCAN）、自动索引给出警告
+   - 估算行数超过上限时拒绝执行（CHATBI_SQL_PLAN_GUARD=warn 时只警告）
+2. 执行中：set_progress_handler 预算
+   - 每执行 CHATBI_SQL_PROGRESS_INTERVAL 条虚拟机指令检查一次墙钟时间和累计指令数，
+     超出预算时中断语句
+
+被拒绝或中断的查询返回结构化错误（error_type、计划、改写建议），Agent 据此改写查询而不是等待。
+"""
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+DEFAULT_SQL_TIMEOUT_SECONDS = float(os.getenv("CHATBI_SQL_TIMEOUT_SECONDS", "15"))
+DEFAULT_SQL_MAX_VM_STEPS = int(os.getenv("CHATBI_SQL_MAX_VM_STEPS", "500000000"))
+DEFAULT_SQL_PROGRESS_INTERVAL = int(os.getenv("CHATBI_SQL_PROGRESS_INTERVAL", "10000"))
+# off：不做计划预检；warn：只警告；reject：估算扫描行数超限时拒绝执行
+DEFAULT_SQL_PLAN_GUARD = os.getenv("CHATBI_SQL_PLAN_GUARD", "reject").lower()
+DEFAULT_SQL_MAX_PLAN_ROWS = int(os.getenv("CHATBI_SQL_MAX_PLAN_ROWS", "50000000"))
+DEFAULT_SQL_LARGE_TABLE_ROWS = int(os.getenv("CHATBI_SQL_LARGE_TABLE_ROWS", "100000"))
+
+_PLAN_LINE = re.compile(r"^(SCAN|SEARCH) (?:TABLE )?(\S+)(?: AS (\S+))?(.*)$")
+_TABLE_REF = re.compile(
+    r"(?:\bFROM|\bJOIN|,)\s+([A-Za-z_]\w*|\"[^\"]+\"|`[^`]+`|\[[^\]]+\])"
+    r"(?:\s+(?:AS\s+)?([A-Za-z_]\w*))?",
+    re.IGNORECASE,
+)
+_KEYWORDS = {
+    "where", "join", "on", "using", "left", "right", "inner", "outer", "cross", "natural", "full",
+    "group", "order", "limit", "union", "except", "intersect", "having", "window", "as", "set", "values",
+}
+
+SUGGESTIONS = {
+    "unindexed_join": "Join tables with an explicit JOIN ... ON equality on key columns (e.g. *_ID); never list tables without a join condition.",
+    "full_scan": "Add a selective WHERE filter, or aggregate in SQL (COUNT, SUM, GROUP BY) instead of reading every row.",
+    "budget": "Simplify the query: filter early, aggregate in SQL, add LIMIT, and avoid cartesian joins and correlated subqueries.",
+}
+
+
+@dataclass
+class PlanReport:
+    """EXPLAIN QUERY PLAN 预检结果"""
+    plan: List[str] = field(default_factory=list)
+    estimated_rows: int = 0
+    max_rows: int = 0
+    warnings: List[str] = field(default_factory=list)
+    suggestions: List[str] = field(default_factory=list)
+    # 估算代价超限且 plan_guard 为 reject：不应执行
+    rejected: bool = False
+
+    def suggest(self, kind: str) -> None:
+        if SUGGESTIONS[kind] not in self.suggestions:
+            self.suggestions.append(SUGGESTIONS[kind])
+
+
+class QueryBudget:
+    """单次工具调用的执行预算（墙钟时间 + 虚拟机指令数），作为 SQLite progress handler 使用"""
+
+    def __init__(self, timeout_seconds: float, max_vm_steps: int, interval: int):
+        self.timeout_seconds = timeout_seconds
+        self.max_vm_steps = max_vm_steps
+        self.interval = max(interval, 1)
+        self.started_at = time.perf_counter()
+        self.vm_steps = 0
+        # 超出预算的原因："timeout" / "vm_steps"；None 表示未超出
+        self.exceeded: Optional[str] = None
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+    def __call__(self) -> int:
+        # 返回非 0 时 SQLite 中断当前语句（OperationalError: interrupted）
+        self.vm_steps += self.interval
+        if self.max_vm_steps > 0 and self.vm_steps > self.max_vm_steps:
+            self.exceeded = "vm_steps"
+        elif self.timeout_seconds > 0 and self.elapsed > self.timeout_seconds:
+            self.exceeded = "timeout"
+        return 1 if self.exceeded else 0
+
+    def error(self, query: str, plan: Optional[List[str]] = None) -> Dict[str, Any]:
+        """超出预算时返回给 Agent 的结构化错误"""
+        if self.exceeded == "timeout":
+            message = f"Query stopped after {self.elapsed:.1f}s (time limit {self.timeout_seconds:g}s)."
+        else:
+            message = f"Query stopped after {self.vm_steps:,} VM steps (limit {self.max_vm_steps:,})."
+        return {
+            "status": "error",
+            "error_type": "query_timeout" if self.exceeded == "timeout" else "query_too_expensive",
+            "error": message + " Rewrite the query to be cheaper instead of retrying it unchanged.",
+            "query": query,
+            "elapsed_seconds": round(self.elapsed, 3),
+            "vm_steps": self.vm_steps,
+            "plan": plan or [],
+            "suggestions": [SUGGESTIONS["budget"]],
+        }
+
+
+def parse_plan_line(detail: str) -> Optional[Tuple[str, str, str]]:
+    """解析 SCAN / SEARCH 计划行，返回 (SCAN|SEARCH, 表名或别名, 其余部分)；其他计划行返回 None"""
+    match = _PLAN_LINE.match(detail)
+    if not match:
+        return None
+    return match.group(1), match.group(2), match.group(4)
+
+
+def _unquote(name: str) -> str:
+    if name[:1] in "\"`[":
+        return name[1:-1]
+    return name
+
+
+def table_aliases(query: str, tables: Dict[str, str]) -> Dict[str, str]:
+    """
+    从 SQL 文本中提取 表别名 -> 表名（EXPLAIN QUERY PLAN 中使用别名而不是表名）
+
+    tables 为 小写表名 -> 表名；只识别 FROM / JOIN / 逗号后直接跟真实表名的写法。
+    """
+    aliases = {}
+    for match in _TABLE_REF.finditer(query):
+        table = tables.get(_unquote(match.group(1)).lower())
+        if table is None:
+            continue
+        aliases[table.lower()] = table
+        alias = match.group(2)
+        if alias and alias.lower() not in _KEYWORDS:
+            aliases[alias.lower()] = table
+    return aliases
+
+
+def analyze_plan(plan_rows: List[Tuple[int, int, int, str]], query: str,
+                 tables: Dict[str, Tuple[str, int]], large_table_rows: int = DEFAULT_SQL_LARGE_TABLE_ROWS,
+                 search_rows: Optional[Callable[[str, str], int]] = None) -> PlanReport:
+    """
+    按 EXPLAIN QUERY PLAN 的输出估算扫描行数，并收集警告
+
+    Args:
+        plan_rows: EXPLAIN QUERY PLAN 返回的 (id, parent, notused, detail)
+        query: SQL 文本（用于解析表别名）
+        tables: 小写表名 -> (表名, 行数)
+        large_table_rows: 全表扫描给出警告的行数阈值
+        search_rows: (表名, SEARCH 明细) -> 每次 SEARCH 返回的行数；默认视为 1 行
+    """
+    aliases = table_aliases(query, {lower: name for lower, (name, _) in tables.items()})
+    sizes = {alias: tables[table.lower()][1] for alias, table in aliases.items()}
+    children: Dict[int, List[Tuple[int, str]]] = {}
+    for node_id, parent, _, detail in plan_rows:
+        children.setdefault(parent, []).append((node_id, detail))
+
+    report = PlanReport(plan=[row[3] for row in plan_rows])
+
+    def estimate(parent: int, outer: int) -> int:
+        # 同级的 SCAN / SEARCH 按顺序构成嵌套循环：SCAN 乘以表行数，SEARCH 乘以每次返回的行数；
+        # 相关子查询在外层循环的每一行上执行一次，其余子查询（物化、复合查询等）只执行一次
+        total = 0
+        loop = outer
+        for node_id, detail in children.get(parent, []):
+            parsed = parse_plan_line(detail)
+            if parsed:
+                kind, name, rest = parsed
+                table = aliases.get(name.lower(), name)
+                name = name.lower()
+                size = sizes.get(name)
+                if kind == "SCAN" and size is not None:
+                    if loop > 1:
+                        report.warnings.append(
+                            f"Unindexed join: {table} ({size:,} rows) is fully scanned for each of ~{loop:,} outer rows."
+                        )
+                        report.suggest("unindexed_join")
+                    elif size >= large_table_rows:
+                        report.warnings.append(f"Full scan of large table {table} ({size:,} rows).")
+                        report.suggest("full_scan")
+                    loop *= max(size, 1)
+                elif kind == "SEARCH" and size is not None:
+                    if "AUTOMATIC" in rest:
+                        # SQLite 为缺少索引的连接临时建索引，每次执行都要先扫描一遍该表
+                        report.warnings.append(
+                            f"No index for join on {table}; SQLite builds a temporary index on every run."
+                        )
+                        report.suggest("unindexed_join")
+                        total += size
+                    if search_rows is not None:
+                        loop *= max(search_rows(table, detail), 1)
+                total += loop
+            elif node_id in children:
+                total += estimate(node_id, loop if detail.startswith("CORRELATED") else 1)
+        return total
+
+    report.estimated_rows = estimate(0, 1)
+    return report
+
+
+class QueryGuard:
+    """查询计划预检 + 执行预算（线程安全）"""
+
+    def __init__(
+        self,
+        timeout_seconds: float = DEFAULT_SQL_TIMEOUT_SECONDS,
+        max_vm_steps: int = DEFAULT_SQL_MAX_VM_STEPS,
+        progress_interval: int = DEFAULT_SQL_PROGRESS_INTERVAL,
+        plan_guard: str = DEFAULT_SQL_PLAN_GUARD,
+        max_plan_rows: int = DEFAULT_SQL_MAX_PLAN_ROWS,
+        large_table_rows: int = DEFAULT_SQL_LARGE_TABLE_ROWS,
+    ):
+        self.timeout_seconds = timeout_seconds
+        self.max_vm_steps = max_vm_steps
+        self.progress_interval = progress_interval
+        self.plan_guard = plan_guard
+        self.max_plan_rows = max_plan_rows
+        self.large_table_rows = large_table_rows
+        self._lock = threading.Lock()
+        # (数据库路径, 数据库版本) -> 小写表名 -> (表名, 估算行数)
+        self._table_rows: Dict[Tuple[str, str], Dict[str, Tuple[str, int]]] = {}
+        self.checked = 0
+        self.warned = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.step_limits = 0
+
+    # ---- 执行预算 ----
+
+    def new_budget(self) -> QueryBudget:
+        return QueryBudget(self.timeout_seconds, self.max_vm_steps, self.progress_interval)
+
+    @contextmanager
+    def limit(self, conn: sqlite3.Connection, budget: QueryBudget) -> Iterator[QueryBudget]:
+        """在连接上安装 progress handler；退出时移除（连接会归还连接池）"""
+        conn.set_progress_handler(budget, budget.interval)
+        try:
+            yield budget
+        finally:
+            conn.set_progress_handler(None, 0)
+            if budget.exceeded:
+                with self._lock:
+                    if budget.exceeded == "timeout":
+                        self.timeouts += 1
+                    else:
+                        self.step_limits += 1
+                print(f"[WARNING] SQL query stopped by budget ({budget.exceeded}) after {budget.elapsed:.2f}s")
+
+    # ---- 计划预检 ----
+
+    def table_rows(self, conn: sqlite3.Connection, database_path: str,
+                   database_version: str) -> Dict[str, Tuple[str, int]]:
+        """各表的估算行数（小写表名 -> (表名, 行数)），按数据库版本缓存"""
+        key = (database_path, database_version)
+        with self._lock:
+            cached = self._table_rows.get(key)
+        if cached is not None:
+            return cached
+        stats = {}
+        try:
+            for (index_table, stat) in conn.execute("SELECT tbl, stat FROM sqlite_stat1"):
+                stats.setdefault(index_table.lower(), int(stat.split()[0]))
+        except (sqlite3.Error, ValueError, IndexError):
+            pass
+        tables = {}
+        for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"):
+            rows = stats.get(name.lower())
+            if rows is None:
+                # MAX(rowid) 只需走一次 B 树，不扫描整表；WITHOUT ROWID 表退回 COUNT(*)
+                try:
+                    rows = conn.execute(f'SELECT MAX(rowid) FROM "{name}"').fetchone()[0] or 0
+                except sqlite3.Error:
+                    rows = conn.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+            tables[name.lower()] = (name, int(rows))
+        with self._lock:
+            # 只保留当前版本
+            self._table_rows = {k: v for k, v in self._table_rows.items() if k[0] != database_path}
+            self._table_rows[key] = tables
+        return tables
+
+    def check_plan(self, conn: sqlite3.Connection, query: str, database_path: str,
+                   database_version: str) -> Optional[PlanReport]:
+        """
+        执行前预检查询计划
+
+        Returns:
+            PlanReport（估算扫描行数超过上限且 plan_guard 为 reject 时 rejected 为 True）；
+            预检关闭或语句无法 EXPLAIN（语法错误等，留给实际执行报告）时返回 None
+        """
+        if self.plan_guard == "off":
+            return None
+        try:
+            rows = conn.execute("EXPLAIN QUERY PLAN " + query).fetchall()
+            tables = self.table_rows(conn, database_path, database_version)
+        except (sqlite3.Error, sqlite3.Warning):
+            return None
+        report = analyze_plan(rows, query, tables, self.large_table_rows)
+        report.max_rows = self.max_plan_rows
+        over_limit = report.estimated_rows > self.max_plan_rows > 0
+        if over_limit:
+            report.warnings.append(
+                f"Estimated {report.estimated_rows:,} rows examined exceeds the limit of {self.max_plan_rows:,}."
+            )
+            report.suggest("budget")
+        report.rejected = over_limit and self.plan_guard == "reject"
+        with self._lock:
+            self.checked += 1
+            if report.rejected:
+                self.rejected += 1
+            elif report.warnings:
+                self.warned += 1
+        return report
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "plan_guard": self.plan_guard,
+                "timeout_seconds": self.timeout_seconds,
+                "max_vm_steps": self.max_vm_steps,
+                "max_plan_rows": self.max_plan_rows,
+                "checked": self.checked,
+                "warned": self.warned,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+                "step_limits": self.step_limits,
+            }
+
+
+def rejection_error(report: PlanReport, query: str) -> Dict[str, Any]:
+    """计划预检拒绝时返回给 Agent 的结构化错误"""
+    return {
+        "status": "error",
+        "error_type": "query_rejected",
+        "error": (
+            f"Query rejected before execution: the plan would examine about {report.estimated_rows:,} rows "
+            f"(limit {report.max_rows:,}). Rewrite the query using the warnings and suggestions below."
+        ),
+        "query": query,
+        "estimated_rows": report.estimated_rows,
+        "warnings": report.warnings,
+        "plan": report.plan,
+        "suggestions": report.suggestions,
+    }
+
+
+query_guard = QueryGuard()
@@ -0,0 +1,202 @@
+"""
+查询结果分页
+
+查询结果会进入 LLM 上下文和会话 checkpoint，不能无限制地 fetchall()。
+- 第一页：用 fetchmany 分批读取，达到行数或字节数上限即停止，不会物化完整结果集
+- 结果被截断时，用 SELECT COUNT(*) FROM (<query>) 统计总行数，并登记一个游标句柄
+- 后续页通过 fetch_sqlite_page 工具（或 GET /api/chat/sql/pages/{cursor}）按需获取，
+  以 SELECT * FROM (<query>) LIMIT ? OFFSET ? 重新执行，每页同样受行数和字节数限制
+
+每次执行（包括缓存命中）都登记一个新的随机游标句柄，"接着上一页"的位置只属于这一次执行，
+不同会话、不同请求执行同一查询不会互相推进对方的游标；总行数按（数据库路径, 数据库版本, 规范化 SQL）缓存，
+同一查询不会重复 COUNT。读完最后一页后游标停在结果末尾，不带 offset 再次读取返回空页。
+数据库变化后句柄失效，需要重新执行查询。
+"""
+import hashlib
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+from tools.sql_result_cache import canonicalize_sql
+
+DEFAULT_MAX_ROWS = int(os.getenv("CHATBI_SQL_MAX_ROWS", "200"))
+DEFAULT_MAX_BYTES = int(os.getenv("CHATBI_SQL_MAX_BYTES", str(64 * 1024)))
+DEFAULT_FETCH_BATCH_SIZE = int(os.getenv("CHATBI_SQL_FETCH_BATCH_SIZE", "100"))
+DEFAULT_CURSOR_TTL_SECONDS = float(os.getenv("CHATBI_SQL_CURSOR_TTL_SECONDS", "1800"))
+DEFAULT_MAX_CURSORS = int(os.getenv("CHATBI_SQL_MAX_CURSORS", "1024"))
+
+
+def fetch_bounded(cursor: sqlite3.Cursor, max_rows: int = DEFAULT_MAX_ROWS,
+                  max_bytes: int = DEFAULT_MAX_BYTES,
+                  batch_size: int = DEFAULT_FETCH_BATCH_SIZE) -> Tuple[List[Any], bool]:
+    """
+    分批读取结果，返回 (行, 是否还有更多行)
+
+    行数不超过 max_rows，按 JSON 估算的字节数不超过 max_bytes（至少返回一行）。
+    """
+    rows: List[Any] = []
+    size = 0
+    while True:
+        batch = cursor.fetchmany(min(batch_size, max_rows - len(rows) + 1))
+        if not batch:
+            return rows, False
+        for row in batch:
+            row_size = len(json.dumps(row, ensure_ascii=False, default=str))
+            if len(rows) >= max_rows or (rows and size + row_size > max_bytes):
+                return rows, True
+            rows.append(row)
+            size += row_size
+
+
+def _strip_statement(query: str) -> str:
+    return query.strip().rstrip(";").strip()
+
+
+def count_rows(conn: sqlite3.Connection, query: str) -> Optional[int]:
+    """统计结果集总行数；语句不能作为子查询（如 PRAGMA）时返回 None"""
+    try:
+        return conn.execute(f"SELECT COUNT(*) FROM ({_strip_statement(query)})").fetchone()[0]
+    except sqlite3.Error:
+        return None
+
+
+def cursor_key(database_path: str, database_version: str, query: str) -> str:
+    """同一数据库版本上同一（规范化后）查询的键，用于缓存总行数"""
+    raw = json.dumps([database_path, database_version, canonicalize_sql(query)], ensure_ascii=False)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def new_cursor_handle() -> str:
+    """每次执行一个新句柄：分页位置（next_offset）不在会话和请求之间共享"""
+    return "cur_" + secrets.token_hex(8)
+
+
+@dataclass
+class ResultCursor:
+    handle: str
+    query: str
+    database_path: str
+    database_version: str
+    columns: List[str]
+    total_rows: Optional[int]
+    next_offset: int
+    expires_at: float = 0.0
+
+
+class CursorRegistry:
+    """游标句柄登记表（有界 LRU + TTL，线程安全）"""
+
+    def __init__(self, ttl: float = DEFAULT_CURSOR_TTL_SECONDS, max_cursors: int = DEFAULT_MAX_CURSORS):
+        self.ttl = ttl
+        self.max_cursors = max(max_cursors, 1)
+        self._lock = threading.Lock()
+        self._cursors: "OrderedDict[str, ResultCursor]" = OrderedDict()
+        # cursor_key -> 总行数
+        self._counts: "OrderedDict[str, int]" = OrderedDict()
+
+    def register(self, cursor: ResultCursor) -> None:
+        cursor.expires_at = time.monotonic() + self.ttl
+        with self._lock:
+            self._cursors[cursor.handle] = cursor
+            self._cursors.move_to_end(cursor.handle)
+            while len(self._cursors) > self.max_cursors:
+                self._cursors.popitem(last=False)
+
+    def get(self, handle: str) -> Optional[ResultCursor]:
+        with self._lock:
+            cursor = self._cursors.get(handle)
+            if cursor is None:
+                return None
+            if cursor.expires_at < time.monotonic():
+                del self._cursors[handle]
+                return None
+            cursor.expires_at = time.monotonic() + self.ttl
+            self._cursors.move_to_end(handle)
+            return cursor
+
+    def cached_count(self, key: str) -> Optional[int]:
+        with self._lock:
+            total_rows = self._counts.get(key)
+            if total_rows is not None:
+                self._counts.move_to_end(key)
+            return total_rows
+
+    def remember_count(self, key: str, total_rows: int) -> None:
+        with self._lock:
+            self._counts[key] = total_rows
+            self._counts.move_to_end(key)
+            while len(self._counts) > self.max_cursors:
+                self._counts.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._cursors)
+
+
+cursor_registry = CursorRegistry()
+
+
+def paginate_first_page(conn: sqlite3.Connection, query: str, result: Dict[str, Any],
+                        database_path: str, database_version: str) -> Dict[str, Any]:
+    """
+    第一页被截断时补充总行数和游标句柄
+
+    语句不能改写为子查询时（COUNT 失败）不提供游标，只标记截断。
+    """
+    key = cursor_key(database_path, database_version, query)
+    total_rows = cursor_registry.cached_count(key)
+    if total_rows is None:
+        total_rows = count_rows(conn, query)
+        if total_rows is None:
+            return {**result, "total_rows": None, "cursor": None, "next_offset": None}
+        cursor_registry.remember_count(key, total_rows)
+    handle = new_cursor_handle()
+    next_offset = len(result["rows"])
+    cursor_registry.register(ResultCursor(
+        handle, query, database_path, database_version, result["columns"], total_rows, next_offset,
+    ))
+    return {**result, "total_rows": total_rows, "cursor": handle, "next_offset": next_offset}
+
+
+def restore_cursor(query: str, result: Dict[str, Any], database_path: str, database_version: str) -> Dict[str, Any]:
+    """缓存命中的第一页带有游标时登记一个新游标，返回带新句柄的结果（缓存中的结果不修改）"""
+    if not result.get("cursor"):
+        return result
+    handle = new_cursor_handle()
+    next_offset = len(result["rows"])
+    cursor_registry.register(ResultCursor(
+        handle, query, database_path, database_version, result["columns"], result.get("total_rows"), next_offset,
+    ))
+    return {**result, "cursor": handle, "next_offset": next_offset}
+
+
+def fetch_page(conn: sqlite3.Connection, cursor: ResultCursor, offset: int,
+               limit: int = DEFAULT_MAX_ROWS, max_bytes: int = DEFAULT_MAX_BYTES) -> Dict[str, Any]:
+    """按 offset 重新执行查询读取一页"""
+    limit = max(1, min(limit, DEFAULT_MAX_ROWS))
+    db_cursor = conn.execute(
+        f"SELECT * FROM ({_strip_statement(cursor.query)}) LIMIT ? OFFSET ?",
+        (limit + 1, max(offset, 0)),
+    )
+    try:
+        rows, truncated = fetch_bounded(db_cursor, limit, max_bytes)
+    finally:
+        db_cursor.close()
+    next_offset = offset + len(rows) if truncated else None
+    # 最后一页之后游标停在末尾，不带 offset 的下一次读取返回空页而不是重复最后一页
+    cursor.next_offset = offset + len(rows)
+    return {
+        "columns": cursor.columns,
+        "rows": rows,
+        "row_count": len(rows),
+        "offset": offset,
+        "truncated": truncated,
+        "total_rows": cursor.total_rows,
+        "cursor": cursor.handle,
+        "next_offset": next_offset,
+    }
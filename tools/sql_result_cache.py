@@ -0,0 +1,162 @@
+"""
+SQL 查询结果缓存
+
+Agent 在同一会话内（以及不同会话之间）经常重复执行相同或等价的 SELECT。
+结果按（数据库路径, 数据库版本, 规范化 SQL）缓存：
+- 规范化：去掉注释和结尾分号，字符串/标识符引号外的部分转小写并合并空白，
+  因此只有大小写、空白、注释不同的查询会命中同一条目
+- 数据库版本由调用方提供（数据库文件指纹），数据库变化后旧条目不再命中
+- 按结果的 JSON 字节数计量，超过总字节上限时按 LRU 淘汰；单条结果过大时不缓存
+
+工具在线程池中执行，所有方法都是线程安全的。
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+DEFAULT_SQL_CACHE_ENABLED = os.getenv("CHATBI_SQL_CACHE_ENABLED", "true").lower() == "true"
+DEFAULT_SQL_CACHE_MAX_BYTES = int(os.getenv("CHATBI_SQL_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+DEFAULT_SQL_CACHE_MAX_ENTRY_BYTES = int(os.getenv("CHATBI_SQL_CACHE_MAX_ENTRY_BYTES", str(8 * 1024 * 1024)))
+
+_QUOTES = {"'": "'", '"': '"', "`": "`", "[": "]"}
+_PUNCTUATION = set("(),=<>+-*/%|;")
+
+
+def canonicalize_sql(query: str) -> str:
+    """
+    规范化 SQL 文本，用作缓存键
+
+    引号内的内容（字符串字面量、带引号的标识符）保持原样，其余部分：
+    去掉 -- 和 /* */ 注释，转小写，合并空白，去掉标点两侧的空白和结尾分号。
+    """
+    out = []
+    i, n = 0, len(query)
+    pending_space = False
+    while i < n:
+        ch = query[i]
+        if ch in _QUOTES:
+            close = _QUOTES[ch]
+            end = i + 1
+            while end < n:
+                if query[end] == close:
+                    # SQL 中用两个引号转义
+                    if end + 1 < n and query[end + 1] == close and close != "]":
+                        end += 2
+                        continue
+                    break
+                end += 1
+            if pending_space and out and out[-1][-1:] not in _PUNCTUATION:
+                out.append(" ")
+            pending_space = False
+            out.append(query[i:end + 1])
+            i = end + 1
+            continue
+        if query.startswith("--", i):
+            end = query.find("\n", i)
+            i = n if end == -1 else end
+            pending_space = True
+            continue
+        if query.startswith("/*", i):
+            end = query.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+            pending_space = True
+            continue
+        if ch.isspace():
+            pending_space = True
+            i += 1
+            continue
+        if ch in _PUNCTUATION:
+            pending_space = False
+            out.append(ch)
+            i += 1
+            continue
+        if pending_space and out and out[-1][-1:] not in _PUNCTUATION:
+            out.append(" ")
+        pending_space = False
+        out.append(ch.lower())
+        i += 1
+    return "".join(out).rstrip(";").strip()
+
+
+class SQLResultCache:
+    """按字节数限制的 LRU 查询结果缓存"""
+
+    def __init__(self, max_bytes: int = DEFAULT_SQL_CACHE_MAX_BYTES,
+                 max_entry_bytes: int = DEFAULT_SQL_CACHE_MAX_ENTRY_BYTES,
+                 enabled: bool = DEFAULT_SQL_CACHE_ENABLED):
+        self.max_bytes = max(max_bytes, 0)
+        self.max_entry_bytes = min(max_entry_bytes, self.max_bytes)
+        self.enabled = enabled and self.max_bytes > 0
+        self._lock = threading.Lock()
+        # key -> (result, 字节数)
+        self._entries: "OrderedDict[Tuple[str, str, str], Tuple[Any, int]]" = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(database_path: str, database_version: str, query: str) -> Tuple[str, str, str]:
+        return (database_path, database_version, canonicalize_sql(query))
+
+    def get(self, key: Tuple[str, str, str]) -> Optional[Tuple[Any, int]]:
+        """命中时返回 (结果, 字节数)"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            self.bytes_saved += entry[1]
+            return entry
+
+    def put(self, key: Tuple[str, str, str], result: Any) -> int:
+        """写入结果，返回结果的字节数；超过单条上限时不缓存"""
+        size = len(json.dumps(result, ensure_ascii=False, default=str))
+        if not self.enabled or size > self.max_entry_bytes:
+            return size
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous[1]
+            self._entries[key] = (result, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes and self._entries:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+        return size
+
+    def invalidate(self, database_path: Optional[str] = None) -> None:
+        """清除某个数据库（默认全部）的缓存条目，写操作后调用"""
+        with self._lock:
+            for key in [k for k in self._entries if database_path is None or k[0] == database_path]:
+                self._bytes -= self._entries.pop(key)[1]
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hit_rate,
+                "bytes_saved": self.bytes_saved,
+                "evictions": self.evictions,
+            }
+
+
+sql_result_cache = SQLResultCache()
@@ -0,0 +1,525 @@
+"""
+SQL 执行前校验与自动修正
+
+Agent 的很多轮次浪费在错误的 SQL 上：execute_sqlite_query 返回 sqlite3.Error 后，模型需要再调用一次 LLM
+才能修正拼错的列名，或 tools_text2sqlite.py 提示词中提到的 STREAM_HACKATHON.STREAMLIT. 前缀。
+执行前先按 sqlite_master 中的实时 schema 在本地校验：
+
+- 自动修正无歧义的问题：库名前缀（STREAM_HACKATHON.STREAMLIT.ORDER_DETAILS -> ORDER_DETAILS）、
+  标识符大小写（统一为 schema 中的写法）、拼写相近的列名 / 表名（唯一的近似匹配，如 ORDERDATE -> ORDER_DATE）
+- 无法唯一确定的问题（未知列有多个近似候选、列名有歧义、语法错误等）返回结构化诊断：
+  类型、出错的标识符、所在行列、候选名称，让模型一次改对
+- 是否有效以 SQLite 编译（EXPLAIN <sql>，不执行）的结果为准，修正后重新编译，最多 CHATBI_SQL_VALIDATOR_MAX_PASSES 轮
+
+自动修正了会导致执行失败的问题时，相当于省掉一轮“执行失败 -> 模型改写”的 Agent 迭代，
+stats() 中的 iterations_saved 统计这一数量。CHATBI_SQL_VALIDATOR_AUTOFIX=false 时只诊断不修正，便于对比。
+"""
+import difflib
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+DEFAULT_VALIDATOR_ENABLED = os.getenv("CHATBI_SQL_VALIDATOR_ENABLED", "true").lower() == "true"
+DEFAULT_VALIDATOR_AUTOFIX = os.getenv("CHATBI_SQL_VALIDATOR_AUTOFIX", "true").lower() == "true"
+DEFAULT_MATCH_CUTOFF = float(os.getenv("CHATBI_SQL_VALIDATOR_CUTOFF", "0.8"))
+DEFAULT_MAX_PASSES = int(os.getenv("CHATBI_SQL_VALIDATOR_MAX_PASSES", "5"))
+DEFAULT_MAX_CACHED = 512
+
+KEYWORDS = frozenset("""
+ABORT ACTION ADD AFTER ALL ALTER ALWAYS ANALYZE AND AS ASC ATTACH AUTOINCREMENT BEFORE BEGIN BETWEEN BY CASCADE
+CASE CAST CHECK COLLATE COLUMN COMMIT CONFLICT CONSTRAINT CREATE CROSS CURRENT CURRENT_DATE CURRENT_TIME
+CURRENT_TIMESTAMP DATABASE DEFAULT DEFERRABLE DEFERRED DELETE DESC DETACH DISTINCT DO DROP EACH ELSE END ESCAPE
+EXCEPT EXCLUDE EXCLUSIVE EXISTS EXPLAIN FAIL FILTER FIRST FOLLOWING FOR FOREIGN FROM FULL GENERATED GLOB GROUP
+GROUPS HAVING IF IGNORE IMMEDIATE IN INDEX INDEXED INITIALLY INNER INSERT INSTEAD INTERSECT INTO IS ISNULL JOIN
+KEY LAST LEFT LIKE LIMIT MATCH MATERIALIZED NATURAL NO NOT NOTHING NOTNULL NULL NULLS OF OFFSET ON OR ORDER
+OTHERS OUTER OVER PARTITION PLAN PRAGMA PRECEDING PRIMARY QUERY RAISE RANGE RECURSIVE REFERENCES REGEXP REINDEX
+RELEASE RENAME REPLACE RESTRICT RETURNING RIGHT ROLLBACK ROW ROWS SAVEPOINT SELECT SET TABLE TEMP TEMPORARY THEN
+TIES TO TRANSACTION TRIGGER UNBOUNDED UNION UNIQUE UPDATE USING VACUUM VALUES VIEW VIRTUAL WHEN WHERE WINDOW WITH
+WITHOUT TRUE FALSE
+""".split())
+
+_TOKEN_RE = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+  | (?P<string>'(?:[^']|'')*'?)
+  | (?P<quoted>"(?:[^"]|"")*"?|`[^`]*`?|\[[^\]]*\]?)
+  | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<param>[?:@$][A-Za-z0-9_]*)
+  | (?P<op>.)
+""", re.S | re.X)
+
+_NO_SUCH_COLUMN = re.compile(r"no such column: (.+)$")
+_NO_SUCH_TABLE = re.compile(r"no such table: (.+)$")
+_UNKNOWN_DATABASE = re.compile(r"unknown database (.+)$")
+_AMBIGUOUS_COLUMN = re.compile(r"ambiguous column name: (.+)$")
+_NEAR = re.compile(r'near "(.*)": syntax error')
+
+
+@dataclass
+class Token:
+    kind: str
+    text: str
+
+    @property
+    def name(self) -> Optional[str]:
+        """标识符的名称（去掉引号）；非标识符返回 None"""
+        if self.kind == "word":
+            return None if self.text.upper() in KEYWORDS else self.text
+        if self.kind == "quoted" and len(self.text) >= 2:
+            return self.text[1:-1].replace('""', '"') if self.text[0] == '"' else self.text[1:-1]
+        return None
+
+
+def tokenize(sql: str) -> List[Token]:
+    return [Token(match.lastgroup, match.group()) for match in _TOKEN_RE.finditer(sql)]
+
+
+def _render(tokens: List[Token]) -> str:
+    return "".join(token.text for token in tokens)
+
+
+def _squash(name: str) -> str:
+    """近似比较用：忽略大小写、下划线和空格"""
+    return re.sub(r"[\s_]", "", name).lower()
+
+
+@dataclass
+class SchemaCatalog:
+    """数据库中的表 / 视图及其列（名称按小写索引，值为 schema 中的写法）"""
+    tables: Dict[str, str]
+    columns: Dict[str, Dict[str, str]]
+    schemas: Set[str]
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> "SchemaCatalog":
+        tables: Dict[str, str] = {}
+        columns: Dict[str, Dict[str, str]] = {}
+        for (name,) in conn.execute(
+            "SELECT name FROM sqlite_master WHERE type IN ('table', 'view') AND name NOT LIKE 'sqlite_%'"
+        ):
+            tables[name.lower()] = name
+            quoted = name.replace('"', '""')
+            columns[name] = {row[1].lower(): row[1] for row in conn.execute(f'PRAGMA table_info("{quoted}")')}
+        schemas = {row[1].lower() for row in conn.execute("PRAGMA database_list")} | {"main", "temp"}
+        return cls(tables, columns, schemas)
+
+    def all_columns(self, tables: Optional[List[str]] = None) -> Dict[str, str]:
+        merged: Dict[str, str] = {}
+        for table in tables if tables is not None else list(self.columns):
+            for lower, name in self.columns.get(table, {}).items():
+                merged.setdefault(lower, name)
+        return merged
+
+
+@dataclass
+class SqlFix:
+    type: str  # schema_prefix / case / column / table
+    original: str
+    replacement: str
+
+
+@dataclass
+class SqlDiagnostic:
+    type: str  # unknown_column / unknown_table / unknown_database / ambiguous_column / syntax / error
+    message: str
+    identifier: Optional[str] = None
+    candidates: List[str] = field(default_factory=list)
+    line: Optional[int] = None
+    column: Optional[int] = None
+
+
+@dataclass
+class ValidationResult:
+    original: str
+    query: str
+    fixes: List[SqlFix] = field(default_factory=list)
+    diagnostics: List[SqlDiagnostic] = field(default_factory=list)
+
+    @property
+    def rejected(self) -> bool:
+        return bool(self.diagnostics)
+
+    def fix_report(self) -> List[Dict[str, Any]]:
+        return [asdict(fix) for fix in self.fixes]
+
+    def error(self) -> Dict[str, Any]:
+        """校验未通过时返回给 Agent 的结构化错误"""
+        first = self.diagnostics[0]
+        hint = f" Candidates: {', '.join(first.candidates[:5])}." if first.candidates else ""
+        response = {
+            "status": "error",
+            "error_type": "invalid_sql",
+            "error": f"SQL validation failed: {first.message}.{hint} Fix the query using the diagnostics below.",
+            "query": self.original,
+            "diagnostics": [asdict(diagnostic) for diagnostic in self.diagnostics],
+        }
+        if self.fixes:
+            response["sql_fixes"] = self.fix_report()
+            response["checked_query"] = self.query
+        return response
+
+
+class _Scope:
+    """查询中引用的表、别名和 CTE / 输出列别名（粗略的词法分析，只用于挑选候选名称）"""
+
+    def __init__(self, tokens: List[Token], catalog: SchemaCatalog):
+        self.tables: List[str] = []
+        self.aliases: Dict[str, Optional[str]] = {}  # 小写别名 -> 表（子查询 / 输出列别名为 None）
+        code = [token for token in tokens if token.kind not in ("space", "comment")]
+        for index, token in enumerate(code):
+            name = token.name
+            prev = code[index - 1] if index else None
+            nxt = code[index + 1] if index + 1 < len(code) else None
+            if name is not None and name.lower() in catalog.tables and not (prev and prev.text == "."):
+                table = catalog.tables[name.lower()]
+                if table not in self.tables:
+                    self.tables.append(table)
+                alias = self._alias_after(code, index + 1)
+                if alias:
+                    self.aliases[alias.lower()] = table
+            elif token.kind == "word" and token.text.upper() == "AS" and nxt is not None and nxt.name:
+                after = code[index + 2] if index + 2 < len(code) else None
+                if not (after and after.text == "("):
+                    self.aliases.setdefault(nxt.name.lower(), None)
+            elif token.text == ")" and nxt is not None and nxt.kind == "word" and nxt.name:
+                self.aliases.setdefault(nxt.name.lower(), None)
+            elif name is not None and nxt is not None and nxt.kind == "word" and nxt.text.upper() == "AS":
+                after = code[index + 2] if index + 2 < len(code) else None
+                if after is not None and after.text == "(":
+                    # CTE：name AS (...)
+                    self.aliases.setdefault(name.lower(), None)
+
+    @staticmethod
+    def _alias_after(code: List[Token], index: int) -> Optional[str]:
+        if index < len(code) and code[index].kind == "word" and code[index].text.upper() == "AS":
+            index += 1
+        if index < len(code) and code[index].name and code[index].kind in ("word", "quoted"):
+            following = code[index + 1] if index + 1 < len(code) else None
+            if not (following and following.text in (".", "(")):
+                return code[index].name
+        return None
+
+
+class SqlValidator:
+    """执行前的 SQL 校验器（schema 按数据库版本缓存，校验结果按 SQL 缓存，线程安全）"""
+
+    def __init__(self, enabled: bool = DEFAULT_VALIDATOR_ENABLED, autofix: bool = DEFAULT_VALIDATOR_AUTOFIX,
+                 cutoff: float = DEFAULT_MATCH_CUTOFF, max_passes: int = DEFAULT_MAX_PASSES,
+                 max_cached: int = DEFAULT_MAX_CACHED):
+        self.enabled = enabled
+        self.autofix = autofix
+        self.cutoff = cutoff
+        self.max_passes = max(max_passes, 1)
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        self._catalogs: Dict[str, Tuple[str, SchemaCatalog]] = {}
+        self._results: "OrderedDict[Tuple[str, str, str], ValidationResult]" = OrderedDict()
+        self.checked = 0
+        self.passed = 0
+        self.fixed = 0
+        self.rejected = 0
+        self.iterations_saved = 0
+        self.fixes_by_type: Dict[str, int] = {}
+        self.diagnostics_by_type: Dict[str, int] = {}
+
+    def catalog(self, conn: sqlite3.Connection, database_path: str, database_version: str) -> SchemaCatalog:
+        with self._lock:
+            cached = self._catalogs.get(database_path)
+        if cached is not None and cached[0] == database_version:
+            return cached[1]
+        catalog = SchemaCatalog.load(conn)
+        with self._lock:
+            self._catalogs[database_path] = (database_version, catalog)
+        return catalog
+
+    def validate(self, conn: sqlite3.Connection, query: str, database_path: str,
+                 database_version: str) -> ValidationResult:
+        """校验（并在允许时修正）一条 SQL；未启用或无法校验的语句原样通过"""
+        if not self.enabled:
+            return ValidationResult(query, query)
+        key = (database_path, database_version, query)
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is not None:
+                self._results.move_to_end(key)
+        if cached is None:
+            cached = self._validate(conn, query, self.catalog(conn, database_path, database_version))
+            with self._lock:
+                self._results[key] = cached
+                while len(self._results) > self.max_cached:
+                    self._results.popitem(last=False)
+        self._count(cached)
+        return cached
+
+    def _count(self, result: ValidationResult) -> None:
+        with self._lock:
+            self.checked += 1
+            if result.rejected:
+                self.rejected += 1
+                for diagnostic in result.diagnostics:
+                    self.diagnostics_by_type[diagnostic.type] = self.diagnostics_by_type.get(diagnostic.type, 0) + 1
+            elif result.fixes:
+                self.fixed += 1
+                # 只改了大小写的语句本来也能执行，不算省掉的迭代
+                if any(fix.type != "case" for fix in result.fixes):
+                    self.iterations_saved += 1
+            else:
+                self.passed += 1
+            for fix in result.fixes:
+                self.fixes_by_type[fix.type] = self.fixes_by_type.get(fix.type, 0) + 1
+
+    def _validate(self, conn: sqlite3.Connection, query: str, catalog: SchemaCatalog) -> ValidationResult:
+        result = ValidationResult(query, query)
+        if query.lstrip()[:7].upper() == "EXPLAIN":
+            return result
+        tokens = tokenize(query)
+        if self.autofix:
+            self._strip_prefixes(tokens, catalog, result)
+            self._normalize_case(tokens, catalog, result)
+            result.query = _render(tokens)
+        for _ in range(self.max_passes):
+            error = self._compile(conn, result.query)
+            if error is None:
+                return result
+            if error == "":
+                # 多条语句等无法单独编译的情况，交给执行阶段处理
+                return result
+            fix, diagnostic = self._repair(tokens, catalog, error)
+            if fix is None or not self.autofix:
+                if diagnostic is None:
+                    diagnostic = SqlDiagnostic(self._error_type(error), error)
+                if fix is not None:
+                    diagnostic.candidates = [fix.replacement]
+                self._locate(result.query, diagnostic)
+                result.diagnostics.append(diagnostic)
+                return result
+            result.fixes.append(fix)
+            result.query = _render(tokens)
+        result.diagnostics.append(SqlDiagnostic("error", "the query could not be repaired automatically"))
+        return result
+
+    @staticmethod
+    def _compile(conn: sqlite3.Connection, query: str) -> Optional[str]:
+        """只编译不执行：成功返回 None，失败返回错误信息；无法单独编译时返回空字符串"""
+        try:
+            conn.execute("EXPLAIN " + query).close()
+        except sqlite3.OperationalError as e:
+            return str(e)
+        except (sqlite3.ProgrammingError, sqlite3.Warning):
+            return ""
+        except sqlite3.Error as e:
+            return str(e)
+        return None
+
+    @staticmethod
+    def _error_type(error: str) -> str:
+        if "syntax error" in error or "incomplete input" in error:
+            return "syntax"
+        return "error"
+
+    # ---- 编译前的修正 ----
+
+    @staticmethod
+    def _chains(tokens: List[Token]) -> List[List[int]]:
+        """以 '.' 连接的标识符序列（token 下标），如 a.b.c"""
+        chains, index = [], 0
+        while index < len(tokens):
+            if tokens[index].kind in ("word", "quoted") and tokens[index].name is not None:
+                chain = [index]
+                while (index + 2 < len(tokens) and tokens[index + 1].text == "."
+                       and tokens[index + 2].kind in ("word", "quoted")):
+                    index += 2
+                    chain.append(index)
+                if len(chain) > 1:
+                    chains.append(chain)
+            index += 1
+        return chains
+
+    def _strip_prefixes(self, tokens: List[Token], catalog: SchemaCatalog, result: ValidationResult) -> None:
+        """去掉表名前不存在的库名前缀（如 STREAM_HACKATHON.STREAMLIT.）；main / temp / 已附加的库保留"""
+        scope = _Scope(tokens, catalog)
+        all_columns = catalog.all_columns()
+        for chain in reversed(self._chains(tokens)):
+            names = [tokens[index].name or tokens[index].text for index in chain]
+            first = names[0].lower()
+            if first in catalog.schemas or first in catalog.tables or first in scope.aliases:
+                continue
+            position = next((i for i in range(1, len(names)) if names[i].lower() in catalog.tables), None)
+            if position is None and len(names) >= 3:
+                # 三段以上的名称只能是 库.表.列；表名也拼错时按近似表名定位，表名留给编译阶段修正
+                position = next((i for i in range(1, len(names)) if self._closest(names[i], catalog.tables)[0]), None)
+            if position is None:
+                continue
+            if position == len(names) - 1 == 1 and names[1].lower() in all_columns:
+                # a.B 中 B 既是表名又是列名时，a 更可能是别名
+                continue
+            original = ".".join(names[:position + 1])
+            del tokens[chain[0]:chain[position]]
+            self._add_fix(result, SqlFix("schema_prefix", original, names[position]))
+
+    def _normalize_case(self, tokens: List[Token], catalog: SchemaCatalog, result: ValidationResult) -> None:
+        """表名、列名统一为 schema 中的写法（SQLite 标识符不区分大小写，只影响可读性和缓存命中）"""
+        scope = _Scope(tokens, catalog)
+        columns = catalog.all_columns()
+        code = [index for index, token in enumerate(tokens) if token.kind not in ("space", "comment")]
+        for position, index in enumerate(code):
+            token = tokens[index]
+            if token.kind != "word" or token.name is None:
+                continue
+            prev = tokens[code[position - 1]] if position else None
+            nxt = tokens[code[position + 1]] if position + 1 < len(code) else None
+            if (nxt is not None and nxt.text == "(") or (prev is not None and prev.text.upper() == "AS"):
+                continue
+            lower = token.text.lower()
+            if lower in scope.aliases and scope.aliases[lower] is None:
+                continue
+            canonical = catalog.tables.get(lower) if not (prev and prev.text == ".") else None
+            if canonical is None and lower not in scope.aliases:
+                canonical = columns.get(lower)
+            if canonical and canonical != token.text:
+                self._add_fix(result, SqlFix("case", token.text, canonical))
+                token.text = canonical
+
+    # ---- 编译错误的修正 ----
+
+    def _repair(self, tokens: List[Token], catalog: SchemaCatalog,
+                error: str) -> Tuple[Optional[SqlFix], Optional[SqlDiagnostic]]:
+        """根据 SQLite 的错误信息尝试修正，返回（修正, 诊断）；有唯一修正时就地修改 tokens"""
+        scope = _Scope(tokens, catalog)
+        match = _NO_SUCH_COLUMN.search(error)
+        if match:
+            qualifier, _, name = match.group(1).rpartition(".")
+            if qualifier:
+                table = scope.aliases.get(qualifier.lower()) or catalog.tables.get(qualifier.lower())
+                candidates = catalog.all_columns([table] if table else scope.tables or None)
+            else:
+                candidates = catalog.all_columns(scope.tables or None)
+                candidates.update({alias: alias for alias, table in scope.aliases.items() if table is None})
+            replacement, close = self._closest(name, candidates)
+            diagnostic = SqlDiagnostic("unknown_column", error, match.group(1), close or sorted(candidates.values())[:20])
+            if replacement and self._replace(tokens, name, replacement, qualifier or None):
+                return SqlFix("column", match.group(1), f"{qualifier}.{replacement}" if qualifier else replacement), diagnostic
+            return None, diagnostic
+
+        match = _NO_SUCH_TABLE.search(error) or _UNKNOWN_DATABASE.search(error)
+        if match:
+            qualifier, _, name = match.group(1).rpartition(".")
+            if match.re is _UNKNOWN_DATABASE:
+                qualifier, name = name, ""
+            if qualifier and (not name or name.lower() in catalog.tables):
+                if self._drop_qualifier(tokens, qualifier):
+                    return SqlFix("schema_prefix", match.group(1), name or ""), None
+            replacement, close = self._closest(name, catalog.tables) if name else (None, [])
+            diagnostic = SqlDiagnostic(
+                "unknown_database" if match.re is _UNKNOWN_DATABASE else "unknown_table",
+                error, match.group(1), close or sorted(catalog.tables.values()),
+            )
+            if replacement and self._replace(tokens, name, replacement, None):
+                return SqlFix("table", match.group(1), replacement), diagnostic
+            return None, diagnostic
+
+        match = _AMBIGUOUS_COLUMN.search(error)
+        if match:
+            name = match.group(1)
+            candidates = []
+            for table in scope.tables:
+                if name.lower() in catalog.columns.get(table, {}):
+                    aliases = [alias for alias, target in scope.aliases.items() if target == table]
+                    candidates.append(f"{aliases[0] if aliases else table}.{catalog.columns[table][name.lower()]}")
+            return None, SqlDiagnostic("ambiguous_column", error, name, candidates)
+
+        match = _NEAR.search(error)
+        if match:
+            return None, SqlDiagnostic("syntax", error, match.group(1) or None)
+        return None, None
+
+    def _closest(self, name: str, candidates: Dict[str, str]) -> Tuple[Optional[str], List[str]]:
+        """唯一的近似名称（忽略下划线后相同，或相似度明显高于其他候选），以及候选列表"""
+        squashed = [value for value in candidates.values() if _squash(value) == _squash(name)]
+        if len(set(squashed)) == 1:
+            return squashed[0], squashed
+        scored = sorted(
+            ((difflib.SequenceMatcher(None, name.lower(), lower).ratio(), value) for lower, value in candidates.items()),
+            reverse=True,
+        )
+        close = [value for score, value in scored[:3] if score >= self.cutoff]
+        if len(close) == 1 or (len(close) > 1 and scored[0][0] - scored[1][0] >= 0.1):
+            return close[0], close
+        return None, close
+
+    @staticmethod
+    def _replace(tokens: List[Token], name: str, replacement: str, qualifier: Optional[str]) -> bool:
+        """替换标识符（有限定名时只替换 qualifier.name 形式的引用）"""
+        replaced = False
+        for index, token in enumerate(tokens):
+            if token.name is None or token.name.lower() != name.lower():
+                continue
+            preceded = index >= 2 and tokens[index - 1].text == "."
+            if qualifier:
+                if not preceded or (tokens[index - 2].name or "").lower() != qualifier.lower():
+                    continue
+            elif preceded or (index + 1 < len(tokens) and tokens[index + 1].text == "("):
+                continue
+            token.text = replacement if token.kind == "word" else f'"{replacement}"'
+            replaced = True
+        return replaced
+
+    @staticmethod
+    def _drop_qualifier(tokens: List[Token], qualifier: str) -> bool:
+        """删除 qualifier. 前缀（qualifier 可以是多段，如 A.B）"""
+        parts = [part.lower() for part in qualifier.split(".")]
+        dropped = False
+        index = 0
+        while index < len(tokens):
+            names = []
+            cursor = index
+            while len(names) < len(parts) and cursor + 1 < len(tokens) and tokens[cursor].name is not None \
+                    and tokens[cursor + 1].text == ".":
+                names.append(tokens[cursor].name.lower())
+                cursor += 2
+            if names == parts and not (index >= 1 and tokens[index - 1].text == "."):
+                del tokens[index:cursor]
+                dropped = True
+            index += 1
+        return dropped
+
+    @staticmethod
+    def _add_fix(result: ValidationResult, fix: SqlFix) -> None:
+        if all((existing.type, existing.original) != (fix.type, fix.original) for existing in result.fixes):
+            result.fixes.append(fix)
+
+    @staticmethod
+    def _locate(query: str, diagnostic: SqlDiagnostic) -> None:
+        """诊断中补充标识符在语句中的位置（行、列从 1 开始）"""
+        if not diagnostic.identifier:
+            return
+        target = diagnostic.identifier.rpartition(".")[2]
+        match = re.search(rf"(?<![\w$]){re.escape(target)}(?![\w$])", query, re.I) or \
+            re.search(re.escape(target), query, re.I)
+        if match is None:
+            return
+        before = query[:match.start()]
+        diagnostic.line = before.count("\n") + 1
+        diagnostic.column = match.start() - (before.rfind("\n") + 1) + 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "autofix": self.autofix,
+                "checked": self.checked,
+                "passed": self.passed,
+                "fixed": self.fixed,
+                "rejected": self.rejected,
+                "iterations_saved": self.iterations_saved,
+                "fixes_by_type": dict(self.fixes_by_type),
+                "diagnostics_by_type": dict(self.diagnostics_by_type),
+            }
+
+
+sql_validator = SqlValidator()
@@ -0,0 +1,617 @@
+"""
+SQLite 持久化 checkpointer
+
+会话状态以前保存在进程内的 MemorySaver 中，重启即丢失。现在 LangGraph 的 checkpoint 写入本地 SQLite 文件，
+服务重启后会话可以继续：
+- WAL 模式 + synchronous=NORMAL：读不阻塞写，多个进程（如多个 worker、管理脚本）可以安全地打开同一个文件；
+  写事务以 BEGIN IMMEDIATE 开始，遇到其他进程持有写锁时等待 busy_timeout
+- 写入批量提交：节点执行过程中的 put_writes 先缓存在进程内，随该步结束时的 put 在同一个事务中提交
+  （缓存超过 CHATBI_CHECKPOINT_WRITE_BATCH 条、写入错误 / 中断等特殊通道、或读取前都会立即提交）
+- 通道值按 (会话, 通道, 版本) 单独保存，未变化的通道不会重复写入；
+  序列化后超过 CHATBI_CHECKPOINT_COMPRESS_MIN_BYTES 的数据用 zlib 压缩
+- 每个会话只保留最近 CHATBI_CHECKPOINT_KEEP_PER_THREAD 个 checkpoint，更早的 checkpoint、
+  它们的待写入记录以及不再被引用的通道值在写入新 checkpoint 的同一事务中删除
+- 会话最近一次使用时间（touch_thread）保存在 threads 表中，空闲回收在所有进程和重启之后看到同一个时间
+
+共享文件不等于多个 worker 可以任意处理同一会话的请求：同一会话的串行执行（admission）、流式重放缓冲区、
+SQL 分页游标和各类缓存仍在进程内，多 worker 部署仍需要按 session_id 做粘性路由。
+
+CHATBI_CHECKPOINTER=memory 时仍使用 MemorySaver（单进程开发调试）。
+"""
+import asyncio
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+import weakref
+import zlib
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    WRITES_IDX_MAP,
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    get_checkpoint_id,
+    get_checkpoint_metadata,
+)
+from langgraph.checkpoint.memory import MemorySaver
+
+DEFAULT_CHECKPOINTER = os.getenv("CHATBI_CHECKPOINTER", "sqlite").lower()
+# 相对路径按项目根目录解析（而不是启动时的工作目录）；data/ 已在 .gitignore 中
+_PROJECT_ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_CHECKPOINT_DB = str(_PROJECT_ROOT / (os.getenv("CHATBI_CHECKPOINT_DB") or "data/checkpoints.db"))
+DEFAULT_CHECKPOINT_KEEP_PER_THREAD = int(os.getenv("CHATBI_CHECKPOINT_KEEP_PER_THREAD", "10"))
+DEFAULT_CHECKPOINT_WRITE_BATCH = int(os.getenv("CHATBI_CHECKPOINT_WRITE_BATCH", "64"))
+DEFAULT_CHECKPOINT_COMPRESS_MIN_BYTES = int(os.getenv("CHATBI_CHECKPOINT_COMPRESS_MIN_BYTES", "1024"))
+DEFAULT_CHECKPOINT_COMPRESS_LEVEL = int(os.getenv("CHATBI_CHECKPOINT_COMPRESS_LEVEL", "6"))
+DEFAULT_CHECKPOINT_BUSY_TIMEOUT_SECONDS = float(os.getenv("CHATBI_CHECKPOINT_BUSY_TIMEOUT_SECONDS", "30"))
+
+# 压缩过的数据在类型名后加这个后缀
+COMPRESSED_SUFFIX = "+zlib"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    parent_checkpoint_id TEXT,
+    type TEXT NOT NULL,
+    checkpoint BLOB NOT NULL,
+    metadata_type TEXT NOT NULL,
+    metadata BLOB NOT NULL,
+    channel_versions TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id)
+);
+CREATE TABLE IF NOT EXISTS blobs (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    channel TEXT NOT NULL,
+    version TEXT NOT NULL,
+    type TEXT NOT NULL,
+    blob BLOB,
+    PRIMARY KEY (thread_id, checkpoint_ns, channel, version)
+);
+CREATE TABLE IF NOT EXISTS writes (
+    thread_id TEXT NOT NULL,
+    checkpoint_ns TEXT NOT NULL DEFAULT '',
+    checkpoint_id TEXT NOT NULL,
+    task_id TEXT NOT NULL,
+    idx INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    type TEXT NOT NULL,
+    value BLOB,
+    task_path TEXT NOT NULL DEFAULT '',
+    PRIMARY KEY (thread_id, checkpoint_ns, checkpoint_id, task_id, idx)
+);
+CREATE TABLE IF NOT EXISTS threads (
+    thread_id TEXT PRIMARY KEY,
+    last_access REAL NOT NULL
+);
+"""
+
+# put_writes 的缓存行：(是否覆盖已有记录, writes 表的一行)
+PendingRow = Tuple[bool, Tuple[Any, ...]]
+
+
+class SQLiteCheckpointSaver(BaseCheckpointSaver[str]):
+    """SQLite 持久化 checkpointer（线程安全；多进程通过 SQLite 文件锁协调）"""
+
+    def __init__(self, database_path: str = DEFAULT_CHECKPOINT_DB,
+                 keep_per_thread: int = DEFAULT_CHECKPOINT_KEEP_PER_THREAD,
+                 write_batch: int = DEFAULT_CHECKPOINT_WRITE_BATCH,
+                 compress_min_bytes: int = DEFAULT_CHECKPOINT_COMPRESS_MIN_BYTES,
+                 compress_level: int = DEFAULT_CHECKPOINT_COMPRESS_LEVEL,
+                 busy_timeout: float = DEFAULT_CHECKPOINT_BUSY_TIMEOUT_SECONDS, serde=None):
+        super().__init__(serde=serde)
+        self.database_path = database_path
+        # 0 表示不清理；至少保留 2 个，保证最新 checkpoint 的父节点可用
+        self.keep_per_thread = max(keep_per_thread, 2) if keep_per_thread > 0 else 0
+        self.write_batch = max(write_batch, 0)
+        self.compress_min_bytes = compress_min_bytes
+        self.compress_level = compress_level
+        self._lock = threading.RLock()
+        self._pending: List[PendingRow] = []
+        self._stats = {
+            "puts": 0, "writes": 0, "transactions": 0, "reads": 0,
+            "bytes_raw": 0, "bytes_stored": 0, "compressed_values": 0,
+            "pruned_checkpoints": 0, "pruned_blobs": 0, "deleted_threads": 0,
+        }
+
+        Path(database_path).parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None：事务由 _transaction 显式控制
+        self._conn = sqlite3.connect(database_path, timeout=busy_timeout, check_same_thread=False,
+                                     isolation_level=None)
+        self.journal_mode = self._conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+        self._conn.execute("PRAGMA synchronous = NORMAL")
+        self._conn.executescript(SCHEMA)
+
+    # ---------- 编码 ----------
+
+    def _encode(self, value: Any) -> Tuple[str, bytes]:
+        type_, data = self.serde.dumps_typed(value)
+        stored = data
+        if self.compress_min_bytes >= 0 and len(data) >= self.compress_min_bytes:
+            compressed = zlib.compress(data, self.compress_level)
+            if len(compressed) < len(data):
+                type_, stored = type_ + COMPRESSED_SUFFIX, compressed
+                self._stats["compressed_values"] += 1
+        self._stats["bytes_raw"] += len(data)
+        self._stats["bytes_stored"] += len(stored)
+        return type_, stored
+
+    def _decode(self, type_: str, data: Optional[bytes]) -> Any:
+        if type_.endswith(COMPRESSED_SUFFIX):
+            type_, data = type_[:-len(COMPRESSED_SUFFIX)], zlib.decompress(data)
+        return self.serde.loads_typed((type_, data))
+
+    # ---------- 事务 ----------
+
+    def _transaction(self, work) -> Any:
+        """在一个写事务中执行 work(conn)，并把缓存的 put_writes 一起提交；调用方需持有 self._lock"""
+        conn = self._conn
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._write_pending(conn)
+            result = work(conn) if work else None
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._pending.clear()
+        self._stats["transactions"] += 1
+        return result
+
+    def _write_pending(self, conn: sqlite3.Connection) -> None:
+        for replace, row in self._pending:
+            verb = "INSERT OR REPLACE" if replace else "INSERT OR IGNORE"
+            conn.execute(f"{verb} INTO writes (thread_id, checkpoint_ns, checkpoint_id, task_id, idx, channel, "
+                         f"type, value, task_path) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", row)
+
+    def flush(self) -> None:
+        """立即提交缓存的 put_writes"""
+        with self._lock:
+            if self._pending:
+                self._transaction(None)
+
+    # ---------- 读取 ----------
+
+    def _load_tuple(self, conn: sqlite3.Connection, thread_id: str, checkpoint_ns: str,
+                    row: Tuple[Any, ...], metadata: Optional[CheckpointMetadata] = None) -> CheckpointTuple:
+        checkpoint_id, parent_checkpoint_id, type_, data, metadata_type, metadata_data = row
+        checkpoint = self._decode(type_, data)
+        channel_values = {}
+        for channel, version in checkpoint["channel_versions"].items():
+            blob = conn.execute(
+                "SELECT type, blob FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?",
+                (thread_id, checkpoint_ns, channel, str(version)),
+            ).fetchone()
+            if blob and blob[0] != "empty":
+                channel_values[channel] = self._decode(*blob)
+        writes = conn.execute(
+            "SELECT task_id, channel, type, value FROM writes WHERE thread_id = ? AND checkpoint_ns = ? "
+            "AND checkpoint_id = ? ORDER BY task_path, task_id, idx",
+            (thread_id, checkpoint_ns, checkpoint_id),
+        ).fetchall()
+        return CheckpointTuple(
+            config={"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                     "checkpoint_id": checkpoint_id}},
+            checkpoint={**checkpoint, "channel_values": channel_values},
+            metadata=metadata if metadata is not None else self._decode(metadata_type, metadata_data),
+            pending_writes=[(task_id, channel, self._decode(t, v)) for task_id, channel, t, v in writes],
+            parent_config=(
+                {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                  "checkpoint_id": parent_checkpoint_id}}
+                if parent_checkpoint_id else None
+            ),
+        )
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        columns = "checkpoint_id, parent_checkpoint_id, type, checkpoint, metadata_type, metadata"
+        with self._lock:
+            self.flush()
+            self._stats["reads"] += 1
+            if checkpoint_id := get_checkpoint_id(config):
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                    (thread_id, checkpoint_ns, checkpoint_id),
+                ).fetchone()
+            else:
+                row = self._conn.execute(
+                    f"SELECT {columns} FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+                    f"ORDER BY checkpoint_id DESC LIMIT 1",
+                    (thread_id, checkpoint_ns),
+                ).fetchone()
+            return self._load_tuple(self._conn, thread_id, checkpoint_ns, row) if row else None
+
+    def list(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+             before: Optional[RunnableConfig] = None, limit: Optional[int] = None) -> Iterator[CheckpointTuple]:
+        clauses, params = [], []
+        if config:
+            clauses.append("thread_id = ?")
+            params.append(config["configurable"]["thread_id"])
+            if (checkpoint_ns := config["configurable"].get("checkpoint_ns")) is not None:
+                clauses.append("checkpoint_ns = ?")
+                params.append(checkpoint_ns)
+            if checkpoint_id := get_checkpoint_id(config):
+                clauses.append("checkpoint_id = ?")
+                params.append(checkpoint_id)
+        if before and (before_id := get_checkpoint_id(before)):
+            clauses.append("checkpoint_id < ?")
+            params.append(before_id)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        # 先取出结果再逐个返回，避免调用方迭代期间长时间持有锁
+        results = []
+        with self._lock:
+            self.flush()
+            self._stats["reads"] += 1
+            rows = self._conn.execute(
+                f"SELECT thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, type, checkpoint, "
+                f"metadata_type, metadata FROM checkpoints {where} ORDER BY checkpoint_id DESC",
+                params,
+            ).fetchall()
+            for thread_id, checkpoint_ns, *row in rows:
+                if limit is not None and len(results) >= limit:
+                    break
+                metadata = self._decode(row[4], row[5])
+                if filter and not all(metadata.get(key) == value for key, value in filter.items()):
+                    continue
+                results.append(self._load_tuple(self._conn, thread_id, checkpoint_ns, tuple(row), metadata))
+        yield from results
+
+    # ---------- 写入 ----------
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+            new_versions: ChannelVersions) -> RunnableConfig:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_copy = checkpoint.copy()
+        values: Dict[str, Any] = checkpoint_copy.pop("channel_values")
+
+        with self._lock:
+            blobs = [
+                (thread_id, checkpoint_ns, channel, str(version),
+                 *(self._encode(values[channel]) if channel in values else ("empty", None)))
+                for channel, version in new_versions.items()
+            ]
+            type_, data = self._encode(checkpoint_copy)
+            # 与 MemorySaver 一致：元数据合并 config 中非内部的 configurable / metadata 字段
+            metadata_type, metadata_data = self._encode(get_checkpoint_metadata(config, metadata))
+            versions = json.dumps({channel: str(version) for channel, version in checkpoint["channel_versions"].items()})
+
+            def work(conn: sqlite3.Connection) -> None:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO blobs (thread_id, checkpoint_ns, channel, version, type, blob) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", blobs,
+                )
+                conn.execute(
+                    "INSERT OR REPLACE INTO checkpoints (thread_id, checkpoint_ns, checkpoint_id, parent_checkpoint_id, "
+                    "type, checkpoint, metadata_type, metadata, channel_versions, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread_id, checkpoint_ns, checkpoint["id"], config["configurable"].get("checkpoint_id"),
+                     type_, data, metadata_type, metadata_data, versions, time.time()),
+                )
+                self._prune(conn, thread_id, checkpoint_ns)
+
+            self._transaction(work)
+            self._stats["puts"] += 1
+        return {"configurable": {"thread_id": thread_id, "checkpoint_ns": checkpoint_ns,
+                                 "checkpoint_id": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                   task_path: str = "") -> None:
+        thread_id = config["configurable"]["thread_id"]
+        checkpoint_ns = config["configurable"].get("checkpoint_ns", "")
+        checkpoint_id = config["configurable"]["checkpoint_id"]
+        special = False
+        with self._lock:
+            for idx, (channel, value) in enumerate(writes):
+                write_idx = WRITES_IDX_MAP.get(channel, idx)
+                special = special or channel in WRITES_IDX_MAP
+                # 与 MemorySaver 一致：普通写入不覆盖已有记录，错误 / 中断等特殊写入覆盖
+                self._pending.append((write_idx < 0, (thread_id, checkpoint_ns, checkpoint_id, task_id, write_idx,
+                                                      channel, *self._encode(value), task_path)))
+            self._stats["writes"] += len(writes)
+            # 特殊写入（错误、中断）之后通常没有 put，不能留在缓存中
+            if special or len(self._pending) >= self.write_batch:
+                self._transaction(None)
+
+    def _prune(self, conn: sqlite3.Connection, thread_id: str, checkpoint_ns: str) -> None:
+        """只保留会话最近的 keep_per_thread 个 checkpoint，并删除不再被引用的通道值"""
+        if not self.keep_per_thread:
+            return
+        stale = [row[0] for row in conn.execute(
+            "SELECT checkpoint_id FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? "
+            "ORDER BY checkpoint_id DESC LIMIT -1 OFFSET ?",
+            (thread_id, checkpoint_ns, self.keep_per_thread),
+        )]
+        if not stale:
+            return
+        for checkpoint_id in stale:
+            conn.execute("DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                         (thread_id, checkpoint_ns, checkpoint_id))
+            conn.execute("DELETE FROM writes WHERE thread_id = ? AND checkpoint_ns = ? AND checkpoint_id = ?",
+                         (thread_id, checkpoint_ns, checkpoint_id))
+        referenced = set()
+        for (versions,) in conn.execute(
+            "SELECT channel_versions FROM checkpoints WHERE thread_id = ? AND checkpoint_ns = ?",
+            (thread_id, checkpoint_ns),
+        ):
+            referenced.update(json.loads(versions).items())
+        orphaned = [
+            (thread_id, checkpoint_ns, channel, version)
+            for channel, version in conn.execute(
+                "SELECT channel, version FROM blobs WHERE thread_id = ? AND checkpoint_ns = ?",
+                (thread_id, checkpoint_ns),
+            )
+            if (channel, version) not in referenced
+        ]
+        conn.executemany(
+            "DELETE FROM blobs WHERE thread_id = ? AND checkpoint_ns = ? AND channel = ? AND version = ?", orphaned
+        )
+        self._stats["pruned_checkpoints"] += len(stale)
+        self._stats["pruned_blobs"] += len(orphaned)
+
+    def delete_thread(self, thread_id: str) -> None:
+        """删除会话的全部 checkpoint、待写入记录与通道值"""
+        def work(conn: sqlite3.Connection) -> None:
+            for table in ("checkpoints", "blobs", "writes", "threads"):
+                conn.execute(f"DELETE FROM {table} WHERE thread_id = ?", (thread_id,))
+
+        with self._lock:
+            self._pending = [row for row in self._pending if row[1][0] != thread_id]
+            self._transaction(work)
+            self._stats["deleted_threads"] += 1
+
+    def touch_thread(self, thread_id: str, at: Optional[float] = None) -> None:
+        """记录会话最近一次使用的时间（只会向后推进）"""
+        def work(conn: sqlite3.Connection) -> None:
+            conn.execute(
+                "INSERT INTO threads (thread_id, last_access) VALUES (?, ?) "
+                "ON CONFLICT(thread_id) DO UPDATE SET last_access = MAX(last_access, excluded.last_access)",
+                (thread_id, time.time() if at is None else at),
+            )
+
+        with self._lock:
+            self._transaction(work)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        """与 MemorySaver 相同的字符串版本号：递增序号 + 随机后缀，按字符串比较单调递增"""
+        if current is None:
+            current_v = 0
+        elif isinstance(current, int):
+            current_v = current
+        else:
+            current_v = int(current.split(".")[0])
+        return f"{current_v + 1:032}.{random.random():016}"
+
+    # ---------- 异步接口：在线程中执行同步实现，不阻塞事件循环 ----------
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(self, config: Optional[RunnableConfig], *, filter: Optional[Dict[str, Any]] = None,
+                    before: Optional[RunnableConfig] = None,
+                    limit: Optional[int] = None) -> AsyncIterator[CheckpointTuple]:
+        results = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for item in results:
+            yield item
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata,
+                   new_versions: ChannelVersions) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata, new_versions)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str,
+                          task_path: str = "") -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id, task_path)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    # ---------- 统计 ----------
+
+    def thread_sizes(self, thread_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        每个会话的存储占用：保留的 checkpoint 数、最近一次使用时间（touch_thread 与最近一次写入中较晚的一个）、
+        全部保留版本的字节数（bytes）、
+        最新状态（最新 checkpoint 及其引用的通道值）的字节数（state_bytes）；字节数为压缩后的大小
+
+        Args:
+            thread_id: 只统计这个会话；None 时统计全部会话
+        """
+        where, params = ("WHERE thread_id = ?", (thread_id,)) if thread_id is not None else ("", ())
+        sizes: Dict[str, Dict[str, Any]] = {}
+        with self._lock:
+            self.flush()
+            for thread, count, last_active, size in self._conn.execute(
+                f"SELECT thread_id, COUNT(*), MAX(created_at), SUM(length(checkpoint) + length(metadata)) "
+                f"FROM checkpoints {where} GROUP BY thread_id", params,
+            ):
+                sizes[thread] = {"checkpoints": count, "last_active": last_active, "bytes": size, "state_bytes": 0}
+            for thread, last_access in self._conn.execute(f"SELECT thread_id, last_access FROM threads {where}", params):
+                if thread in sizes:
+                    sizes[thread]["last_active"] = max(sizes[thread]["last_active"] or 0, last_access)
+            for table, column in (("blobs", "blob"), ("writes", "value")):
+                for thread, size in self._conn.execute(
+                    f"SELECT thread_id, SUM(length({column})) FROM {table} {where} GROUP BY thread_id", params,
+                ):
+                    if thread in sizes:
+                        sizes[thread]["bytes"] += size or 0
+            # 每个会话根命名空间下最新的 checkpoint
+            latest = "c.checkpoint_ns = '' AND c.checkpoint_id = (SELECT MAX(checkpoint_id) FROM checkpoints " \
+                     "WHERE thread_id = c.thread_id AND checkpoint_ns = '')"
+            if thread_id is not None:
+                latest += " AND c.thread_id = ?"
+            for thread, versions, size in self._conn.execute(
+                f"SELECT c.thread_id, c.channel_versions, length(c.checkpoint) + length(c.metadata) "
+                f"FROM checkpoints c WHERE {latest}", params,
+            ):
+                referenced = json.loads(versions).items()
+                blob_sizes = dict(
+                    ((channel, version), size or 0) for channel, version, size in self._conn.execute(
+                        "SELECT channel, version, length(blob) FROM blobs WHERE thread_id = ? AND checkpoint_ns = ''",
+                        (thread,),
+                    )
+                )
+                sizes[thread]["state_bytes"] = size + sum(blob_sizes.get(key, 0) for key in referenced)
+        return sizes
+
+    def thread_count(self) -> int:
+        with self._lock:
+            self.flush()
+            return self._conn.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints").fetchone()[0]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            pending = len(self._pending)
+            threads, checkpoints = self._conn.execute(
+                "SELECT COUNT(DISTINCT thread_id), COUNT(*) FROM checkpoints"
+            ).fetchone()
+        size = sum(
+            os.path.getsize(path) for path in (self.database_path, self.database_path + "-wal")
+            if os.path.exists(path)
+        )
+        return {
+            "backend": "sqlite",
+            "path": self.database_path,
+            "journal_mode": self.journal_mode,
+            "keep_per_thread": self.keep_per_thread,
+            "threads": threads,
+            "checkpoints": checkpoints,
+            "file_bytes": size,
+            "pending_writes": pending,
+            **stats,
+            "compression_ratio": round(stats["bytes_stored"] / stats["bytes_raw"], 4) if stats["bytes_raw"] else 1.0,
+        }
+
+
+def create_checkpointer(kind: str = DEFAULT_CHECKPOINTER, database_path: str = DEFAULT_CHECKPOINT_DB):
+    """按 CHATBI_CHECKPOINTER 创建 checkpointer；SQLite 文件无法打开时回退到 MemorySaver"""
+    if kind == "memory":
+        return MemorySaver()
+    try:
+        return SQLiteCheckpointSaver(database_path)
+    except (sqlite3.Error, OSError) as e:
+        print(f"[WARNING] Failed to open checkpoint database {database_path}, falling back to MemorySaver: {e}")
+        return MemorySaver()
+
+
+def checkpointer_stats(checkpointer) -> Dict[str, Any]:
+    if isinstance(checkpointer, SQLiteCheckpointSaver):
+        return checkpointer.stats()
+    return {"backend": "memory"}
+
+
+# MemorySaver 只在本进程内，最近使用时间也保存在本进程内
+_memory_last_access: "weakref.WeakKeyDictionary[MemorySaver, Dict[str, float]]" = weakref.WeakKeyDictionary()
+_memory_last_access_lock = threading.Lock()
+
+
+def _memory_thread_sizes(saver: MemorySaver, thread_id: Optional[str]) -> Dict[str, Dict[str, Any]]:
+    """MemorySaver 中各会话的占用（序列化后的字节数，即它在内存中保存的数据量）"""
+    threads = [thread_id] if thread_id is not None else list(saver.storage)
+    sizes: Dict[str, Dict[str, Any]] = {}
+    for thread in threads:
+        namespaces = saver.storage.get(thread)
+        if not namespaces:
+            continue
+        entry = {"checkpoints": 0, "last_active": None, "bytes": 0, "state_bytes": 0}
+        for checkpoints in list(namespaces.values()):
+            for checkpoint, metadata, _ in list(checkpoints.values()):
+                entry["checkpoints"] += 1
+                entry["bytes"] += len(checkpoint[1]) + len(metadata[1])
+        root = namespaces.get("")
+        if root:
+            latest = root[max(root)]
+            checkpoint = saver.serde.loads_typed(latest[0])
+            entry["last_active"] = _timestamp(checkpoint.get("ts"))
+            entry["state_bytes"] = len(latest[0][1]) + len(latest[1][1]) + sum(
+                len(saver.blobs.get((thread, "", channel, version), ("", b""))[1])
+                for channel, version in checkpoint["channel_versions"].items()
+            )
+        sizes[thread] = entry
+    with _memory_last_access_lock:
+        last_access = _memory_last_access.get(saver, {})
+        if thread_id is None:
+            # 顺便清理已被删除的会话
+            for thread in [thread for thread in last_access if thread not in sizes]:
+                del last_access[thread]
+        for thread, at in last_access.items():
+            if thread in sizes:
+                sizes[thread]["last_active"] = max(sizes[thread]["last_active"] or 0, at)
+    for key in list(saver.blobs):
+        if key[0] in sizes:
+            sizes[key[0]]["bytes"] += len(saver.blobs.get(key, ("", b""))[1])
+    for key in list(saver.writes):
+        if key[0] in sizes:
+            sizes[key[0]]["bytes"] += sum(len(write[2][1]) for write in list(saver.writes.get(key, {}).values()))
+    return sizes
+
+
+def _timestamp(ts: Optional[str]) -> Optional[float]:
+    from datetime import datetime
+    try:
+        return datetime.fromisoformat(ts).timestamp() if ts else None
+    except ValueError:
+        return None
+
+
+def thread_sizes(checkpointer, thread_id: Optional[str] = None) -> Dict[str, Dict[str, Any]]:
+    """两种 checkpointer 通用的会话占用统计，字段见 SQLiteCheckpointSaver.thread_sizes"""
+    if isinstance(checkpointer, SQLiteCheckpointSaver):
+        return checkpointer.thread_sizes(thread_id)
+    return _memory_thread_sizes(checkpointer, thread_id)
+
+
+def touch_thread(checkpointer, thread_id: str) -> None:
+    """记录会话最近一次使用的时间；SQLite checkpointer 保存在数据库中，所有进程共享"""
+    if isinstance(checkpointer, SQLiteCheckpointSaver):
+        checkpointer.touch_thread(thread_id)
+        return
+    with _memory_last_access_lock:
+        _memory_last_access.setdefault(checkpointer, {})[thread_id] = time.time()
+
+
+def count_threads(checkpointer) -> int:
+    """会话数（不统计占用，开销小）"""
+    if isinstance(checkpointer, SQLiteCheckpointSaver):
+        return checkpointer.thread_count()
+    return sum(1 for namespaces in list(checkpointer.storage.values()) if namespaces)
+
+
+def prune_thread(checkpointer, thread_id: str, keep: int = DEFAULT_CHECKPOINT_KEEP_PER_THREAD) -> int:
+    """
+    MemorySaver 不清理旧 checkpoint，每轮都会保存一份完整的消息列表；按与 SQLite 相同的规则只保留最近 keep 个，
+    返回删除的 checkpoint 数。SQLite checkpointer 在写入时已经清理，直接返回 0。调用方需保证该会话没有正在执行的运行
+    """
+    if isinstance(checkpointer, SQLiteCheckpointSaver) or keep <= 0:
+        return 0
+    keep = max(keep, 2)
+    removed = 0
+    for checkpoint_ns, checkpoints in list(checkpointer.storage.get(thread_id, {}).items()):
+        stale = sorted(checkpoints)[:-keep]
+        for checkpoint_id in stale:
+            checkpoints.pop(checkpoint_id, None)
+            checkpointer.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+        if not stale:
+            continue
+        removed += len(stale)
+        referenced = set()
+        for checkpoint, _, _ in list(checkpoints.values()):
+            referenced.update(checkpointer.serde.loads_typed(checkpoint)["channel_versions"].items())
+        for key in list(checkpointer.blobs):
+            if key[:2] == (thread_id, checkpoint_ns) and (key[2], key[3]) not in referenced:
+                checkpointer.blobs.pop(key, None)
+    return removed
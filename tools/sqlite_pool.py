@@ -0,0 +1,239 @@
+"""
+SQLite 连接池
+
+execute_sqlite_query 以前每次调用都 connect / close 一次，且以读写方式打开数据库，
+LLM 生成的任何非 SELECT 语句都会被直接提交。现在：
+- 查询使用只读连接池：URI 只读模式（mode=ro）打开，并设置 query_only、mmap_size、cache_size 等 pragma；
+  连接在调用之间复用，sqlite3 的语句缓存（cached_statements）随连接保留
+- 可选的 WAL 模式（读连接不会被写操作阻塞）：切换会改写数据库文件头并产生 -wal/-shm 文件，
+  而 tools/example.db 受版本控制，所以默认不切换。需要时显式执行一次
+  python -m tools.sqlite_pool wal（持久化在数据库文件中），或设置 CHATBI_SQLITE_WAL=true 在首次打开时切换
+- 写语句走单独的读写连接（串行执行），必须显式开启 CHATBI_SQLITE_ALLOW_WRITES
+
+连接池是线程安全的：工具在 LangChain 线程池中执行，连接以 check_same_thread=False 打开，
+同一时刻只会被一个线程使用。
+"""
+import argparse
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+DEFAULT_POOL_SIZE = int(os.getenv("CHATBI_SQLITE_POOL_SIZE", "8"))
+DEFAULT_POOL_TIMEOUT_SECONDS = float(os.getenv("CHATBI_SQLITE_POOL_TIMEOUT_SECONDS", "30"))
+DEFAULT_STATEMENT_CACHE_SIZE = int(os.getenv("CHATBI_SQLITE_STATEMENT_CACHE_SIZE", "256"))
+DEFAULT_MMAP_SIZE = int(os.getenv("CHATBI_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+DEFAULT_CACHE_SIZE_KIB = int(os.getenv("CHATBI_SQLITE_CACHE_SIZE_KIB", "16384"))
+DEFAULT_ENABLE_WAL = os.getenv("CHATBI_SQLITE_WAL", "false").lower() == "true"
+DEFAULT_ALLOW_WRITES = os.getenv("CHATBI_SQLITE_ALLOW_WRITES", "false").lower() == "true"
+
+
+class WriteNotAllowed(Exception):
+    """写语句被拒绝（未开启 CHATBI_SQLITE_ALLOW_WRITES）"""
+
+
+def is_readonly_error(error: sqlite3.Error) -> bool:
+    """只读连接上执行写语句时 SQLite 返回的错误"""
+    message = str(error).lower()
+    return "readonly" in message or "read-only" in message or "query_only" in message
+
+
+def enable_wal(database_path: str) -> Optional[str]:
+    """把数据库切换为 WAL 模式（需要写权限），返回当前的 journal_mode；失败时返回 None"""
+    try:
+        conn = sqlite3.connect(database_path)
+        try:
+            mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+            if mode.lower() != "wal":
+                mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+            return mode
+        finally:
+            conn.close()
+    except sqlite3.Error as e:
+        print(f"[WARNING] Failed to enable WAL for {database_path}: {e}")
+        return None
+
+
+class SQLiteConnectionPool:
+    """只读连接池"""
+
+    def __init__(
+        self,
+        database_path: str,
+        max_size: int = DEFAULT_POOL_SIZE,
+        timeout: float = DEFAULT_POOL_TIMEOUT_SECONDS,
+        statement_cache_size: int = DEFAULT_STATEMENT_CACHE_SIZE,
+        mmap_size: int = DEFAULT_MMAP_SIZE,
+        cache_size_kib: int = DEFAULT_CACHE_SIZE_KIB,
+    ):
+        self.database_path = database_path
+        self.max_size = max(max_size, 1)
+        self.timeout = timeout
+        self.statement_cache_size = statement_cache_size
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+
+        self._condition = threading.Condition()
+        self._idle: List[sqlite3.Connection] = []
+        self._size = 0
+        self.created = 0
+        self.reused = 0
+        self.waits = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        uri = Path(self.database_path).resolve().as_uri() + "?mode=ro"
+        conn = sqlite3.connect(
+            uri,
+            uri=True,
+            check_same_thread=False,
+            cached_statements=self.statement_cache_size,
+        )
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        # 负数表示以 KiB 为单位
+        conn.execute(f"PRAGMA cache_size = {-int(self.cache_size_kib)}")
+        conn.execute("PRAGMA temp_store = MEMORY")
+        return conn
+
+    def _acquire(self) -> sqlite3.Connection:
+        with self._condition:
+            if not self._idle and self._size >= self.max_size:
+                self.waits += 1
+                if not self._condition.wait_for(lambda: self._idle or self._size < self.max_size, self.timeout):
+                    raise TimeoutError(f"Timed out waiting for a SQLite connection ({self.max_size} in use)")
+            if self._idle:
+                self.reused += 1
+                # 后进先出：最近使用的连接页缓存最热
+                return self._idle.pop()
+            self._size += 1
+        try:
+            conn = self._connect()
+        except BaseException:
+            with self._condition:
+                self._size -= 1
+                self._condition.notify()
+            raise
+        self.created += 1
+        return conn
+
+    def _release(self, conn: sqlite3.Connection, broken: bool = False) -> None:
+        with self._condition:
+            if broken:
+                self._size -= 1
+            else:
+                self._idle.append(conn)
+            self._condition.notify()
+        if broken:
+            conn.close()
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """借出一个只读连接，用完归还；连接出现非 SQL 错误时丢弃"""
+        conn = self._acquire()
+        broken = False
+        try:
+            yield conn
+        except sqlite3.Error:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        except BaseException:
+            broken = True
+            raise
+        finally:
+            self._release(conn, broken)
+
+    def close(self) -> None:
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn in idle:
+            conn.close()
+
+    def stats(self) -> Dict[str, int]:
+        with self._condition:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "max_size": self.max_size,
+                "created": self.created,
+                "reused": self.reused,
+                "waits": self.waits,
+            }
+
+
+class SQLiteWriter:
+    """写语句通道：单个读写连接，串行执行"""
+
+    def __init__(self, database_path: str, allow_writes: bool = DEFAULT_ALLOW_WRITES):
+        self.database_path = database_path
+        self.allow_writes = allow_writes
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """借出读写连接（持锁），正常结束时提交，出错时回滚"""
+        if not self.allow_writes:
+            raise WriteNotAllowed(
+                "Write statements are disabled. Only read-only queries (SELECT / WITH ... SELECT) are allowed."
+            )
+        with self._lock:
+            if self._conn is None:
+                self._conn = sqlite3.connect(self.database_path, check_same_thread=False)
+            try:
+                yield self._conn
+                self._conn.commit()
+            except BaseException:
+                self._conn.rollback()
+                raise
+
+
+_pools: Dict[str, SQLiteConnectionPool] = {}
+_writers: Dict[str, SQLiteWriter] = {}
+_registry_lock = threading.Lock()
+
+
+def get_read_pool(database_path: str) -> SQLiteConnectionPool:
+    """按数据库路径获取只读连接池（开启 CHATBI_SQLITE_WAL 时首次创建时切换 WAL 模式）"""
+    with _registry_lock:
+        pool = _pools.get(database_path)
+        if pool is None:
+            if DEFAULT_ENABLE_WAL:
+                enable_wal(database_path)
+            pool = SQLiteConnectionPool(database_path)
+            _pools[database_path] = pool
+        return pool
+
+
+def get_writer(database_path: str) -> SQLiteWriter:
+    with _registry_lock:
+        writer = _writers.get(database_path)
+        if writer is None:
+            writer = SQLiteWriter(database_path)
+            _writers[database_path] = writer
+        return writer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Switch a SQLite database between WAL and rollback journal mode")
+    parser.add_argument("command", choices=["wal", "delete", "status"])
+    parser.add_argument("database", nargs="?", default=str(Path(__file__).resolve().parent / "example.db"))
+    args = parser.parse_args()
+
+    if args.command == "wal":
+        mode = enable_wal(args.database)
+    else:
+        conn = sqlite3.connect(args.database)
+        try:
+            pragma = "PRAGMA journal_mode" if args.command == "status" else "PRAGMA journal_mode=DELETE"
+            mode = conn.execute(pragma).fetchone()[0]
+        finally:
+            conn.close()
+    print(f"{args.database}: journal_mode={mode}")
+
+
+if __name__ == "__main__":
+    main()
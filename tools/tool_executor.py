@@ -0,0 +1,236 @@
+"""
+并发执行工具调用的 ToolNode
+
+模型一轮中发出多个工具调用（如 database_schema_rag 加两条 execute_sqlite_query）时，预置的 ToolNode
+每次都新建线程池执行，没有任何并发上限：SQLite 读连接池和 LLM 接口的并发都不受控制。ConcurrentToolNode：
+
+- 同一轮的工具调用提交到进程内共享的线程池（CHATBI_TOOL_WORKERS 个工作线程）并发执行；
+  异步运行（ainvoke / astream_events）时在事件循环上并发
+- 按工具分组限制并发（所有会话共享）：sqlite（读连接池，CHATBI_TOOL_SQLITE_CONCURRENCY）、
+  llm（内部调用大模型的工具，CHATBI_TOOL_LLM_CONCURRENCY）、其余工具（CHATBI_TOOL_DEFAULT_CONCURRENCY，0 表示不限）
+- 结果按调用顺序返回；每次调用的排队时间、执行时间和状态记录到图状态的 tool_timings 中
+  （只保留最近 CHATBI_TOOL_TIMINGS_KEPT 条，避免随会话无限增长）
+"""
+import asyncio
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.messages import ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.runnables.config import get_config_list
+from langgraph.prebuilt import ToolNode
+
+DEFAULT_TOOL_WORKERS = int(os.getenv("CHATBI_TOOL_WORKERS", "8"))
+DEFAULT_TOOL_TIMINGS_KEPT = int(os.getenv("CHATBI_TOOL_TIMINGS_KEPT", "200"))
+DEFAULT_GROUP_LIMITS = {
+    "sqlite": int(os.getenv("CHATBI_TOOL_SQLITE_CONCURRENCY", "4")),
+    "llm": int(os.getenv("CHATBI_TOOL_LLM_CONCURRENCY", "2")),
+    "default": int(os.getenv("CHATBI_TOOL_DEFAULT_CONCURRENCY", "0")),
+}
+
+# 工具名 -> 并发分组；未列出的工具（检索、搜索、MCP 工具等）属于 default
+TOOL_GROUPS = {
+    "execute_sqlite_query": "sqlite",
+    "execute_sqlite_batch": "sqlite",
+    "fetch_sqlite_page": "sqlite",
+    "text2sqlite_query": "llm",
+    "high_charts_json": "llm",
+}
+
+
+def keep_recent_timings(left: Optional[List[Dict[str, Any]]],
+                        right: Optional[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """tool_timings 的合并函数：追加本轮记录，只保留最近的若干条"""
+    merged = list(left or []) + list(right or [])
+    return merged[-DEFAULT_TOOL_TIMINGS_KEPT:] if DEFAULT_TOOL_TIMINGS_KEPT > 0 else merged
+
+
+class ConcurrencyLimiter:
+    """按分组限制并发的信号量集合（线程与协程共用同一组许可，线程安全）"""
+
+    def __init__(self, limits: Dict[str, int]):
+        self.limits = {group: limit for group, limit in limits.items() if limit > 0}
+        self._semaphores = {group: threading.BoundedSemaphore(limit) for group, limit in self.limits.items()}
+        self._lock = threading.Lock()
+        self.waits: Dict[str, int] = {}
+
+    def _record_wait(self, group: str) -> None:
+        with self._lock:
+            self.waits[group] = self.waits.get(group, 0) + 1
+
+    @contextmanager
+    def slot(self, group: str) -> Iterator[None]:
+        semaphore = self._semaphores.get(group)
+        if semaphore is None:
+            yield
+            return
+        if not semaphore.acquire(blocking=False):
+            self._record_wait(group)
+            semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+    @asynccontextmanager
+    async def aslot(self, group: str) -> AsyncIterator[None]:
+        """异步获取许可：轮询而不是占用线程等待，取消时不会泄漏许可"""
+        semaphore = self._semaphores.get(group)
+        if semaphore is None:
+            yield
+            return
+        if not semaphore.acquire(blocking=False):
+            self._record_wait(group)
+            delay = 0.002
+            while not semaphore.acquire(blocking=False):
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 0.05)
+        try:
+            yield
+        finally:
+            semaphore.release()
+
+
+class ToolStats:
+    """各工具的调用次数、失败次数、排队与执行耗时（线程安全）"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tools: Dict[str, Dict[str, float]] = {}
+        self.batches = 0
+        self.concurrent_batches = 0
+
+    def record(self, timing: Dict[str, Any]) -> None:
+        with self._lock:
+            stats = self._tools.setdefault(
+                timing["name"], {"calls": 0, "errors": 0, "total_ms": 0.0, "max_ms": 0.0, "queued_ms": 0.0},
+            )
+            stats["calls"] += 1
+            stats["errors"] += timing["status"] != "success"
+            stats["total_ms"] += timing["duration_ms"]
+            stats["max_ms"] = max(stats["max_ms"], timing["duration_ms"])
+            stats["queued_ms"] += timing["queued_ms"]
+
+    def record_batch(self, size: int) -> None:
+        with self._lock:
+            self.batches += 1
+            self.concurrent_batches += size > 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "concurrent_batches": self.concurrent_batches,
+                "tools": {
+                    name: {**stats, "avg_ms": stats["total_ms"] / stats["calls"] if stats["calls"] else 0.0}
+                    for name, stats in self._tools.items()
+                },
+            }
+
+
+tool_limiter = ConcurrencyLimiter(DEFAULT_GROUP_LIMITS)
+tool_stats = ToolStats()
+_tool_executor = ThreadPoolExecutor(max_workers=max(DEFAULT_TOOL_WORKERS, 1), thread_name_prefix="agent-tools")
+
+
+def tool_execution_stats() -> Dict[str, Any]:
+    return {
+        "workers": max(DEFAULT_TOOL_WORKERS, 1),
+        "limits": dict(tool_limiter.limits),
+        "waits": dict(tool_limiter.waits),
+        **tool_stats.snapshot(),
+    }
+
+
+class ConcurrentToolNode(ToolNode):
+    """并发执行同一轮工具调用、按分组限流并记录耗时的 ToolNode"""
+
+    def __init__(self, tools: Sequence[Any], *, name: str = "tools",
+                 limiter: ConcurrencyLimiter = tool_limiter,
+                 executor: ThreadPoolExecutor = _tool_executor,
+                 groups: Optional[Dict[str, str]] = None, **kwargs: Any):
+        super().__init__(tools, name=name, **kwargs)
+        self.limiter = limiter
+        self.executor = executor
+        self.groups = dict(TOOL_GROUPS if groups is None else groups)
+
+    def _group(self, call: Dict[str, Any]) -> str:
+        return self.groups.get(call["name"], "default")
+
+    @staticmethod
+    def _timing(call: Dict[str, Any], group: str, message: ToolMessage, queued_at: float,
+                started_at: float, finished_at: float) -> Dict[str, Any]:
+        content = message.content
+        failed = getattr(message, "status", None) == "error" or (isinstance(content, str) and content.startswith("Error: "))
+        return {
+            "tool_call_id": call["id"],
+            "name": call["name"],
+            "group": group,
+            "started_at": time.time() - (time.perf_counter() - started_at),
+            "queued_ms": round((started_at - queued_at) * 1000, 3),
+            "duration_ms": round((finished_at - started_at) * 1000, 3),
+            "status": "error" if failed else "success",
+        }
+
+    def _run_timed(self, call: Dict[str, Any], config: RunnableConfig,
+                   queued_at: float) -> Tuple[ToolMessage, Dict[str, Any]]:
+        group = self._group(call)
+        with self.limiter.slot(group):
+            started_at = time.perf_counter()
+            message = self._run_one(call, config)
+            finished_at = time.perf_counter()
+        timing = self._timing(call, group, message, queued_at, started_at, finished_at)
+        tool_stats.record(timing)
+        return message, timing
+
+    async def _arun_timed(self, call: Dict[str, Any], config: RunnableConfig,
+                          queued_at: float) -> Tuple[ToolMessage, Dict[str, Any]]:
+        group = self._group(call)
+        tool = self.tools_by_name.get(call["name"])
+        async with self.limiter.aslot(group):
+            started_at = time.perf_counter()
+            if tool is not None and getattr(tool, "coroutine", None) is None:
+                # 同步工具放到共享线程池执行，不占用事件循环默认线程池（否则耗时里混入排队时间）
+                message = await asyncio.get_running_loop().run_in_executor(
+                    self.executor, contextvars.copy_context().run, self._run_one, call, config,
+                )
+            else:
+                message = await self._arun_one(call, config)
+            finished_at = time.perf_counter()
+        timing = self._timing(call, group, message, queued_at, started_at, finished_at)
+        tool_stats.record(timing)
+        return message, timing
+
+    @staticmethod
+    def _output(results: List[Tuple[ToolMessage, Dict[str, Any]]], output_type: str) -> Any:
+        messages = [message for message, _ in results]
+        if output_type == "list":
+            return messages
+        return {"messages": messages, "tool_timings": [timing for _, timing in results]}
+
+    def _func(self, input: Any, config: RunnableConfig, *, store: Any) -> Any:
+        tool_calls, output_type = self._parse_input(input, store)
+        tool_stats.record_batch(len(tool_calls))
+        queued_at = time.perf_counter()
+        if len(tool_calls) == 1:
+            # 单个调用直接在当前线程执行
+            return self._output([self._run_timed(tool_calls[0], config, queued_at)], output_type)
+        config_list = get_config_list(config, len(tool_calls))
+        # 每个调用复制一份 contextvars（取消范围等），在共享线程池中并发执行，按调用顺序收集结果
+        futures = [
+            self.executor.submit(contextvars.copy_context().run, self._run_timed, call, call_config, queued_at)
+            for call, call_config in zip(tool_calls, config_list)
+        ]
+        return self._output([future.result() for future in futures], output_type)
+
+    async def _afunc(self, input: Any, config: RunnableConfig, *, store: Any) -> Any:
+        tool_calls, output_type = self._parse_input(input, store)
+        tool_stats.record_batch(len(tool_calls))
+        queued_at = time.perf_counter()
+        results = await asyncio.gather(*(self._arun_timed(call, config, queued_at) for call in tool_calls))
+        return self._output(list(results), output_type)
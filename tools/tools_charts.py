@@ -1,4 +1,4 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
 from langchain_core.tools import tool
 from langchain_core.language_models import BaseLanguageModel
 from langchain.chat_models import init_chat_model
@@ -7,8 +7,13 @@ import json
 import os
 # import streamlit_highcharts as hct
 
+from tools.result_store import result_store
+
 load_dotenv()
 
+# 从结果句柄读取数据时最多使用的数据点数
+CHART_MAX_POINTS = int(os.getenv("CHATBI_CHART_MAX_POINTS", "500"))
+
 # 初始化语言模型（不再依赖 streamlit session_state）
 # 使用环境变量或默认值
 default_model = os.getenv("DEFAULT_MODEL", "qwen-plus")
@@ -19,24 +24,66 @@ llm = init_chat_model(
 )
 
 
+def _load_series(handle: str, value_column: Optional[str],
+                 label_column: Optional[str]) -> Tuple[List[float], Optional[List[Any]]]:
+    """
+    从结果句柄读取图表数据（最多 CHART_MAX_POINTS 行）
+
+    未指定 value_column 时取第一个数值列；未指定 label_column 时取第一个非数值列作为类别。
+    """
+    columns, rows = result_store.read(handle, 0, CHART_MAX_POINTS)
+    schema = {column: index for index, column in enumerate(columns)}
+    numeric = [
+        index for index in range(len(columns))
+        if any(isinstance(row[index], (int, float)) for row in rows)
+        and all(row[index] is None or isinstance(row[index], (int, float)) for row in rows)
+    ]
+    for name in (value_column, label_column):
+        if name is not None and name not in schema:
+            raise ValueError(f"Column {name} not found in result {handle}; available columns: {columns}")
+    if value_column is not None:
+        value_index = schema[value_column]
+    elif numeric:
+        value_index = numeric[0]
+    else:
+        raise ValueError(f"Result {handle} has no numeric column; available columns: {columns}")
+    if label_column is not None:
+        label_index = schema[label_column]
+    else:
+        label_index = next((index for index in range(len(columns)) if index not in numeric), None)
+    numbers = [row[value_index] for row in rows]
+    labels = [row[label_index] for row in rows] if label_index is not None else None
+    return numbers, labels
+
+
 @tool(
     "high_charts_json",
-    description="Use LLM to generate Highcharts JSON config from a list of numbers and chart type."
+    description=(
+        "Use LLM to generate Highcharts JSON config from a list of numbers and chart type. "
+        "Instead of 'numbers', pass the 'result_handle' of an execute_sqlite_query result to chart its rows directly; "
+        "'value_column' and 'label_column' select the columns (default: the first numeric column and the first text column)."
+    )
 )
-def highcharts_tool(numbers: List[float], chart_type: str = "line") -> Dict[str, Any]:
+def highcharts_tool(numbers: Optional[List[float]] = None, chart_type: str = "line",
+                    result_handle: Optional[str] = None, value_column: Optional[str] = None,
+                    label_column: Optional[str] = None) -> Dict[str, Any]:
     """
     参数:
         numbers: 数字列表，用于生成图表数据
         chart_type: 图表类型（如 'line', 'column', 'bar', 'spline' 等），默认为 'line'
+        result_handle: execute_sqlite_query 返回的结果句柄，提供时从结果文件读取数据
+        value_column: 数值列名（配合 result_handle 使用）
+        label_column: 类别列名（配合 result_handle 使用）
     返回:
         Highcharts JSON 配置字典
     """
-    def _build_prompt(numbers: List[float], chart_type: str) -> str:
+    def _build_prompt(numbers: List[float], chart_type: str, labels: Optional[List[Any]] = None) -> str:
         """
         构造给大模型的prompt。
         参数:
             numbers: 数字列表
             chart_type: 图表类型
+            labels: 与数字一一对应的类别（可选）
         """
         example_json = '''json\n{
    "title":{
@@ -74,7 +121,8 @@ def highcharts_tool(numbers: List[float], chart_type: str = "line") -> Dict[str,
         return (
             f"你是一个前端可视化专家，请根据以下要求生成 Highcharts 的 {chart_type} 图 JSON 配置：\n"
             f"- 数据列表: {numbers}\n"
-            f"- 图表类型: {chart_type}\n"
+            + (f"- 类别（与数据一一对应，用作 xAxis.categories）: {labels}\n" if labels else "")
+            + f"- 图表类型: {chart_type}\n"
             "- 只输出标准 JSON，不要有任何解释、不要有 html、markdown 标签。\n"
             "- 保证输出内容能被 Python 的 json.loads 正确解析。\n"
             "- 结构参考如下示例：\n"
@@ -82,8 +130,20 @@ def highcharts_tool(numbers: List[float], chart_type: str = "line") -> Dict[str,
             "- 输出前请再次校验格式。"
         )
 
+    labels = None
+    if result_handle:
+        # 大结果不经过模型上下文，直接从结果文件读取
+        try:
+            numbers, labels = _load_series(result_handle, value_column, label_column)
+        except KeyError:
+            return {"error": f"Result {result_handle} not found or expired. Re-run the query with execute_sqlite_query.", "status": "error"}
+        except ValueError as e:
+            return {"error": str(e), "status": "error"}
+    if not numbers:
+        return {"error": "Either numbers or result_handle is required", "status": "error"}
+
     # 构造 prompt
-    prompt = _build_prompt(numbers, chart_type)
+    prompt = _build_prompt(numbers, chart_type, labels)
 
     # 调用 LLM
     response = llm.invoke(prompt)
@@ -1,49 +1,396 @@
-from typing import Dict, Any
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
+from langchain_core.runnables import RunnableConfig
 from langchain_core.tools import tool
+import contextvars
 import sqlite3
-import json, os
+import json, os, time
+
+from tools.cancellation import check_cancelled, track_connection
+from tools.duckdb_engine import get_duckdb_engine
+from tools.query_log import query_log
+from tools.result_store import is_result_handle, result_handle, result_store
+from tools.rollups import RollupRewrite, get_rollup_manager
+from tools.sql_pagination import (
+    DEFAULT_MAX_ROWS,
+    cursor_registry,
+    fetch_bounded,
+    fetch_page,
+    paginate_first_page,
+    restore_cursor,
+)
+from tools.sql_guard import query_guard, rejection_error
+from tools.sql_result_cache import sql_result_cache
+from tools.sql_validator import sql_validator
+from tools.sqlite_pool import DEFAULT_POOL_SIZE, WriteNotAllowed, get_read_pool, get_writer, is_readonly_error
 
 # 固定的 SQLite 数据库路径
 
 current_file_dir = os.path.dirname(os.path.abspath(__file__))
 DATABASE_PATH = os.path.join(current_file_dir, "example.db")  # 替换为你的数据库文件路径
 
+# execute_sqlite_batch：并发执行的工作线程数（不超过读连接池大小）、单次最多的查询条数
+DEFAULT_BATCH_WORKERS = int(os.getenv("CHATBI_SQL_BATCH_WORKERS", "4"))
+DEFAULT_BATCH_MAX_QUERIES = int(os.getenv("CHATBI_SQL_BATCH_MAX_QUERIES", "10"))
+
+
+def get_database_version(database_path: str = DATABASE_PATH) -> str:
+    """
+    数据库版本指纹（文件及 WAL 文件的修改时间和大小），数据库内容变化后指纹随之变化
+
+    用于缓存失效：缓存键中包含该指纹，数据库更新后旧缓存自然不再命中。
+    """
+    parts = []
+    for path in (database_path, database_path + "-wal"):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if path != database_path and stat.st_size == 0:
+            # 第一个读连接打开时会创建空的 WAL 文件，内容并未变化
+            continue
+        parts.append(f"{stat.st_mtime_ns}-{stat.st_size}")
+    return ":".join(parts) or "missing"
+
+
+def _cache_report(hit: bool, size: int) -> Dict[str, Any]:
+    """单次调用的缓存情况：是否命中、结果字节数、本次节省的字节数、累计命中率"""
+    return {
+        "hit": hit,
+        "result_bytes": size,
+        "bytes_saved": size if hit else 0,
+        "hit_rate": round(sql_result_cache.hit_rate, 3),
+    }
+
+
 @tool(
     "execute_sqlite_query",
-    description="Execute a SQLite query on a fixed database and return the results as JSON. Use this tool to interact with the SQLite database."
+    description=(
+        "Execute a SQLite query on a fixed database and return the results as JSON. Use this tool to interact with the SQLite database. "
+        "Large results are truncated to the first page; when 'truncated' is true the result includes 'total_rows' and a 'cursor' "
+        "that can be passed to fetch_sqlite_page to read more rows. Prefer aggregation (COUNT, SUM, GROUP BY) over reading all rows. "
+        "Results with many rows are stored on the server and only a preview is returned together with a 'result_handle' and the "
+        "column 'schema'; pass the 'result_handle' to high_charts_json or export_artifacts instead of copying rows. "
+        "Queries that are too expensive (e.g. joins without a join condition) are rejected or stopped with an 'error_type', "
+        "'warnings' and 'suggestions'; rewrite the query accordingly instead of retrying it unchanged. "
+        "Unambiguous mistakes (schema prefixes, identifier case, near-miss column names) are fixed automatically and listed in "
+        "'sql_fixes'; otherwise an 'invalid_sql' error lists 'diagnostics' with the offending identifier and candidate names."
+    )
 )
-def execute_sqlite_query(query: str) -> Dict[str, Any]:
+def execute_sqlite_query(query: str, config: RunnableConfig = None) -> Dict[str, Any]:
     """
     参数:
         query: 要执行的 SQL 查询
+        config: 运行配置（由 LangGraph 注入，用于取会话 ID，不对模型暴露）
     返回:
         查询结果的 JSON 格式，或者错误信息
     """
-    try:
-        # 连接到 SQLite 数据库
-        conn = sqlite3.connect(DATABASE_PATH)
-        cursor = conn.cursor()
+    check_cancelled()
+    return _query_and_record(query, _session_id(config))
+
+
+def _session_id(config: Optional[RunnableConfig]) -> Optional[str]:
+    return ((config or {}).get("configurable") or {}).get("thread_id")
+
+
+def _query_and_record(query: str, session_id: Optional[str], readonly: bool = False) -> Dict[str, Any]:
+    """执行一条查询、记录查询日志，大结果落盘（单条与批量执行共用）"""
+    started_at = time.perf_counter()
+    response = _execute_query(query, readonly)
+    # 自动修正过的语句按实际执行的 SQL 记录和落盘
+    query = response.get("executed_query", query)
+    # 记录到查询日志，供索引建议工具分析工作负载
+    query_log.record(query, response, (time.perf_counter() - started_at) * 1000)
+    if response.get("status") == "success" and result_store.should_spill(response["result"]):
+        # 行数多的结果写入结果文件，工具消息中只保留预览和结果句柄
+        response = {**response, "result": _spill_result(query, response["result"], session_id)}
+    return response
+
+
+def execute_readonly_query(query: str, session_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    在工具之外执行一条只读查询（如快速路径），与 execute_sqlite_query 走相同的校验、缓存、代价保护、日志和落盘
+
+    Args:
+        query: SQL 查询语句
+        session_id: 落盘结果文件归属的会话
+
+    Returns:
+        与 execute_sqlite_query 相同格式的返回值；写语句返回错误
+    """
+    return _query_and_record(query, session_id, readonly=True)
+
+
+_batch_executor = ThreadPoolExecutor(
+    max_workers=max(1, min(DEFAULT_BATCH_WORKERS, DEFAULT_POOL_SIZE)),
+    thread_name_prefix="sqlite-batch",
+)
+
+
+@tool(
+    "execute_sqlite_batch",
+    description=(
+        "Execute several independent read-only SQLite queries at once, e.g. the metrics of a comparison dashboard. "
+        "Pass 'queries' as an object mapping a short name to a SELECT statement; the queries run concurrently and all "
+        "results are returned in one response keyed by name, each with the same fields as execute_sqlite_query plus "
+        "'elapsed_ms'. A failing query does not affect the others. Prefer this over several execute_sqlite_query calls "
+        "when the queries do not depend on each other's results."
+    )
+)
+def execute_sqlite_batch(queries: Dict[str, str], config: RunnableConfig = None) -> Dict[str, Any]:
+    """
+    参数:
+        queries: 查询名称 -> SQL（只允许只读语句）
+        config: 运行配置（由 LangGraph 注入，用于取会话 ID，不对模型暴露）
+    返回:
+        按名称汇总的各查询结果、耗时和错误
+    """
+    check_cancelled()
+    if not queries:
+        return {"status": "error", "error": "No queries given. Pass an object mapping names to SQL statements."}
+    if len(queries) > DEFAULT_BATCH_MAX_QUERIES:
+        return {"status": "error", "error": f"Too many queries ({len(queries)}); at most {DEFAULT_BATCH_MAX_QUERIES} per batch."}
+    session_id = _session_id(config)
+    started_at = time.perf_counter()
+    # 每条查询在独立的读连接上并发执行；复制 contextvars，工作线程中取消同样生效
+    futures = {
+        name: _batch_executor.submit(contextvars.copy_context().run, _timed_query, query, session_id)
+        for name, query in queries.items()
+    }
+    results = {name: future.result() for name, future in futures.items()}
+    failed = [name for name, response in results.items() if response.get("status") != "success"]
+    return {
+        "status": "success" if not failed else ("error" if len(failed) == len(results) else "partial"),
+        "results": results,
+        "succeeded": len(results) - len(failed),
+        "failed": failed,
+        "elapsed_ms": round((time.perf_counter() - started_at) * 1000, 3),
+    }
 
-        # 执行查询
-        print("---- Executing SQL Query ----")
+
+def _timed_query(query: str, session_id: Optional[str]) -> Dict[str, Any]:
+    check_cancelled()
+    started_at = time.perf_counter()
+    response = _query_and_record(query, session_id, readonly=True)
+    return {**response, "elapsed_ms": round((time.perf_counter() - started_at) * 1000, 3)}
+
+
+def _spill_result(query: str, result: Dict[str, Any], session_id: Optional[str]) -> Dict[str, Any]:
+    """把完整结果写入结果文件，返回预览 + 句柄；失败时保持原结果（第一页 + 游标）"""
+    if result.get("rollup"):
+        database_path = get_rollup_manager(DATABASE_PATH).rollup_path
+        source_query = result["rollup"]["query"]
+    else:
+        database_path, source_query = DATABASE_PATH, query
+    handle = result_handle(database_path, get_database_version(database_path), source_query)
+    stored = result_store.adopt(handle, session_id)
+    if stored is None:
+        budget = query_guard.new_budget()
+        try:
+            # 第一页不完整时重新执行查询读取完整结果（最多 CHATBI_RESULT_SPILL_MAX_ROWS 行）
+            rows = _fetch_all(database_path, source_query, budget) if result.get("truncated") else result["rows"]
+            stored = result_store.write(handle, result["columns"], rows, session_id)
+        except (sqlite3.Error, OSError, ValueError, RuntimeError) as e:
+            reason = budget.exceeded or e
+            print(f"[WARNING] Failed to spill query result, returning the first page only: {reason}")
+            return result
+    return result_store.describe(stored, result, session_id)
+
+
+def _fetch_all(database_path: str, query: str, budget) -> List[Any]:
+    rows: List[Any] = []
+    with get_read_pool(database_path).connection() as conn, track_connection(conn), query_guard.limit(conn, budget):
+        cursor = conn.execute(query)
+        try:
+            while len(rows) < result_store.max_rows:
+                batch = cursor.fetchmany(min(10000, result_store.max_rows - len(rows)))
+                if not batch:
+                    break
+                rows.extend(batch)
+        finally:
+            cursor.close()
+    return rows
+
+
+def _execute_query(query: str, readonly: bool = False) -> Dict[str, Any]:
+    # 先取连接池：开启 CHATBI_SQLITE_WAL 时首次创建会切换 WAL 模式，数据库指纹要在这之后计算
+    pool = get_read_pool(DATABASE_PATH)
+    # 执行前按实时 schema 校验：无歧义的问题直接修正，否则返回结构化诊断，省掉一轮“执行失败 -> 模型改写”
+    with pool.connection() as conn:
+        validation = sql_validator.validate(conn, query, DATABASE_PATH, get_database_version())
+    if validation.rejected:
+        print(f"[WARNING] SQL validation failed: {validation.diagnostics[0].message}")
+        return validation.error()
+    response = _run_query(validation.query, readonly)
+    if validation.fixes:
+        print(f"[INFO] SQL auto-fixed: {validation.fix_report()}")
+        response["sql_fixes"] = validation.fix_report()
+        response["executed_query"] = validation.query
+    return response
+
+
+def _run_query(query: str, readonly: bool = False) -> Dict[str, Any]:
+    pool = get_read_pool(DATABASE_PATH)
+    duckdb_engine = get_duckdb_engine(DATABASE_PATH)
+    rollups = get_rollup_manager(DATABASE_PATH)
+    # 相同（规范化后）的查询在数据库未变化时直接返回缓存结果，不再访问数据库
+    cache_key = sql_result_cache.make_key(DATABASE_PATH, get_database_version(), query)
+    cached = sql_result_cache.get(cache_key)
+    if cached is not None:
+        result, size = cached
+        print("---- SQL Query (cache hit) ----")
         print(query)
-        cursor.execute(query)
-        if query.strip().lower().startswith("select"):
-            # 如果是 SELECT 查询，获取所有结果
-            columns = [description[0] for description in cursor.description]
-            rows = cursor.fetchall()
-            result = {"columns": columns, "rows": rows}
+        if result.get("rollup"):
+            rollup_path = get_rollup_manager(DATABASE_PATH).rollup_path
+            result = restore_cursor(result["rollup"]["query"], result, rollup_path, get_database_version(rollup_path))
         else:
-            # 如果是非 SELECT 查询，提交更改
-            conn.commit()
-            result = {"message": "Query executed successfully."}
+            result = restore_cursor(query, result, DATABASE_PATH, cache_key[1])
+        return {"status": "success", "result": result, "cache": _cache_report(True, size)}
+
+    print("---- Executing SQL Query ----")
+    print(query)
+    report = None
+    budget = query_guard.new_budget()
+    try:
+        # 先在只读连接上执行；运行被取消时连接会被 interrupt，语句以 "interrupted" 错误结束
+        with pool.connection() as conn, track_connection(conn), query_guard.limit(conn, budget):
+            # 能由预聚合汇总表回答的聚合查询改写为查询汇总表，不再扫描基础表
+            rewrite = rollups.rewrite(conn, query, cache_key[1])
+            result = _run_rollup(rewrite, budget) if rewrite else None
+            engine = "rollup"
+            if result is None:
+                # 执行前检查查询计划：估算代价超限的查询（如缺少连接条件的笛卡尔积）直接拒绝
+                report = query_guard.check_plan(conn, query, DATABASE_PATH, cache_key[1])
+                if report and report.rejected:
+                    print(f"[WARNING] SQL query rejected by plan guard (~{report.estimated_rows} rows)")
+                    return rejection_error(report, query)
+                # 扫描量大的聚合查询交给 DuckDB（已安装时），失败或副本未就绪时仍在 SQLite 上执行
+                if duckdb_engine.should_route(query, report.estimated_rows if report else None):
+                    result = duckdb_engine.execute(conn, query, cache_key[1], budget)
+                engine = "sqlite" if result is None else "duckdb"
+                if result is None:
+                    result = _run_statement(conn, query)
+                if result.get("truncated"):
+                    # 结果超过行数/字节数上限：返回第一页、总行数和游标句柄，后续页用 fetch_sqlite_page 获取
+                    result = paginate_first_page(conn, query, result, DATABASE_PATH, cache_key[1])
+    except sqlite3.Error as e:
+        if budget.exceeded:
+            # 超出执行预算被中断：返回结构化错误，让 Agent 改写查询
+            return budget.error(query, report.plan if report else None)
+        if not is_readonly_error(e):
+            # 捕获 SQLite 错误并返回
+            return {"status": "error", "error": str(e)+"--"+query+"--"+DATABASE_PATH}
+        if readonly:
+            return {"status": "error", "error": "Only read-only queries are allowed in execute_sqlite_batch.--"+query}
+        return _execute_write(query)
+
+    size = sql_result_cache.put(cache_key, result)
+    response = {"status": "success", "result": result, "engine": engine, "cache": _cache_report(False, size)}
+    if report and report.warnings:
+        response["warnings"] = report.warnings
+        response["suggestions"] = report.suggestions
+    return response
+
+
+def _run_rollup(rewrite: RollupRewrite, budget) -> Optional[Dict[str, Any]]:
+    """在汇总表数据库上执行改写后的查询；失败时返回 None，由调用方按原查询执行"""
+    rollups = get_rollup_manager(DATABASE_PATH)
+    try:
+        pool = get_read_pool(rollups.rollup_path)
+        with pool.connection() as conn, track_connection(conn), query_guard.limit(conn, budget):
+            result = _run_statement(conn, rewrite.query)
+            if result.get("truncated"):
+                version = get_database_version(rollups.rollup_path)
+                result = paginate_first_page(conn, rewrite.query, result, rollups.rollup_path, version)
+    except sqlite3.Error as e:
+        if budget.exceeded:
+            raise
+        rollups.record_fallback()
+        print(f"[WARNING] Rollup query failed, falling back to the base tables: {e}")
+        return None
+    result["rollup"] = {"table": rewrite.table, "query": rewrite.query}
+    return result
+
 
-        # 关闭连接
+def _run_statement(conn: sqlite3.Connection, query: str) -> Dict[str, Any]:
+    cursor = conn.execute(query)
+    try:
+        if cursor.description is None:
+            return {"message": "Query executed successfully."}
+        # 返回结果集的语句（SELECT、WITH ... SELECT 等），分批读取，最多读取一页
+        columns = [description[0] for description in cursor.description]
+        rows, truncated = fetch_bounded(cursor)
+        return {"columns": columns, "rows": rows, "row_count": len(rows), "truncated": truncated}
+    finally:
         cursor.close()
-        conn.close()
 
-        return {"status": "success", "result": result}
 
+def _execute_write(query: str) -> Dict[str, Any]:
+    """写语句走单独的读写连接，需要显式开启 CHATBI_SQLITE_ALLOW_WRITES"""
+    budget = query_guard.new_budget()
+    try:
+        with get_writer(DATABASE_PATH).connection() as conn, track_connection(conn), query_guard.limit(conn, budget):
+            result = _run_statement(conn, query)
+    except WriteNotAllowed as e:
+        return {"status": "error", "error": str(e)+"--"+query}
+    except sqlite3.Error as e:
+        if budget.exceeded:
+            return budget.error(query)
+        return {"status": "error", "error": str(e)+"--"+query+"--"+DATABASE_PATH}
+    # 写操作后数据库文件指纹也会变化，这里立即清除以释放内存
+    sql_result_cache.invalidate(DATABASE_PATH)
+    return {"status": "success", "result": result}
+
+
+@tool(
+    "fetch_sqlite_page",
+    description=(
+        "Fetch another page of a truncated execute_sqlite_query result. Pass the 'cursor' (or 'result_handle') from the previous result; "
+        "'offset' defaults to the previous page's 'next_offset', 'limit' is the maximum number of rows to return."
+    )
+)
+def fetch_sqlite_page(cursor: str, offset: Optional[int] = None, limit: Optional[int] = None,
+                      config: RunnableConfig = None) -> Dict[str, Any]:
+    """
+    参数:
+        cursor: execute_sqlite_query 返回的游标句柄
+        offset: 起始行号（从 0 开始），默认接着上一页
+        limit: 本页最多返回的行数
+    返回:
+        一页结果，或者错误信息
+    """
+    check_cancelled()
+    return fetch_result_page(cursor, offset, limit, _session_id(config))
+
+
+def fetch_result_page(handle: str, offset: Optional[int] = None, limit: Optional[int] = None,
+                      session_id: Optional[str] = None) -> Dict[str, Any]:
+    """读取游标或结果句柄的一页结果（工具与 HTTP 接口共用）；结果句柄不带 offset 时接着该会话上一页"""
+    if is_result_handle(handle):
+        try:
+            page = result_store.page(
+                handle, offset, max(1, min(limit or DEFAULT_MAX_ROWS, DEFAULT_MAX_ROWS)), session_id,
+            )
+        except KeyError:
+            return {"status": "error", "error": f"Result {handle} not found or expired. Re-run the query with execute_sqlite_query."}
+        return {"status": "success", "result": page}
+    result_cursor = cursor_registry.get(handle)
+    if result_cursor is None:
+        return {"status": "error", "error": f"Cursor {handle} not found or expired. Re-run the query with execute_sqlite_query."}
+    if result_cursor.database_version != get_database_version(result_cursor.database_path):
+        return {"status": "error", "error": "The database has changed since the query was executed. Re-run the query with execute_sqlite_query."}
+    budget = query_guard.new_budget()
+    try:
+        pool = get_read_pool(result_cursor.database_path)
+        with pool.connection() as conn, track_connection(conn), query_guard.limit(conn, budget):
+            page = fetch_page(
+                conn,
+                result_cursor,
+                result_cursor.next_offset if offset is None else offset,
+                limit or DEFAULT_MAX_ROWS,
+            )
     except sqlite3.Error as e:
-        # 捕获 SQLite 错误并返回
-        return {"status": "error", "error": str(e)+"--"+query+"--"+DATABASE_PATH}
\ No newline at end of file
+        if budget.exceeded:
+            return budget.error(result_cursor.query)
+        return {"status": "error", "error": str(e)+"--"+result_cursor.query}
+    return {"status": "success", "result": page}
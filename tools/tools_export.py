@@ -13,6 +13,8 @@ import pandas as pd
 from langchain_core.tools import tool
 from PIL import Image
 
+from tools.result_store import result_store
+
 try:  # Optional dependency for chart rendering
     import matplotlib.pyplot as plt  # type: ignore
 except Exception:  # pragma: no cover - handled at runtime
@@ -36,6 +38,8 @@ _PDF_FONT_REGISTERED = False
 
 ExportAction = Literal["chart_png", "data_export", "report_pdf"]
 _DEFAULT_EXPORT_DIR = Path(os.getenv("CHATBI_EXPORT_DIR", Path(__file__).resolve().parent.parent / "exports"))
+# PDF 報告中由結果句柄載入的表格最多呈現的行數
+_PDF_TABLE_MAX_ROWS = int(os.getenv("CHATBI_EXPORT_PDF_TABLE_MAX_ROWS", "100"))
 
 
 def _ensure_export_dir(target_dir: Optional[Union[str, Path]]) -> Path:
@@ -187,6 +191,15 @@ def _build_dataframe(rows: Iterable[Any], columns: Optional[List[str]]) -> pd.Da
     raise TypeError("rows 資料格式不支援，請提供 list[dict]、list[list] 或 pandas.DataFrame。")
 
 
+def _load_result_handle(handle: str, limit: Optional[int] = None) -> Dict[str, Any]:
+    """由 execute_sqlite_query 回傳的 result_handle 讀取結果檔（不必經由模型上下文傳遞資料列）"""
+    try:
+        columns, rows = result_store.read(handle, 0, limit)
+    except KeyError:
+        raise ValueError(f"result_handle {handle} 不存在或已過期，請重新執行查詢。") from None
+    return {"columns": columns, "rows": [list(row) for row in rows]}
+
+
 def _resolve_excel_engine(preferred_engine: Optional[str] = None) -> str:
     candidates = []
     if preferred_engine:
@@ -394,6 +407,8 @@ def _export_pdf_report(
     if tables_list:
         current_y = _write_wrapped_text(pdf, "資料表：", margin, current_y, content_width, line_height, margin)
         for table in tables_list:
+            if isinstance(table, dict) and table.get("result_handle") and not table.get("rows"):
+                table = {**table, **_load_result_handle(table["result_handle"], _PDF_TABLE_MAX_ROWS)}
             current_y = _insert_table(pdf, table, margin, current_y, content_width, line_height, margin)
             current_y -= 10
 
@@ -443,8 +458,8 @@ def _export_artifacts(
     """
     匯出工具支援：
     - 圖表 PNG：提供 chart_payload（可為 dict 或 JSON 字串），可選擇直接傳入 base64 圖像。
-    - 資料 CSV/Excel：提供 rows（list[dict]、list[list] 或 DataFrame）與 columns。
-    - PDF 報告：提供 title、summary、questions、insights、tables、charts 等內容。
+    - 資料 CSV/Excel：提供 rows（list[dict]、list[list] 或 DataFrame）與 columns，或提供 result_handle 匯出完整查詢結果。
+    - PDF 報告：提供 title、summary、questions、insights、tables、charts 等內容；tables 中的表格可用 result_handle 代替 rows。
     """
 
     payload = payload or {}
@@ -455,6 +470,8 @@ def _export_artifacts(
         return _export_chart_png(chart_payload, export_dir, filename, width, height, dpi)
 
     if action == "data_export":
+        if payload.get("result_handle"):
+            payload = {**payload, **_load_result_handle(payload["result_handle"])}
         rows = payload.get("rows")
         if rows is None:
             raise ValueError("data_export 行為需要提供 rows。")
@@ -471,7 +488,8 @@ export_artifacts_tool = tool(
     "export_artifacts",
     description=(
         "匯出分析產物。action 可為 'chart_png' (匯出圖表 PNG)、'data_export' (匯出資料 CSV/Excel)、"
-        "'report_pdf' (產生分析報告 PDF)。"
+        "'report_pdf' (產生分析報告 PDF)。execute_sqlite_query 回傳 result_handle 時，"
+        "data_export 的 payload 可直接提供 result_handle，report_pdf 的 tables 也可用 result_handle 代替 rows。"
     ),
 )(_export_artifacts)
 